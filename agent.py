@@ -4,6 +4,25 @@ from sub_agents.no_match_analysis_agent.agent import no_match_analysis_agent
 from sub_agents.dialogflow_cx_parser_agent.agent import dialogflow_cx_parser_agent
 from sub_agents.csv_generation_agent.agent import csv_generation_agent
 from tools.initialize_state import initialize_state_var
+from tools.state_offload import offload_event_state, offload_session_state, get_state_value_size, load_state_value
+from tools.workflow_checkpoints import WorkflowCheckpointer, WORKFLOW_STEPS
+from tools.step_deadlines import RunDeadline, StepDeadlineExceeded, run_with_deadline
+from tools.process_pool import cpu_task_pool
+from tools.cpu_tasks import validate_phrase_csv
+from tools.memory_profiling import memory_profiler
+from tools.context_budget import CONTEXT_BUDGET_STATE_KEY, context_budget
+from tools.event_stream import event_stream
+from tools.period_comparison import (
+    COMPARISON_OUTPUT_STATE_KEY, comparison_enabled, comparison_windows, compare_periods, format_comparison_report,
+)
+from tools.phrase_validation import (
+    PHRASE_VALIDATION_DROP_COLLISIONS, PHRASE_VALIDATION_ENABLED, VALIDATION_REPORT_STATE_KEY,
+    extract_csv_content, replace_csv_content, format_validation_summary,
+)
+from tools.sampling_preview import (
+    PREVIEW_ESTIMATES_STATE_KEY, PREVIEW_REFINE_STATE_KEY, PREVIEW_SAMPLE_PERCENT_STATE_KEY, DEFAULT_SAMPLE_PERCENT,
+    preview_enabled, preview_date_range, run_sampled_preview, format_preview_report,
+)
 
 from typing import Dict, Any, List
 from typing import AsyncGenerator
@@ -11,6 +30,7 @@ from typing_extensions import override
 from google.adk.events import Event, EventActions
 from google.adk.agents.invocation_context import InvocationContext
 from google.adk.tools import ToolContext
+from google.genai import types
 import logging
 
 # --- Configure Logging ---
@@ -35,6 +55,153 @@ class NoMatchAnalysisAgent(BaseAgent):
             **agents
         )
 
+    async def _run_step(
+        self,
+        ctx: InvocationContext,
+        checkpointer: WorkflowCheckpointer,
+        deadline: RunDeadline,
+        step: int,
+        agent: LlmAgent,
+        label: str
+    ) -> AsyncGenerator[Event, None]:
+        """
+        Run one workflow step, or restore its output from a fresh checkpoint.
+        A step that misses its deadline is cancelled and recorded as degraded.
+        """
+        restored = checkpointer.restore(step)
+        if restored:
+            logger.info(f"[{self.name}] - Step {step}: {label} restored from checkpoint.")
+            yield checkpointer.state_event(self.name, restored)
+            return
+
+        timeout = deadline.step_timeout(step)
+        memory_profiler.start_step(ctx, WORKFLOW_STEPS[step]["name"])
+        try:
+            if timeout is not None and timeout <= 0:
+                raise StepDeadlineExceeded("No run budget left for the step")
+            async for event in run_with_deadline(event_stream.relay(agent.run_async(ctx), label), timeout):
+                event = await offload_event_state(ctx, event)
+                if event.partial:
+                    logger.debug(f"[{self.name}] - {label} partial event: {event.model_dump_json(exclude_none=True)}")
+                else:
+                    logger.info(f"[{self.name}] - {label} event: {event.model_dump_json(indent=2, exclude_none=True)}")
+                yield event
+        except StepDeadlineExceeded:
+            logger.warning(f"[{self.name}] - Step {step}: {label} exceeded its {timeout:.1f}s deadline and was cancelled.")
+            yield checkpointer.state_event(self.name, deadline.record_timeout(step, timeout))
+            return
+        finally:
+            memory_profiler.finish_step(ctx, WORKFLOW_STEPS[step]["name"])
+
+        state_delta = checkpointer.complete(step)
+        # What the step's prompts left out to stay within the agent's token budget
+        budget_reports = context_budget.pop_reports(ctx.invocation_id)
+        if budget_reports:
+            state_delta[CONTEXT_BUDGET_STATE_KEY] = {**(ctx.session.state.get(CONTEXT_BUDGET_STATE_KEY) or {}), **budget_reports}
+        yield checkpointer.state_event(self.name, state_delta)
+
+    async def _degraded_result_event(self, ctx: InvocationContext, deadline: RunDeadline) -> Event:
+        """
+        Build the final event of a degraded run from the outputs already in state.
+        """
+        missed = ", ".join(
+            f"Step {degraded['step']} ({degraded['name']}, {degraded['timeout_seconds']:.1f}s)"
+            for degraded in deadline.degraded_steps
+        )
+        sections = [f"⚠️ DEGRADED RESULT: {missed} exceeded the time budget and was cancelled. The outputs below are partial."]
+
+        # Prefer the analysis outputs; fall back to the raw conversation data
+        for step in (2, 3, 4, 1):
+            if step == 1 and len(sections) > 1:
+                break
+            output_key = WORKFLOW_STEPS[step]["output_key"]
+            output = await load_state_value(ctx, ctx.session.state.get(output_key, ''))
+            if output:
+                sections.append(f"## {output_key}\n\n{output}")
+
+        return Event(
+            invocation_id=ctx.invocation_id,
+            author=self.name,
+            branch=ctx.branch,
+            content=types.Content(role="model", parts=[types.Part(text="\n\n".join(sections))]),
+        )
+
+    async def _preview_event(self, ctx: InvocationContext) -> Event:
+        """
+        Estimate no-match rates from a sample of conversations and report them.
+        The estimates are stored under the `preview_estimates` state key. When
+        the query names a date range the preview cannot resolve, the preview
+        is skipped rather than estimating a different window than the full run.
+        """
+        state = ctx.session.state
+        user_text = "".join(part.text or "" for part in ctx.user_content.parts) if ctx.user_content and ctx.user_content.parts else ""
+        date_range = preview_date_range(state, user_text)
+        if date_range is None:
+            logger.info(f"[{self.name}] - Preview skipped: date range of the query not resolved.")
+            return Event(
+                invocation_id=ctx.invocation_id,
+                author=self.name,
+                branch=ctx.branch,
+                content=types.Content(role="model", parts=[types.Part(text=(
+                    "🔎 Preview skipped: the date range in the query could not be resolved to exact dates. "
+                    "Give the range as two YYYY-MM-DD dates (or set `start_date` and `end_date`) to preview it."
+                ))]),
+            )
+        start_date, end_date = date_range
+        sample_percent = float(state.get(PREVIEW_SAMPLE_PERCENT_STATE_KEY) or DEFAULT_SAMPLE_PERCENT)
+        estimates = await run_sampled_preview(state.get("PROJECT"), state.get("DATASET"), start_date, end_date, sample_percent)
+        return Event(
+            invocation_id=ctx.invocation_id,
+            author=self.name,
+            branch=ctx.branch,
+            content=types.Content(role="model", parts=[types.Part(text=format_preview_report(estimates))]),
+            actions=EventActions(state_delta={PREVIEW_ESTIMATES_STATE_KEY: estimates}),
+        )
+
+    async def _comparison_event(self, ctx: InvocationContext) -> Event:
+        """
+        Compare no-match rates of the current and baseline windows. The deltas
+        replace the retrieved conversation data as the input of Step 2.
+        """
+        state = ctx.session.state
+        current, baseline = comparison_windows(state)
+        comparison = await compare_periods(state.get("PROJECT"), state.get("DATASET"), current, baseline)
+        report = format_comparison_report(comparison)
+        return Event(
+            invocation_id=ctx.invocation_id,
+            author=self.name,
+            branch=ctx.branch,
+            content=types.Content(role="model", parts=[types.Part(text=report)]),
+            actions=EventActions(state_delta={
+                COMPARISON_OUTPUT_STATE_KEY: comparison,
+                WORKFLOW_STEPS[1]["output_key"]: report,
+            }),
+        )
+
+    async def _validation_event(self, ctx: InvocationContext) -> Event:
+        """
+        Validate the generated CSV against itself and the parsed bot's phrases.
+        Rows that would fail or duplicate on import are removed from the output.
+        """
+        output_key = WORKFLOW_STEPS[4]["output_key"]
+        output = await load_state_value(ctx, ctx.session.state.get(output_key, ''))
+        bot_json = await load_state_value(ctx, ctx.session.state.get('dialogflow_bot_json', ''))
+
+        # Parsing the bot export and validating run in the CPU task pool, off the event loop
+        csv_content, report = await cpu_task_pool.run(
+            validate_phrase_csv, [extract_csv_content(output), bot_json or ''], PHRASE_VALIDATION_DROP_COLLISIONS
+        )
+        logger.info(f"[{self.name}] - {format_validation_summary(report)}")
+        state_delta = {VALIDATION_REPORT_STATE_KEY: report}
+        if report.get("dropped"):
+            state_delta[output_key] = replace_csv_content(output, csv_content)
+        return await offload_event_state(ctx, Event(
+            invocation_id=ctx.invocation_id,
+            author=self.name,
+            branch=ctx.branch,
+            actions=EventActions(state_delta=state_delta),
+        ))
+
     @override
     async def _run_async_impl(self, ctx: InvocationContext) -> AsyncGenerator[Event, None]:
         """
@@ -42,18 +209,93 @@ class NoMatchAnalysisAgent(BaseAgent):
         1. Retrieve conversation data with no-match events
         2. Analyze patterns and provide recommendations
         3. Parse Dialogflow CX bot structure (if provided)
-        4. Generate CSV artifacts with training phrases
+        4. Generate CSV artifacts with training phrases, then validate and
+           deduplicate them (see tools/phrase_validation.py)
+
+        Steps whose inputs match a completed checkpoint are restored instead of
+        re-run. Set the `rerun_from_step` state key to force a rerun from step N.
+        Steps that run past their deadline are cancelled and the run ends with
+        the partial outputs, marked as degraded. With the `comparison_mode` state
+        key, Step 1 compares two date windows instead (see
+        tools/period_comparison.py). With MEMORY_PROFILING_ENABLED
+        each step is profiled and the report is saved as an artifact. Prompts
+        are fitted to per-agent token budgets (see tools/context_budget.py).
+        Streamed text chunks of the sub-agents are coalesced and, for slow
+        consumers, thinned out (see tools/event_stream.py).
+
+        With the `preview_mode` state key (or PREVIEW_MODE_ENABLED) a sampled
+        preview with confidence intervals is reported first; the full workflow
+        then refines it unless `preview_refine` is False.
         """
         logger.info(f"[{self.name}] - Starting no-match analysis workflow.")
-        
-        # Step 1: Conversation data retrieval
-        logger.info(f"[{self.name}] - Step 1: Retrieving conversation data with no-match events.")
-        async for event in self.conversation_data_retrieval_agent.run_async(ctx):
-            logger.info(f"[{self.name}] - Conversation data retrieval event: {event.model_dump_json(indent=2, exclude_none=True)}")
-            yield event
+
+        # Move large values already in state (metadata, bot export) to the artifact store
+        offload_event = await offload_session_state(ctx, author=self.name)
+        if offload_event:
+            yield offload_event
+
+        if preview_enabled(ctx.session.state):
+            logger.info(f"[{self.name}] - Preview: estimating no-match rates from a sample of conversations.")
+            try:
+                yield await self._preview_event(ctx)
+            except Exception as e:
+                # The preview is a shortcut; the full run still answers the query
+                logger.warning(f"[{self.name}] - Sampled preview failed: {e}")
+            if ctx.session.state.get(PREVIEW_REFINE_STATE_KEY, True) is False:
+                logger.info(f"[{self.name}] - Preview only, skipping the full analysis.")
+                return
+
+        try:
+            checkpointer = WorkflowCheckpointer.from_context(ctx)
+            if checkpointer.rerun_from_step:
+                logger.info(f"[{self.name}] - Rerunning from step {checkpointer.rerun_from_step}.")
+
+            deadline = RunDeadline.from_env()
+            async for event in self._run_workflow(ctx, checkpointer, deadline):
+                yield event
+
+            if deadline.degraded:
+                logger.warning(f"[{self.name}] - Workflow finished degraded: {deadline.degraded_steps}")
+                yield await self._degraded_result_event(ctx, deadline)
+
+            if memory_profiler.enabled:
+                profile_artifact = await memory_profiler.save_report(ctx)
+                if profile_artifact:
+                    logger.info(f"[{self.name}] - Memory profile saved as {profile_artifact}")
+        finally:
+            # A failed or cancelled run never saves its report; stop tracing anyway
+            if memory_profiler.enabled:
+                memory_profiler.discard(ctx)
+
+        pool_metrics = cpu_task_pool.get_metrics()
+        if pool_metrics["tasks"]:
+            logger.info(f"[{self.name}] - CPU task pool: {pool_metrics}")
+
+    async def _run_workflow(
+        self,
+        ctx: InvocationContext,
+        checkpointer: WorkflowCheckpointer,
+        deadline: RunDeadline
+    ) -> AsyncGenerator[Event, None]:
+        """
+        Run the four workflow steps in order, ending early when a step yields no output.
+        """
+        # Step 1: Conversation data retrieval, or the deltas between two windows
+        compared = False
+        if comparison_enabled(ctx.session.state):
+            logger.info(f"[{self.name}] - Step 1: Comparing no-match rates of two date windows.")
+            try:
+                yield await self._comparison_event(ctx)
+                compared = True
+            except Exception as e:
+                logger.warning(f"[{self.name}] - Period comparison failed, retrieving conversation data instead: {e}")
+        if not compared:
+            logger.info(f"[{self.name}] - Step 1: Retrieving conversation data with no-match events.")
+            async for event in self._run_step(ctx, checkpointer, deadline, 1, self.conversation_data_retrieval_agent, "Conversation data retrieval"):
+                yield event
         
         conversation_data_output = ctx.session.state.get('conversation_data_output', '')
-        logger.info(f"[{self.name}] - Conversation data retrieved: {len(conversation_data_output)} characters")
+        logger.info(f"[{self.name}] - Conversation data retrieved: {get_state_value_size(conversation_data_output)} characters")
 
         if not conversation_data_output:
             logger.warning(f"[{self.name}] - No conversation data retrieved. Ending workflow.")
@@ -61,12 +303,11 @@ class NoMatchAnalysisAgent(BaseAgent):
 
         # Step 2: No-match analysis
         logger.info(f"[{self.name}] - Step 2: Analyzing no-match patterns and providing recommendations.")
-        async for event in self.no_match_analysis_agent.run_async(ctx):
-            logger.info(f"[{self.name}] - No-match analysis event: {event.model_dump_json(indent=2, exclude_none=True)}")
+        async for event in self._run_step(ctx, checkpointer, deadline, 2, self.no_match_analysis_agent, "No-match analysis"):
             yield event
         
         no_match_analysis_output = ctx.session.state.get('no_match_analysis_output', '')
-        logger.info(f"[{self.name}] - No-match analysis completed: {len(no_match_analysis_output)} characters")
+        logger.info(f"[{self.name}] - No-match analysis completed: {get_state_value_size(no_match_analysis_output)} characters")
 
         if not no_match_analysis_output:
             logger.warning(f"[{self.name}] - No no-match analysis results. Ending workflow.")
@@ -76,28 +317,33 @@ class NoMatchAnalysisAgent(BaseAgent):
         dialogflow_bot_json = ctx.session.state.get('dialogflow_bot_json', '')
         if dialogflow_bot_json:
             logger.info(f"[{self.name}] - Step 3: Analyzing Dialogflow CX bot structure.")
-            async for event in self.dialogflow_cx_parser_agent.run_async(ctx):
-                logger.info(f"[{self.name}] - Dialogflow CX analysis event: {event.model_dump_json(indent=2, exclude_none=True)}")
+            async for event in self._run_step(ctx, checkpointer, deadline, 3, self.dialogflow_cx_parser_agent, "Dialogflow CX analysis"):
                 yield event
             
             dialogflow_analysis_output = ctx.session.state.get('dialogflow_analysis_output', '')
-            logger.info(f"[{self.name}] - Dialogflow CX analysis completed: {len(dialogflow_analysis_output)} characters")
+            logger.info(f"[{self.name}] - Dialogflow CX analysis completed: {get_state_value_size(dialogflow_analysis_output)} characters")
         else:
             logger.info(f"[{self.name}] - Step 3: Skipping Dialogflow CX analysis (no bot JSON provided).")
 
         # Step 4: CSV generation (always generate for no-match analysis)
         logger.info(f"[{self.name}] - Step 4: Generating CSV artifacts with training phrases.")
-        async for event in self.csv_generation_agent.run_async(ctx):
-            logger.info(f"[{self.name}] - CSV generation event: {event.model_dump_json(indent=2, exclude_none=True)}")
+        async for event in self._run_step(ctx, checkpointer, deadline, 4, self.csv_generation_agent, "CSV generation"):
             yield event
         
         csv_generation_output = ctx.session.state.get('csv_generation_output', '')
-        logger.info(f"[{self.name}] - CSV generation completed: {len(csv_generation_output)} characters")
+        logger.info(f"[{self.name}] - CSV generation completed: {get_state_value_size(csv_generation_output)} characters")
 
         if not csv_generation_output:
             logger.warning(f"[{self.name}] - No CSV generation results.")
             return
 
+        # Validate and deduplicate the CSV before it reaches a Dialogflow CX import
+        if PHRASE_VALIDATION_ENABLED:
+            yield await self._validation_event(ctx)
+
+        if deadline.degraded:
+            return
+
         logger.info(f"[{self.name}] - No-match analysis workflow completed successfully.")
 
 # Initialize the main orchestrator agent
@@ -4,7 +4,7 @@ This module configures the GCS artifact service for storing CSV files.
 """
 
 import os
-from google.adk.artifacts import GcsArtifactService, InMemoryArtifactService
+from google.adk.artifacts import InMemoryArtifactService
 
 def get_artifact_service():
     """
@@ -17,7 +17,8 @@ def get_artifact_service():
     
     if bucket_name and bucket_name != "your-no-match-analysis-artifacts":
         try:
-            # Use GCS Artifact Service for production
+            # Use GCS Artifact Service for production (imported here: the GCS client stack is slow to load)
+            from google.adk.artifacts import GcsArtifactService
             print(f"🔧 Configuring GCS Artifact Service with bucket: {bucket_name}")
             return GcsArtifactService(bucket_name=bucket_name)
         except Exception as e:
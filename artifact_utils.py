@@ -5,8 +5,12 @@ Provides helper functions for accessing and managing CSV artifacts using ADK con
 
 import os
 from datetime import datetime
-from typing import List, Dict, Any, Optional
+from typing import IO, List, Dict, Any, Optional
 from google.adk.agents.invocation_context import InvocationContext
+from google.genai import types
+
+# Largest intent bundle saved; the artifact service holds the whole zip in memory
+INTENT_BUNDLE_MAX_BYTES = int(os.environ.get("INTENT_BUNDLE_MAX_BYTES", str(100 * 1024 * 1024)))
 
 def list_available_artifacts(ctx: InvocationContext) -> List[str]:
     """
@@ -200,6 +204,295 @@ def create_csv_content_from_data(data: List[Dict[str, Any]]) -> str:
     
     return output.getvalue()
 
+async def save_delta_csv_artifact(
+    artifact_service,
+    app_name: str,
+    user_id: str,
+    session_id: str,
+    csv_content: str,
+    bot_id: str,
+    filename: str = None,
+    registry=None,
+) -> Dict[str, Any]:
+    """
+    Save only the CSV rows whose training phrase was never exported for the bot.
+
+    The artifact's custom metadata records its lineage: the bot and the
+    filename, version and session of the export it is a delta of.
+
+    Args:
+        artifact_service: ADK artifact service to save to
+        app_name: Application name
+        user_id: User to save the artifact for
+        session_id: Session to save the artifact in
+        csv_content: Full CSV content with intent and training phrase columns
+            (see `phrase_validation.find_phrase_columns`); rows without an
+            intent or a phrase are skipped
+        bot_id: Bot the phrases belong to
+        filename: Optional filename, will generate one if not provided
+        registry: ExportedPhraseRegistry, defaults to the process-wide one
+
+    Returns:
+        Dict[str, Any]: Result of the save operation; status "unchanged" (and
+        nothing saved) when every phrase was exported before
+    """
+    import asyncio
+    import csv
+    import io
+    from tools.exported_phrases import get_exported_phrase_registry
+    from tools.phrase_validation import find_phrase_columns
+
+    reserved = False
+    try:
+        registry = registry or get_exported_phrase_registry()
+        if not filename:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            filename = f"dialogflow_cx_training_phrases_delta_{timestamp}.csv"
+
+        reader = csv.DictReader(io.StringIO(csv_content))
+        rows = list(reader)
+        intent_column, phrase_column = find_phrase_columns(reader.fieldnames or [])
+        if not intent_column or not phrase_column:
+            raise ValueError(f"CSV has no intent or training phrase column: {reader.fieldnames}")
+        base = await asyncio.to_thread(registry.last_export, bot_id)
+        # Reserved in one transaction, so concurrent exports of the bot never both get a phrase
+        new_rows, skipped_rows = await asyncio.to_thread(
+            registry.reserve_new, bot_id, rows, filename, intent_column, phrase_column
+        )
+        reserved = True
+        lineage = {
+            "delta": True,
+            "bot_id": bot_id,
+            "base_filename": base["filename"] if base else None,
+            "base_version": base["version"] if base else None,
+            "base_session_id": base["session_id"] if base else None,
+            "new_rows": len(new_rows),
+            "skipped_rows": skipped_rows,
+        }
+
+        if not new_rows:
+            print(f"📭 No new training phrases for {bot_id}; {skipped_rows} rows were exported before")
+            return {"status": "unchanged", "filename": None, "lineage": lineage, "saved_at": datetime.now().isoformat()}
+
+        output = io.StringIO()
+        writer = csv.DictWriter(output, fieldnames=reader.fieldnames)
+        writer.writeheader()
+        writer.writerows(new_rows)
+        delta_content = output.getvalue().encode('utf-8')
+
+        version = await artifact_service.save_artifact(
+            app_name=app_name,
+            user_id=user_id,
+            session_id=session_id,
+            filename=filename,
+            artifact=types.Part.from_bytes(data=delta_content, mime_type="text/csv"),
+            custom_metadata=lineage,
+        )
+        # Saved: the phrases stay exported even if recording the version fails
+        reserved = False
+        await asyncio.to_thread(
+            registry.record_export, bot_id, new_rows, filename, version, user_id=user_id, session_id=session_id,
+            base=base, skipped_rows=skipped_rows, intent_column=intent_column, phrase_column=phrase_column,
+        )
+
+        print(f"💾 Saved delta CSV artifact: {filename} ({len(new_rows)} new rows, {skipped_rows} skipped)")
+        return {
+            "status": "success",
+            "filename": filename,
+            "version": version,
+            "lineage": lineage,
+            "saved_at": datetime.now().isoformat(),
+            "size": len(delta_content),
+            "mime_type": "text/csv"
+        }
+
+    except Exception as e:
+        if reserved:
+            await asyncio.to_thread(registry.release, bot_id, filename)
+        print(f"⚠️ Error saving delta CSV artifact: {e}")
+        return {
+            "status": "error",
+            "error": str(e),
+            "saved_at": datetime.now().isoformat()
+        }
+
+async def get_artifact_lineage(
+    artifact_service, app_name: str, user_id: str, session_id: str, filename: str, version: Optional[int] = None
+) -> Optional[Dict[str, Any]]:
+    """
+    Get the lineage recorded with a delta CSV artifact.
+
+    Args:
+        artifact_service: ADK artifact service
+        app_name: Application name
+        user_id: User the artifact belongs to
+        session_id: Session the artifact belongs to
+        filename: Artifact filename
+        version: Artifact version, defaults to the latest
+
+    Returns:
+        Optional[Dict[str, Any]]: Lineage metadata, None for artifacts without lineage
+    """
+    artifact_version = await artifact_service.get_artifact_version(
+        app_name=app_name, user_id=user_id, session_id=session_id, filename=filename, version=version
+    )
+    if artifact_version is None or not (artifact_version.custom_metadata or {}).get("delta"):
+        return None
+    return {"version": artifact_version.version, **artifact_version.custom_metadata}
+
+def write_intent_bundle(fileobj: IO[bytes], csv_content: str, bot_json: str = "") -> Dict[str, Any]:
+    """
+    Write a Dialogflow CX intent import bundle: a zip with one intent JSON
+    file (`intents/<display name>.json`) per intent in the CSV.
+
+    Intents that exist in the bot export keep their name, parameters and
+    training phrases, and get the new phrases appended; phrases the intent
+    already has (ignoring case and spacing) are left out. Entries are written
+    one intent at a time, so only one intent's JSON is in memory at once.
+
+    Args:
+        fileobj: Writable binary file to write the zip to
+        csv_content: CSV with "Intent Name" and "Training Phrase" columns and
+            an optional "Language Code" column
+        bot_json: Dialogflow CX bot export the phrases are merged into
+
+    Returns:
+        Dict[str, Any]: Counts of intents (new and merged) and phrases (added
+        and skipped)
+    """
+    import io
+    import json
+    import re
+    import zipfile
+    from tools.phrase_validation import exact_key, read_intent_phrases
+
+    try:
+        bot = json.loads(bot_json) if bot_json else {}
+    except json.JSONDecodeError:
+        bot = {}
+    intents = (bot.get("intents") or []) if isinstance(bot, dict) else []
+    existing_intents = {intent.get("displayName", ""): intent for intent in intents if isinstance(intent, dict)}
+
+    new_phrases: Dict[str, List[Dict[str, Any]]] = {}
+    for record in read_intent_phrases(csv_content):
+        training_phrase = {"parts": [{"text": record.phrase}], "repeatCount": 1}
+        if record.language_code:
+            training_phrase["languageCode"] = record.language_code
+        new_phrases.setdefault(record.intent, []).append(training_phrase)
+
+    summary = {"intents": 0, "new_intents": 0, "merged_intents": 0, "phrases_added": 0, "phrases_skipped": 0}
+    entry_names = set()
+    with zipfile.ZipFile(fileobj, "w", compression=zipfile.ZIP_DEFLATED) as bundle:
+        for intent_name, phrases in new_phrases.items():
+            existing = existing_intents.get(intent_name)
+            intent = dict(existing) if existing else {"displayName": intent_name, "priority": 500000}
+            training_phrases = list(intent.get("trainingPhrases") or [])
+            known = {
+                exact_key("".join(part.get("text", "") for part in training_phrase.get("parts", [])))
+                for training_phrase in training_phrases
+            }
+            for training_phrase in phrases:
+                key = exact_key(training_phrase["parts"][0]["text"])
+                if key in known:
+                    summary["phrases_skipped"] += 1
+                    continue
+                known.add(key)
+                training_phrases.append(training_phrase)
+                summary["phrases_added"] += 1
+            intent["trainingPhrases"] = training_phrases
+
+            entry_name = re.sub(r"[^\w.-]+", "_", intent_name)
+            while entry_name in entry_names:
+                entry_name += "_"
+            entry_names.add(entry_name)
+            with bundle.open(f"intents/{entry_name}.json", "w") as entry:
+                with io.TextIOWrapper(entry, encoding="utf-8") as text:
+                    json.dump(intent, text, ensure_ascii=False, indent=2)
+
+            summary["intents"] += 1
+            summary["merged_intents" if existing else "new_intents"] += 1
+    return summary
+
+async def save_intent_bundle_artifact(
+    artifact_service,
+    app_name: str,
+    user_id: str,
+    session_id: str,
+    csv_content: str,
+    bot_json: str = "",
+    filename: str = None,
+) -> Dict[str, Any]:
+    """
+    Save a Dialogflow CX intent import bundle (see `write_intent_bundle`) as an artifact.
+
+    The bundle is built in the CPU task pool and written to a temporary file,
+    then saved through the artifact service like any other artifact, so it is
+    versioned and listed with them. Artifact services take the zip as bytes,
+    so bundles over INTENT_BUNDLE_MAX_BYTES are refused.
+
+    Args:
+        artifact_service: ADK artifact service to save to
+        app_name: Application name
+        user_id: User to save the artifact for
+        session_id: Session to save the artifact in
+        csv_content: CSV content with "Intent Name" and "Training Phrase" columns
+        bot_json: Dialogflow CX bot export the phrases are merged into
+        filename: Optional filename, will generate one if not provided
+
+    Returns:
+        Dict[str, Any]: Result of the save operation with the bundle's counts
+    """
+    import tempfile
+    from tools.cpu_tasks import build_intent_bundle
+    from tools.process_pool import cpu_task_pool
+
+    try:
+        if not filename:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            filename = f"dialogflow_cx_intent_bundle_{timestamp}.zip"
+
+        with tempfile.TemporaryDirectory() as directory:
+            # Bot export parsing and zipping run in the CPU task pool, off the event loop
+            path = os.path.join(directory, "bundle.zip")
+            summary = await cpu_task_pool.run(build_intent_bundle, [csv_content, bot_json], path)
+            size = os.path.getsize(path)
+
+            if size > INTENT_BUNDLE_MAX_BYTES:
+                raise ValueError(
+                    f"Intent bundle is {size} bytes, over INTENT_BUNDLE_MAX_BYTES ({INTENT_BUNDLE_MAX_BYTES}); "
+                    "split the CSV into smaller imports"
+                )
+            with open(path, "rb") as bundle_file:
+                artifact = types.Part.from_bytes(data=bundle_file.read(), mime_type="application/zip")
+
+        version = await artifact_service.save_artifact(
+            app_name=app_name,
+            user_id=user_id,
+            session_id=session_id,
+            filename=filename,
+            artifact=artifact,
+            custom_metadata={"intent_bundle": True, **summary},
+        )
+
+        print(f"💾 Saved intent bundle artifact: {filename} ({summary['intents']} intents, {summary['phrases_added']} phrases)")
+        return {
+            "status": "success",
+            "filename": filename,
+            "version": version,
+            "saved_at": datetime.now().isoformat(),
+            "size": size,
+            "mime_type": "application/zip",
+            **summary,
+        }
+
+    except Exception as e:
+        print(f"⚠️ Error saving intent bundle artifact: {e}")
+        return {
+            "status": "error",
+            "error": str(e),
+            "saved_at": datetime.now().isoformat()
+        }
+
 def generate_sample_csv() -> str:
     """
     Generate a sample CSV content for testing.
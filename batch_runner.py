@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+"""
+Headless Batch Runner for No-Match Analysis Agent
+Runs the analysis for many bots, GCP projects and date windows from a job
+manifest, with a bounded number of concurrent jobs, and writes one CSV artifact
+per job plus a JSON summary report.
+
+Usage:
+    python batch_runner.py jobs.json --workers 8 --summary batch_summary.json
+
+Manifest (JSON list, {"jobs": [...]} object, or one job per line in .jsonl):
+    {"job_id": "retail_bot_2024w01", "project": "my-project", "dataset": "cx_logs",
+     "bq_location": "US", "bot_export": "exports/retail_bot.json",
+     "start_date": "2024-01-01", "end_date": "2024-01-07"}
+
+With --delta (or "delta_export": true on a job) a job's CSV only contains
+training phrases never exported before for its bot ("bot_id", else the bot
+export's file name, else project.dataset).
+
+With --bundle (or "intent_bundle": true on a job) a job also saves a Dialogflow
+CX intent import bundle, with the phrases merged into the bot export's intents.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from google.adk import Runner
+from google.adk.events import Event, EventActions
+from google.genai import types
+
+from agent import no_match_analysis_orchestrator
+from artifact_config import configure_artifact_service_for_runner
+from artifact_utils import save_delta_csv_artifact, save_intent_bundle_artifact
+from run_agent import APP_NAME
+from session_config import get_session_service
+from tools.model_tiering import model_router
+from tools.phrase_validation import extract_csv_content
+from tools.state_offload import state_value_digest
+from tools.workflow_checkpoints import CHECKPOINTS_STATE_KEY, WORKFLOW_STEPS, build_checkpoint
+
+REQUIRED_JOB_FIELDS = ("project", "dataset", "start_date", "end_date")
+
+BATCH_USER_PREFIX = "batch-"
+BOT_PARSER_USER_ID = "batch-bot-parser"
+
+
+def load_manifest(path: str) -> List[Dict[str, Any]]:
+    """
+    Load and validate a batch job manifest.
+
+    Args:
+        path: JSON or JSONL manifest file
+
+    Returns:
+        List[Dict[str, Any]]: Jobs with `job_id` filled in and `bot_export`
+        resolved relative to the manifest
+
+    Raises:
+        ValueError: If a job misses a required field or a job id repeats
+    """
+    with open(path, "r") as f:
+        content = f.read()
+
+    if path.endswith(".jsonl"):
+        jobs = [json.loads(line) for line in content.splitlines() if line.strip()]
+    else:
+        data = json.loads(content)
+        jobs = data.get("jobs", []) if isinstance(data, dict) else data
+
+    manifest_dir = os.path.dirname(os.path.abspath(path))
+    job_ids = set()
+    for index, job in enumerate(jobs):
+        missing = [field for field in REQUIRED_JOB_FIELDS if not job.get(field)]
+        if missing:
+            raise ValueError(f"Job {index} is missing required fields: {', '.join(missing)}")
+
+        job.setdefault("job_id", f"{job['project']}_{job['dataset']}_{job['start_date']}_{job['end_date']}")
+        if job["job_id"] in job_ids:
+            raise ValueError(f"Duplicate job_id in manifest: {job['job_id']}")
+        job_ids.add(job["job_id"])
+
+        if job.get("bot_export"):
+            job["bot_export"] = os.path.join(manifest_dir, job["bot_export"])
+
+    return jobs
+
+
+def job_bot_id(job: Dict[str, Any]) -> str:
+    """
+    Bot a job's training phrases belong to, for delta exports.
+
+    Args:
+        job: Job from `load_manifest`
+
+    Returns:
+        str: `bot_id`, else the bot export's file name, else `project.dataset`
+    """
+    if job.get("bot_id"):
+        return job["bot_id"]
+    if job.get("bot_export"):
+        return os.path.splitext(os.path.basename(job["bot_export"]))[0]
+    return f"{job['project']}.{job['dataset']}"
+
+
+class BatchRunner:
+    """
+    Runs batch jobs through a shared ADK runner.
+
+    Jobs run concurrently up to `max_workers` and share everything that lives
+    at process level: the BigQuery clients and dataset metadata cache (see
+    tools/bigquery_tools.py), the Gemini rate limiter and response cache, and
+    the bot-parse cache below. Each bot export is read and analysed once; the
+    analysis is seeded as a Step 3 checkpoint into every job that uses it.
+    Each job runs as its own user (`batch-<job_id>`), so rerunning a manifest
+    resumes jobs from their own checkpoints.
+    """
+
+    def __init__(self, runner: Runner, max_workers: int = 4, delta_export: bool = False, intent_bundle: bool = False):
+        """
+        Args:
+            runner: Runner for the no-match analysis orchestrator
+            max_workers: Maximum number of jobs running at once
+            delta_export: Save only phrases not exported before (jobs can override)
+            intent_bundle: Also save a CX intent import bundle (jobs can override)
+        """
+        self.runner = runner
+        self.max_workers = max_workers
+        self.delta_export = delta_export
+        self.intent_bundle = intent_bundle
+        self._bot_exports: Dict[str, str] = {}
+        self._bot_checkpoints: Dict[str, Dict[str, Any]] = {}
+
+    def _load_bot_export(self, path: str) -> str:
+        """Read a bot export once per batch."""
+        if path not in self._bot_exports:
+            with open(path, "r") as f:
+                self._bot_exports[path] = f.read()
+        return self._bot_exports[path]
+
+    async def _parse_bot(self, bot_json: str, semaphore: asyncio.Semaphore) -> None:
+        """Run the Dialogflow CX parser once for a bot export and cache its checkpoint."""
+        parser_agent = self.runner.agent.dialogflow_cx_parser_agent
+        async with semaphore:
+            try:
+                parser_runner = Runner(
+                    app_name=self.runner.app_name,
+                    agent=parser_agent,
+                    session_service=self.runner.session_service,
+                    artifact_service=self.runner.artifact_service,
+                )
+                session = await self.runner.session_service.create_session(
+                    app_name=self.runner.app_name,
+                    user_id=BOT_PARSER_USER_ID,
+                    state={"dialogflow_bot_json": bot_json, "request_priority": "batch"},
+                )
+                message = types.Content(role="user", parts=[types.Part(text="Analyze the Dialogflow CX bot structure.")])
+                async for _ in parser_runner.run_async(user_id=BOT_PARSER_USER_ID, session_id=session.id, new_message=message):
+                    pass
+
+                session = await self.runner.session_service.get_session(
+                    app_name=self.runner.app_name, user_id=BOT_PARSER_USER_ID, session_id=session.id
+                )
+                checkpoint = build_checkpoint(3, session.state)
+                if checkpoint["output"]:
+                    self._bot_checkpoints[state_value_digest(bot_json)] = checkpoint
+            except Exception as e:
+                # Jobs using this bot run Step 3 themselves
+                print(f"⚠️ Could not pre-parse bot export: {e}")
+
+    async def _seed_bot_checkpoint(self, session, bot_json: str) -> None:
+        """Add the cached Step 3 checkpoint of a bot to a job's checkpoints."""
+        checkpoint = self._bot_checkpoints.get(state_value_digest(bot_json))
+        if not checkpoint:
+            return
+        checkpoints = dict(session.state.get(CHECKPOINTS_STATE_KEY) or {})
+        checkpoints[WORKFLOW_STEPS[3]["name"]] = checkpoint
+        await self.runner.session_service.append_event(
+            session,
+            Event(author="user", actions=EventActions(state_delta={CHECKPOINTS_STATE_KEY: checkpoints})),
+        )
+
+    async def _run_job(self, job: Dict[str, Any], semaphore: asyncio.Semaphore) -> Dict[str, Any]:
+        """Run one job and save its CSV artifact."""
+        result: Dict[str, Any] = {
+            "job_id": job["job_id"],
+            "project": job["project"],
+            "dataset": job["dataset"],
+            "start_date": job["start_date"],
+            "end_date": job["end_date"],
+            "status": "failed",
+        }
+        async with semaphore:
+            started = time.monotonic()
+            user_id = f"{BATCH_USER_PREFIX}{job['job_id']}"
+            try:
+                state = {
+                    "PROJECT": job["project"],
+                    "DATASET": job["dataset"],
+                    "request_priority": "batch",
+                }
+                if job.get("bq_location"):
+                    state["BQ_LOCATION"] = job["bq_location"]
+                bot_json = self._load_bot_export(job["bot_export"]) if job.get("bot_export") else ""
+                if bot_json:
+                    state["dialogflow_bot_json"] = bot_json
+
+                session = await self.runner.session_service.create_session(
+                    app_name=self.runner.app_name, user_id=user_id, state=state
+                )
+                if bot_json:
+                    await self._seed_bot_checkpoint(session, bot_json)
+
+                message = types.Content(role="user", parts=[types.Part(
+                    text=f"Analyze no-match events from {job['start_date']} to {job['end_date']}."
+                )])
+                async for _ in self.runner.run_async(user_id=user_id, session_id=session.id, new_message=message):
+                    pass
+
+                session = await self.runner.session_service.get_session(
+                    app_name=self.runner.app_name, user_id=user_id, session_id=session.id
+                )
+                csv_generation_output = session.state.get("csv_generation_output", "")
+                result["session_id"] = session.id
+                result["degraded_steps"] = session.state.get("degraded_steps") or []
+
+                if csv_generation_output and self.runner.artifact_service and job.get("delta_export", self.delta_export):
+                    saved = await save_delta_csv_artifact(
+                        self.runner.artifact_service,
+                        app_name=self.runner.app_name,
+                        user_id=user_id,
+                        session_id=session.id,
+                        csv_content=extract_csv_content(csv_generation_output),
+                        bot_id=job_bot_id(job),
+                        filename=f"{job['job_id']}_no_match_training_phrases_delta.csv",
+                    )
+                    if saved["status"] == "error":
+                        raise RuntimeError(f"Delta export failed: {saved['error']}")
+                    result["artifact"] = {"filename": saved["filename"], "version": saved.get("version"), "lineage": saved["lineage"]}
+                elif csv_generation_output and self.runner.artifact_service:
+                    filename = f"{job['job_id']}_no_match_training_phrases.csv"
+                    version = await self.runner.artifact_service.save_artifact(
+                        app_name=self.runner.app_name,
+                        user_id=user_id,
+                        session_id=session.id,
+                        filename=filename,
+                        artifact=types.Part.from_bytes(
+                            data=extract_csv_content(csv_generation_output).encode("utf-8"),
+                            mime_type="text/csv",
+                        ),
+                    )
+                    result["artifact"] = {"filename": filename, "version": version}
+
+                if csv_generation_output and self.runner.artifact_service and job.get("intent_bundle", self.intent_bundle):
+                    bundle = await save_intent_bundle_artifact(
+                        self.runner.artifact_service,
+                        app_name=self.runner.app_name,
+                        user_id=user_id,
+                        session_id=session.id,
+                        csv_content=extract_csv_content(csv_generation_output),
+                        bot_json=bot_json,
+                        filename=f"{job['job_id']}_cx_intent_bundle.zip",
+                    )
+                    if bundle["status"] == "error":
+                        raise RuntimeError(f"Intent bundle export failed: {bundle['error']}")
+                    result["bundle"] = {key: bundle[key] for key in ("filename", "version", "intents", "phrases_added")}
+
+                if session.state.get("run_degraded"):
+                    result["status"] = "degraded"
+                elif csv_generation_output:
+                    result["status"] = "succeeded"
+                else:
+                    result["status"] = "empty"
+            except Exception as e:
+                result["error"] = str(e)
+            result["duration_seconds"] = round(time.monotonic() - started, 3)
+
+        icon = {"succeeded": "✅", "degraded": "⚠️", "empty": "📭"}.get(result["status"], "❌")
+        print(f"{icon} Job {job['job_id']}: {result['status']} in {result['duration_seconds']}s")
+        return result
+
+    async def run(self, jobs: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Run all jobs and build the summary report.
+
+        Args:
+            jobs: Jobs from `load_manifest`
+
+        Returns:
+            Dict[str, Any]: Summary with per-job results, status counts and throughput
+        """
+        started_at = datetime.now()
+        started = time.monotonic()
+        semaphore = asyncio.Semaphore(self.max_workers)
+
+        bot_exports = {
+            state_value_digest(bot_json): bot_json
+            for bot_json in (self._load_bot_export(job["bot_export"]) for job in jobs if job.get("bot_export"))
+        }
+        if bot_exports:
+            print(f"🤖 Parsing {len(bot_exports)} unique bot export(s)")
+            await asyncio.gather(*(self._parse_bot(bot_json, semaphore) for bot_json in bot_exports.values()))
+
+        print(f"🚀 Running {len(jobs)} job(s) with {self.max_workers} worker(s)")
+        results = await asyncio.gather(*(self._run_job(job, semaphore) for job in jobs))
+
+        wall_seconds = time.monotonic() - started
+        status_counts = {status: 0 for status in ("succeeded", "degraded", "empty", "failed")}
+        for result in results:
+            status_counts[result["status"]] += 1
+
+        return {
+            "started_at": started_at.isoformat(),
+            "finished_at": datetime.now().isoformat(),
+            "workers": self.max_workers,
+            "total_jobs": len(jobs),
+            **status_counts,
+            "bots_parsed": len(self._bot_checkpoints),
+            "wall_seconds": round(wall_seconds, 3),
+            "jobs_per_minute": round(len(jobs) / wall_seconds * 60, 2) if wall_seconds else None,
+            # Per-tier latency and cost, to tune MODEL_TIER_* thresholds
+            "model_tiers": model_router.report(),
+            "jobs": results,
+        }
+
+
+def build_runner(agent=None) -> Runner:
+    """
+    Create the runner used for batch jobs, with the configured session and artifact services.
+
+    Args:
+        agent: Orchestrator to run, defaults to the no-match analysis orchestrator
+
+    Returns:
+        Runner: Configured runner
+    """
+    runner = Runner(
+        app_name=APP_NAME,
+        agent=agent or no_match_analysis_orchestrator,
+        session_service=get_session_service()
+    )
+    return configure_artifact_service_for_runner(runner)
+
+
+def main(argv: Optional[List[str]] = None):
+    """Run a batch manifest from the command line."""
+    parser = argparse.ArgumentParser(description="Run no-match analysis jobs from a manifest")
+    parser.add_argument("manifest", help="JSON or JSONL job manifest")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("BATCH_WORKERS", "4")),
+                        help="Maximum number of concurrent jobs (default: BATCH_WORKERS or 4)")
+    parser.add_argument("--summary", default=None,
+                        help="Summary report path (default: batch_summary_<timestamp>.json)")
+    parser.add_argument("--delta", action="store_true",
+                        default=os.environ.get("DELTA_CSV_EXPORT", "false").lower() in ("1", "true", "yes"),
+                        help="Only export training phrases not exported before (default: DELTA_CSV_EXPORT)")
+    parser.add_argument("--bundle", action="store_true",
+                        default=os.environ.get("CX_INTENT_BUNDLE_EXPORT", "false").lower() in ("1", "true", "yes"),
+                        help="Also save a Dialogflow CX intent import bundle (default: CX_INTENT_BUNDLE_EXPORT)")
+    args = parser.parse_args(argv)
+
+    print("🚀 Starting No-Match Analysis batch run")
+
+    try:
+        jobs = load_manifest(args.manifest)
+        summary = asyncio.run(BatchRunner(
+            build_runner(), max_workers=args.workers, delta_export=args.delta, intent_bundle=args.bundle
+        ).run(jobs))
+    except KeyboardInterrupt:
+        print("\n🛑 Batch run stopped by user")
+        sys.exit(130)
+    except Exception as e:
+        print(f"❌ Batch run failed: {e}")
+        sys.exit(1)
+
+    summary_path = args.summary or f"batch_summary_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    with open(summary_path, "w") as f:
+        json.dump(summary, f, indent=2)
+
+    print(f"📊 {summary['succeeded']} succeeded, {summary['degraded']} degraded, "
+          f"{summary['empty']} empty, {summary['failed']} failed "
+          f"in {summary['wall_seconds']}s ({summary['jobs_per_minute']} jobs/min)")
+    print(f"📝 Summary report: {summary_path}")
+    sys.exit(1 if summary["failed"] else 0)
+
+
+if __name__ == "__main__":
+    main()
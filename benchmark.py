@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+"""
+Offline Benchmark for No-Match Analysis Agent
+Runs the full NoMatchAnalysisAgent workflow end to end against a scripted
+fake Gemini model and a fake BigQuery backend with synthetic conversation
+data, at several data scales, and writes per-step latency, peak memory and
+events per second as JSON so runs can be compared over time.
+
+Usage:
+    python benchmark.py --scales 10,1000,100000,1000000 --seconds-per-token 0.002
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import re
+import sys
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+from google.adk.artifacts import InMemoryArtifactService
+from google.adk.runners import Runner
+from google.adk.sessions import InMemorySessionService
+from google.genai import types
+
+from fake_services import FakeBigQueryClient, FakeGeminiLlm, use_fake_bigquery, use_fake_model
+
+BENCHMARK_APP_NAME = "no_match_benchmark"
+FAKE_PROJECT = "fake-project"
+FAKE_DATASET = "fake_dataset"
+DEFAULT_SCALES = [10, 1000, 100000]
+
+# Sub-agent (event author) -> workflow step name
+STEP_AUTHORS = {
+    "conversation_data_retrieval_agent": "conversation_data_retrieval",
+    "no_match_analysis_agent": "no_match_analysis",
+    "dialogflow_cx_parser_agent": "dialogflow_cx_parser",
+    "csv_generation_agent": "csv_generation",
+}
+
+
+def no_match_query(days: int = 30) -> str:
+    """Build the no-match template query over the last `days` days."""
+    end = date.today()
+    start = end - timedelta(days=days - 1)
+    return f"""
+        SELECT
+           REGEXP_EXTRACT(conversation_name, r'[^\\\\/]+$') AS Convo_ID,
+           STRING_AGG(JSON_VALUE(request, '$.queryInput.text.text'), '\\n---\\n' ORDER BY request_time) AS conversation_script,
+           COUNT(CASE WHEN JSON_VALUE(request, '$.intentDetectionConfidence') = '0.0' THEN 1 END) as no_match_count
+        FROM `{FAKE_PROJECT}.{FAKE_DATASET}.dialogflow_bigquery_export_data`
+        WHERE DATE(request_time) BETWEEN '{start.isoformat()}' AND '{end.isoformat()}'
+        GROUP BY Convo_ID
+        HAVING no_match_count > 0
+        ORDER BY no_match_count DESC
+        LIMIT 10
+    """
+
+
+def synthetic_bot_export(num_intents: int = 50) -> str:
+    """Build a Dialogflow CX-style bot export with the given number of intents."""
+    return json.dumps({
+        "displayName": "benchmark_bot",
+        "intents": [
+            {
+                "displayName": f"intent_{index}",
+                "trainingPhrases": [{"parts": [{"text": f"sample phrase {index}-{phrase}"}]} for phrase in range(10)],
+            }
+            for index in range(num_intents)
+        ],
+        "flows": [{"displayName": "Default Start Flow", "pages": [{"displayName": f"page_{index}"} for index in range(10)]}],
+    })
+
+
+def _retrieval_response(llm_request) -> str:
+    rows = (FakeGeminiLlm.last_function_response(llm_request) or {}).get("result", [])
+    lines = [f"Convo_ID: {row['Convo_ID']}, no_match_count: {row['no_match_count']}, "
+             f"conversation_script: {row['conversation_script']}" for row in rows]
+    return f"Retrieved {len(rows)} conversations with no-match events:\n" + "\n".join(lines)
+
+
+def _utterance_counts(llm_request) -> Counter:
+    instruction = str(llm_request.config.system_instruction or "")
+    return Counter({
+        utterance: instruction.count(utterance)
+        for utterance in FakeBigQueryClient.UTTERANCES if utterance in instruction
+    })
+
+
+def _analysis_response(llm_request) -> str:
+    lines = ["## No-Match Event Analysis Report", "", "### Most frequent unmatched utterances"]
+    for utterance, count in _utterance_counts(llm_request).most_common():
+        lines.append(f"- \"{utterance}\": {count} occurrences. Recommendation: add a dedicated intent.")
+    return "\n".join(lines)
+
+
+def _csv_response(llm_request) -> str:
+    rows = ["intent_name,training_phrase,language_code"]
+    for utterance in _utterance_counts(llm_request):
+        intent_name = re.sub(r"\W+", "_", utterance).strip("_")
+        rows.extend(f"{intent_name},{variant},en" for variant in (utterance, f"I need help: {utterance}", f"{utterance} please"))
+    return "```csv\n" + "\n".join(rows) + "\n```"
+
+
+def build_fake_model(latency_seconds: float = 0.0, seconds_per_token: float = 0.0) -> FakeGeminiLlm:
+    """
+    Build the scripted model for the benchmark.
+
+    Args:
+        latency_seconds: Fixed latency per model call
+        seconds_per_token: Generation time per output token
+
+    Returns:
+        FakeGeminiLlm: Model that calls the BigQuery tool in Step 1 and derives
+        each later step's output from its prompt
+    """
+    return FakeGeminiLlm(
+        calls=[],
+        latency_seconds=latency_seconds,
+        seconds_per_token=seconds_per_token,
+        tool_calls={
+            "conversation_data_retrieval_agent": {
+                "name": "bigquery_execution_tool",
+                "args": {"PROJECT": FAKE_PROJECT, "query": no_match_query()},
+            },
+        },
+        responses={
+            "conversation_data_retrieval_agent": _retrieval_response,
+            "no_match_analysis_agent": _analysis_response,
+            "dialogflow_cx_parser_agent": "## Bot Structure Analysis\nIntents and flows parsed.",
+            "csv_generation_agent": _csv_response,
+        },
+    )
+
+
+def max_rss_bytes() -> Optional[int]:
+    """Get the peak resident set size of this process, or None where unsupported."""
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+async def run_workflow(runner: Runner, user_id: str, state: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Run the workflow once in a new session and time each step.
+
+    Args:
+        runner: Runner for the orchestrator (with a fake model)
+        user_id: User to create the session for
+        state: Initial session state
+
+    Returns:
+        Dict[str, Any]: Session id, total seconds, seconds per step and event count
+    """
+    session = await runner.session_service.create_session(app_name=runner.app_name, user_id=user_id, state=state)
+    message = types.Content(role="user", parts=[types.Part(text="Analyze no-match events from the last 30 days")])
+    step_ends: Dict[str, float] = {}
+    events = 0
+
+    started = time.perf_counter()
+    async for event in runner.run_async(user_id=user_id, session_id=session.id, new_message=message):
+        events += 1
+        if event.author in STEP_AUTHORS:
+            step_ends[STEP_AUTHORS[event.author]] = time.perf_counter()
+    total_seconds = time.perf_counter() - started
+
+    # A step runs from the end of the previous step (or the start of the run) to its last event
+    step_seconds: Dict[str, float] = {}
+    previous_end = started
+    for step_name, step_end in sorted(step_ends.items(), key=lambda item: item[1]):
+        step_seconds[step_name] = round(step_end - previous_end, 6)
+        previous_end = step_end
+
+    return {
+        "session_id": session.id,
+        "total_seconds": round(total_seconds, 6),
+        "step_seconds": step_seconds,
+        "events": events,
+    }
+
+
+def initial_state(bot_json: str = "") -> Dict[str, Any]:
+    """Build the initial session state for the fake project."""
+    state = {"PROJECT": FAKE_PROJECT, "DATASET": FAKE_DATASET, "BQ_LOCATION": "US"}
+    if bot_json:
+        state["dialogflow_bot_json"] = bot_json
+    return state
+
+
+async def run_scale(runner: Runner, scale: int, bot_json: str, bigquery_latency_seconds: float = 0.0) -> Dict[str, Any]:
+    """
+    Run the workflow once against `scale` synthetic conversations.
+
+    Args:
+        runner: Runner for the orchestrator (with a fake model)
+        scale: Number of conversations in the fake export table
+        bot_json: Bot export for Step 3, or "" to skip it
+        bigquery_latency_seconds: Fixed latency of each fake query
+
+    Returns:
+        Dict[str, Any]: Latency per step, totals, events per second and memory
+    """
+    fake_bigquery = use_fake_bigquery(FakeBigQueryClient(
+        num_conversations=scale, project=FAKE_PROJECT, latency_seconds=bigquery_latency_seconds
+    ))
+    user_id = f"benchmark-{uuid.uuid4().hex[:8]}"
+
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+    run = await run_workflow(runner, user_id, initial_state(bot_json))
+    peak_traced = tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else None
+
+    session = await runner.session_service.get_session(app_name=runner.app_name, user_id=user_id, session_id=run["session_id"])
+    return {
+        "scale": scale,
+        "total_seconds": run["total_seconds"],
+        "step_seconds": run["step_seconds"],
+        "events": run["events"],
+        "events_per_second": round(run["events"] / run["total_seconds"], 2) if run["total_seconds"] else None,
+        "peak_traced_memory_bytes": peak_traced,
+        "max_rss_bytes": max_rss_bytes(),
+        "bigquery_rows_scanned": fake_bigquery.rows_scanned,
+        "csv_generated": bool(session.state.get("csv_generation_output")),
+        "degraded": bool(session.state.get("run_degraded")),
+    }
+
+
+async def run_benchmark(
+    scales: List[int],
+    latency_seconds: float = 0.0,
+    seconds_per_token: float = 0.0,
+    bigquery_latency_seconds: float = 0.0,
+    with_bot: bool = True,
+    warmup_runs: int = 1,
+    trace_memory: bool = True,
+    agent=None,
+) -> Dict[str, Any]:
+    """
+    Run the offline benchmark at each scale.
+
+    Args:
+        scales: Numbers of synthetic conversations to run against
+        latency_seconds: Fixed latency per model call
+        seconds_per_token: Generation time per output token
+        bigquery_latency_seconds: Fixed latency of each fake query
+        with_bot: Include a synthetic bot export so Step 3 runs
+        warmup_runs: Unmeasured runs first (ADK loads parts of itself on the
+            first run)
+        trace_memory: Record peak Python allocations with tracemalloc, which
+            slows allocation-heavy steps down several times
+        agent: Orchestrator to benchmark, defaults to the root agent
+
+    Returns:
+        Dict[str, Any]: Machine-readable benchmark report
+    """
+    if agent is None:
+        from agent import root_agent as agent
+
+    fake_llm = use_fake_model(agent, build_fake_model(latency_seconds, seconds_per_token))
+    runner = Runner(
+        app_name=BENCHMARK_APP_NAME,
+        agent=agent,
+        session_service=InMemorySessionService(),
+        artifact_service=InMemoryArtifactService(),
+    )
+    bot_json = synthetic_bot_export() if with_bot else ""
+
+    tracing_started = trace_memory and not tracemalloc.is_tracing()
+    if tracing_started:
+        tracemalloc.start()
+    try:
+        for _ in range(warmup_runs):
+            await run_scale(runner, min(scales), bot_json)
+        warmup_calls = len(fake_llm.calls)
+        results = [await run_scale(runner, scale, bot_json, bigquery_latency_seconds) for scale in scales]
+    finally:
+        if tracing_started:
+            tracemalloc.stop()
+
+    return {
+        "benchmark": "offline_end_to_end",
+        "timestamp": datetime.now().isoformat(),
+        "python_version": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {
+            "scales": scales,
+            "model_latency_seconds": latency_seconds,
+            "seconds_per_token": seconds_per_token,
+            "bigquery_latency_seconds": bigquery_latency_seconds,
+            "with_bot": with_bot,
+            "warmup_runs": warmup_runs,
+            "trace_memory": trace_memory,
+        },
+        "model_calls": len(fake_llm.calls) - warmup_calls,
+        "results": results,
+    }
+
+
+def main():
+    """Run the offline benchmark from the command line."""
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark for the no-match analysis agent")
+    parser.add_argument("--scales", default=",".join(str(scale) for scale in DEFAULT_SCALES),
+                        help="Comma-separated conversation counts (default: 10,1000,100000)")
+    parser.add_argument("--latency", type=float, default=0.0, help="Fixed latency per model call in seconds")
+    parser.add_argument("--seconds-per-token", type=float, default=0.0, help="Generation time per output token")
+    parser.add_argument("--bigquery-latency", type=float, default=0.0, help="Fixed latency per BigQuery query")
+    parser.add_argument("--warmup", type=int, default=1, help="Unmeasured warm-up runs (default: 1)")
+    parser.add_argument("--no-trace-memory", action="store_true",
+                        help="Skip tracemalloc (faster, only max RSS is reported)")
+    parser.add_argument("--no-bot", action="store_true", help="Skip Step 3 (no bot export)")
+    parser.add_argument("--output", default=None, help="Results path (default: benchmark_<timestamp>.json)")
+    args = parser.parse_args()
+
+    # Measure the workflow itself, not replayed responses or stored checkpoints
+    os.environ["LLM_CACHE_ENABLED"] = "false"
+    os.environ["WORKFLOW_CHECKPOINTS_ENABLED"] = "false"
+    logging.basicConfig(level=logging.WARNING)
+
+    scales = [int(scale) for scale in args.scales.split(",") if scale.strip()]
+    report = asyncio.run(run_benchmark(
+        scales, args.latency, args.seconds_per_token, args.bigquery_latency, with_bot=not args.no_bot,
+        warmup_runs=args.warmup,
+        trace_memory=not args.no_trace_memory,
+    ))
+
+    for result in report["results"]:
+        steps = ", ".join(f"{name} {seconds:.3f}s" for name, seconds in result["step_seconds"].items())
+        peak = result["peak_traced_memory_bytes"] or result["max_rss_bytes"] or 0
+        print(f"📊 {result['scale']:>9} conversations: {result['total_seconds']:.3f}s total ({steps}), "
+              f"{result['events_per_second']} events/s, peak {peak / 1e6:.1f} MB")
+
+    output = args.output or f"benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"📝 Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,540 @@
+"""
+Local Fake Services for No-Match Analysis Agent
+Offline stand-ins for Gemini, Gemini context caching and BigQuery used to test
+and measure the workflow without live services, plus fault injection for
+exercising retries and hedging.
+"""
+
+import asyncio
+import random
+import re
+import threading
+import time
+import zlib
+from datetime import date, timedelta
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+from google.adk.models.base_llm import BaseLlm
+from google.adk.models.llm_request import LlmRequest
+from google.adk.models.llm_response import LlmResponse
+from google.genai import types
+
+from tools.bigquery_tools import register_bigquery_client
+from tools.rate_limiter import estimate_request_tokens
+from tools.model_tiering import TieredLlm
+from tools.resilience import ResilientLlm
+from tools.top_k import top_k
+
+
+class InjectedFault(Exception):
+    """Transient error raised by `FaultInjector`, carrying an HTTP-style status code."""
+
+    def __init__(self, code: int = 503, message: str = "Injected fault"):
+        super().__init__(f"{code} {message}")
+        self.code = code
+
+
+class FaultInjector:
+    """
+    Adds scripted or random failures and slow calls to a fake operation.
+
+    Calls listed in `fail_calls` / `slow_calls` (1-based) always fail / stall;
+    other calls fail or stall at random with `error_rate` / `slow_rate`.
+    """
+
+    def __init__(
+        self,
+        error_rate: float = 0.0,
+        slow_rate: float = 0.0,
+        slow_latency_seconds: float = 1.0,
+        fail_calls: Optional[List[int]] = None,
+        slow_calls: Optional[List[int]] = None,
+        error_code: int = 503,
+        seed: Optional[int] = None,
+    ):
+        self.error_rate = error_rate
+        self.slow_rate = slow_rate
+        self.slow_latency_seconds = slow_latency_seconds
+        self.fail_calls = set(fail_calls or [])
+        self.slow_calls = set(slow_calls or [])
+        self.error_code = error_code
+        self.call_count = 0
+        self.cancelled_count = 0
+        self._random = random.Random(seed)
+
+    async def inject(self) -> None:
+        """Apply the fault (if any) for the next call."""
+        self.call_count += 1
+        call_number = self.call_count
+        if call_number in self.fail_calls or self._random.random() < self.error_rate:
+            raise InjectedFault(self.error_code)
+        if call_number in self.slow_calls or self._random.random() < self.slow_rate:
+            try:
+                await asyncio.sleep(self.slow_latency_seconds)
+            except asyncio.CancelledError:
+                self.cancelled_count += 1
+                raise
+
+    async def call(self, result: Any) -> Any:
+        """
+        Run one faulty call that returns `result` if it survives.
+
+        Args:
+            result: Value to return
+
+        Returns:
+            Any: `result`
+        """
+        await self.inject()
+        return result
+
+
+class FakeContextCacheBackend:
+    """
+    In-process stand-in for Gemini context caching (see tools/context_cache.py).
+    Cached instructions are kept by name, so a `FakeGeminiLlm` sharing the
+    backend can answer requests that reference them.
+    """
+
+    def __init__(self, fault_injector: Optional[FaultInjector] = None):
+        self.contents: Dict[str, str] = {}
+        self.created: List[str] = []
+        self.deleted: List[str] = []
+        self.fault_injector = fault_injector
+
+    async def create(self, model: str, system_instruction: str, ttl_seconds: float, display_name: str) -> str:
+        if self.fault_injector:
+            await self.fault_injector.inject()
+        name = f"cachedContents/fake-{len(self.created) + 1}"
+        self.contents[name] = system_instruction
+        self.created.append(name)
+        return name
+
+    async def delete(self, name: str) -> None:
+        self.contents.pop(name, None)
+        self.deleted.append(name)
+
+
+class FakeGeminiLlm(BaseLlm):
+    """
+    Scripted model that answers without calling Gemini.
+
+    Responses come from `responses` (keyed by agent name, or a callable taking
+    the request), otherwise a short canned text. An agent listed in
+    `tool_calls` ({"name": ..., "args": ...}) first gets that function call and
+    the text response once the tool result is in the request. `latency_seconds`
+    is applied once per call, plus `seconds_per_token` for each output token,
+    to mimic generation time. Requests that reference a cached context are
+    resolved through `context_cache_backend`, and their cached tokens are
+    reported in the usage metadata.
+    """
+
+    model: str = "fake-gemini"
+    responses: Dict[str, Union[str, Callable[[LlmRequest], str]]] = {}
+    tool_calls: Dict[str, Dict[str, Any]] = {}
+    default_response: str = "Fake analysis output."
+    latency_seconds: float = 0.0
+    seconds_per_token: float = 0.0
+    fault_injector: Optional[FaultInjector] = None
+    context_cache_backend: Optional[FakeContextCacheBackend] = None
+    calls: List[str] = []
+
+    def system_instruction(self, llm_request: LlmRequest) -> str:
+        """Instruction of a request, from its cached context if it references one."""
+        if not llm_request.config:
+            return ""
+        if llm_request.config.cached_content:
+            if self.context_cache_backend is None or llm_request.config.cached_content not in self.context_cache_backend.contents:
+                raise InjectedFault(404, f"Cached content {llm_request.config.cached_content} not found")
+            return self.context_cache_backend.contents[llm_request.config.cached_content]
+        return str(llm_request.config.system_instruction or "")
+
+    def _agent_name(self, llm_request: LlmRequest) -> str:
+        instruction = self.system_instruction(llm_request)
+        marker = 'Your internal name is "'
+        if marker in instruction:
+            return instruction.split(marker, 1)[1].split('"', 1)[0]
+        return ""
+
+    @staticmethod
+    def last_function_response(llm_request: LlmRequest) -> Optional[Dict[str, Any]]:
+        """
+        Get the tool result at the end of a request, if any.
+
+        Args:
+            llm_request: Model request
+
+        Returns:
+            Optional[Dict[str, Any]]: The function response payload, or None
+        """
+        if not llm_request.contents:
+            return None
+        for part in llm_request.contents[-1].parts or []:
+            if part.function_response:
+                return part.function_response.response
+        return None
+
+    async def generate_content_async(self, llm_request: LlmRequest, stream: bool = False):
+        agent_name = self._agent_name(llm_request)
+        self.calls.append(agent_name)
+        if self.fault_injector:
+            await self.fault_injector.inject()
+
+        tool_call = self.tool_calls.get(agent_name)
+        if tool_call and self.last_function_response(llm_request) is None:
+            await asyncio.sleep(self.latency_seconds)
+            yield LlmResponse(
+                content=types.Content(role="model", parts=[
+                    types.Part.from_function_call(name=tool_call["name"], args=tool_call["args"])
+                ]),
+            )
+            return
+
+        response = self.responses.get(agent_name, self.default_response)
+        text = response(llm_request) if callable(response) else response
+        output_tokens = max(1, len(text) // 4)
+        cached = bool(llm_request.config and llm_request.config.cached_content)
+        cached_tokens = len(self.system_instruction(llm_request)) // 4 if cached else 0
+        prompt_tokens = estimate_request_tokens(llm_request) + cached_tokens
+
+        await asyncio.sleep(self.latency_seconds + self.seconds_per_token * output_tokens)
+        yield LlmResponse(
+            content=types.Content(role="model", parts=[types.Part(text=text)]),
+            usage_metadata=types.GenerateContentResponseUsageMetadata(
+                prompt_token_count=prompt_tokens,
+                cached_content_token_count=cached_tokens or None,
+                candidates_token_count=output_tokens,
+                total_token_count=prompt_tokens + output_tokens,
+            ),
+        )
+
+
+class FakeRow:
+    """BigQuery-style row exposing `items()`."""
+
+    def __init__(self, values: Dict[str, Any]):
+        self._values = values
+
+    def items(self):
+        return self._values.items()
+
+
+class FakeQueryJob:
+    """Query job of `FakeBigQueryClient`; the query runs when `result` is called."""
+
+    def __init__(self, client: "FakeBigQueryClient", query: str):
+        self.client = client
+        self.query = query
+        self.cancelled = False
+
+    def result(self, timeout: Optional[float] = None) -> List[FakeRow]:
+        return self.client._execute(self.query)
+
+    def cancel(self) -> bool:
+        self.cancelled = True
+        return True
+
+
+class FakeBigQueryClient:
+    """
+    In-process stand-in for `bigquery.Client` over synthetic conversation data.
+
+    Conversations are generated on the fly from a seed, so scans over a million
+    conversations need no storage. Queries on INFORMATION_SCHEMA return the
+    export table's columns; every other query is answered like the no-match
+    template query: conversations with at least one no-match in the
+    `BETWEEN 'start' AND 'end'` date range, by no-match count, up to `LIMIT`.
+    The sampled preview queries (see tools/sampling_preview.py) are answered
+    from the same data; the first `no_match_count` turns of a conversation are
+    its no-matches, and the hash sample uses CRC32 in place of FARM_FINGERPRINT.
+    The no-match rollup (see tools/no_match_rollup.py) is kept in memory in
+    `rollup`, its covered days in `rollup_days`; each utterance is asked on a
+    fixed page and flow.
+    """
+
+    COLUMNS = [
+        ("conversation_name", "STRING", "Full resource name of the conversation"),
+        ("request_time", "TIMESTAMP", "Time of the detect intent request"),
+        ("request", "JSON", "Detect intent request"),
+        ("response", "JSON", "Detect intent response"),
+    ]
+    UTTERANCES = [
+        "where is my refund", "talk to a human", "cancel my order", "my package never arrived",
+        "change delivery address", "billing question", "reset my password", "the app keeps crashing",
+        "do you ship internationally", "update payment method", "I was charged twice", "track my order",
+    ]
+    PAGES = [("Start Page", "Default Start Flow"), ("Order Status", "Orders"), ("Payment", "Billing"), ("Login", "Account")]
+
+    def __init__(
+        self,
+        num_conversations: int = 1000,
+        project: str = "fake-project",
+        no_match_rate: float = 0.2,
+        days: int = 30,
+        end_date: Optional[date] = None,
+        latency_seconds: float = 0.0,
+        submit_latency_seconds: float = 0.0,
+        seed: int = 0,
+    ):
+        """
+        Args:
+            num_conversations: Conversations in the synthetic export table
+            project: Project the client belongs to
+            no_match_rate: Probability that a turn is a no-match
+            days: Conversations are spread over this many days
+            end_date: Last day of the data, defaults to today
+            latency_seconds: Fixed query latency on top of the scan
+            submit_latency_seconds: Time `query` takes to create a job
+            seed: Seed of the synthetic data
+        """
+        self.num_conversations = num_conversations
+        self.project = project
+        self.no_match_rate = no_match_rate
+        self.days = days
+        self.end_date = end_date or date.today()
+        self.latency_seconds = latency_seconds
+        self.submit_latency_seconds = submit_latency_seconds
+        self.seed = seed
+        self.queries: List[str] = []
+        self.jobs: Dict[str, FakeQueryJob] = {}
+        self.rows_scanned = 0
+        self.rollup: Dict[Tuple[date, str, str, str, str], Dict[str, Any]] = {}
+        self.rollup_days: set = set()
+        self._lock = threading.Lock()
+
+    def query(self, query: str, job_id: Optional[str] = None) -> FakeQueryJob:
+        time.sleep(self.submit_latency_seconds)
+        job = FakeQueryJob(self, query)
+        with self._lock:
+            self.queries.append(query)
+            self.jobs[job_id or f"job_{len(self.queries)}"] = job
+        return job
+
+    def cancel_job(self, job_id: str, location: Optional[str] = None) -> FakeQueryJob:
+        job = self.jobs.get(job_id)
+        if job is None:
+            raise LookupError(f"Not found: Job {job_id}")
+        job.cancel()
+        return job
+
+    def conversation_date(self, index: int) -> date:
+        return self.end_date - timedelta(days=index % self.days)
+
+    def _scan(self) -> Iterator[Tuple[int, int, int]]:
+        """Yield (conversation index, turns, no-match count) for every conversation."""
+        rng = random.Random(self.seed)
+        for index in range(self.num_conversations):
+            turns = 2 + int(rng.random() * 7)
+            yield index, turns, sum(1 for _ in range(turns) if rng.random() < self.no_match_rate)
+
+    def conversation_script(self, index: int, turns: int) -> str:
+        rng = random.Random(f"{self.seed}-{index}")
+        return "\n---\n".join(rng.choice(self.UTTERANCES) for _ in range(turns))
+
+    def _execute(self, query: str) -> List[FakeRow]:
+        time.sleep(self.latency_seconds)
+        if "INFORMATION_SCHEMA" in query:
+            return [
+                FakeRow({"table_name": "dialogflow_bigquery_export_data", "column_name": name,
+                         "data_type": data_type, "description": description})
+                for name, data_type, description in self.COLUMNS
+            ]
+
+        if "no_match_daily_rollup" in query or "group_key" in query:
+            return self._execute_rollup(query)
+        if "sum_turns_squared" in query or "COUNT(DISTINCT conversation_name)" in query:
+            return self._execute_preview(query)
+
+        dates = re.search(r"BETWEEN\s+'(\d{4}-\d{2}-\d{2})'\s+AND\s+'(\d{4}-\d{2}-\d{2})'", query, re.IGNORECASE)
+        start, end = (date.fromisoformat(dates.group(1)), date.fromisoformat(dates.group(2))) if dates else (date.min, date.max)
+        limit = re.search(r"LIMIT\s+(\d+)", query, re.IGNORECASE)
+        limit = int(limit.group(1)) if limit else None
+
+        matches = (
+            (no_match_count, index, turns) for index, turns, no_match_count in self._scan()
+            if no_match_count and start <= self.conversation_date(index) <= end
+        )
+        # Memory stays proportional to LIMIT however many conversations are scanned
+        top = top_k(matches, limit if limit is not None else self.num_conversations,
+                    key=lambda match: match[0], tie_key=lambda match: match[1])
+        with self._lock:
+            self.rows_scanned += self.num_conversations
+        return [
+            FakeRow({"Convo_ID": f"conv_{index:07d}", "conversation_script": self.conversation_script(index, turns),
+                     "no_match_count": no_match_count})
+            for no_match_count, index, turns in top
+        ]
+
+    def _daily_rollup_rows(self, ranges: List[Tuple[date, date]]) -> Dict[Tuple[date, str, str, str, str], Dict[str, Any]]:
+        """Aggregate the days in `ranges` into rollup rows keyed by (day, grain, utterance, page, flow)."""
+        rows: Dict[Tuple[date, str, str, str, str], Dict[str, Any]] = {}
+        conversations: Dict[Tuple[date, str, str, str, str], set] = {}
+
+        def add(key, name, no_match_turns, turns, is_no_match):
+            row = rows.setdefault(key, {"no_match_turns": 0, "turns": 0, "no_match_conversations": 0, "conversations": 0})
+            row["no_match_turns"] += no_match_turns
+            row["turns"] += turns
+            if name not in conversations.setdefault(key, set()):
+                conversations[key].add(name)
+                row["conversations"] += 1
+                row["no_match_conversations"] += int(is_no_match)
+
+        for index, turns, no_match_count in self._scan():
+            day = self.conversation_date(index)
+            if not any(start <= day <= end for start, end in ranges):
+                continue
+            name = f"conv_{index:07d}"
+            add((day, "day", "", "", ""), name, no_match_count, turns, no_match_count > 0)
+            for utterance in self.conversation_script(index, turns).split("\n---\n")[:no_match_count]:
+                page, flow = self.PAGES[self.UTTERANCES.index(utterance) % len(self.PAGES)]
+                add((day, "utterance", utterance.strip().lower(), page, flow), name, 1, 1, True)
+        with self._lock:
+            self.rows_scanned += self.num_conversations
+        return rows
+
+    def _execute_rollup(self, query: str) -> List[FakeRow]:
+        """Answer the DDL, MERGE, coverage and read queries of the no-match rollup."""
+        raw_ranges = [
+            (date.fromisoformat(start), date.fromisoformat(end))
+            for start, end in re.findall(r"DATE\(request_time\) BETWEEN '([\d-]+)' AND '([\d-]+)'", query)
+        ]
+        if query.lstrip().startswith("CREATE TABLE"):
+            return []
+        if query.lstrip().startswith("MERGE"):
+            fresh = self._daily_rollup_rows(raw_ranges)
+            with self._lock:
+                for key, row in fresh.items():
+                    self.rollup.setdefault(key, row)
+                for start, end in raw_ranges:
+                    self.rollup_days.update(start + timedelta(days=offset) for offset in range((end - start).days + 1))
+            return []
+        if "covered_day" in query:
+            return [FakeRow({"covered_day": day}) for day in sorted(self.rollup_days)]
+
+        rows = dict(self._daily_rollup_rows(raw_ranges)) if raw_ranges else {}
+        for start, end in re.findall(r"\bday BETWEEN '([\d-]+)' AND '([\d-]+)'", query):
+            start, end = date.fromisoformat(start), date.fromisoformat(end)
+            rows.update({key: row for key, row in self.rollup.items() if start <= key[0] <= end})
+
+        key_expression = re.search(r"SELECT\s+(.+?) AS group_key", query).group(1)
+        grain = "day" if "WHERE grain = 'day'" in query else "utterance"
+        group_key = {
+            "utterance": lambda key: key[2],
+            "page": lambda key: key[3],
+            "flow": lambda key: key[4],
+            "CAST(day AS STRING)": lambda key: key[0].isoformat(),
+            "CAST(DATE_TRUNC(day, WEEK(MONDAY)) AS STRING)": lambda key: (key[0] - timedelta(days=key[0].weekday())).isoformat(),
+        }[key_expression]
+
+        groups: Dict[str, Dict[str, Any]] = {}
+        for key, row in rows.items():
+            if key[1] != grain:
+                continue
+            group = groups.setdefault(group_key(key), {"no_match_turns": 0, "turns": 0, "no_match_conversations": 0, "conversations": 0})
+            for column in group:
+                group[column] += row[column]
+
+        if grain == "day":
+            return [
+                FakeRow({"group_key": name, **group,
+                         "no_match_rate": group["no_match_turns"] / group["turns"] if group["turns"] else None})
+                for name, group in sorted(groups.items())
+            ]
+        limit = re.search(r"LIMIT\s+(\d+)", query)
+        top = top_k(groups.items(), int(limit.group(1)) if limit else len(groups),
+                    key=lambda item: item[1]["no_match_turns"], tie_key=lambda item: item[0])
+        return [
+            FakeRow({"group_key": name, "no_match_turns": group["no_match_turns"],
+                     "no_match_conversations": group["no_match_conversations"]})
+            for name, group in top
+        ]
+
+    def _execute_preview(self, query: str) -> List[FakeRow]:
+        """Answer the sampled summary or pattern query of the preview mode."""
+        dates = re.search(r"BETWEEN\s+'(\d{4}-\d{2}-\d{2})'\s+AND\s+'(\d{4}-\d{2}-\d{2})'", query, re.IGNORECASE)
+        start, end = (date.fromisoformat(dates.group(1)), date.fromisoformat(dates.group(2))) if dates else (date.min, date.max)
+        hash_sample = re.search(r"FARM_FINGERPRINT\(conversation_name\)\),\s*(\d+)\)\s*<\s*(\d+)", query)
+        table_sample = re.search(r"TABLESAMPLE SYSTEM \(([\d.]+) PERCENT\)", query)
+
+        per_conversation = []
+        for index, turns, no_match_count in self._scan():
+            if not start <= self.conversation_date(index) <= end:
+                continue
+            name = f"conv_{index:07d}"
+            if hash_sample and zlib.crc32(name.encode()) % int(hash_sample.group(1)) >= int(hash_sample.group(2)):
+                continue
+            if table_sample and zlib.crc32(f"block-{index // 100}".encode()) % 10000 >= float(table_sample.group(1)) * 100:
+                continue
+            per_conversation.append((name, index, turns, no_match_count))
+        with self._lock:
+            self.rows_scanned += self.num_conversations
+
+        if "sum_turns_squared" in query:
+            return [FakeRow({
+                "conversations": len(per_conversation),
+                "conversations_with_no_match": sum(1 for *_, no_match in per_conversation if no_match),
+                "turns": sum(turns for _, _, turns, _ in per_conversation),
+                "no_match_turns": sum(no_match for *_, no_match in per_conversation),
+                "sum_turns_squared": sum(turns * turns for _, _, turns, _ in per_conversation),
+                "sum_no_match_turns_squared": sum(no_match * no_match for *_, no_match in per_conversation),
+                "sum_turns_by_no_match_turns": sum(turns * no_match for _, _, turns, no_match in per_conversation),
+            })]
+
+        turn_counts: Dict[str, int] = {}
+        conversations: Dict[str, set] = {}
+        for name, index, turns, no_match_count in per_conversation:
+            for utterance in self.conversation_script(index, turns).split("\n---\n")[:no_match_count]:
+                utterance = utterance.strip().lower()
+                turn_counts[utterance] = turn_counts.get(utterance, 0) + 1
+                conversations.setdefault(utterance, set()).add(name)
+        limit = re.search(r"LIMIT\s+(\d+)", query, re.IGNORECASE)
+        top = top_k(turn_counts.items(), int(limit.group(1)) if limit else len(turn_counts),
+                    key=lambda item: item[1], tie_key=lambda item: item[0])
+        return [
+            FakeRow({"utterance": utterance, "no_match_turns": count, "conversations": len(conversations[utterance])})
+            for utterance, count in top
+        ]
+
+
+def use_fake_bigquery(client: FakeBigQueryClient) -> FakeBigQueryClient:
+    """
+    Route the BigQuery tools for the client's project to a fake client.
+
+    Args:
+        client: Fake client to use
+
+    Returns:
+        FakeBigQueryClient: The fake client in use
+    """
+    register_bigquery_client(client.project, client)
+    return client
+
+
+def use_fake_model(root_agent, fake_llm: Optional[FakeGeminiLlm] = None) -> FakeGeminiLlm:
+    """
+    Point every LLM sub-agent of the orchestrator at a fake model, keeping any
+    model tiering and retry policy the sub-agent already applies.
+
+    Args:
+        root_agent: NoMatchAnalysisAgent instance
+        fake_llm: Fake model to use, a default one is created if omitted
+
+    Returns:
+        FakeGeminiLlm: The fake model in use
+    """
+    fake_llm = fake_llm or FakeGeminiLlm(calls=[])
+    for agent_name in (
+        "conversation_data_retrieval_agent",
+        "no_match_analysis_agent",
+        "dialogflow_cx_parser_agent",
+        "csv_generation_agent",
+    ):
+        sub_agent = getattr(root_agent, agent_name)
+        tiered = sub_agent.model if isinstance(sub_agent.model, TieredLlm) else None
+        model = tiered.inner if tiered else sub_agent.model
+        if isinstance(model, ResilientLlm):
+            model = ResilientLlm(model=fake_llm.model, inner=fake_llm, policy=model.policy)
+        else:
+            model = fake_llm
+        sub_agent.model = tiered.model_copy(update={"inner": model}) if tiered else model
+    return fake_llm
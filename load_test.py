@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+"""
+Load Test for No-Match Analysis Agent
+Drives many concurrent sessions through one Runner at increasing arrival
+rates, using the fake Gemini model, fake BigQuery and in-memory artifacts, to
+find the rate at which latency falls apart and to catch memory that is
+retained per session.
+
+Usage:
+    python load_test.py --sessions 50 --rates 1,5,10,20 --latency 0.2
+"""
+
+import argparse
+import asyncio
+import gc
+import json
+import logging
+import os
+import random
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from google.adk.artifacts import InMemoryArtifactService
+from google.adk.runners import Runner
+from google.adk.sessions import InMemorySessionService, State
+
+from benchmark import (
+    FAKE_PROJECT,
+    STEP_AUTHORS,
+    build_fake_model,
+    initial_state,
+    max_rss_bytes,
+    run_workflow,
+    synthetic_bot_export,
+)
+from fake_services import FakeBigQueryClient, use_fake_bigquery, use_fake_model
+
+LOAD_TEST_APP_NAME = "no_match_load_test"
+DEFAULT_RATES = [1.0, 5.0, 10.0, 20.0]
+
+# A level is saturated when sessions fail, complete slower than they arrived,
+# or its p95 latency grows past this multiple of the lightest level's p95
+THROUGHPUT_SATURATION_RATIO = 0.9
+LATENCY_SATURATION_FACTOR = 2.0
+
+
+def percentile(samples: List[float], fraction: float) -> Optional[float]:
+    """Nearest-rank percentile of samples, or None without samples."""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def summarize(samples: List[float]) -> Dict[str, Optional[float]]:
+    """Summarize latency samples in seconds."""
+    return {
+        "count": len(samples),
+        "p50": percentile(samples, 0.50),
+        "p95": percentile(samples, 0.95),
+        "p99": percentile(samples, 0.99),
+        "max": max(samples) if samples else None,
+    }
+
+
+class EventLoopLagMonitor:
+    """
+    Measures how late the event loop wakes up a task that sleeps for a fixed
+    interval. Lag grows when synchronous work (parsing, serialization, CPU
+    bound tools) holds the loop, delaying every other session.
+    """
+
+    def __init__(self, interval_seconds: float = 0.05):
+        """
+        Args:
+            interval_seconds: Sleep between samples
+        """
+        self.interval_seconds = interval_seconds
+        self.samples: List[float] = []
+        self._task: Optional[asyncio.Task] = None
+
+    async def _sample(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval_seconds)
+            self.samples.append(max(0.0, loop.time() - started - self.interval_seconds))
+
+    def start(self) -> None:
+        """Start sampling on the running loop."""
+        self.samples = []
+        self._task = asyncio.ensure_future(self._sample())
+
+    async def stop(self) -> Dict[str, Optional[float]]:
+        """
+        Stop sampling.
+
+        Returns:
+            Dict[str, Optional[float]]: Lag percentiles in seconds
+        """
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        return summarize(self.samples)
+
+
+def _traced_bytes() -> Optional[int]:
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None
+
+
+async def run_load_level(
+    runner: Runner,
+    arrival_rate: float,
+    sessions: int,
+    bot_json: str = "",
+    max_concurrency: int = 0,
+    rng: Optional[random.Random] = None,
+) -> Dict[str, Any]:
+    """
+    Start sessions with Poisson arrivals and wait for all of them to finish.
+
+    Args:
+        runner: Runner for the orchestrator (with a fake model)
+        arrival_rate: Mean new sessions per second, 0 to start all at once
+        sessions: Number of sessions to start
+        bot_json: Bot export for Step 3, or "" to skip it
+        max_concurrency: Sessions allowed to run at once, 0 for no limit
+        rng: Random source for arrival times
+
+    Returns:
+        Dict[str, Any]: Throughput, latency percentiles overall and per step,
+        event loop lag and memory retained per session
+    """
+    rng = rng or random.Random()
+    level_id = f"{arrival_rate:g}-{int(time.time() * 1000)}"
+    semaphore = asyncio.Semaphore(max_concurrency) if max_concurrency > 0 else None
+    runs: List[Dict[str, Any]] = []
+    queue_waits: List[float] = []
+    failures: List[str] = []
+
+    async def run_one(index: int) -> None:
+        arrived = time.perf_counter()
+        user_id = f"load-{level_id}-{index}"
+        try:
+            if semaphore is None:
+                run = await run_workflow(runner, user_id, initial_state(bot_json))
+            else:
+                async with semaphore:
+                    queue_waits.append(time.perf_counter() - arrived)
+                    run = await run_workflow(runner, user_id, initial_state(bot_json))
+            finished = time.perf_counter()
+            runs.append({**run, "user_id": user_id, "latency_seconds": finished - arrived, "finished": finished})
+        except Exception as e:
+            failures.append(f"{type(e).__name__}: {e}")
+
+    traced_before = _traced_bytes()
+    rss_before = max_rss_bytes()
+    monitor = EventLoopLagMonitor()
+    monitor.start()
+
+    started = time.perf_counter()
+    tasks = []
+    for index in range(sessions):
+        if arrival_rate > 0 and index:
+            await asyncio.sleep(rng.expovariate(arrival_rate))
+        tasks.append(asyncio.ensure_future(run_one(index)))
+    arrival_seconds = time.perf_counter() - started
+    await asyncio.gather(*tasks)
+    wall_seconds = time.perf_counter() - started
+    event_loop_lag = await monitor.stop()
+
+    traced_after = _traced_bytes()
+    state_bytes, user_state_bytes = [], []
+    for run in runs:
+        session = await runner.session_service.get_session(
+            app_name=runner.app_name, user_id=run["user_id"], session_id=run["session_id"]
+        )
+        state_bytes.append(len(json.dumps(session.state, default=str)))
+        user_state_bytes.append(len(json.dumps(
+            {key: value for key, value in session.state.items() if key.startswith(State.USER_PREFIX)}, default=str
+        )))
+        await runner.session_service.delete_session(
+            app_name=runner.app_name, user_id=run["user_id"], session_id=run["session_id"]
+        )
+    # What stays allocated after the sessions are deleted is user-scoped state
+    # (kept per user, e.g. workflow checkpoints) or held somewhere else
+    traced_after_delete = _traced_bytes()
+
+    # With paced arrivals, throughput is the completion rate between the first
+    # and last completion (the wall clock would also count one run's latency)
+    finish_times = sorted(run["finished"] for run in runs)
+    if arrival_rate > 0 and len(finish_times) > 1 and finish_times[-1] > finish_times[0]:
+        throughput = (len(finish_times) - 1) / (finish_times[-1] - finish_times[0])
+    else:
+        throughput = len(runs) / wall_seconds if wall_seconds else None
+
+    def per_session(after: Optional[int]) -> Optional[int]:
+        if traced_before is None or after is None or not sessions:
+            return None
+        return (after - traced_before) // sessions
+
+    return {
+        "arrival_rate": arrival_rate,
+        "sessions": sessions,
+        "completed": len(runs),
+        "failed": len(failures),
+        "errors": sorted(set(failures))[:5],
+        "offered_sessions_per_second": (
+            round((sessions - 1) / arrival_seconds, 3) if arrival_rate > 0 and sessions > 1 and arrival_seconds else None
+        ),
+        "wall_seconds": round(wall_seconds, 3),
+        "throughput_sessions_per_second": round(throughput, 3) if throughput is not None else None,
+        "events_per_second": round(sum(run["events"] for run in runs) / wall_seconds, 2) if wall_seconds else None,
+        "latency_seconds": summarize([run["latency_seconds"] for run in runs]),
+        "queue_wait_seconds": summarize(queue_waits) if semaphore is not None else None,
+        "step_latency_seconds": {
+            step_name: summarize([run["step_seconds"][step_name] for run in runs if step_name in run["step_seconds"]])
+            for step_name in STEP_AUTHORS.values()
+        },
+        "event_loop_lag_seconds": event_loop_lag,
+        "memory": {
+            "traced_growth_bytes_per_session": per_session(traced_after),
+            "traced_retained_after_delete_bytes_per_session": per_session(traced_after_delete),
+            "session_state_bytes_mean": sum(state_bytes) // len(state_bytes) if state_bytes else None,
+            "user_state_bytes_mean": sum(user_state_bytes) // len(user_state_bytes) if user_state_bytes else None,
+            "max_rss_growth_bytes": (max_rss_bytes() - rss_before) if rss_before is not None else None,
+        },
+    }
+
+
+def order_rates(rates: List[float]) -> List[float]:
+    """Order arrival rates from lightest to heaviest load (0, all at once, is heaviest)."""
+    return sorted(rates, key=lambda rate: rate if rate > 0 else float("inf"))
+
+
+def find_saturation(levels: List[Dict[str, Any]]) -> Optional[float]:
+    """
+    Find the lowest saturated arrival rate.
+
+    Args:
+        levels: Results of `run_load_level`, in increasing rate order
+
+    Returns:
+        Optional[float]: First rate with failures, throughput behind the
+        actual arrivals or p95 latency past the baseline, or None if none saturated
+    """
+    baseline_p95 = levels[0]["latency_seconds"]["p95"] if levels else None
+    for level in levels:
+        rate, offered, p95 = level["arrival_rate"], level["offered_sessions_per_second"], level["latency_seconds"]["p95"]
+        throughput = level["throughput_sessions_per_second"]
+        if level["failed"]:
+            return rate
+        if offered and throughput is not None and throughput < THROUGHPUT_SATURATION_RATIO * offered:
+            return rate
+        if baseline_p95 and p95 is not None and p95 > LATENCY_SATURATION_FACTOR * baseline_p95:
+            return rate
+    return None
+
+
+async def run_load_test(
+    rates: List[float],
+    sessions: int,
+    scale: int = 1000,
+    latency_seconds: float = 0.2,
+    seconds_per_token: float = 0.0,
+    bigquery_latency_seconds: float = 0.0,
+    max_concurrency: int = 0,
+    with_bot: bool = True,
+    trace_memory: bool = True,
+    seed: int = 0,
+    agent=None,
+) -> Dict[str, Any]:
+    """
+    Run one load level per arrival rate against a shared Runner.
+
+    Args:
+        rates: Arrival rates in sessions per second, 0 to start all at once
+        sessions: Sessions started per level
+        scale: Conversations in the fake export table
+        latency_seconds: Fixed latency per model call
+        seconds_per_token: Generation time per output token
+        bigquery_latency_seconds: Fixed latency of each fake query
+        max_concurrency: Sessions allowed to run at once, 0 for no limit
+        with_bot: Include a synthetic bot export so Step 3 runs
+        trace_memory: Measure retained memory per session with tracemalloc
+        seed: Seed for arrival times
+        agent: Orchestrator to load, defaults to the root agent
+
+    Returns:
+        Dict[str, Any]: Machine-readable load test report
+    """
+    if agent is None:
+        from agent import root_agent as agent
+
+    use_fake_model(agent, build_fake_model(latency_seconds, seconds_per_token))
+    use_fake_bigquery(FakeBigQueryClient(
+        num_conversations=scale, project=FAKE_PROJECT, latency_seconds=bigquery_latency_seconds
+    ))
+    runner = Runner(
+        app_name=LOAD_TEST_APP_NAME,
+        agent=agent,
+        session_service=InMemorySessionService(),
+        artifact_service=InMemoryArtifactService(),
+    )
+    bot_json = synthetic_bot_export() if with_bot else ""
+    rng = random.Random(seed)
+
+    # Warm-up: ADK loads parts of itself on the first run
+    await run_load_level(runner, 0, 1, bot_json)
+
+    tracing_started = trace_memory and not tracemalloc.is_tracing()
+    if tracing_started:
+        tracemalloc.start()
+    try:
+        levels = [
+            await run_load_level(runner, rate, sessions, bot_json, max_concurrency, rng)
+            for rate in order_rates(rates)
+        ]
+    finally:
+        if tracing_started:
+            tracemalloc.stop()
+
+    return {
+        "load_test": "concurrent_sessions",
+        "timestamp": datetime.now().isoformat(),
+        "config": {
+            "rates": order_rates(rates),
+            "sessions_per_level": sessions,
+            "scale": scale,
+            "model_latency_seconds": latency_seconds,
+            "seconds_per_token": seconds_per_token,
+            "bigquery_latency_seconds": bigquery_latency_seconds,
+            "max_concurrency": max_concurrency,
+            "with_bot": with_bot,
+            "trace_memory": trace_memory,
+            "seed": seed,
+        },
+        "saturation_rate": find_saturation(levels),
+        "levels": levels,
+    }
+
+
+def main():
+    """Run the load test from the command line."""
+    parser = argparse.ArgumentParser(description="Concurrent-session load test for the no-match analysis agent")
+    parser.add_argument("--sessions", type=int, default=50, help="Sessions started per level (default: 50)")
+    parser.add_argument("--rates", default=",".join(f"{rate:g}" for rate in DEFAULT_RATES),
+                        help="Comma-separated arrival rates in sessions/second, 0 starts all at once (default: 1,5,10,20)")
+    parser.add_argument("--scale", type=int, default=1000, help="Conversations in the fake export table (default: 1000)")
+    parser.add_argument("--latency", type=float, default=0.2, help="Fixed latency per model call in seconds (default: 0.2)")
+    parser.add_argument("--seconds-per-token", type=float, default=0.0, help="Generation time per output token")
+    parser.add_argument("--bigquery-latency", type=float, default=0.0, help="Fixed latency per BigQuery query")
+    parser.add_argument("--max-concurrency", type=int, default=0, help="Sessions running at once, 0 for no limit")
+    parser.add_argument("--no-trace-memory", action="store_true",
+                        help="Skip tracemalloc (faster, only max RSS growth is reported)")
+    parser.add_argument("--no-bot", action="store_true", help="Skip Step 3 (no bot export)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for arrival times (default: 0)")
+    parser.add_argument("--output", default=None, help="Results path (default: load_test_<timestamp>.json)")
+    args = parser.parse_args()
+
+    # Every session runs the full workflow: no replayed responses or stored checkpoints
+    os.environ["LLM_CACHE_ENABLED"] = "false"
+    os.environ["WORKFLOW_CHECKPOINTS_ENABLED"] = "false"
+    logging.basicConfig(level=logging.WARNING)
+
+    report = asyncio.run(run_load_test(
+        [float(rate) for rate in args.rates.split(",") if rate.strip()],
+        args.sessions,
+        scale=args.scale,
+        latency_seconds=args.latency,
+        seconds_per_token=args.seconds_per_token,
+        bigquery_latency_seconds=args.bigquery_latency,
+        max_concurrency=args.max_concurrency,
+        with_bot=not args.no_bot,
+        trace_memory=not args.no_trace_memory,
+        seed=args.seed,
+    ))
+
+    for level in report["levels"]:
+        latency, lag, memory = level["latency_seconds"], level["event_loop_lag_seconds"], level["memory"]
+        growth = memory["traced_growth_bytes_per_session"]
+        print(f"📈 {level['arrival_rate']:>6g}/s: {level['completed']}/{level['sessions']} sessions, "
+              f"{level['throughput_sessions_per_second']}/s throughput, "
+              f"p50 {latency['p50']:.3f}s p95 {latency['p95']:.3f}s p99 {latency['p99']:.3f}s, "
+              f"loop lag p99 {lag['p99'] or 0:.3f}s"
+              + (f", {growth / 1024:.1f} KiB/session" if growth is not None else ""))
+        if level["failed"]:
+            print(f"❌ {level['failed']} sessions failed: {level['errors']}")
+
+    if report["saturation_rate"] is None:
+        print("✅ No saturation up to the highest rate")
+    else:
+        print(f"⚠️ Saturated at {report['saturation_rate']:g} sessions/s")
+
+    output = args.output or f"load_test_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"📝 Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,380 @@
+"""
+Local Persistent Session Service for No-Match Analysis Agent
+SQLite-backed ADK session service that survives restarts and can be shared by
+several worker processes on one host without a remote database.
+"""
+
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+from google.adk.events import Event
+from google.adk.sessions import BaseSessionService, Session
+from google.adk.sessions.base_session_service import GetSessionConfig, ListSessionsResponse
+from google.adk.sessions.state import State
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    app_name TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    create_time REAL NOT NULL,
+    update_time REAL NOT NULL,
+    PRIMARY KEY (app_name, user_id, session_id)
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_user_update
+    ON sessions (app_name, user_id, update_time);
+CREATE TABLE IF NOT EXISTS session_state (
+    app_name TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value BLOB NOT NULL,
+    compressed INTEGER NOT NULL,
+    PRIMARY KEY (app_name, user_id, session_id, key)
+);
+CREATE TABLE IF NOT EXISTS user_state (
+    app_name TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value BLOB NOT NULL,
+    compressed INTEGER NOT NULL,
+    PRIMARY KEY (app_name, user_id, key)
+);
+CREATE TABLE IF NOT EXISTS app_state (
+    app_name TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value BLOB NOT NULL,
+    compressed INTEGER NOT NULL,
+    PRIMARY KEY (app_name, key)
+);
+CREATE TABLE IF NOT EXISTS events (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    app_name TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    event_id TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    data BLOB NOT NULL,
+    compressed INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_events_session
+    ON events (app_name, user_id, session_id, seq);
+"""
+
+
+class LocalSqliteSessionService(BaseSessionService):
+    """
+    Session service backed by a local SQLite database in WAL mode.
+
+    State is stored per key, so each event only writes the keys in its state
+    delta instead of a full snapshot. Values and events above
+    `compress_threshold_bytes` are zlib-compressed. Event writes are buffered
+    and committed in batches: when `batch_size` events are waiting, when the
+    oldest has waited `flush_interval_seconds`, or when an event of a new
+    invocation arrives (the previous turn is over). Any read flushes the
+    buffer first so the workflow always sees its own writes.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        batch_size: int = 16,
+        flush_interval_seconds: float = 1.0,
+        compress_threshold_bytes: int = 4096,
+        busy_timeout_ms: int = 5000,
+    ):
+        """
+        Args:
+            db_path: Path to the SQLite database file
+            batch_size: Number of buffered events that triggers a commit
+            flush_interval_seconds: Maximum age of buffered events before a commit
+            compress_threshold_bytes: Values larger than this are compressed
+            busy_timeout_ms: How long to wait on a lock held by another process
+        """
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval_seconds = flush_interval_seconds
+        self.compress_threshold_bytes = compress_threshold_bytes
+
+        self._lock = threading.Lock()
+        self._pending: List[Tuple[Session, Event]] = []
+        self._pending_since: Optional[float] = None
+        self._flush_tasks: set = set()
+
+        self._conn = sqlite3.connect(db_path, timeout=busy_timeout_ms / 1000, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(f"PRAGMA busy_timeout={busy_timeout_ms}")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+
+    # --- Encoding helpers ---
+
+    def _encode(self, value: Any) -> Tuple[bytes, int]:
+        """Serialize a value to JSON bytes, compressing it if it is large."""
+        payload = json.dumps(value, default=str).encode("utf-8")
+        if len(payload) > self.compress_threshold_bytes:
+            return zlib.compress(payload), 1
+        return payload, 0
+
+    @staticmethod
+    def _decode(payload: bytes, compressed: int) -> Any:
+        """Inverse of `_encode`."""
+        if compressed:
+            payload = zlib.decompress(payload)
+        return json.loads(payload.decode("utf-8"))
+
+    def _encode_event(self, event: Event) -> Tuple[bytes, int]:
+        payload = event.model_dump_json(exclude_none=True).encode("utf-8")
+        if len(payload) > self.compress_threshold_bytes:
+            return zlib.compress(payload), 1
+        return payload, 0
+
+    @staticmethod
+    def _decode_event(payload: bytes, compressed: int) -> Event:
+        if compressed:
+            payload = zlib.decompress(payload)
+        return Event.model_validate_json(payload)
+
+    # --- Synchronous database operations (run in a worker thread) ---
+
+    def _write_state(self, app_name: str, user_id: str, session_id: str, state: Dict[str, Any]) -> None:
+        """Upsert state keys into the app, user or session table by prefix."""
+        for key, value in state.items():
+            if key.startswith(State.TEMP_PREFIX):
+                continue
+            payload, compressed = self._encode(value)
+            if key.startswith(State.APP_PREFIX):
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO app_state VALUES (?, ?, ?, ?)",
+                    (app_name, key[len(State.APP_PREFIX):], payload, compressed),
+                )
+            elif key.startswith(State.USER_PREFIX):
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO user_state VALUES (?, ?, ?, ?, ?)",
+                    (app_name, user_id, key[len(State.USER_PREFIX):], payload, compressed),
+                )
+            else:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO session_state VALUES (?, ?, ?, ?, ?, ?)",
+                    (app_name, user_id, session_id, key, payload, compressed),
+                )
+
+    def _create_session_sync(self, app_name: str, user_id: str, session_id: str, state: Dict[str, Any]) -> float:
+        now = time.time()
+        with self._lock:
+            try:
+                self._conn.execute(
+                    "INSERT INTO sessions VALUES (?, ?, ?, ?, ?)",
+                    (app_name, user_id, session_id, now, now),
+                )
+            except sqlite3.IntegrityError:
+                self._conn.rollback()
+                raise ValueError(f"Session {session_id} already exists for user {user_id}")
+            self._write_state(app_name, user_id, session_id, state)
+            self._conn.commit()
+        return now
+
+    def _load_state(self, app_name: str, user_id: str, session_id: str) -> Dict[str, Any]:
+        """Merge app, user and session state into one dict with ADK prefixes."""
+        state: Dict[str, Any] = {}
+        for key, value, compressed in self._conn.execute(
+            "SELECT key, value, compressed FROM app_state WHERE app_name = ?", (app_name,)
+        ):
+            state[State.APP_PREFIX + key] = self._decode(value, compressed)
+        for key, value, compressed in self._conn.execute(
+            "SELECT key, value, compressed FROM user_state WHERE app_name = ? AND user_id = ?",
+            (app_name, user_id),
+        ):
+            state[State.USER_PREFIX + key] = self._decode(value, compressed)
+        for key, value, compressed in self._conn.execute(
+            "SELECT key, value, compressed FROM session_state WHERE app_name = ? AND user_id = ? AND session_id = ?",
+            (app_name, user_id, session_id),
+        ):
+            state[key] = self._decode(value, compressed)
+        return state
+
+    def _get_session_sync(
+        self, app_name: str, user_id: str, session_id: str, config: Optional[GetSessionConfig]
+    ) -> Optional[Session]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT update_time FROM sessions WHERE app_name = ? AND user_id = ? AND session_id = ?",
+                (app_name, user_id, session_id),
+            ).fetchone()
+            if row is None:
+                return None
+
+            query = "SELECT data, compressed FROM events WHERE app_name = ? AND user_id = ? AND session_id = ?"
+            params: List[Any] = [app_name, user_id, session_id]
+            if config and config.after_timestamp is not None:
+                query += " AND timestamp >= ?"
+                params.append(config.after_timestamp)
+            query += " ORDER BY seq DESC"
+            if config and config.num_recent_events is not None:
+                query += " LIMIT ?"
+                params.append(config.num_recent_events)
+            event_rows = self._conn.execute(query, params).fetchall()
+
+            state = self._load_state(app_name, user_id, session_id)
+
+        events = [self._decode_event(data, compressed) for data, compressed in reversed(event_rows)]
+        return Session(
+            id=session_id,
+            app_name=app_name,
+            user_id=user_id,
+            state=state,
+            events=events,
+            last_update_time=row[0],
+        )
+
+    def _list_sessions_sync(self, app_name: str, user_id: Optional[str]) -> List[Session]:
+        with self._lock:
+            if user_id is None:
+                rows = self._conn.execute(
+                    "SELECT user_id, session_id, update_time FROM sessions WHERE app_name = ? ORDER BY update_time",
+                    (app_name,),
+                ).fetchall()
+            else:
+                rows = self._conn.execute(
+                    "SELECT user_id, session_id, update_time FROM sessions WHERE app_name = ? AND user_id = ? ORDER BY update_time",
+                    (app_name, user_id),
+                ).fetchall()
+            return [
+                Session(
+                    id=session_id,
+                    app_name=app_name,
+                    user_id=row_user_id,
+                    state=self._load_state(app_name, row_user_id, session_id),
+                    events=[],
+                    last_update_time=update_time,
+                )
+                for row_user_id, session_id, update_time in rows
+            ]
+
+    def _delete_session_sync(self, app_name: str, user_id: str, session_id: str) -> None:
+        with self._lock:
+            params = (app_name, user_id, session_id)
+            self._conn.execute("DELETE FROM events WHERE app_name = ? AND user_id = ? AND session_id = ?", params)
+            self._conn.execute("DELETE FROM session_state WHERE app_name = ? AND user_id = ? AND session_id = ?", params)
+            self._conn.execute("DELETE FROM sessions WHERE app_name = ? AND user_id = ? AND session_id = ?", params)
+            self._conn.commit()
+
+    def _flush_sync(self) -> None:
+        """Commit all buffered events and their state deltas in one transaction."""
+        with self._lock:
+            pending, self._pending = self._pending, []
+            self._pending_since = None
+            if not pending:
+                return
+            try:
+                for session, event in pending:
+                    payload, compressed = self._encode_event(event)
+                    self._conn.execute(
+                        "INSERT INTO events (app_name, user_id, session_id, event_id, timestamp, data, compressed) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (session.app_name, session.user_id, session.id, event.id, event.timestamp, payload, compressed),
+                    )
+                    if event.actions and event.actions.state_delta:
+                        self._write_state(session.app_name, session.user_id, session.id, event.actions.state_delta)
+                    self._conn.execute(
+                        "UPDATE sessions SET update_time = ? WHERE app_name = ? AND user_id = ? AND session_id = ?",
+                        (event.timestamp, session.app_name, session.user_id, session.id),
+                    )
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+        logger.debug(f"Flushed {len(pending)} session events to {self.db_path}")
+
+    # --- BaseSessionService interface ---
+
+    async def create_session(
+        self,
+        *,
+        app_name: str,
+        user_id: str,
+        state: Optional[Dict[str, Any]] = None,
+        session_id: Optional[str] = None,
+    ) -> Session:
+        session_id = session_id.strip() if session_id and session_id.strip() else str(uuid.uuid4())
+        state = state or {}
+        await self.flush()
+        await asyncio.to_thread(self._create_session_sync, app_name, user_id, session_id, state)
+        return await self.get_session(app_name=app_name, user_id=user_id, session_id=session_id)
+
+    async def get_session(
+        self,
+        *,
+        app_name: str,
+        user_id: str,
+        session_id: str,
+        config: Optional[GetSessionConfig] = None,
+    ) -> Optional[Session]:
+        await self.flush()
+        return await asyncio.to_thread(self._get_session_sync, app_name, user_id, session_id, config)
+
+    async def list_sessions(self, *, app_name: str, user_id: Optional[str] = None) -> ListSessionsResponse:
+        await self.flush()
+        sessions = await asyncio.to_thread(self._list_sessions_sync, app_name, user_id)
+        return ListSessionsResponse(sessions=sessions)
+
+    async def delete_session(self, *, app_name: str, user_id: str, session_id: str) -> None:
+        await self.flush()
+        await asyncio.to_thread(self._delete_session_sync, app_name, user_id, session_id)
+
+    async def append_event(self, session: Session, event: Event) -> Event:
+        event = await super().append_event(session=session, event=event)
+        if event.partial:
+            return event
+        session.last_update_time = event.timestamp
+
+        with self._lock:
+            # Events of one invocation arrive in order, so a new invocation means the last turn ended
+            turn_ended = bool(self._pending) and self._pending[-1][1].invocation_id != event.invocation_id
+            self._pending.append((session, event))
+            started_batch = self._pending_since is None
+            if started_batch:
+                self._pending_since = time.monotonic()
+            should_flush = (
+                len(self._pending) >= self.batch_size
+                or time.monotonic() - self._pending_since >= self.flush_interval_seconds
+                or turn_ended
+            )
+        if should_flush:
+            await self.flush()
+        elif started_batch:
+            # The last events of a run get no successor, so they are committed on a timer
+            asyncio.get_running_loop().call_later(self.flush_interval_seconds, self._flush_later)
+        return event
+
+    def _flush_later(self) -> None:
+        """Timer callback: flush the buffer in the background if events are still waiting."""
+        if self._pending:
+            task = asyncio.ensure_future(self.flush())
+            self._flush_tasks.add(task)
+            task.add_done_callback(self._on_background_flush_done)
+
+    def _on_background_flush_done(self, task: "asyncio.Task") -> None:
+        self._flush_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"Background flush of session events failed: {task.exception()}")
+
+    async def flush(self) -> None:
+        """Commit any buffered events to the database."""
+        if self._pending:
+            await asyncio.to_thread(self._flush_sync)
+
+    def close(self) -> None:
+        """Flush buffered events and close the database connection."""
+        self._flush_sync()
+        self._conn.close()
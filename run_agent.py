@@ -9,14 +9,21 @@ import sys
 from google.adk import Runner
 from agent import no_match_analysis_orchestrator
 from artifact_config import configure_artifact_service_for_runner
+from session_config import get_session_service
+
+APP_NAME = "no_match_analysis_agent"
 
 def main():
     """Configure and run the no-match analysis agent."""
     print("🚀 Starting No-Match Analysis Agent with ADK Artifact Integration")
     
     try:
-        # Create the runner
-        runner = Runner(agent=no_match_analysis_orchestrator)
+        # Create the runner with a persistent session service
+        runner = Runner(
+            app_name=APP_NAME,
+            agent=no_match_analysis_orchestrator,
+            session_service=get_session_service()
+        )
         
         # Configure artifact service
         runner = configure_artifact_service_for_runner(runner)
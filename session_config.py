@@ -0,0 +1,39 @@
+"""
+ADK Session Service Configuration for No-Match Analysis Agent
+This module configures the session service used by the runner.
+"""
+
+import os
+from google.adk.sessions import InMemorySessionService
+
+DEFAULT_SESSION_DB_PATH = "no_match_sessions.db"
+
+def get_session_service():
+    """
+    Get the appropriate session service based on environment configuration.
+
+    `SESSION_BACKEND=sqlite` (the default) persists sessions to the local
+    SQLite file at `SESSION_DB_PATH`, which every worker process on the host
+    can share. `SESSION_BACKEND=memory` keeps sessions in process memory.
+
+    Returns:
+        BaseSessionService: Configured session service (local SQLite or InMemory)
+    """
+    backend = os.environ.get("SESSION_BACKEND", "sqlite").lower()
+
+    if backend == "sqlite":
+        db_path = os.environ.get("SESSION_DB_PATH", DEFAULT_SESSION_DB_PATH)
+        try:
+            from local_session_service import LocalSqliteSessionService
+            print(f"🔧 Configuring local SQLite Session Service at: {db_path}")
+            return LocalSqliteSessionService(
+                db_path=db_path,
+                batch_size=int(os.environ.get("SESSION_BATCH_SIZE", "16")),
+            )
+        except Exception as e:
+            print(f"⚠️ Failed to initialize SQLite Session Service: {e}")
+            print("🔄 Falling back to InMemory Session Service")
+            return InMemorySessionService()
+    else:
+        print("🔧 Configuring InMemory Session Service")
+        return InMemorySessionService()
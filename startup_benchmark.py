@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Startup Benchmark for No-Match Analysis Agent
+Measures the cold import time of agent.py in fresh interpreters and fails if
+it exceeds the startup budget or if a dependency meant to load on first use
+was imported eagerly. The profile mode reports the import cost per module.
+
+Usage:
+    python startup_benchmark.py                  # benchmark against the budget
+    python startup_benchmark.py --profile        # per-module import cost
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_STARTUP_BUDGET_SECONDS = 2.0
+
+# Heavy dependencies that must only load on first use, not when agent.py is imported
+DEFERRED_MODULES = [
+    "google.cloud.bigquery",
+    "google.cloud.storage",
+    "google.adk.models.google_llm",
+]
+
+
+def _run_python(code: str, *flags: str) -> subprocess.CompletedProcess:
+    """Run code in a fresh interpreter from the project directory."""
+    return subprocess.run(
+        [sys.executable, *flags, "-c", code],
+        cwd=PROJECT_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+
+def measure_cold_import(module: str = "agent", runs: int = 5) -> List[float]:
+    """
+    Time the import of a module in fresh interpreters.
+
+    Args:
+        module: Module to import
+        runs: Number of interpreters to start
+
+    Returns:
+        List[float]: Import time of each run, in seconds
+    """
+    code = f"import time; started = time.perf_counter(); import {module}; print(time.perf_counter() - started)"
+    return [float(_run_python(code).stdout.strip().splitlines()[-1]) for _ in range(runs)]
+
+
+def find_eager_imports(module: str = "agent", deferred: List[str] = DEFERRED_MODULES) -> List[str]:
+    """
+    List deferred dependencies that are loaded by importing a module.
+
+    Args:
+        module: Module to import
+        deferred: Modules that should not be loaded yet
+
+    Returns:
+        List[str]: Deferred modules found in sys.modules after the import
+    """
+    code = f"import sys; import {module}; print('\\n'.join(name for name in {deferred!r} if name in sys.modules))"
+    return [name for name in _run_python(code).stdout.splitlines() if name]
+
+
+def profile_imports(module: str = "agent") -> List[Tuple[str, int, int]]:
+    """
+    Profile the import of a module with `python -X importtime`.
+
+    Args:
+        module: Module to import
+
+    Returns:
+        List[Tuple[str, int, int]]: (module name, self microseconds, cumulative
+        microseconds) for every module loaded by the import
+    """
+    result = _run_python(f"import {module}", "-X", "importtime")
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        entries.append((name.strip(), int(self_us), int(cumulative_us)))
+    return entries
+
+
+def summarize_by_package(entries: List[Tuple[str, int, int]], depth: int = 2) -> Dict[str, int]:
+    """
+    Sum the self import time of modules per package prefix.
+
+    Args:
+        entries: Output of `profile_imports`
+        depth: Number of dotted name components that make up a package
+
+    Returns:
+        Dict[str, int]: Microseconds per package, largest first
+    """
+    totals: Dict[str, int] = defaultdict(int)
+    for name, self_us, _ in entries:
+        totals[".".join(name.split(".")[:depth])] += self_us
+    return dict(sorted(totals.items(), key=lambda item: item[1], reverse=True))
+
+
+def print_profile(module: str, top: int) -> None:
+    """Print the most expensive modules and packages of an import."""
+    entries = profile_imports(module)
+    total_us = sum(self_us for _, self_us, _ in entries)
+    print(f"🔬 Import profile of '{module}': {len(entries)} modules, {total_us / 1e6:.3f}s total")
+
+    print(f"\n📦 Top {top} packages by import time:")
+    for package, self_us in list(summarize_by_package(entries).items())[:top]:
+        print(f"  {self_us / 1000:9.1f} ms  {package}")
+
+    print(f"\n📄 Top {top} modules by self time:")
+    for name, self_us, cumulative_us in sorted(entries, key=lambda entry: entry[1], reverse=True)[:top]:
+        print(f"  {self_us / 1000:9.1f} ms  (cumulative {cumulative_us / 1000:8.1f} ms)  {name}")
+
+
+def run_benchmark(module: str, runs: int, budget_seconds: float) -> bool:
+    """
+    Benchmark cold imports against the budget and check deferred imports.
+
+    Args:
+        module: Module to import
+        runs: Number of fresh interpreters
+        budget_seconds: Maximum allowed median import time
+
+    Returns:
+        bool: True if the import is within budget and nothing deferred loaded eagerly
+    """
+    timings = measure_cold_import(module, runs)
+    median = statistics.median(timings)
+    print(f"⏱️ Cold import of '{module}': median {median:.3f}s, min {min(timings):.3f}s, "
+          f"max {max(timings):.3f}s over {runs} runs (budget {budget_seconds:.3f}s)")
+
+    eager = find_eager_imports(module)
+    for name in eager:
+        print(f"❌ {name} is imported eagerly; it should load on first use")
+
+    if median > budget_seconds:
+        print(f"❌ Cold import exceeds the startup budget by {median - budget_seconds:.3f}s")
+    passed = median <= budget_seconds and not eager
+    if passed:
+        print("✅ Startup within budget")
+    return passed
+
+
+def main():
+    """Run the startup benchmark or profile from the command line."""
+    parser = argparse.ArgumentParser(description="Cold-start benchmark for the no-match analysis agent")
+    parser.add_argument("--module", default="agent", help="Module to import (default: agent)")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters to time (default: 5)")
+    parser.add_argument("--budget", type=float,
+                        default=float(os.environ.get("STARTUP_BUDGET_SECONDS", DEFAULT_STARTUP_BUDGET_SECONDS)),
+                        help="Maximum median import time in seconds (default: STARTUP_BUDGET_SECONDS or 2.0)")
+    parser.add_argument("--profile", action="store_true", help="Report import cost per module instead")
+    parser.add_argument("--top", type=int, default=20, help="Entries to show in profile mode (default: 20)")
+    args = parser.parse_args()
+
+    if args.profile:
+        print_profile(args.module, args.top)
+        return
+
+    sys.exit(0 if run_benchmark(args.module, args.runs, args.budget) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,32 @@
 from google.adk.agents import LlmAgent
 from sub_agents.conversation_data_retrieval_agent.prompts import CONVERSATION_DATA_RETRIEVAL_INSTRUCTION_STR
 from tools.bigquery_tools import bigquery_execution_tool
+from tools.no_match_rollup import no_match_rollup_tool
+from tools.llm_cache import llm_response_cache
+from tools.model_tiering import tiered_model
+from tools.memory_profiling import memory_profiler
+from tools.rate_limiter import gemini_rate_limiter
 
 # LLM Agent for retrieving conversation data with no-match events from BigQuery
 conversation_data_retrieval_agent = LlmAgent(
     name="conversation_data_retrieval_agent",
-    model="gemini-2.5-flash",
+    model=tiered_model("conversation_data_retrieval_agent", "gemini-2.5-flash"),
     description="Retrieves conversation data with no-match events from BigQuery for analysis",
     instruction=CONVERSATION_DATA_RETRIEVAL_INSTRUCTION_STR,
-    tools=[bigquery_execution_tool],
-    output_key="conversation_data_output"
+    tools=[bigquery_execution_tool, no_match_rollup_tool],
+    output_key="conversation_data_output",
+    before_model_callback=[
+        llm_response_cache.before_model_callback,
+        gemini_rate_limiter.before_model_callback
+    ],
+    after_model_callback=[
+        llm_response_cache.after_model_callback,
+        gemini_rate_limiter.after_model_callback
+    ],
+    on_model_error_callback=[
+        llm_response_cache.on_model_error_callback,
+        gemini_rate_limiter.on_model_error_callback
+    ],
+    before_tool_callback=memory_profiler.before_tool_callback,
+    after_tool_callback=memory_profiler.after_tool_callback
 ) 
\ No newline at end of file
@@ -35,8 +35,16 @@ CONVERSATION_DATA_RETRIEVAL_INSTRUCTION_STR = """
     - If user mentions relative dates (e.g., "last week", "this month"), convert to appropriate date ranges
     - If no dates mentioned, use last week as default
     
+    Aggregate Questions:
+    - If the user asks for top no-match utterances, no-match counts by page or flow,
+      or no-match trends by day or week, call `no_match_rollup_tool` instead of writing SQL
+    - Pass PROJECT, DATASET, start_date and end_date (YYYY-MM-DD) and group_by
+      ("utterance", "page", "flow", "day" or "week")
+    - It reads a small precomputed daily rollup, so it is much cheaper than scanning the export table
+    - Present its rows as the conversation data, noting the grouping and date range
+
     Query Selection Logic:
-    - Always use the no-match analysis query template
+    - Use the no-match analysis query template whenever conversation scripts are needed
     - Focus on conversations with intent detection confidence of 0.0 or NULL
     - Limit results to top 10 conversations with highest no-match counts
     
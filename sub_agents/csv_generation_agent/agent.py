@@ -1,11 +1,27 @@
 from google.adk.agents import LlmAgent
 from sub_agents.csv_generation_agent.prompts import CSV_GENERATION_INSTRUCTION_STR
+from tools.context_budget import context_budget_instruction
+from tools.llm_cache import llm_response_cache
+from tools.model_tiering import tiered_model
+from tools.rate_limiter import gemini_rate_limiter
 
 # LLM Agent for generating CSV artifacts with training phrases for Dialogflow CX import
 csv_generation_agent = LlmAgent(
     name="csv_generation_agent",
-    model="gemini-2.5-flash",
+    model=tiered_model("csv_generation_agent", "gemini-2.5-flash"),
     description="Generates CSV artifacts with training phrases that can be imported into Dialogflow CX to reduce no-match events",
-    instruction=CSV_GENERATION_INSTRUCTION_STR,
-    output_key="csv_generation_output"
+    instruction=context_budget_instruction(CSV_GENERATION_INSTRUCTION_STR),
+    output_key="csv_generation_output",
+    before_model_callback=[
+        llm_response_cache.before_model_callback,
+        gemini_rate_limiter.before_model_callback
+    ],
+    after_model_callback=[
+        llm_response_cache.after_model_callback,
+        gemini_rate_limiter.after_model_callback
+    ],
+    on_model_error_callback=[
+        llm_response_cache.on_model_error_callback,
+        gemini_rate_limiter.on_model_error_callback
+    ]
 ) 
\ No newline at end of file
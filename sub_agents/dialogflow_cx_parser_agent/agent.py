@@ -1,11 +1,31 @@
 from google.adk.agents import LlmAgent
 from sub_agents.dialogflow_cx_parser_agent.prompts import DIALOGFLOW_CX_PARSER_INSTRUCTION_STR
+from tools.context_budget import context_budget_instruction
+from tools.context_cache import context_cache
+from tools.llm_cache import llm_response_cache
+from tools.model_tiering import tiered_model
+from tools.rate_limiter import gemini_rate_limiter
 
 # LLM Agent for analyzing Dialogflow CX bot structure
 dialogflow_cx_parser_agent = LlmAgent(
     name="dialogflow_cx_parser_agent",
-    model="gemini-2.5-flash",
+    model=tiered_model("dialogflow_cx_parser_agent", "gemini-2.5-flash"),
     description="Analyzes Dialogflow CX bot JSON structure and extracts intent information for optimization",
-    instruction=DIALOGFLOW_CX_PARSER_INSTRUCTION_STR,
-    output_key="dialogflow_analysis_output"
+    instruction=context_budget_instruction(DIALOGFLOW_CX_PARSER_INSTRUCTION_STR),
+    output_key="dialogflow_analysis_output",
+    before_model_callback=[
+        llm_response_cache.before_model_callback,
+        gemini_rate_limiter.before_model_callback,
+        context_cache.before_model_callback
+    ],
+    after_model_callback=[
+        llm_response_cache.after_model_callback,
+        gemini_rate_limiter.after_model_callback,
+        context_cache.after_model_callback
+    ],
+    on_model_error_callback=[
+        llm_response_cache.on_model_error_callback,
+        gemini_rate_limiter.on_model_error_callback,
+        context_cache.on_model_error_callback
+    ]
 ) 
\ No newline at end of file
@@ -1,11 +1,27 @@
 from google.adk.agents import LlmAgent
 from sub_agents.no_match_analysis_agent.prompts import NO_MATCH_ANALYSIS_INSTRUCTION_STR
+from tools.context_budget import context_budget_instruction
+from tools.llm_cache import llm_response_cache
+from tools.model_tiering import tiered_model
+from tools.rate_limiter import gemini_rate_limiter
 
 # LLM Agent for analyzing no-match events and providing recommendations
 no_match_analysis_agent = LlmAgent(
     name="no_match_analysis_agent",
-    model="gemini-2.5-flash",
+    model=tiered_model("no_match_analysis_agent", "gemini-2.5-flash"),
     description="Analyzes no-match events in conversation data and provides bot optimization recommendations",
-    instruction=NO_MATCH_ANALYSIS_INSTRUCTION_STR,
-    output_key="no_match_analysis_output"
+    instruction=context_budget_instruction(NO_MATCH_ANALYSIS_INSTRUCTION_STR),
+    output_key="no_match_analysis_output",
+    before_model_callback=[
+        llm_response_cache.before_model_callback,
+        gemini_rate_limiter.before_model_callback
+    ],
+    after_model_callback=[
+        llm_response_cache.after_model_callback,
+        gemini_rate_limiter.after_model_callback
+    ],
+    on_model_error_callback=[
+        llm_response_cache.on_model_error_callback,
+        gemini_rate_limiter.on_model_error_callback
+    ]
 ) 
\ No newline at end of file
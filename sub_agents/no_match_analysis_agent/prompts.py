@@ -33,6 +33,15 @@ NO_MATCH_ANALYSIS_INSTRUCTION_STR = """
     - Provide specific, actionable recommendations
     - Consider the bot's current structure and capabilities
 
+    **Period Comparisons:**
+    If the conversation data is a "No-Match Comparison" of two date windows, it lists
+    utterance clusters with their no-match rate change and a significance flag instead of
+    conversations. In that case:
+    - Focus on clusters with a significant increase and on new clusters (likely regressions)
+    - Mention significant decreases as improvements, without recommendations
+    - Do not draw conclusions from changes that are not significant
+    - Use the cluster's example utterances as the example utterances and training phrases
+
     **Output Format:**
     Provide your analysis in the following format:
 
@@ -80,6 +80,547 @@ def test_tools():
         print(f"❌ Tools testing error: {e}")
         return False
 
+def test_state_offload():
+    """Test that large state values round-trip through the artifact store by reference."""
+    print("\n📦 Testing state offload...")
+    
+    try:
+        import asyncio
+        from types import SimpleNamespace
+        from google.adk.artifacts import InMemoryArtifactService
+        from tools import state_offload
+        from tools.state_offload import (
+            offload_state_value,
+            load_state_value,
+            is_offloaded_reference,
+            get_state_value_size
+        )
+        
+        ctx = SimpleNamespace(
+            artifact_service=InMemoryArtifactService(),
+            app_name="test_app",
+            user_id="test_user",
+            session=SimpleNamespace(id="test_session")
+        )
+        large_value = "conversation script\n---\n" * 5000
+        
+        async def round_trip():
+            reference = await offload_state_value(ctx, "conversation_data_output", large_value)
+            state_offload._rehydration_cache.clear()
+            return reference, await load_state_value(ctx, reference)
+        
+        reference, resolved = asyncio.run(round_trip())
+        assert is_offloaded_reference(reference), "Large value was not offloaded"
+        assert get_state_value_size(reference) == len(large_value), "Reference size mismatch"
+        assert resolved == large_value, "Rehydrated value mismatch"
+        
+        # A save into one artifact service says nothing about another
+        other_ctx = SimpleNamespace(**{**vars(ctx), "artifact_service": InMemoryArtifactService()})
+        asyncio.run(offload_state_value(other_ctx, "conversation_data_output", large_value))
+        assert asyncio.run(other_ctx.artifact_service.load_artifact(
+            app_name="test_app", user_id="test_user", session_id="test_session", filename=reference["artifact"]
+        )), "Value was not saved to the second artifact service"
+
+        small_value = asyncio.run(offload_state_value(ctx, "no_match_analysis_output", "short"))
+        assert small_value == "short", "Small value should stay inline"
+        
+        print("✅ State offload testing successful")
+        return True
+        
+    except Exception as e:
+        print(f"❌ State offload error: {e}")
+        return False
+
+def test_records():
+    """Test that compact records are slotted, coerce row values and pickle for worker processes."""
+    print("\n🧱 Testing compact records...")
+
+    try:
+        import pickle
+        import sys
+        from tools.records import IntentPhrase, UtteranceCluster, UtteranceCount, records_from_rows, records_to_rows
+
+        rows = [{"group_key": f"utterance {i % 50}", "no_match_turns": i % 7, "conversations": i % 3} for i in range(5000)]
+        counts = records_from_rows(UtteranceCount, rows)
+        assert counts[3] == UtteranceCount("utterance 3", 3, 0), "Row aliases not applied"
+        assert not hasattr(counts[0], "__dict__"), "Records should be slotted"
+        assert sys.getsizeof(counts[0]) < sys.getsizeof(rows[0]), "Record should be smaller than its dict"
+
+        clusters = [UtteranceCluster("order track"), UtteranceCluster("refund")]
+        clusters[0].add("track my order", 3)
+        clusters[0].add("track order", 5)
+        clusters[0].add("track my order", 4)
+        assert (clusters[0].no_match_turns, clusters[0].label()) == (12, "track my order"), "Cluster counts mismatch"
+        assert pickle.loads(pickle.dumps(clusters)) == clusters, "Records (with an empty one) should pickle for worker processes"
+
+        phrases = [IntentPhrase("billing", "where is my bill", "en"), IntentPhrase("billing", "wo ist meine Rechnung ✓", "de")]
+        assert pickle.loads(pickle.dumps(phrases)) == phrases, "Non-ASCII phrases did not round-trip"
+        counts = records_from_rows(UtteranceCount, [{"group_key": "cancel", "no_match_turns": "7", "no_match_conversations": None}])
+        assert records_to_rows(counts) == [{"utterance": "cancel", "no_match_turns": 7, "no_match_conversations": 0}], "Coercion mismatch"
+
+        print(f"✅ {len(rows)} utterance counts as records ({sys.getsizeof(counts[0])} bytes per record)")
+        return True
+
+    except Exception as e:
+        print(f"❌ Compact records error: {e}")
+        return False
+
+def test_top_k():
+    """Test streaming top-k, merged shards, the count-min sketch and heavy hitters."""
+    print("\n🏆 Testing streaming top-k...")
+
+    try:
+        import random
+        from collections import Counter
+        from tools.bigquery_tools import _collect_capped_rows
+        from tools.top_k import CountMinSketch, HeavyHitters, TopK, top_k
+
+        rng = random.Random(7)
+        rows = [{"Convo_ID": f"conv_{i:05d}", "no_match_count": rng.randint(0, 50)} for i in range(20000)]
+        expected = sorted(rows, key=lambda row: (-row["no_match_count"], row["Convo_ID"]))[:10]
+
+        def ranking():
+            return TopK(10, key=lambda row: row["no_match_count"], tie_key=lambda row: row["Convo_ID"])
+
+        single = ranking().extend(rows)
+        assert single.items() == expected and len(single) == 10, "Top-k differs from a full sort"
+        shards = [ranking().extend(rows[start::4]) for start in range(4)]
+        merged = shards[0]
+        for shard in shards[1:]:
+            merged.merge(shard)
+        assert merged.items() == expected and merged.seen == len(rows), "Merged shards should give the same top-k"
+        assert top_k([3, 1, 3, 2], 2, key=lambda value: value) == [3, 3], "Ties without a tie key keep arrival order"
+
+        # Zipf-like utterance stream: a few frequent utterances, a long tail
+        stream = [f"utterance {int(rng.paretovariate(1.2))}" for _ in range(50000)]
+        exact = Counter(stream)
+        sketch = CountMinSketch.from_error(epsilon=0.001, delta=0.01)
+        for utterance in stream:
+            sketch.add(utterance)
+        assert all(sketch.estimate(key) >= count for key, count in exact.items()), "Count-min sketch undercounted"
+        assert max(sketch.estimate(key) - count for key, count in exact.items()) <= 0.001 * len(stream) * 2, "Overcount too large"
+        assert CountMinSketch.from_bytes(sketch.to_bytes()).estimate("utterance 1") == sketch.estimate("utterance 1"), "Sketch did not round-trip"
+
+        halves = [HeavyHitters(5), HeavyHitters(5)]
+        for index, utterance in enumerate(stream):
+            halves[index % 2].add(utterance)
+        heavy = halves[0].merge(halves[1])
+        assert [key for key, _ in heavy.top()] == [key for key, _ in exact.most_common(5)], f"Heavy hitters mismatch: {heavy.top()}"
+
+        class Job:
+            def result(self, timeout=None):
+                return iter(_Row(row) for row in rows)
+
+        class _Row(dict):
+            pass
+
+        capped, total = _collect_capped_rows(Job(), max_rows=10)
+        assert (capped, total) == (rows[:10], len(rows)), "Capped results should keep the query's first rows"
+        ranked, _ = _collect_capped_rows(Job(), max_rows=10, ranking_columns=("no_match_count",))
+        assert ranked == sorted(rows, key=lambda row: -row["no_match_count"])[:10], "Ranked results should keep the top rows"
+
+        import asyncio
+        from tools import bigquery_tools
+
+        class Client:
+            def query(self, query, job_id=None):
+                return Job()
+
+        bigquery_tools.register_bigquery_client("top-k-project", Client())
+        limit = bigquery_tools.BIGQUERY_MAX_RESULT_ROWS
+        try:
+            assert len(asyncio.run(bigquery_tools.bigquery_execution_tool("top-k-project", "SELECT 1"))) == len(rows), \
+                "Results should not be capped by default"
+            bigquery_tools.BIGQUERY_MAX_RESULT_ROWS = 10
+            truncated = asyncio.run(bigquery_tools.bigquery_execution_tool("top-k-project", "SELECT 1"))
+        finally:
+            bigquery_tools.BIGQUERY_MAX_RESULT_ROWS = limit
+        assert truncated == {"rows": rows[:10], "truncated": True, "returned_rows": 10, "total_rows": len(rows)}, \
+            "Truncation should be visible to the model"
+
+        print(f"✅ Top-k of {len(rows)} rows kept {len(single)}; heavy hitters {heavy.top(3)}")
+        return True
+
+    except Exception as e:
+        print(f"❌ Top-k error: {e}")
+        return False
+
+def test_llm_cache():
+    """Test the LLM response cache key, tiers and TTL."""
+    print("\n🗄️ Testing LLM response cache...")
+    
+    try:
+        import tempfile
+        from google.genai import types
+        from google.adk.models.llm_request import LlmRequest
+        from google.adk.models.llm_response import LlmResponse
+        from tools.llm_cache import LlmResponseCache, compute_request_key
+        
+        def build_request(call_id):
+            return LlmRequest(
+                model="gemini-2.5-flash",
+                contents=[types.Content(role="model", parts=[types.Part(
+                    function_call=types.FunctionCall(id=call_id, name="bigquery_execution_tool", args={"query": "SELECT 1"})
+                )])],
+                config=types.GenerateContentConfig(system_instruction="Analyze no-match events")
+            )
+        
+        key = compute_request_key(build_request("adk-1"))
+        assert key == compute_request_key(build_request("adk-2")), "Function call ids should not affect the key"
+        
+        cache_dir = tempfile.mkdtemp()
+        response = LlmResponse(content=types.Content(role="model", parts=[types.Part(text="report")]))
+        LlmResponseCache(enabled=True, cache_dir=cache_dir).put(key, response)
+        
+        fresh_cache = LlmResponseCache(enabled=True, cache_dir=cache_dir)
+        assert fresh_cache.get(key).content.parts[0].text == "report", "Disk tier lookup failed"
+        
+        expired_cache = LlmResponseCache(enabled=True, cache_dir=cache_dir, ttl_seconds=-1)
+        assert expired_cache.get(key) is None, "Expired entry should be a miss"
+        
+        # A failed model call never reaches the after callback; its key must not leak
+        from types import SimpleNamespace
+        callback_context = SimpleNamespace(invocation_id="inv-1", agent_name="csv_generation_agent", state={})
+        fresh_cache.before_model_callback(callback_context, build_request("adk-3"))
+        fresh_cache.on_model_error_callback(callback_context, build_request("adk-3"), RuntimeError("503"))
+        fresh_cache.before_model_callback(callback_context, build_request("adk-4"))
+        fresh_cache.after_model_callback(callback_context, LlmResponse(error_code="RESOURCE_EXHAUSTED"))
+        assert not fresh_cache._pending_keys, "Pending request keys leaked"
+        
+        print("✅ LLM response cache testing successful")
+        return True
+        
+    except Exception as e:
+        print(f"❌ LLM response cache error: {e}")
+        return False
+
+def test_workflow_checkpoints():
+    """Test that step checkpoints restore fresh outputs and detect stale inputs."""
+    print("\n🧭 Testing workflow checkpoints...")
+    
+    try:
+        from types import SimpleNamespace
+        from tools.workflow_checkpoints import WorkflowCheckpointer, CHECKPOINTS_STATE_KEY
+        
+        state = {
+            "conversation_data_output": "Convo_ID: conv_001, no_match_count: 3",
+            "no_match_analysis_output": "## No-Match Event Analysis Report"
+        }
+        
+        def build_ctx():
+            return SimpleNamespace(session=SimpleNamespace(state=state), user_content=None, invocation_id="inv", branch=None)
+        
+        state.update(WorkflowCheckpointer(build_ctx()).complete(2))
+        restored = WorkflowCheckpointer(build_ctx()).restore(2)
+        assert restored == {"no_match_analysis_output": "## No-Match Event Analysis Report"}, "Fresh checkpoint not restored"
+        
+        state["rerun_from_step"] = 2
+        assert WorkflowCheckpointer(build_ctx()).restore(2) is None, "Forced rerun should ignore checkpoint"
+        state["rerun_from_step"] = None
+        
+        state["conversation_data_output"] = "Convo_ID: conv_002, no_match_count: 5"
+        assert WorkflowCheckpointer(build_ctx()).restore(2) is None, "Stale checkpoint should not be restored"
+        assert CHECKPOINTS_STATE_KEY.startswith("user:"), "Checkpoints should be user-scoped"
+        
+        print("✅ Workflow checkpoint testing successful")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Workflow checkpoint error: {e}")
+        return False
+
+def test_step_deadlines():
+    """Test that step deadlines respect the run budget and cancel slow steps."""
+    print("\n⏱️ Testing step deadlines...")
+    
+    try:
+        import asyncio
+        from tools.step_deadlines import RunDeadline, StepDeadlineExceeded, run_with_deadline, RUN_DEGRADED_STATE_KEY
+        
+        deadline = RunDeadline(slo_seconds=60.0, step_timeouts={1: 600.0, 3: 5.0})
+        assert deadline.step_timeout(1) <= 60.0, "Step deadline should be capped by the run budget"
+        assert deadline.step_timeout(3) == 5.0, "Step deadline not applied"
+        assert RunDeadline(slo_seconds=None, step_timeouts={}).step_timeout(2) is None, "Unbounded step should have no deadline"
+        
+        cancelled = []
+        
+        async def slow_step():
+            yield "started"
+            try:
+                await asyncio.sleep(5)
+                yield "finished"
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+        
+        async def run_slow_step():
+            received = []
+            try:
+                async for event in run_with_deadline(slow_step(), 0.05):
+                    received.append(event)
+            except StepDeadlineExceeded:
+                return received
+            return None
+        
+        received = asyncio.run(run_slow_step())
+        assert received == ["started"], "Events before the deadline should be relayed"
+        assert cancelled, "Slow step was not cancelled"
+
+        async def timing_out_step():
+            yield "started"
+            raise asyncio.TimeoutError("tool call timed out")
+
+        async def run_timing_out_step():
+            try:
+                async for _ in run_with_deadline(timing_out_step(), 5.0):
+                    pass
+            except StepDeadlineExceeded:
+                return "deadline"
+            except asyncio.TimeoutError:
+                return "step error"
+
+        assert asyncio.run(run_timing_out_step()) == "step error", "A step's own timeout is not a missed deadline"
+        
+        state_delta = deadline.record_timeout(3, 5.0)
+        assert state_delta[RUN_DEGRADED_STATE_KEY] is True and deadline.degraded, "Timeout should mark the run as degraded"
+        
+        print("✅ Step deadline testing successful")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Step deadline error: {e}")
+        return False
+
+def test_memory_profiling():
+    """Test that step memory profiles attribute allocations and state sizes and are saved as artifacts."""
+    print("\n🧮 Testing memory profiling...")
+
+    try:
+        import asyncio
+        import json
+        from types import SimpleNamespace
+        from google.adk.artifacts import InMemoryArtifactService
+        from tools.memory_profiling import MemoryProfiler, state_key_sizes
+        from tools.state_offload import OFFLOAD_REFERENCE_MARKER
+
+        sizes = state_key_sizes({
+            "conversation_data_output": "x" * 100000,
+            "bigquery_metadata": {OFFLOAD_REFERENCE_MARKER: True, "size": 500000, "sha256": "abc"},
+        })
+        assert list(sizes)[0] == "conversation_data_output", "State keys should be ordered by retained size"
+        assert sizes["bigquery_metadata"]["offloaded_bytes"] == 500000, "Offloaded payload size not reported"
+
+        ctx = SimpleNamespace(
+            app_name="test_app", user_id="test_user", invocation_id="e-test",
+            session=SimpleNamespace(id="session-1", state={}), artifact_service=InMemoryArtifactService()
+        )
+
+        async def profile_step():
+            profiler = MemoryProfiler(enabled=True, top_n=5)
+            profiler.start_step(ctx, "conversation_data_retrieval")
+            ctx.session.state["conversation_data_output"] = [str(i) * 20 for i in range(20000)]
+            profile = profiler.finish_step(ctx, "conversation_data_retrieval")
+            filename = await profiler.save_report(ctx)
+            artifact = await ctx.artifact_service.load_artifact(
+                app_name="test_app", user_id="test_user", session_id="session-1", filename=filename
+            )
+            return profile, json.loads(artifact.inline_data.data)
+
+        profile, report = asyncio.run(profile_step())
+        assert profile["net_bytes"] > 500000 and profile["peak_over_start_bytes"] >= profile["net_bytes"], "Allocations not measured"
+        assert any("test_agent.py" in allocation["site"][0] for allocation in profile["top_allocations"]), "Allocation site not reported"
+        assert "conversation_data_output" in profile["state_keys"], "State key sizes not reported"
+        assert report["profiles"][0]["name"] == "conversation_data_retrieval", "Profile report not saved"
+
+        # A run that fails mid-step never saves its report but must still stop tracing
+        import tracemalloc
+        failed_ctx = SimpleNamespace(**{**vars(ctx), "invocation_id": "e-failed"})
+        profiler = MemoryProfiler(enabled=True, top_n=5)
+        profiler.start_step(failed_ctx, "conversation_data_retrieval")
+        assert tracemalloc.is_tracing(), "Tracing should start with the first step"
+        profiler.discard(failed_ctx)
+        assert not tracemalloc.is_tracing(), "Discarding an unfinished run should stop tracing"
+
+        print(f"✅ Memory profiling recorded {profile['net_bytes'] / 1e6:.1f} MB for the step")
+        return True
+
+    except Exception as e:
+        print(f"❌ Memory profiling error: {e}")
+        return False
+
+def test_phrase_validation():
+    """Test that generated training phrases are validated and deduplicated in bulk."""
+    print("\n✅ Testing phrase validation...")
+
+    try:
+        import json
+        from tools.phrase_validation import (
+            BotPhraseIndex, extract_csv_content, replace_csv_content, validate_training_phrases,
+        )
+
+        bot_json = json.dumps({"intents": [
+            {"displayName": "order.cancel", "trainingPhrases": [{"parts": [{"text": "cancel my order"}]}]},
+            {"displayName": "order.track", "trainingPhrases": [{"parts": [{"text": "where is my "}, {"text": "package"}]}]},
+        ]})
+        bot_index = BotPhraseIndex.from_bot_json(bot_json)
+        assert BotPhraseIndex.from_bot_json(bot_json) is bot_index, "Bot index should be cached per export"
+        assert not BotPhraseIndex.from_bot_json("[]").exact, "A non-object bot export has no phrases"
+
+        csv_content = "\n".join([
+            "intent_name,training_phrase",
+            "billing.refund,I want a refund",
+            "billing.refund,i want a   REFUND",
+            "billing.refund,want refund!",
+            "billing.refund,",
+            "billing.refund," + "x" * 800,
+            "order.cancel,Cancel my order please",
+            "order.status,where is my package",
+            "x" * 70 + ",some phrase",
+        ]) + "\n"
+        validated, report = validate_training_phrases(csv_content, bot_index)
+        counts = report["counts"]
+        assert counts == {
+            "duplicate": 1, "near_duplicate": 1, "empty": 1, "too_long": 1, "exists_in_bot": 1,
+            "cross_intent_collision": 1, "intent_name_too_long": 1,
+        }, f"Unexpected counts: {counts}"
+        assert report["kept"] == 3 and report["dropped"] == 5, "Flagged rows should be kept by default"
+        assert report["flagged_rows"][0]["other_intents"] == ["order.track"], "Collision should name the other intent"
+        assert validated.splitlines()[1] == "billing.refund,I want a refund", "First occurrence should be kept"
+
+        _, strict = validate_training_phrases(csv_content, bot_index, drop_collisions=True)
+        assert strict["kept"] == 2, "Collisions should be dropped when configured"
+
+        # Non-Latin and accented phrases keep their words instead of sharing an empty near key
+        unicode_csv = "\n".join([
+            "Intent Name,Training Phrase,Language Code",
+            "order.cancel,注文をキャンセルしたい,ja",
+            "order.cancel,注文の状況を教えて,ja",
+            "order.track,荷物はどこですか,ja",
+            "order.track,¿Dónde está mi pedido?,es",
+            "order.track,donde esta mi pedido,es",
+            "order.track,!!!,en",
+            "order.cancel,???,en",
+            "order.track,está mi pedido dónde,es",
+        ]) + "\n"
+        _, unicode_report = validate_training_phrases(unicode_csv, bot_index, drop_collisions=True)
+        assert unicode_report["kept"] == 7 and unicode_report["counts"] == {"near_duplicate": 1}, \
+            f"Non-Latin rows misjudged: {unicode_report['counts']}"
+
+        # The orchestrator parses the bot export and validates in a worker process
+        import asyncio
+        from tools.cpu_tasks import validate_phrase_csv
+        from tools.process_pool import CpuTaskPool
+        pool = CpuTaskPool(max_workers=1)
+        try:
+            pooled, pooled_report = asyncio.run(pool.run(validate_phrase_csv, [csv_content, bot_json], False))
+        finally:
+            pool.shutdown()
+        assert pooled == validated and pooled_report["counts"] == counts, "Pooled validation differs"
+
+        output = f"Here is the CSV:\n```csv\n{csv_content}```\nDone."
+        assert replace_csv_content(output, validated).endswith("```\nDone."), "CSV should be replaced in place"
+        assert extract_csv_content(replace_csv_content(output, validated)) == validated, "Replaced CSV not extracted"
+
+        rows = ["Intent Name,Training Phrase"] + [f"intent_{i % 50},help me with order number {i} today" for i in range(20000)]
+        _, bulk = validate_training_phrases("\n".join(rows), bot_index)
+        assert bulk["kept"] == 20000 and bulk["seconds"] < 1.0, f"Bulk validation took {bulk['seconds']:.3f}s"
+
+        print(f"✅ Phrase validation checked {bulk['rows']} rows in {bulk['seconds']:.3f}s")
+        return True
+
+    except Exception as e:
+        print(f"❌ Phrase validation error: {e}")
+        return False
+
+def test_context_budget():
+    """Test that instructions are fitted to the agent's token budget by keeping the most informative content."""
+    print("\n🪙 Testing context budget...")
+
+    try:
+        import asyncio
+        import json
+        from types import SimpleNamespace
+        from sub_agents.csv_generation_agent.prompts import CSV_GENERATION_INSTRUCTION_STR
+        from sub_agents.dialogflow_cx_parser_agent.prompts import DIALOGFLOW_CX_PARSER_INSTRUCTION_STR
+        from tools.context_budget import ContextBudget, estimate_tokens
+
+        budget = ContextBudget(enabled=True, default_budget=4000, agent_budgets={"dialogflow_cx_parser_agent": 3000})
+        conversations = "Retrieved 2000 conversations with no-match events:\n" + "\n".join(
+            f"Convo_ID: c{i}, no_match_count: {50 if i % 100 == 0 else 1}, conversation_script: "
+            + ("cancel my subscription" if i % 100 == 0 else f"unusual request about topic{i} and more words")
+            for i in range(2000)
+        )
+        analysis = "## No-Match Event Analysis Report\n\n" + "\n".join(
+            f"{i}. **Pattern {i}: topic{i}**\n   - Frequency: {1000 if i == 7 else i} occurrences" for i in range(1, 400)
+        )
+        ctx = SimpleNamespace(session=SimpleNamespace(state={
+            "conversation_data_output": conversations,
+            "no_match_analysis_output": analysis,
+            "dialogflow_analysis_output": "## Dialogflow CX Bot Structure Analysis",
+        }))
+
+        def render(template, agent_name):
+            readonly_context = SimpleNamespace(_invocation_context=ctx, agent_name=agent_name, invocation_id="inv-1")
+            return asyncio.run(budget.instruction(template)(readonly_context))
+
+        rendered = render("Analyze:\n{conversation_data_output}", "no_match_analysis_agent")
+        report = budget.pop_reports("inv-1")["no_match_analysis_agent"]
+        assert estimate_tokens(rendered) <= 4000 < report["tokens_before"], "Instruction should fit the budget"
+        assert "cancel my subscription [+19 similar]" in rendered, "Most frequent cluster should be kept and merged"
+        records = report["values"]["conversation_data_output"]
+        assert records["dropped_items"] > 0 and records["merged_items"] == 19, f"Dropped records not recorded: {records}"
+
+        rendered = render(CSV_GENERATION_INSTRUCTION_STR, "csv_generation_agent")
+        assert "Pattern 7: topic7" in rendered and "Pattern 2: topic2**" not in rendered, "High-frequency sections should win"
+        assert "## Dialogflow CX Bot Structure Analysis" in rendered, "Small values should be kept whole"
+
+        ctx.session.state["dialogflow_bot_json"] = json.dumps({"intents": [
+            {"displayName": f"intent_{i}", "trainingPhrases": [{"parts": [{"text": f"filler words {i} {j}"}]} for j in range(40)]}
+            for i in range(60)
+        ] + [{"displayName": "subscription.cancel", "trainingPhrases": [{"parts": [{"text": f"cancel subscription {j}"}]} for j in range(41)]}]})
+        ctx.session.state["no_match_analysis_output"] = "Users try to cancel their subscription"
+        rendered = render(DIALOGFLOW_CX_PARSER_INSTRUCTION_STR, "dialogflow_cx_parser_agent")
+        bot_report = budget.pop_reports("inv-1")["dialogflow_cx_parser_agent"]["values"]["dialogflow_bot_json"]
+        assert estimate_tokens(rendered) <= 3000, "Per-agent budget should apply"
+        assert '"displayName":"subscription.cancel"' in rendered, "Most trained intent should be kept whole"
+        assert bot_report["dropped_items"] > 0 and "otherIntentNames" in rendered, "Dropped intents should be listed by name"
+        ctx.session.state["no_match_analysis_output"] = "Users ask about topic 12 and more"
+        assert render(DIALOGFLOW_CX_PARSER_INSTRUCTION_STR, "dialogflow_cx_parser_agent") == rendered, \
+            "The parser's prompt should not depend on the session's no-match data"
+
+        from tools.process_pool import cpu_task_pool
+        fitted_tasks = cpu_task_pool.get_metrics()["tasks"]["fit_instruction"]["tasks"]
+        assert render(DIALOGFLOW_CX_PARSER_INSTRUCTION_STR, "dialogflow_cx_parser_agent") == rendered, "Retry changed the prompt"
+        assert cpu_task_pool.get_metrics()["tasks"]["fit_instruction"]["tasks"] == fitted_tasks, \
+            "A retry with the same inputs should reuse the fitted instruction"
+
+        small = ContextBudget(enabled=True, default_budget=4000).fit("Data: {x}", {"x": "short"}, 4000)
+        assert small == ("Data: short", {**small[1], "values": {}}), "Instructions within budget should not change"
+
+        print(f"✅ Context budget reduced {report['tokens_before']} tokens to {report['tokens_after']}")
+        return True
+
+    except Exception as e:
+        print(f"❌ Context budget error: {e}")
+        return False
+
+def test_cold_start():
+    """Test that heavy dependencies are not imported with agent.py."""
+    print("\n🧊 Testing cold start...")
+    
+    try:
+        from startup_benchmark import find_eager_imports, measure_cold_import
+        
+        eager = find_eager_imports("agent")
+        assert not eager, f"Imported eagerly: {eager}"
+        
+        print(f"✅ Cold import of agent.py took {measure_cold_import('agent', runs=1)[0]:.3f}s with heavy dependencies deferred")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Cold start error: {e}")
+        return False
+
 def test_environment():
     """Test environment configuration."""
     print("\n🌍 Testing environment configuration...")
@@ -181,6 +722,16 @@ def main():
         test_agent_structure,
         test_tools,
         test_artifact_implementation,
+        test_state_offload,
+        test_records,
+        test_top_k,
+        test_llm_cache,
+        test_workflow_checkpoints,
+        test_step_deadlines,
+        test_memory_profiling,
+        test_phrase_validation,
+        test_context_budget,
+        test_cold_start,
         test_environment
     ]
     
@@ -70,6 +70,943 @@ def test_runner_config():
         print(f"❌ Runner configuration error: {e}")
         return False
 
+def test_local_session_service():
+    """Test that the local SQLite session service persists state deltas across instances."""
+    print("\n💾 Testing local session service...")
+    
+    try:
+        import tempfile
+        from google.adk.events import Event, EventActions
+        from local_session_service import LocalSqliteSessionService
+        
+        db_path = os.path.join(tempfile.mkdtemp(), "sessions.db")
+        
+        async def write_session():
+            service = LocalSqliteSessionService(db_path=db_path, batch_size=4)
+            session = await service.create_session(
+                app_name="test_app", user_id="test_user", state={"user:preferred_bot": "support"}
+            )
+            event = Event(
+                author="conversation_data_retrieval_agent",
+                actions=EventActions(state_delta={"conversation_data_output": "x" * 10000})
+            )
+            await service.append_event(session, event)
+            service.close()
+            return session.id
+        
+        async def read_session(session_id):
+            service = LocalSqliteSessionService(db_path=db_path)
+            session = await service.get_session(app_name="test_app", user_id="test_user", session_id=session_id)
+            listed = await service.list_sessions(app_name="test_app", user_id="test_user")
+            service.close()
+            return session, listed
+        
+        async def batch_events():
+            # Final responses of one turn are batched; the next turn or the flush timer commits them
+            import sqlite3
+            from google.genai import types
+            service = LocalSqliteSessionService(db_path=db_path, batch_size=16, flush_interval_seconds=0.2)
+            session = await service.create_session(app_name="test_app", user_id="batch_user")
+
+            def committed():
+                with sqlite3.connect(db_path) as conn:
+                    return conn.execute("SELECT COUNT(*) FROM events WHERE user_id = 'batch_user'").fetchone()[0]
+
+            def response(invocation_id):
+                return Event(invocation_id=invocation_id, author="no_match_analysis_agent",
+                             content=types.Content(role="model", parts=[types.Part(text="done")]))
+
+            for _ in range(3):
+                await service.append_event(session, response("turn-1"))
+            counts = [committed()]
+            await service.append_event(session, response("turn-2"))
+            counts.append(committed())
+            await service.append_event(session, response("turn-2"))
+            counts.append(committed())
+            await asyncio.sleep(0.5)
+            counts.append(committed())
+            service.close()
+            return counts
+
+        session_id = asyncio.run(write_session())
+        session, listed = asyncio.run(read_session(session_id))
+        batched = asyncio.run(batch_events())
+        assert batched == [0, 4, 4, 5], f"Session events not batched per turn and timer: {batched}"
+        
+        assert session is not None, "Session not persisted"
+        assert session.state["conversation_data_output"] == "x" * 10000, "State delta not persisted"
+        assert session.state["user:preferred_bot"] == "support", "User state not persisted"
+        assert len(session.events) == 1, "Event not persisted"
+        assert [s.id for s in listed.sessions] == [session_id], "Session listing failed"
+        
+        print("✅ Local session service persists sessions across instances")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Local session service error: {e}")
+        return False
+
+def test_rate_limiter():
+    """Test that the Gemini rate limiter serves interactive sessions before batch jobs."""
+    print("\n🚦 Testing Gemini rate limiter...")
+    
+    try:
+        from tools.rate_limiter import GeminiRateLimiter, RateBudget
+        
+        async def run_queue():
+            limiter = GeminiRateLimiter(RateBudget(requests_per_minute=1200, tokens_per_minute=0))
+            limiter.budget._levels[0] = 0
+            order = []
+            
+            async def call(priority, session_id, tag):
+                await limiter.acquire(100, priority=priority, session_id=session_id)
+                order.append(tag)
+            
+            tasks = [asyncio.create_task(call("batch", "batch_session", f"batch-{i}")) for i in range(3)]
+            await asyncio.sleep(0)
+            tasks.append(asyncio.create_task(call("interactive", "ui_session", "interactive")))
+            await asyncio.gather(*tasks)
+            return order, limiter.get_metrics()
+        
+        order, metrics = asyncio.run(run_queue())
+        assert order[0] == "interactive", f"Interactive call should be served first: {order}"
+        assert metrics["batch"]["granted"] == 3, "Batch metrics not recorded"
+        
+        import sqlite3, tempfile, threading
+        from tools.rate_limiter import SqliteRateBudget
+        db_path = os.path.join(tempfile.mkdtemp(), "rate.db")
+        shared = GeminiRateLimiter(SqliteRateBudget(db_path, requests_per_minute=600, tokens_per_minute=0))
+        
+        async def contended():
+            # Another process holds the budget's write lock; the loop must keep running meanwhile
+            other = sqlite3.connect(db_path, isolation_level=None, check_same_thread=False)
+            other.execute("BEGIN IMMEDIATE")
+            threading.Timer(0.5, lambda: other.execute("COMMIT")).start()
+            ticks = 0
+            acquire = asyncio.create_task(shared.acquire(100))
+            while not acquire.done():
+                ticks += 1
+                await asyncio.sleep(0.01)
+            return ticks
+        
+        ticks = asyncio.run(contended())
+        assert ticks > 10, f"Event loop blocked on the SQLite budget ({ticks} ticks)"
+        
+        print(f"✅ Rate limiter order: {order}")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Rate limiter error: {e}")
+        return False
+
+def test_resilience():
+    """Test retries, deadlines and hedging against the fault-injecting stand-in."""
+    print("\n🛡️ Testing resilience layer...")
+    
+    try:
+        from fake_services import FaultInjector
+        from tools.resilience import RetryPolicy, run_with_resilience, get_resilience_stats
+        
+        async def exercise():
+            retry_policy = RetryPolicy(max_attempts=3, initial_backoff_seconds=0.01)
+            flaky = FaultInjector(fail_calls=[1, 2])
+            retried = await run_with_resilience(lambda: flaky.call("rows"), retry_policy, "test_retry")
+            
+            hedge_policy = RetryPolicy(hedging_enabled=True, min_hedge_delay_seconds=0.05)
+            slow_tail = FaultInjector(slow_calls=[21], slow_latency_seconds=5.0)
+            for _ in range(20):
+                await run_with_resilience(lambda: slow_tail.call("rows"), hedge_policy, "test_hedge")
+            hedged = await asyncio.wait_for(
+                run_with_resilience(lambda: slow_tail.call("rows"), hedge_policy, "test_hedge"), timeout=1.0
+            )
+            await asyncio.sleep(0)
+            
+            deadline_policy = RetryPolicy(max_attempts=2, attempt_timeout_seconds=0.05, initial_backoff_seconds=0.01)
+            stalled = FaultInjector(slow_calls=[1, 2], slow_latency_seconds=5.0)
+            try:
+                await run_with_resilience(lambda: stalled.call("rows"), deadline_policy, "test_deadline")
+                timed_out = False
+            except asyncio.TimeoutError:
+                timed_out = True
+            return retried, hedged, timed_out, slow_tail.cancelled_count
+        
+        retried, hedged, timed_out, cancelled = asyncio.run(exercise())
+
+        # Model retries draw on the rate budget like first attempts
+        from types import SimpleNamespace
+        from google.adk.models.llm_request import LlmRequest
+        from google.adk.models.llm_response import LlmResponse
+        from google.genai import types
+        from fake_services import FakeGeminiLlm
+        from tools.rate_limiter import GeminiRateLimiter, RateBudget
+        from tools.resilience import ResilientLlm
+
+        limiter = GeminiRateLimiter(RateBudget(requests_per_minute=1200, tokens_per_minute=0))
+        flaky_llm = FakeGeminiLlm(fault_injector=FaultInjector(fail_calls=[1, 2]))
+        model = ResilientLlm(model="fake-gemini", inner=flaky_llm, limiter=limiter,
+                             policy=RetryPolicy(max_attempts=3, initial_backoff_seconds=0.01))
+        request = LlmRequest(contents=[types.Content(role="user", parts=[types.Part(text="hello")])])
+
+        async def generate():
+            return [response async for response in model.generate_content_async(request)]
+
+        assert asyncio.run(generate()), "Model call not retried"
+        assert limiter.get_metrics()["interactive"]["granted"] == 3, "Each model attempt should acquire rate budget"
+
+        # The usage estimate is reconciled on the final response of a stream, not its first chunk
+        callback_context = SimpleNamespace(invocation_id="inv", agent_name="agent")
+        limiter._pending[("inv", "agent")] = 10
+        asyncio.run(limiter.after_model_callback(callback_context, LlmResponse(partial=True)))
+        assert ("inv", "agent") in limiter._pending, "Partial chunk should not consume the estimate"
+        asyncio.run(limiter.after_model_callback(callback_context, LlmResponse()))
+        assert ("inv", "agent") not in limiter._pending, "Final response should consume the estimate"
+
+        # A cancelled query attempt cancels its job, even while the job is still being submitted
+        from fake_services import FakeBigQueryClient
+        from tools.bigquery_tools import register_bigquery_client, run_bigquery_query
+
+        async def cancel_query(client, project):
+            register_bigquery_client(project, client)
+            try:
+                await asyncio.wait_for(run_bigquery_query(project, "SELECT 1"), timeout=0.05)
+            except asyncio.TimeoutError:
+                pass
+            await asyncio.sleep(0.5)
+            return [job.cancelled for job in client.jobs.values()]
+
+        submitting = FakeBigQueryClient(num_conversations=10, submit_latency_seconds=0.2)
+        running = FakeBigQueryClient(num_conversations=10, latency_seconds=0.2)
+        assert asyncio.run(cancel_query(submitting, "submitting-project")) == [True], "Job submitted after cancellation kept running"
+        assert asyncio.run(cancel_query(running, "running-project")) == [True], "Running job not cancelled"
+        stats = get_resilience_stats()
+        assert retried == "rows" and stats["test_retry"]["retries"] == 2, "Transient errors were not retried"
+        assert hedged == "rows" and stats["test_hedge"]["hedge_wins"] == 1, "Slow call was not hedged"
+        assert cancelled == 1, "Losing hedge was not cancelled"
+        assert timed_out, "Per-attempt deadline not enforced"
+        
+        print("✅ Resilience layer retries, hedges and enforces deadlines")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Resilience layer error: {e}")
+        return False
+
+def test_cpu_task_pool():
+    """Test that CPU tasks run in worker processes through shared memory."""
+    print("\n🧮 Testing CPU task pool...")
+    
+    try:
+        import hashlib
+        import zlib
+        from tools.process_pool import CpuTaskPool
+        from tools.cpu_tasks import compress_state_payload, inflate_state_payload
+        
+        payload = "Convo_ID: conv_001, conversation_script: where is my refund\n" * 2000
+        
+        async def run_tasks():
+            pool = CpuTaskPool(max_workers=1, max_tasks_per_child=1, shared_memory_threshold_bytes=1024)
+            try:
+                digest, compressed = await pool.run(compress_state_payload, [payload])
+                restored = await pool.run(inflate_state_payload, [compressed], "text")
+                return digest, compressed, restored, pool.get_metrics()
+            finally:
+                pool.shutdown()
+        
+        digest, compressed, restored, metrics = asyncio.run(run_tasks())
+        assert digest == hashlib.sha256(payload.encode("utf-8")).hexdigest(), "Digest mismatch"
+        assert zlib.decompress(compressed).decode("utf-8") == payload and restored == payload, "Round trip failed"
+        assert metrics["tasks"]["compress_state_payload"]["shared_bytes"] == len(payload), "Column not passed through shared memory"
+        assert metrics["tasks"]["compress_state_payload"]["cpu_seconds"] > 0, "CPU time not recorded"
+        assert metrics["recycled_generations"] == 1, "Workers not recycled"
+        
+        print(f"✅ CPU task pool ran {sum(m['tasks'] for m in metrics['tasks'].values())} tasks in worker processes")
+        return True
+        
+    except Exception as e:
+        print(f"❌ CPU task pool error: {e}")
+        return False
+
+def test_batch_runner():
+    """Test that the batch runner writes one CSV per job and parses a shared bot once."""
+    print("\n📦 Testing batch runner...")
+    
+    from agent import root_agent
+    sub_agent_names = ["conversation_data_retrieval_agent", "no_match_analysis_agent", "dialogflow_cx_parser_agent", "csv_generation_agent"]
+    original_models = {name: getattr(root_agent, name).model for name in sub_agent_names}
+    
+    try:
+        import json
+        import tempfile
+        from google.adk.artifacts import InMemoryArtifactService
+        from google.adk.runners import Runner
+        from google.adk.sessions import InMemorySessionService
+        from fake_services import FakeGeminiLlm, use_fake_model
+        from batch_runner import BatchRunner, load_manifest
+        
+        fake_llm = use_fake_model(root_agent, FakeGeminiLlm(
+            calls=[], responses={"csv_generation_agent": "```csv\nintent,training_phrase\nbilling,where is my bill\n```"}
+        ))
+        
+        manifest_dir = tempfile.mkdtemp()
+        with open(os.path.join(manifest_dir, "bot.json"), "w") as f:
+            json.dump({"displayName": "support_bot", "flows": []}, f)
+        with open(os.path.join(manifest_dir, "jobs.json"), "w") as f:
+            json.dump({"jobs": [
+                {"job_id": f"job_{i}", "project": "test-project", "dataset": f"dataset_{i}",
+                 "bot_export": "bot.json", "start_date": "2024-01-01", "end_date": "2024-01-07"}
+                for i in range(2)
+            ]}, f)
+        
+        runner = Runner(
+            app_name="test_app", agent=root_agent,
+            session_service=InMemorySessionService(), artifact_service=InMemoryArtifactService()
+        )
+        
+        async def run_batch():
+            summary = await BatchRunner(runner, max_workers=2).run(load_manifest(os.path.join(manifest_dir, "jobs.json")))
+            job = summary["jobs"][0]
+            artifact = await runner.artifact_service.load_artifact(
+                app_name="test_app", user_id="batch-job_0", session_id=job["session_id"], filename=job["artifact"]["filename"]
+            )
+            return summary, artifact
+        
+        summary, artifact = asyncio.run(run_batch())
+        assert summary["succeeded"] == 2, f"Jobs did not succeed: {summary['jobs']}"
+        assert fake_llm.calls.count("dialogflow_cx_parser_agent") == 1, "Shared bot export should be parsed once"
+        assert artifact.inline_data.data == b"intent,training_phrase\nbilling,where is my bill\n", "CSV artifact content mismatch"
+        
+        print(f"✅ Batch runner completed {summary['total_jobs']} jobs in {summary['wall_seconds']}s")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Batch runner error: {e}")
+        return False
+    
+    finally:
+        for name, model in original_models.items():
+            getattr(root_agent, name).model = model
+
+def test_delta_csv_export():
+    """Test that delta CSV exports skip phrases exported before and record their lineage."""
+    print("\n🧾 Testing delta CSV export...")
+
+    try:
+        import tempfile
+        from google.adk.artifacts import InMemoryArtifactService
+        from artifact_utils import get_artifact_lineage, save_delta_csv_artifact
+        from tools.exported_phrases import BloomFilter, ExportedPhraseRegistry, phrase_digest
+
+        bloom = BloomFilter(1000, 0.01)
+        for i in range(1000):
+            bloom.add(phrase_digest("intent", f"phrase {i}"))
+        assert all(phrase_digest("intent", f"phrase {i}") in bloom for i in range(1000)), "Bloom filter lost a key"
+        false_positives = sum(phrase_digest("intent", f"other {i}") in bloom for i in range(10000))
+        assert false_positives < 300, f"Bloom filter false positive rate too high: {false_positives / 10000:.2%}"
+
+        registry = ExportedPhraseRegistry(os.path.join(tempfile.mkdtemp(), "exported_phrases.db"))
+        artifact_service = InMemoryArtifactService()
+        header = "Intent Name,Training Phrase,Priority\n"
+        first_csv = header + "Billing,Where is my bill?,High\nBilling,I was charged twice,High\n"
+        second_csv = header + "Billing,where is my  bill?,High\nRefunds,Where is my refund,Medium\nRefunds,Where is my refund,Medium\n"
+
+        async def export(csv_content, filename):
+            return await save_delta_csv_artifact(
+                artifact_service, app_name="test_app", user_id="test_user", session_id="session-1",
+                csv_content=csv_content, bot_id="support_bot", filename=filename, registry=registry,
+            )
+
+        async def run_exports():
+            first = await export(first_csv, "phrases_1.csv")
+            second = await export(second_csv, "phrases_2.csv")
+            repeat = await export(first_csv, "phrases_3.csv")
+            artifact = await artifact_service.load_artifact(
+                app_name="test_app", user_id="test_user", session_id="session-1", filename="phrases_2.csv"
+            )
+            lineage = await get_artifact_lineage(artifact_service, "test_app", "test_user", "session-1", "phrases_2.csv")
+            return first, second, repeat, artifact, lineage
+
+        first, second, repeat, artifact, lineage = asyncio.run(run_exports())
+        assert first["status"] == "success" and first["lineage"]["base_filename"] is None, "First export should have no base"
+        assert artifact.inline_data.data.decode() == header.replace("\n", "\r\n") + "Refunds,Where is my refund,Medium\r\n", \
+            "Delta should only hold the new phrase"
+        assert lineage["base_filename"] == "phrases_1.csv" and lineage["base_version"] == first["version"], f"Lineage not recorded: {lineage}"
+        assert second["lineage"]["skipped_rows"] == 2, "Exported and repeated phrases should be skipped"
+        assert repeat["status"] == "unchanged", "Export without new phrases should save nothing"
+        assert registry.metrics["filter_negatives"] > 0, "Bloom filter should answer new phrases without a lookup"
+
+        # Other header spellings resolve to the same columns; rows without a phrase are skipped, not deduplicated
+        snake_csv = "intent_name,training_phrase\n" + "".join(f"Orders,order question {i}\n" for i in range(5)) + "Orders,\n,\n"
+        snake = asyncio.run(export(snake_csv, "phrases_4.csv"))
+        assert snake["lineage"]["new_rows"] == 5 and snake["lineage"]["skipped_rows"] == 2, f"Rows lost: {snake['lineage']}"
+
+        # Concurrent exports of the same bot, from two processes sharing the database, never both get a phrase
+        other_registry = ExportedPhraseRegistry(registry.db_path)
+        shipping_csv = "Intent Name,Training Phrase\n" + "".join(f"Shipping,shipping question {i}\n" for i in range(200))
+
+        async def concurrent_exports():
+            return await asyncio.gather(*(
+                save_delta_csv_artifact(
+                    artifact_service, app_name="test_app", user_id="test_user", session_id=f"session-{index}",
+                    csv_content=shipping_csv, bot_id="support_bot", filename=f"shipping_{index}.csv", registry=job_registry,
+                )
+                for index, job_registry in enumerate((registry, other_registry, registry, other_registry))
+            ))
+
+        concurrent = asyncio.run(concurrent_exports())
+        assert sum(result["lineage"]["new_rows"] for result in concurrent) == 200, \
+            f"Phrases exported twice: {[result['lineage']['new_rows'] for result in concurrent]}"
+
+        class FailingArtifactService:
+            async def save_artifact(self, **kwargs):
+                raise RuntimeError("artifact store unavailable")
+
+        failed = asyncio.run(save_delta_csv_artifact(
+            FailingArtifactService(), app_name="test_app", user_id="test_user", session_id="session-1",
+            csv_content="Intent Name,Training Phrase\nReturns,return label\n", bot_id="support_bot",
+            filename="returns.csv", registry=registry,
+        ))
+        assert failed["status"] == "error" and registry.split_new(
+            "support_bot", [{"Intent Name": "Returns", "Training Phrase": "return label"}]
+        )[0], "A failed export should release its phrases"
+
+        print(f"✅ Delta export skipped {second['lineage']['skipped_rows']} known rows; lineage {lineage['base_filename']} v{lineage['base_version']}")
+        return True
+
+    except Exception as e:
+        print(f"❌ Delta CSV export error: {e}")
+        return False
+
+def test_intent_bundle():
+    """Test that the CX intent import bundle merges new phrases into the bot's intents."""
+    print("\n🗜️ Testing intent bundle...")
+
+    try:
+        import io
+        import json
+        import zipfile
+        from google.adk.artifacts import InMemoryArtifactService
+        from artifact_utils import save_intent_bundle_artifact
+
+        bot_json = json.dumps({"intents": [{
+            "name": "projects/p/locations/global/agents/a/intents/1",
+            "displayName": "Billing",
+            "trainingPhrases": [{"parts": [{"text": "Where is my "}, {"text": "bill"}], "repeatCount": 1}],
+        }]})
+        csv_content = "Intent Name,Training Phrase,Language Code\n" + "".join(
+            f"Billing,{phrase},en\n" for phrase in ("where is my bill", "I was charged twice")
+        ) + "".join(f"Refunds/Returns,refund request {i},en\n" for i in range(5000))
+        artifact_service = InMemoryArtifactService()
+
+        async def save():
+            saved = await save_intent_bundle_artifact(
+                artifact_service, app_name="test_app", user_id="test_user", session_id="session-1",
+                csv_content=csv_content, bot_json=bot_json, filename="bundle.zip",
+            )
+            artifact = await artifact_service.load_artifact(
+                app_name="test_app", user_id="test_user", session_id="session-1", filename="bundle.zip"
+            )
+            return saved, artifact
+
+        saved, artifact = asyncio.run(save())
+
+        assert saved["status"] == "success", f"Bundle not saved: {saved}"
+        assert (saved["merged_intents"], saved["new_intents"]) == (1, 1), "Billing should merge, Refunds should be new"
+        assert (saved["phrases_added"], saved["phrases_skipped"]) == (5001, 1), "Known phrase should be skipped"
+
+        with zipfile.ZipFile(io.BytesIO(artifact.inline_data.data)) as bundle:
+            assert sorted(bundle.namelist()) == ["intents/Billing.json", "intents/Refunds_Returns.json"], bundle.namelist()
+            billing = json.loads(bundle.read("intents/Billing.json"))
+            refunds = json.loads(bundle.read("intents/Refunds_Returns.json"))
+        assert billing["name"].endswith("/intents/1"), "Existing intent should keep its resource name"
+        assert [p["parts"][0]["text"] for p in billing["trainingPhrases"]] == ["Where is my ", "I was charged twice"], \
+            "New phrase should be appended to the existing ones"
+        assert refunds["displayName"] == "Refunds/Returns" and refunds["trainingPhrases"][0]["languageCode"] == "en"
+        from tools.process_pool import cpu_task_pool
+        assert cpu_task_pool.get_metrics()["tasks"]["build_intent_bundle"]["tasks"], "Bundle should be built in the CPU task pool"
+
+        from artifact_utils import write_intent_bundle
+        listed = write_intent_bundle(io.BytesIO(), "Intent Name,Training Phrase\nBilling,my bill\n", "[]")
+        assert (listed["merged_intents"], listed["new_intents"]) == (0, 1), "A non-object bot export has no intents"
+
+        import artifact_utils
+        limit = artifact_utils.INTENT_BUNDLE_MAX_BYTES
+        artifact_utils.INTENT_BUNDLE_MAX_BYTES = 100
+        try:
+            too_large = asyncio.run(save_intent_bundle_artifact(
+                artifact_service, app_name="test_app", user_id="test_user", session_id="session-1",
+                csv_content=csv_content, bot_json=bot_json, filename="too_large.zip",
+            ))
+        finally:
+            artifact_utils.INTENT_BUNDLE_MAX_BYTES = limit
+        assert too_large["status"] == "error" and "INTENT_BUNDLE_MAX_BYTES" in too_large["error"], too_large
+
+        print(f"✅ Intent bundle of {saved['intents']} intents, {saved['size']} bytes")
+        return True
+
+    except Exception as e:
+        print(f"❌ Intent bundle error: {e}")
+        return False
+
+def test_context_cache():
+    """Test that a large stable instruction is cached once and reused across sessions."""
+    print("\n🧷 Testing context cache...")
+
+    try:
+        from types import SimpleNamespace
+        from google.genai import types
+        from google.adk.models.llm_request import LlmRequest
+        from fake_services import FakeContextCacheBackend, FakeGeminiLlm
+        from tools.context_cache import ContextCache
+
+        instruction = 'Your internal name is "dialogflow_cx_parser_agent".\nBot export: ' + "{\"intents\": []} " * 2000
+
+        def build_request(system_instruction=instruction):
+            return LlmRequest(
+                model="gemini-2.5-flash",
+                contents=[types.Content(role="user", parts=[types.Part(text="Analyze the bot structure.")])],
+                config=types.GenerateContentConfig(system_instruction=system_instruction),
+            )
+
+        backend = FakeContextCacheBackend()
+        cache = ContextCache(backend, enabled=True, ttl_seconds=3600, min_tokens=1000)
+        model = FakeGeminiLlm(responses={"dialogflow_cx_parser_agent": "## Dialogflow CX Bot Structure Analysis"},
+                              context_cache_backend=backend, latency_seconds=0.01)
+
+        async def session(index):
+            callback_context = SimpleNamespace(agent_name="dialogflow_cx_parser_agent", invocation_id=f"inv-{index}")
+            llm_request = build_request()
+            await cache.before_model_callback(callback_context, llm_request)
+            responses = [response async for response in model.generate_content_async(llm_request)]
+            await cache.after_model_callback(callback_context, responses[-1])
+            return llm_request, responses[-1]
+
+        async def run_sessions():
+            return await asyncio.gather(*(session(index) for index in range(6)))
+
+        results = asyncio.run(run_sessions())
+        llm_request, response = results[0]
+        assert backend.created == ["cachedContents/fake-1"], f"Prefix should be cached once: {backend.created}"
+        assert llm_request.config.cached_content and llm_request.config.system_instruction is None, "Request should reference the cache"
+        assert response.content.parts[0].text.startswith("## Dialogflow"), "Cached instruction should reach the model"
+        assert response.usage_metadata.cached_content_token_count > 1000, "Cached tokens should be reported"
+        assert (cache.stats["misses"], cache.stats["hits"]) == (1, 5), f"Unexpected hit rate: {cache.stats}"
+        assert cache.handles()[0]["refcount"] == 0, "References should be released after each call"
+
+        small_request = build_request('Your internal name is "dialogflow_cx_parser_agent".')
+        callback_context = SimpleNamespace(agent_name="dialogflow_cx_parser_agent", invocation_id="inv-small")
+        asyncio.run(cache.before_model_callback(callback_context, small_request))
+        assert small_request.config.cached_content is None, "Small instructions should not be cached"
+
+        # With a TTL inside the expiry margin every acquire creates a new context
+        expiring = ContextCache(FakeContextCacheBackend(), enabled=True, ttl_seconds=0, min_tokens=1000)
+
+        async def expire():
+            first = await expiring.acquire("gemini-2.5-flash", instruction)
+            second = await expiring.acquire("gemini-2.5-flash", instruction)
+            held = list(expiring.backend.deleted)
+            await expiring.release(first)
+            released = list(expiring.backend.deleted)
+            await expiring.release(second)
+            await expiring.close()
+            return first, second, held, released
+
+        first, second, held, released = asyncio.run(expire())
+        assert first.name != second.name and held == [], "Expired context should stay while a request holds it"
+        assert released == [first.name], "Expired context should be deleted once released"
+        assert expiring.backend.deleted == [first.name, second.name], "close() should delete idle contexts"
+
+        saved = cache.stats["tokens_reused"]
+        print(f"✅ Context cache: {cache.stats['hits']} hits, {cache.stats['misses']} miss, {saved} prompt tokens not re-sent")
+        return True
+
+    except Exception as e:
+        print(f"❌ Context cache error: {e}")
+        return False
+
+def test_model_tiering():
+    """Test that calls are routed by step and input size and fall back on invalid responses."""
+    print("\n🪜 Testing model tiering...")
+
+    try:
+        from google.genai import types
+        from google.adk.models.llm_request import LlmRequest
+        from fake_services import FakeGeminiLlm
+        from tools.model_tiering import ModelRouter, ModelTier, TieredLlm
+
+        tiers = [
+            ModelTier("lite", "gemini-2.5-flash-lite", max_input_tokens=1000, input_cost_per_million=0.1, output_cost_per_million=0.4),
+            ModelTier("flash", "gemini-2.5-flash", max_input_tokens=100000, input_cost_per_million=0.3, output_cost_per_million=2.5),
+            ModelTier("pro", "gemini-2.5-pro", input_cost_per_million=1.25, output_cost_per_million=10.0),
+        ]
+        router = ModelRouter(tiers, enabled=True, step_tiers={
+            "conversation_data_retrieval_agent": "lite", "csv_generation_agent": "lite",
+        })
+
+        def csv_response(llm_request):
+            # The cheapest tier forgets the header row
+            if llm_request.model == "gemini-2.5-flash-lite":
+                return "billing,where is my bill"
+            return "```csv\nIntent Name,Training Phrase\nbilling,where is my bill\n```"
+
+        fake_llm = FakeGeminiLlm(calls=[], responses={"csv_generation_agent": csv_response})
+
+        def build_request(agent_name, text):
+            return LlmRequest(
+                model="gemini-2.5-flash",
+                contents=[types.Content(role="user", parts=[types.Part(text=text)])],
+                config=types.GenerateContentConfig(system_instruction=f'Your internal name is "{agent_name}".'),
+            )
+
+        async def call(agent_name, text):
+            model = TieredLlm(model="gemini-2.5-flash", step=agent_name, inner=fake_llm, router=router)
+            llm_request = build_request(agent_name, text)
+            responses = [response async for response in model.generate_content_async(llm_request)]
+            return llm_request.model, responses[-1]
+
+        small_model, _ = asyncio.run(call("conversation_data_retrieval_agent", "Fill in the dates."))
+        large_model, _ = asyncio.run(call("conversation_data_retrieval_agent", "conversation turn " * 2000))
+        assert small_model == "gemini-2.5-flash-lite", f"Small retrieval call should stay on lite: {small_model}"
+        assert large_model == "gemini-2.5-flash", f"Large input should move up a tier: {large_model}"
+
+        csv_model, response = asyncio.run(call("csv_generation_agent", "Generate the CSV."))
+        assert csv_model == "gemini-2.5-flash", f"Invalid CSV should fall back to flash: {csv_model}"
+        assert "Intent Name" in response.content.parts[0].text, "Only the validated response should be returned"
+
+        report = router.report()
+        assert report["tiers"]["lite"]["validation_failures"] == 1 and report["tiers"]["lite"]["fallbacks"] == 1, report
+        assert report["routes"]["csv_generation_agent"] == {"lite:step": 1, "flash:fallback": 1}, report["routes"]
+        assert report["tiers"]["flash"]["cost_usd"] > 0 and report["tiers"]["lite"]["p50_seconds"] is not None, report
+
+        # Once flash misses the analysis step's latency target, the cheaper tier is used
+        router.step_latency_slos["no_match_analysis_agent"] = 0.5
+        router.step_tiers["no_match_analysis_agent"] = "flash"
+        for _ in range(5):
+            router.record("no_match_analysis_agent", tiers[1], tiers[1].model, "step", 2.0, [], 100)
+        slo_tier, reason = router.route("no_match_analysis_agent", 100, "gemini-2.5-flash")
+        assert (tiers[slo_tier].name, reason) == ("lite", "latency_slo"), f"Slow tier should give way: {tiers[slo_tier].name}"
+
+        disabled = ModelRouter(tiers, enabled=False)
+        assert disabled.route("csv_generation_agent", 10, "gemini-2.5-flash") == (1, "disabled"), "Disabled router should keep the agent's model"
+
+        print(f"✅ Model tiering: {report['routes']}")
+        return True
+
+    except Exception as e:
+        print(f"❌ Model tiering error: {e}")
+        return False
+
+def test_event_stream():
+    """Test that streamed chunks are coalesced, thinned for slow consumers and finals always delivered."""
+    print("\n🌊 Testing event stream...")
+
+    try:
+        from google.genai import types
+        from google.adk.events import Event, EventActions
+        from tools.event_stream import EventStream
+
+        def chunk(text):
+            return Event(author="no_match_analysis_agent", partial=True,
+                         content=types.Content(role="model", parts=[types.Part(text=text)]))
+
+        async def sub_agent(chunks, delay, delivered):
+            for index in range(chunks):
+                yield chunk(f"{index},")
+                await asyncio.sleep(delay)
+            yield Event(author="no_match_analysis_agent", content=types.Content(role="model", parts=[types.Part(text="full")]),
+                        actions=EventActions(state_delta={"no_match_analysis_output": "full"}))
+            # Only reached once the consumer has processed the final event
+            delivered.append("after_final")
+            yield Event(author="no_match_analysis_agent", actions=EventActions(state_delta={"done": True}))
+
+        async def consume(stream, chunks, delay, consumer_delay):
+            delivered = []
+            async for event in stream.relay(sub_agent(chunks, delay, delivered)):
+                delivered.append(event)
+                await asyncio.sleep(consumer_delay)
+            return delivered
+
+        # Fast consumer: 200 chunks in quick succession arrive as a few merged events
+        stream = EventStream(coalesce_seconds=0.05, coalesce_chars=4096, max_buffered_events=32)
+        delivered = asyncio.run(consume(stream, 200, 0.0005, 0))
+        partials = [event for event in delivered if isinstance(event, Event) and event.partial]
+        assert len(partials) < 40, f"Chunks should be coalesced: {len(partials)} partial events"
+        assert "".join(event.content.parts[0].text for event in partials) in "".join(f"{index}," for index in range(200)), "Merged text out of order"
+        finals = [event for event in delivered if isinstance(event, Event) and not event.partial]
+        assert [event.actions.state_delta for event in finals] == [{"no_match_analysis_output": "full"}, {"done": True}], "Finals should all be delivered"
+        assert delivered.index("after_final") == delivered.index(finals[0]) + 1, "Sub-agent should wait for the final event to be processed"
+
+        # Slow consumer: partial events are bounded and dropped, finals still arrive
+        slow = EventStream(coalesce_seconds=0, coalesce_chars=1, max_buffered_events=4)
+        delivered = asyncio.run(consume(slow, 100, 0.001, 0.02))
+        finals = [event for event in delivered if isinstance(event, Event) and not event.partial]
+        assert len(finals) == 2 and finals[0].content.parts[0].text == "full", "Final events must not be dropped"
+        assert slow.stats["dropped"] + slow.stats["superseded"] > 0, f"Slow consumer should shed partial events: {slow.stats}"
+        assert slow.stats["max_buffered"] <= 5, f"Buffer should stay bounded: {slow.stats}"
+
+        print(f"✅ Event stream: {stream.stats['events_in']} events in, {stream.stats['events_out']} out; slow consumer {slow.stats}")
+        return True
+
+    except Exception as e:
+        print(f"❌ Event stream error: {e}")
+        return False
+
+def test_offline_benchmark():
+    """Test that the offline benchmark runs the full workflow against fake Gemini and BigQuery."""
+    print("\n🏁 Testing offline benchmark...")
+
+    from agent import root_agent
+    sub_agent_names = ["conversation_data_retrieval_agent", "no_match_analysis_agent", "dialogflow_cx_parser_agent", "csv_generation_agent"]
+    original_models = {name: getattr(root_agent, name).model for name in sub_agent_names}
+
+    try:
+        import json
+        from benchmark import run_benchmark
+
+        report = asyncio.run(run_benchmark([10], warmup_runs=0))
+        result = report["results"][0]
+        assert result["bigquery_rows_scanned"] == 10, "Fake BigQuery should scan every synthetic conversation"
+        assert set(result["step_seconds"]) == {
+            "conversation_data_retrieval", "no_match_analysis", "dialogflow_cx_parser", "csv_generation"
+        }, f"Missing step timings: {result['step_seconds']}"
+        assert result["csv_generated"] and not result["degraded"], "Workflow should complete with a CSV"
+        assert result["peak_traced_memory_bytes"] > 0, "Peak memory should be recorded"
+        json.dumps(report)
+
+        print(f"✅ Offline benchmark ran in {result['total_seconds']:.3f}s ({result['events']} events)")
+        return True
+
+    except Exception as e:
+        print(f"❌ Offline benchmark error: {e}")
+        return False
+
+    finally:
+        for name, model in original_models.items():
+            getattr(root_agent, name).model = model
+
+def test_load_test():
+    """Test that the load generator runs concurrent sessions and reports latency, lag and memory."""
+    print("\n📈 Testing concurrent-session load generator...")
+
+    from agent import root_agent
+    sub_agent_names = ["conversation_data_retrieval_agent", "no_match_analysis_agent", "dialogflow_cx_parser_agent", "csv_generation_agent"]
+    original_models = {name: getattr(root_agent, name).model for name in sub_agent_names}
+
+    try:
+        from load_test import run_load_test
+
+        report = asyncio.run(run_load_test([0], sessions=3, scale=10, latency_seconds=0.01))
+        level = report["levels"][0]
+        assert level["completed"] == 3 and level["failed"] == 0, f"Sessions failed: {level['errors']}"
+        assert level["step_latency_seconds"]["csv_generation"]["count"] == 3, "Step latencies not recorded"
+        assert level["latency_seconds"]["p99"] is not None, "Latency percentiles missing"
+        assert level["event_loop_lag_seconds"]["count"] > 0, "Event loop lag not sampled"
+        assert level["memory"]["traced_growth_bytes_per_session"] is not None, "Memory growth not measured"
+
+        print(f"✅ Load test ran {level['completed']} concurrent sessions, p95 {level['latency_seconds']['p95']:.3f}s")
+        return True
+
+    except Exception as e:
+        print(f"❌ Load test error: {e}")
+        return False
+
+    finally:
+        for name, model in original_models.items():
+            getattr(root_agent, name).model = model
+
+def test_sampling_preview():
+    """Test that preview mode reports sampled no-match estimates with confidence intervals."""
+    print("\n🔎 Testing sampled preview mode...")
+
+    from agent import root_agent
+    sub_agent_names = ["conversation_data_retrieval_agent", "no_match_analysis_agent", "dialogflow_cx_parser_agent", "csv_generation_agent"]
+    original_models = {name: getattr(root_agent, name).model for name in sub_agent_names}
+
+    try:
+        from google.adk.artifacts import InMemoryArtifactService
+        from google.adk.runners import Runner
+        from google.adk.sessions import InMemorySessionService
+        from benchmark import FAKE_PROJECT, build_fake_model, initial_state, run_workflow
+        from fake_services import FakeBigQueryClient, use_fake_bigquery, use_fake_model
+        from tools.sampling_preview import PREVIEW_ESTIMATES_STATE_KEY, run_sampled_preview, wilson_interval
+
+        from datetime import date
+        from tools.sampling_preview import preview_date_range
+        today = date(2026, 10, 19)
+        assert preview_date_range({}, "no-matches last quarter", today) == ("2026-07-01", "2026-09-30"), "Last quarter not resolved"
+        assert preview_date_range({}, "the last 30 days", today) == ("2026-09-20", "2026-10-19"), "Trailing range not resolved"
+        assert preview_date_range({}, "no-matches since March", today) is None, "Unresolved ranges should skip the preview"
+        assert preview_date_range({}, "why do users hit no-matches?", today) == ("2026-10-13", "2026-10-19"), "Default range changed"
+
+        low, high = wilson_interval(0, 50)
+        assert low == 0.0 and 0 < high < 0.1, "Wilson interval should stay informative at zero successes"
+
+        fake_bigquery = use_fake_bigquery(FakeBigQueryClient(num_conversations=20000, project=FAKE_PROJECT, days=7))
+        end_date = fake_bigquery.end_date.isoformat()
+        start_date = fake_bigquery.conversation_date(6).isoformat()
+        exact = asyncio.run(run_sampled_preview(FAKE_PROJECT, "fake_dataset", start_date, end_date, 100))
+        sampled = asyncio.run(run_sampled_preview(FAKE_PROJECT, "fake_dataset", start_date, end_date, 5))
+        assert 0 < sampled["sampled_conversations"] < exact["sampled_conversations"], "Conversations should be sampled"
+        for rate in ("turn_no_match_rate", "conversation_no_match_rate"):
+            truth = exact[rate]["estimate"]
+            assert sampled[rate]["ci_low"] <= truth <= sampled[rate]["ci_high"], f"{rate} interval misses {truth:.3f}"
+        assert sampled["patterns"], "No-match patterns not estimated"
+
+        fake_llm = use_fake_model(root_agent, build_fake_model())
+        runner = Runner(app_name="preview_test", agent=root_agent,
+                        session_service=InMemorySessionService(), artifact_service=InMemoryArtifactService())
+        state = {**initial_state(), "preview_mode": True, "preview_refine": False, "preview_sample_percent": 5}
+        run = asyncio.run(run_workflow(runner, "preview_user", state))
+        session = asyncio.run(runner.session_service.get_session(app_name="preview_test", user_id="preview_user", session_id=run["session_id"]))
+        estimates = session.state.get(PREVIEW_ESTIMATES_STATE_KEY)
+        assert estimates and estimates["sampled_conversations"] > 0, "Preview estimates not stored in state"
+        assert not fake_llm.calls and not session.state.get("csv_generation_output"), "Preview-only run should skip the workflow"
+
+        print(f"✅ Preview estimated a {sampled['turn_no_match_rate']['estimate']:.1%} turn no-match rate "
+              f"from {sampled['sampled_conversations']} conversations (exact {exact['turn_no_match_rate']['estimate']:.1%})")
+        return True
+
+    except Exception as e:
+        print(f"❌ Sampled preview error: {e}")
+        return False
+
+    finally:
+        for name, model in original_models.items():
+            getattr(root_agent, name).model = model
+
+def test_no_match_rollup():
+    """Test that the daily no-match rollup is built incrementally and answers like the raw export."""
+    print("\n🗂️ Testing daily no-match rollup...")
+
+    try:
+        from datetime import date, timedelta
+        from fake_services import FakeBigQueryClient, use_fake_bigquery
+        from tools import no_match_rollup
+        from tools.bigquery_tools import bigquery_execution_tool
+        from tools.no_match_rollup import build_rollup_read_query, no_match_rollup_tool, refresh_rollup
+
+        fake_bigquery = use_fake_bigquery(FakeBigQueryClient(num_conversations=2000, project="rollup-project", days=14))
+        today = date.today()
+        start_date = (today - timedelta(days=13)).isoformat()
+
+        disabled = asyncio.run(no_match_rollup_tool("rollup-project", "rollup_dataset", start_date, today.isoformat(), "week"))
+        assert disabled["source"] == "raw" and not fake_bigquery.rollup, "Disabled rollup should not write to the dataset"
+        invalid = asyncio.run(no_match_rollup_tool("rollup-project", "rollup_dataset", "last week", today.isoformat()))
+        assert invalid["rows"] == [] and "YYYY-MM-DD" in invalid["error"], "Non-ISO dates should be reported to the model"
+
+        async def run_rollup():
+            weekly = await no_match_rollup_tool("rollup-project", "rollup_dataset", start_date, today.isoformat(), "week")
+            merges = sum(query.lstrip().startswith("MERGE") for query in fake_bigquery.queries)
+            scanned = fake_bigquery.rows_scanned
+            by_utterance = await no_match_rollup_tool("rollup-project", "rollup_dataset", start_date, (today - timedelta(days=1)).isoformat())
+            raw_weekly = await bigquery_execution_tool("rollup-project", build_rollup_read_query(
+                "rollup-project", "rollup_dataset", [], [(today - timedelta(days=13), today)], "week", 20
+            ))
+            refresh = await refresh_rollup("rollup-project", "rollup_dataset")
+            return weekly, by_utterance, raw_weekly, merges, fake_bigquery.rows_scanned - scanned, refresh
+
+        async def run_behind():
+            # Rolled up 3 days, then refreshed again after 17 days without refreshes
+            await refresh_rollup("rollup-project", "behind_dataset", through=today - timedelta(days=20))
+            await refresh_rollup("rollup-project", "behind_dataset")
+            by_day = await no_match_rollup_tool("rollup-project", "behind_dataset", start_date, (today - timedelta(days=1)).isoformat(), "day")
+            raw_by_day = await bigquery_execution_tool("rollup-project", build_rollup_read_query(
+                "rollup-project", "behind_dataset", [], [(today - timedelta(days=13), today - timedelta(days=1))], "day", 20
+            ))
+            return by_day, raw_by_day
+
+        backfill_days = no_match_rollup.NO_MATCH_ROLLUP_BACKFILL_DAYS
+        no_match_rollup.NO_MATCH_ROLLUP_ENABLED = True
+        try:
+            weekly, by_utterance, raw_weekly, merges, scanned, refresh = asyncio.run(run_rollup())
+            no_match_rollup.NO_MATCH_ROLLUP_BACKFILL_DAYS = 3
+            use_fake_bigquery(FakeBigQueryClient(num_conversations=2000, project="rollup-project", days=30))
+            by_day, raw_by_day = asyncio.run(run_behind())
+        finally:
+            no_match_rollup.NO_MATCH_ROLLUP_ENABLED = False
+            no_match_rollup.NO_MATCH_ROLLUP_BACKFILL_DAYS = backfill_days
+        assert weekly["source"] == "rollup+raw" and weekly["raw_days"] == [[today.isoformat(), today.isoformat()]], \
+            f"Only today should be read raw: {weekly['source']} {weekly['raw_days']}"
+        assert weekly["rows"] == raw_weekly, "Rollup answer differs from the raw export"
+        assert by_utterance["source"] == "rollup" and by_utterance["rows"], "Complete days should be answered from the rollup"
+        assert merges == 1 and refresh["added_from"] is None, "Rollup should only be extended with new days"
+        assert scanned == 2000, "Rollup-only question should not scan the export again"
+        assert by_day["raw_days"] == [[start_date, (today - timedelta(days=4)).isoformat()]], \
+            f"Days missed while the rollup was behind should be read raw: {by_day['raw_days']}"
+        assert by_day["rows"] == raw_by_day, "Rollup with a gap differs from the raw export"
+
+        print(f"✅ Rollup answered {len(by_utterance['rows'])} utterance rows without rescanning the export")
+        return True
+
+    except Exception as e:
+        print(f"❌ No-match rollup error: {e}")
+        return False
+
+def test_period_comparison():
+    """Test that comparison mode aligns utterance clusters across windows and passes only deltas to Step 2."""
+    print("\n📊 Testing period-over-period comparison...")
+
+    from agent import root_agent
+    sub_agent_names = ["conversation_data_retrieval_agent", "no_match_analysis_agent", "dialogflow_cx_parser_agent", "csv_generation_agent"]
+    original_models = {name: getattr(root_agent, name).model for name in sub_agent_names}
+
+    try:
+        from google.adk.artifacts import InMemoryArtifactService
+        from google.adk.runners import Runner
+        from google.adk.sessions import InMemorySessionService
+        from benchmark import FAKE_PROJECT, build_fake_model, initial_state, run_workflow
+        from fake_services import FakeBigQueryClient, use_fake_bigquery, use_fake_model
+        from tools.period_comparison import COMPARISON_OUTPUT_STATE_KEY, compare_clusters
+
+        comparison = compare_clusters(
+            [{"group_key": "Cancel my order!", "no_match_turns": 300}, {"group_key": "track order", "no_match_turns": 100}],
+            [{"turns": 10000, "no_match_turns": 400}],
+            [{"group_key": "please cancel order", "no_match_turns": 100}, {"group_key": "track order", "no_match_turns": 98}],
+            [{"turns": 10000, "no_match_turns": 198}],
+        )
+        clusters = {delta["cluster"]: delta for delta in comparison["clusters"]}
+        assert set(clusters) == {"cancel order", "order track"}, f"Clusters not aligned: {list(clusters)}"
+        assert clusters["cancel order"]["significant"] and clusters["cancel order"]["rate_change"] > 0, "Regression not flagged"
+        assert not clusters["order track"]["significant"], "Noise flagged as significant"
+
+        # Each window read only its top 2 utterances: a cluster below the baseline's top is unknown, not new
+        capped = compare_clusters(
+            [{"group_key": "refund status", "no_match_turns": 120}, {"group_key": "track order", "no_match_turns": 100}],
+            [{"turns": 10000, "no_match_turns": 400}],
+            [{"group_key": "cancel order", "no_match_turns": 300}, {"group_key": "track order", "no_match_turns": 98}],
+            [{"turns": 10000, "no_match_turns": 400}],
+            top=2,
+        )
+        capped_clusters = {delta["cluster"]: delta for delta in capped["clusters"]}
+        assert capped_clusters["refund status"]["status"] == "unknown" and not capped_clusters["refund status"]["significant"], \
+            "One-sided cluster should not be tested against 0"
+        assert capped_clusters["refund status"]["baseline_no_match_turns"] is None and capped["clusters_unknown"] == 2
+        assert capped_clusters["order track"]["status"] == "changed", "Clusters in both windows should still be compared"
+
+        use_fake_bigquery(FakeBigQueryClient(num_conversations=2000, project=FAKE_PROJECT, days=14))
+        fake_llm = use_fake_model(root_agent, build_fake_model())
+        runner = Runner(app_name="comparison_test", agent=root_agent,
+                        session_service=InMemorySessionService(), artifact_service=InMemoryArtifactService())
+        state = {**initial_state(), "DATASET": "comparison_dataset", "comparison_mode": True}
+        run = asyncio.run(run_workflow(runner, "comparison_user", state))
+        session = asyncio.run(runner.session_service.get_session(app_name="comparison_test", user_id="comparison_user", session_id=run["session_id"]))
+        assert session.state.get(COMPARISON_OUTPUT_STATE_KEY, {}).get("clusters"), "Comparison not stored in state"
+        assert session.state["conversation_data_output"].startswith("## 📊 No-Match Comparison"), "Step 2 should receive the deltas"
+        assert "conversation_data_retrieval_agent" not in fake_llm.calls, "Comparison should replace the retrieval step"
+        assert "no_match_analysis_agent" in fake_llm.calls, "Deltas not sent to the analysis step"
+        from tools.process_pool import cpu_task_pool
+        assert cpu_task_pool.get_metrics()["tasks"]["compare_utterance_clusters"]["tasks"], "Clustering should run in the CPU task pool"
+
+        print(f"✅ Comparison aligned {len(session.state[COMPARISON_OUTPUT_STATE_KEY]['clusters'])} clusters across two windows")
+        return True
+
+    except Exception as e:
+        print(f"❌ Period comparison error: {e}")
+        return False
+
+    finally:
+        for name, model in original_models.items():
+            getattr(root_agent, name).model = model
+
 def test_complete_agent_setup():
     """Test complete agent setup."""
     print("\n🤖 Testing complete agent setup...")
@@ -197,6 +1134,21 @@ def main():
         test_artifact_config,
         test_artifact_utils,
         test_runner_config,
+        test_local_session_service,
+        test_rate_limiter,
+        test_resilience,
+        test_cpu_task_pool,
+        test_batch_runner,
+        test_delta_csv_export,
+        test_intent_bundle,
+        test_context_cache,
+        test_model_tiering,
+        test_event_stream,
+        test_offline_benchmark,
+        test_load_test,
+        test_sampling_preview,
+        test_no_match_rollup,
+        test_period_comparison,
         test_complete_agent_setup,
         test_environment_setup,
         test_adk_artifact_compliance
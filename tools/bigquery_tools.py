@@ -1,5 +1,107 @@
-from google.cloud import bigquery
-from typing import List, Dict, Any
+import asyncio
+import functools
+import logging
+import os
+import threading
+import time
+import uuid
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Tuple, Union
+from tools.resilience import RetryPolicy, run_with_resilience, run_sync_with_retries
+from tools.top_k import TopK
+
+if TYPE_CHECKING:
+    from google.cloud import bigquery
+
+# Deadlines, retries and (opt-in) hedging for BigQuery calls, see BIGQUERY_* env vars
+BIGQUERY_RETRY_POLICY = RetryPolicy.from_env("BIGQUERY", attempt_timeout_seconds=300.0, total_timeout_seconds=900.0)
+
+# Dataset schemas change rarely; sessions and batch jobs on the same dataset share one lookup
+METADATA_CACHE_TTL_SECONDS = float(os.environ.get("BIGQUERY_METADATA_CACHE_TTL_SECONDS", "3600"))
+
+# Rows a query may return to the model (0 = no limit); larger results are marked as truncated
+BIGQUERY_MAX_RESULT_ROWS = int(os.environ.get("BIGQUERY_MAX_RESULT_ROWS", "0"))
+# Columns a truncated result is ranked by, first match wins (e.g. "no_match_count,no_match_turns");
+# without them a truncated result keeps the query's first rows, in the query's order
+RANKING_COLUMNS = tuple(
+    name.strip() for name in os.environ.get("BIGQUERY_RANKING_COLUMNS", "").split(",") if name.strip()
+)
+
+logger = logging.getLogger(__name__)
+
+_clients: Dict[str, "bigquery.Client"] = {}
+_metadata_cache: Dict[Tuple[str, str, str], Tuple[float, List[Dict[str, Any]]]] = {}
+_lock = threading.Lock()
+
+
+def get_bigquery_client(PROJECT: str) -> "bigquery.Client":
+    """
+    Get the process-wide BigQuery client for a project, creating it on first use.
+    Clients are thread-safe, so sessions and batch jobs share their connection pool.
+    """
+    client = _clients.get(PROJECT)
+    if client is None:
+        # Imported on first use: the BigQuery client stack is slow to import
+        from google.cloud import bigquery
+
+        # Created outside the lock: resolving credentials can take seconds
+        client = bigquery.Client(project=PROJECT)
+        with _lock:
+            client = _clients.setdefault(PROJECT, client)
+    return client
+
+
+def _collect_rows(query_job, timeout: Optional[float]) -> List[Dict[str, Any]]:
+    """
+    Wait for a query job and convert its rows to dictionaries.
+    """
+    return [dict(row.items()) for row in query_job.result(timeout=timeout)]
+
+
+def _collect_capped_rows(query_job, max_rows: int,
+                         ranking_columns: Tuple[str, ...] = ()) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Stream a query job's rows page by page, keeping at most `max_rows`.
+
+    The first rows are kept, in the query's order. With `ranking_columns`, the
+    rows with the highest value in the first of them the rows have are kept
+    instead, once the limit is passed.
+
+    Returns:
+        Tuple[List[Dict[str, Any]], int]: Kept rows and the total number of rows
+    """
+    kept: List[Dict[str, Any]] = []
+    ranking: Optional[TopK] = None
+    total = 0
+    for row in query_job.result():
+        total += 1
+        row = dict(row.items())
+        if ranking is not None:
+            ranking.push(row)
+        elif len(kept) < max_rows:
+            kept.append(row)
+        else:
+            column = next((name for name in ranking_columns if name in row), None)
+            if column is None:
+                continue
+            # Ties keep the query's own order
+            ranking = TopK(max_rows, key=lambda ranked, column=column: ranked[column] or 0)
+            ranking.extend(kept)
+            ranking.push(row)
+    if total > max_rows:
+        how = "highest-ranked" if ranking is not None else "first"
+        logger.warning(f"Query returned {total} rows; keeping the {how} {max_rows} (BIGQUERY_MAX_RESULT_ROWS)")
+    return (ranking.items() if ranking is not None else kept), total
+
+
+def register_bigquery_client(PROJECT: str, client: Any) -> None:
+    """
+    Use the given client for a project instead of creating one, e.g. a local fake.
+    """
+    with _lock:
+        _clients[PROJECT] = client
+    for cache_key in [key for key in _metadata_cache if key[0] == PROJECT]:
+        _metadata_cache.pop(cache_key, None)
+
 
 def bigquery_metdata_extraction_tool(PROJECT: str,
     BQ_LOCATION: str,
@@ -16,7 +118,12 @@ def bigquery_metdata_extraction_tool(PROJECT: str,
         Returns:
         List of dictionaries, Each dictionary in list contains the keys table_name, column_name, data_type and description of the column
     """
-    client = bigquery.Client(project=PROJECT)
+    cache_key = (PROJECT, BQ_LOCATION, DATASET)
+    cached = _metadata_cache.get(cache_key)
+    if cached and time.monotonic() - cached[0] < METADATA_CACHE_TTL_SECONDS:
+        return cached[1]
+
+    client = get_bigquery_client(PROJECT)
 
     query = f"""
         select table_name, column_name, data_type, description
@@ -25,16 +132,61 @@ def bigquery_metdata_extraction_tool(PROJECT: str,
         and table_schema = "{DATASET}"
     """
 
-    query_job = client.query(query)
-    query_list = []
+    metadata = run_sync_with_retries(
+        lambda: _collect_rows(client.query(query), BIGQUERY_RETRY_POLICY.attempt_timeout_seconds),
+        BIGQUERY_RETRY_POLICY,
+        "bigquery_metdata_extraction_tool"
+    )
+    _metadata_cache[cache_key] = (time.monotonic(), metadata)
+    return metadata
+
+
+def _cancel_job(client: "bigquery.Client", job_id: str, location: Optional[str]) -> None:
+    """Cancel a query job by ID; a job that already finished or was never created is left alone."""
+    try:
+        client.cancel_job(job_id, location=location)
+    except Exception as e:
+        logger.warning(f"Could not cancel BigQuery job {job_id}: {e}")
 
-    for row in query_job:
-        query_list.append(dict(row.items()))
-    return query_list
 
+def _cancel_once_submitted(client: "bigquery.Client", job_id: str, submission: "asyncio.Future") -> None:
+    """Done callback of a query submission whose attempt was cancelled: cancel the job it created."""
+    # A failed submission may still have created the job (e.g. a timeout after the insert)
+    query_job = submission.result() if not submission.cancelled() and submission.exception() is None else None
+    location = getattr(query_job, "location", None)
+    asyncio.get_running_loop().run_in_executor(None, _cancel_job, client, job_id, location)
 
-def bigquery_execution_tool(PROJECT:str,
-    query:str)-> List[Dict[str, Any]]:
+
+async def _execute_query(PROJECT: str, query: str, collect: Callable[[Any], Any], operation: str) -> Any:
+    """Run a query with the BigQuery retry policy and collect its rows off the event loop."""
+    client = get_bigquery_client(PROJECT)
+
+    async def attempt() -> Any:
+        # Named up front, so a job can be cancelled even if the attempt ends while it is submitted
+        job_id = f"no_match_{uuid.uuid4().hex}"
+        # Shielded: cancelling the attempt must not lose track of a submission still in flight
+        submission = asyncio.ensure_future(asyncio.to_thread(client.query, query, job_id=job_id))
+        try:
+            query_job = await asyncio.shield(submission)
+            return await asyncio.to_thread(collect, query_job)
+        except asyncio.CancelledError:
+            # Timed-out attempt or losing hedge: stop the job server-side, don't wait for it
+            submission.add_done_callback(functools.partial(_cancel_once_submitted, client, job_id))
+            raise
+
+    return await run_with_resilience(attempt, BIGQUERY_RETRY_POLICY, operation)
+
+
+async def run_bigquery_query(PROJECT: str, query: str) -> List[Dict[str, Any]]:
+    """
+    Execute a query built by the agent's own tools (rollup, sampling preview)
+    and return all its rows; BIGQUERY_MAX_RESULT_ROWS does not apply.
+    """
+    return await _execute_query(PROJECT, query, lambda query_job: _collect_rows(query_job, None), "bigquery_query")
+
+
+async def bigquery_execution_tool(PROJECT:str,
+    query:str)-> Union[List[Dict[str, Any]], Dict[str, Any]]:
     """
     This function is to execute a given bigquery standard sql on bigquery
     and return the results as list of dictionaries
@@ -44,14 +196,22 @@ def bigquery_execution_tool(PROJECT:str,
     `query` - bigquery standard sql query
 
     Returns:
-    List of dictionaries
+    List of dictionaries, in the query's order. If the query returns more rows
+    than the configured limit, a dictionary instead: `rows` (the rows kept),
+    `truncated` (true), `returned_rows` and `total_rows`; add a LIMIT or
+    aggregate to see the rest.
 
     """
-    client = bigquery.Client(project=PROJECT)
-
-    query_job = client.query(query)
-    query_list = []
+    if BIGQUERY_MAX_RESULT_ROWS <= 0:
+        return await _execute_query(
+            PROJECT, query, lambda query_job: _collect_rows(query_job, None), "bigquery_execution_tool"
+        )
 
-    for row in query_job:
-        query_list.append(dict(row.items()))
-    return query_list 
\ No newline at end of file
+    rows, total = await _execute_query(
+        PROJECT, query,
+        lambda query_job: _collect_capped_rows(query_job, BIGQUERY_MAX_RESULT_ROWS, RANKING_COLUMNS),
+        "bigquery_execution_tool",
+    )
+    if total <= len(rows):
+        return rows
+    return {"rows": rows, "truncated": True, "returned_rows": len(rows), "total_rows": total}
@@ -0,0 +1,489 @@
+"""
+Context Budget for No-Match Analysis Agent
+Token-budgeted prompt assembly for the sub-agents whose instructions inline
+large state values (conversation data, the bot export and earlier reports).
+
+Before each model call the instruction provider renders the template, counts
+tokens locally (about 4 characters per token, as the rate limiter does) and,
+when the prompt exceeds the agent's budget, shares the budget between the
+state values and reduces each to its most informative content:
+
+- conversation data: records are clustered by their words, and one
+  representative per cluster is kept, most frequent clusters first
+- bot export: the intents with the most training phrases are kept whole, the
+  others by name only; flows and pages are reduced to an outline. This only
+  depends on the export, so the parser's prompt, its checkpoint and its cached
+  context are the same in every session
+- reports: sections are ranked by the frequency they cite and their
+  relevance to the no-match data; headings and the summary are kept
+
+What was left out is recorded per agent and stored by the orchestrator under
+the `context_budget_report` state key.
+"""
+
+import json
+import logging
+import os
+import re
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from google.adk.agents.readonly_context import ReadonlyContext
+
+from tools.cpu_tasks import fit_instruction
+from tools.period_comparison import utterance_cluster_key
+from tools.process_pool import cpu_task_pool
+from tools.state_offload import fill_template, load_state_value, resolve_template_values, state_value_digest
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_BUDGET_STATE_KEY = "context_budget_report"
+DEFAULT_CONTEXT_BUDGET_TOKENS = 32000
+
+# State values the relevance of records and report sections is measured against
+FOCUS_STATE_KEYS = ("no_match_analysis_output", "conversation_data_output")
+# State values reduced without a focus text (see compact_bot_json)
+_UNFOCUSED_KEYS = ("dialogflow_bot_json",)
+
+# Dropped items named in a report; every dropped item is counted
+_DROPPED_LABELS_MAX = 20
+_REPORTS_MAX_INVOCATIONS = 64
+# Fitted instructions kept for retries and tool round-trips of the same prompt
+_FITTED_CACHE_SIZE = 32
+# Tokens kept free for the note that says what was left out
+_NOTE_RESERVE_TOKENS = 40
+
+_COUNT_PATTERN = re.compile(
+    r"(?:no_match_count|no_match_turns|frequency|occurrences|count)\W{1,3}(\d+)|(\d+)\s+occurrences", re.IGNORECASE
+)
+_SECTION_START_PATTERN = re.compile(r"^(?:#{1,6}\s|\s{0,4}\d+\.\s|\s{0,4}[-*]\s\*\*|[-*]\s)")
+# Per-record fields and bare numbers, ignored when clustering records
+_RECORD_NOISE_PATTERN = re.compile(r"(?:convo_id|conversation_id|conversation_name|no_match_count)\W{1,3}\S+|\b\d+\b", re.IGNORECASE)
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the tokens of a text (about 4 characters per token)."""
+    return len(text) // 4 + 1 if text else 0
+
+
+def _content_words(text: str) -> Set[str]:
+    return set(utterance_cluster_key(text).split())
+
+
+def _weight(text: str) -> int:
+    """Largest frequency an item cites (no-match count, occurrences), else 1."""
+    counts = [int(first or second) for first, second in _COUNT_PATTERN.findall(text)]
+    return max(counts, default=1) or 1
+
+
+def _relevance(words: Set[str], focus_words: Set[str]) -> float:
+    """Share of an item's content words that also appear in the focus text."""
+    if not words or not focus_words:
+        return 0.0
+    return len(words & focus_words) / len(words)
+
+
+def _truncate(text: str, budget: int) -> str:
+    """Cut a text at the last line break that fits the budget."""
+    limit = max(0, budget * 4)
+    if len(text) <= limit:
+        return text
+    cut = text.rfind("\n", 0, limit)
+    return text[:cut if cut > limit // 2 else limit]
+
+
+def _note(kept: int, total: int, noun: str) -> str:
+    return f"[Context budget: {kept} of {total} {noun} shown, most frequent and relevant first; the rest are merged or left out.]"
+
+
+def allocate_budget(sizes: Dict[str, int], available: int) -> Dict[str, int]:
+    """
+    Share a token budget between values: values smaller than an equal share
+    keep their size and the rest of the budget is split between the others.
+
+    Args:
+        sizes: Key -> tokens of the value
+        available: Tokens available for all values
+
+    Returns:
+        Dict[str, int]: Key -> tokens allowed
+    """
+    allowed: Dict[str, int] = {}
+    remaining = max(0, available)
+    pending = sorted(sizes, key=lambda key: sizes[key])
+    while pending:
+        share = remaining // len(pending)
+        key = pending.pop(0)
+        allowed[key] = min(sizes[key], share)
+        remaining -= allowed[key]
+    return allowed
+
+
+def _split_records(text: str) -> Tuple[List[str], str]:
+    """Records of retrieved data and their separator: blank-line separated blocks, else lines."""
+    blocks = [block for block in re.split(r"\n\s*\n", text.strip()) if block.strip()]
+    if len(blocks) > 2:
+        return blocks, "\n\n"
+    return [line for line in text.strip().splitlines() if line.strip()], "\n"
+
+
+def _split_sections(text: str) -> List[str]:
+    """Sections of a markdown report: headings, numbered items and top-level bullets."""
+    sections: List[List[str]] = []
+    for line in text.strip().splitlines():
+        if not sections or _SECTION_START_PATTERN.match(line):
+            sections.append([line])
+        else:
+            sections[-1].append(line)
+    return ["\n".join(lines) for lines in sections]
+
+
+def _select_items(
+    items: List[str],
+    budget: int,
+    focus_words: Set[str],
+    noun: str,
+    separator: str,
+    cluster: bool,
+    always_keep: Callable[[int, str], bool],
+) -> Tuple[str, Dict[str, Any]]:
+    """
+    Keep the highest scoring items that fit the budget, in their original order.
+
+    Items are scored by the frequency they cite times (1 + relevance to the
+    focus words). With `cluster`, items with the same words (ignoring IDs,
+    counts and other numbers) count as one, represented by their most frequent item.
+    """
+    groups: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+    kept_indexes: Set[int] = set()
+    remaining = budget - _NOTE_RESERVE_TOKENS
+    for index, item in enumerate(items):
+        if always_keep(index, item):
+            kept_indexes.add(index)
+            remaining -= estimate_tokens(item) + 1
+            continue
+        key = utterance_cluster_key(_RECORD_NOISE_PATTERN.sub(" ", item)) if cluster else str(index)
+        group = groups.setdefault(key, {"indexes": [], "weight": 0, "words": set(key.split()) if cluster else None})
+        group["indexes"].append(index)
+        group["weight"] += _weight(item)
+
+    for group in groups.values():
+        words = group["words"] if group["words"] is not None else _content_words(items[group["indexes"][0]])
+        group["score"] = group["weight"] * (1 + _relevance(words, focus_words))
+        group["representative"] = max(group["indexes"], key=lambda index: _weight(items[index]))
+
+    dropped_labels: List[str] = []
+    dropped = merged = 0
+    similar: Dict[int, int] = {}
+    for group in sorted(groups.values(), key=lambda group: -group["score"]):
+        index = group["representative"]
+        cost = estimate_tokens(items[index]) + 1
+        if cost <= remaining:
+            remaining -= cost
+            kept_indexes.add(index)
+            similar[index] = len(group["indexes"]) - 1
+            merged += len(group["indexes"]) - 1
+        else:
+            dropped += len(group["indexes"])
+            if len(dropped_labels) < _DROPPED_LABELS_MAX:
+                dropped_labels.append(items[index].strip().splitlines()[0][:120])
+
+    lines = []
+    for index in sorted(kept_indexes):
+        suffix = f" [+{similar[index]} similar]" if similar.get(index) else ""
+        lines.append(items[index] + suffix)
+    lines.append(_note(len(kept_indexes), len(items), noun))
+    text = _truncate(separator.join(lines), budget)
+    return text, {
+        "items": len(items),
+        "kept_items": len(kept_indexes),
+        "merged_items": merged,
+        "dropped_items": dropped,
+        "dropped": dropped_labels,
+    }
+
+
+def select_records(text: str, budget: int, focus_words: Set[str]) -> Tuple[str, Dict[str, Any]]:
+    """
+    Reduce retrieved conversation data to its most frequent record clusters.
+    The first block (the header or summary) is always kept.
+    """
+    records, separator = _split_records(text)
+    return _select_items(records, budget, focus_words, "records", separator, True, lambda index, _: index == 0)
+
+
+def select_sections(text: str, budget: int, focus_words: Set[str]) -> Tuple[str, Dict[str, Any]]:
+    """
+    Reduce a markdown report to its most frequent and relevant sections.
+    Headings and the first section are always kept.
+    """
+    return _select_items(
+        _split_sections(text), budget, focus_words, "sections", "\n", False,
+        lambda index, section: index == 0 or section.lstrip().startswith("#"),
+    )
+
+
+def _outline(value: Any, depth: int = 0) -> Any:
+    """Names and short scalar fields of a nested export (flows, pages, ...)."""
+    if isinstance(value, dict):
+        outline = {}
+        for key, item in value.items():
+            if isinstance(item, (dict, list)) and depth < 3:
+                item = _outline(item, depth + 1)
+                if item:
+                    outline[key] = item
+            elif isinstance(item, (int, float, bool)) or (isinstance(item, str) and len(item) <= 200):
+                outline[key] = item
+        return outline
+    if isinstance(value, list):
+        return [item for item in (_outline(item, depth + 1) for item in value) if item]
+    return value
+
+
+def compact_bot_json(text: str, budget: int, focus_words: Set[str]) -> Tuple[str, Dict[str, Any]]:
+    """
+    Reduce a Dialogflow CX bot export to its most trained intents.
+
+    Intents are ranked by their number of training phrases, then by their
+    order in the export, and kept whole while they fit; the others are listed
+    under `otherIntentNames`. Everything besides the intents is reduced to an
+    outline if it takes more than a quarter of the budget.
+
+    `focus_words` is ignored: the result depends on the export only, so a
+    Step 3 checkpoint, the batch runner's shared parse and the context cache
+    stay valid whatever the session's no-match data.
+    """
+    try:
+        bot = json.loads(text)
+    except json.JSONDecodeError:
+        bot = None
+    if not isinstance(bot, dict):
+        return select_sections(text, budget, set())
+
+    def dumps(value: Any) -> str:
+        return json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+
+    intents = [intent for intent in bot.get("intents") or [] if isinstance(intent, dict)]
+    rest = {key: value for key, value in bot.items() if key != "intents"}
+    outlined = estimate_tokens(dumps(rest)) > budget // 4
+    if outlined:
+        rest = _outline(rest)
+
+    remaining = budget - estimate_tokens(dumps(rest)) - _NOTE_RESERVE_TOKENS
+    ranked = sorted(
+        range(len(intents)),
+        key=lambda index: -len(intents[index].get("trainingPhrases") or []),
+    )
+    kept_indexes: Set[int] = set()
+    other_names: List[str] = []
+    for index in ranked:
+        cost = estimate_tokens(dumps(intents[index]))
+        if cost <= remaining:
+            kept_indexes.add(index)
+            remaining -= cost
+        else:
+            other_names.append(intents[index].get("displayName", ""))
+    # Names are cheap, but not free
+    listed_names: List[str] = []
+    for name in other_names:
+        cost = estimate_tokens(name) + 1
+        if cost > remaining:
+            break
+        listed_names.append(name)
+        remaining -= cost
+
+    compact = {**rest, "intents": [intents[index] for index in sorted(kept_indexes)]}
+    if listed_names:
+        compact["otherIntentNames"] = listed_names
+    compact_text = _truncate(dumps(compact), budget - _NOTE_RESERVE_TOKENS) + "\n" + _note(len(kept_indexes), len(intents), "intents")
+    return compact_text, {
+        "items": len(intents),
+        "kept_items": len(kept_indexes),
+        "dropped_items": len(other_names),
+        "dropped": other_names[:_DROPPED_LABELS_MAX],
+        "outlined": outlined,
+    }
+
+
+# State key -> reduction; other keys are treated as markdown reports
+_REDUCERS: Dict[str, Callable[[str, int, Set[str]], Tuple[str, Dict[str, Any]]]] = {
+    "conversation_data_output": select_records,
+    "dialogflow_bot_json": compact_bot_json,
+}
+
+
+class ContextBudget:
+    """
+    Per-agent token budgets for instruction templates.
+
+    Reports are kept per invocation and agent until the orchestrator collects
+    them with `pop_reports`.
+    """
+
+    def __init__(self, enabled: bool = True, default_budget: int = DEFAULT_CONTEXT_BUDGET_TOKENS,
+                 agent_budgets: Optional[Dict[str, int]] = None):
+        """
+        Args:
+            enabled: Enforce budgets; when False templates are rendered whole
+            default_budget: Token budget of an agent's instruction
+            agent_budgets: Agent name -> budget overriding the default
+        """
+        self.enabled = enabled
+        self.default_budget = default_budget
+        self.agent_budgets = agent_budgets or {}
+        self._reports: "OrderedDict[str, Dict[str, Dict[str, Any]]]" = OrderedDict()
+        self._fitted: "OrderedDict[str, Tuple[str, Dict[str, Any]]]" = OrderedDict()
+
+    @classmethod
+    def from_env(cls) -> "ContextBudget":
+        """
+        Build the budgets from `CONTEXT_BUDGET_ENABLED`, `CONTEXT_BUDGET_TOKENS`
+        and `CONTEXT_BUDGET_TOKENS_<AGENT NAME>` (e.g. CONTEXT_BUDGET_TOKENS_CSV_GENERATION_AGENT).
+
+        Returns:
+            ContextBudget: Budgets configured from the environment
+        """
+        prefix = "CONTEXT_BUDGET_TOKENS_"
+        return cls(
+            enabled=os.environ.get("CONTEXT_BUDGET_ENABLED", "true").lower() in ("1", "true", "yes"),
+            default_budget=int(os.environ.get("CONTEXT_BUDGET_TOKENS", str(DEFAULT_CONTEXT_BUDGET_TOKENS))),
+            agent_budgets={
+                name[len(prefix):].lower(): int(value) for name, value in os.environ.items() if name.startswith(prefix)
+            },
+        )
+
+    def budget_for(self, agent_name: str) -> int:
+        return self.agent_budgets.get(agent_name, self.default_budget)
+
+    def fit(self, template: str, values: Dict[str, str], budget: int, focus_text: str = "") -> Tuple[str, Dict[str, Any]]:
+        """
+        Render a template within a token budget.
+
+        Args:
+            template: Instruction template with state placeholders
+            values: Resolved placeholder values
+            budget: Token budget of the rendered instruction
+            focus_text: Text the relevance of records and sections is measured
+                against, in addition to the other values of the template
+
+        Returns:
+            Tuple[str, Dict[str, Any]]: Rendered instruction and a report of
+            the tokens before and after and, per reduced value, what was left out
+        """
+        template_tokens = estimate_tokens(fill_template(template, {key: "" for key in values}))
+        sizes = {key: estimate_tokens(value) for key, value in values.items()}
+        report: Dict[str, Any] = {
+            "budget": budget,
+            "template_tokens": template_tokens,
+            "tokens_before": template_tokens + sum(sizes.values()),
+            "values": {},
+        }
+        if report["tokens_before"] <= budget:
+            report["tokens_after"] = report["tokens_before"]
+            return fill_template(template, values), report
+
+        allowed = allocate_budget(sizes, budget - template_tokens)
+        fitted = dict(values)
+        for key, value in values.items():
+            if sizes[key] <= allowed[key]:
+                continue
+            focus = " ".join([focus_text] + [other for name, other in values.items() if name != key])
+            reducer = _REDUCERS.get(key, select_sections)
+            fitted[key], value_report = reducer(value, allowed[key], _content_words(focus))
+            report["values"][key] = {
+                "tokens": sizes[key],
+                "budget": allowed[key],
+                "kept_tokens": estimate_tokens(fitted[key]),
+                **value_report,
+            }
+        rendered = fill_template(template, fitted)
+        report["tokens_after"] = estimate_tokens(rendered)
+        return rendered, report
+
+    async def fit_cached(self, template: str, values: Dict[str, str], budget: int,
+                         focus_text: str = "") -> Tuple[str, Dict[str, Any]]:
+        """
+        Run `fit` in the CPU task pool, reusing the result for the same inputs.
+
+        Retries and tool round-trips render the same template and values again;
+        they get the fitted instruction cached under the digest of the inputs.
+
+        Returns:
+            Tuple[str, Dict[str, Any]]: Rendered instruction and report, as `fit`
+        """
+        digest = state_value_digest([template, focus_text, budget, values])
+        fitted = self._fitted.get(digest)
+        if fitted is not None:
+            self._fitted.move_to_end(digest)
+            return fitted
+
+        keys = list(values)
+        fitted = await cpu_task_pool.run(
+            fit_instruction, [template, focus_text] + [values[key] for key in keys], keys, budget
+        )
+        self._fitted[digest] = fitted
+        while len(self._fitted) > _FITTED_CACHE_SIZE:
+            self._fitted.popitem(last=False)
+        return fitted
+
+    def instruction(self, template: str):
+        """
+        Build an ADK instruction provider that renders a template (rehydrating
+        offloaded state, see tools/state_offload.py) within the agent's budget.
+
+        Args:
+            template: Instruction template with state placeholders
+
+        Returns:
+            Callable: Async instruction provider for `LlmAgent(instruction=...)`
+        """
+        async def instruction_provider(readonly_context: ReadonlyContext) -> str:
+            values = await resolve_template_values(template, readonly_context)
+            if not self.enabled:
+                return fill_template(template, values)
+
+            ctx = readonly_context._invocation_context
+            focus_text = ""
+            # The bot export is reduced without one; don't load it for the parser's prompt
+            if any(key not in _UNFOCUSED_KEYS for key in values):
+                for key in FOCUS_STATE_KEYS:
+                    if key not in values and ctx.session.state.get(key):
+                        focus_text = str(await load_state_value(ctx, ctx.session.state[key]))
+                        break
+
+            agent_name = readonly_context.agent_name
+            # Section ranking and bot export compaction run off the event loop
+            rendered, report = await self.fit_cached(template, values, self.budget_for(agent_name), focus_text)
+            if report["values"]:
+                logger.info(
+                    f"[{agent_name}] - Context budget: {report['tokens_before']} -> {report['tokens_after']} tokens "
+                    f"(budget {report['budget']}); reduced {sorted(report['values'])}"
+                )
+            self._record(readonly_context.invocation_id, agent_name, report)
+            return rendered
+
+        return instruction_provider
+
+    def _record(self, invocation_id: str, agent_name: str, report: Dict[str, Any]) -> None:
+        self._reports.setdefault(invocation_id, {})[agent_name] = report
+        self._reports.move_to_end(invocation_id)
+        while len(self._reports) > _REPORTS_MAX_INVOCATIONS:
+            self._reports.popitem(last=False)
+
+    def pop_reports(self, invocation_id: str) -> Dict[str, Dict[str, Any]]:
+        """
+        Take the reports recorded for an invocation.
+
+        Returns:
+            Dict[str, Dict[str, Any]]: Agent name -> report of its latest model call
+        """
+        return self._reports.pop(invocation_id, {})
+
+
+# Shared by the sub-agents with large state values in their instructions
+context_budget = ContextBudget.from_env()
+
+
+def context_budget_instruction(template: str):
+    """Instruction provider rendering a template within the agent's token budget."""
+    return context_budget.instruction(template)
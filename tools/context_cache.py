@@ -0,0 +1,311 @@
+"""
+Context Cache for No-Match Analysis Agent
+Reusable cached-context handles for large, stable prompt prefixes such as a
+bot export, so sessions analysing the same bot do not re-send it.
+
+A prefix is keyed by the SHA-256 of the model and its text. The first request
+with a prefix creates a cached context at the provider (Gemini explicit
+context caching); later requests reference it by name and send only their own
+contents. Handles expire after a TTL and are reference counted while requests
+use them: an expired handle is deleted at the provider once no request holds it,
+and the next request creates a fresh one.
+
+The provider is behind a small backend interface (`create` / `delete`);
+fake_services.FakeContextCacheBackend implements it locally so hit rates and
+token savings can be measured offline.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.models.llm_request import LlmRequest
+from google.adk.models.llm_response import LlmResponse
+from google.genai import types
+
+from tools.context_budget import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Agents whose whole instruction is a stable prefix (template plus bot export)
+DEFAULT_CACHED_AGENTS = ("dialogflow_cx_parser_agent",)
+# Handles this close to expiry are not handed out, so a request never outlives its cache
+_EXPIRY_MARGIN_SECONDS = 30.0
+
+
+def context_cache_key(model: str, system_instruction: str) -> str:
+    """Content hash identifying a cached prefix."""
+    return hashlib.sha256(f"{model}\x00{system_instruction}".encode("utf-8")).hexdigest()
+
+
+class GeminiContextCacheBackend:
+    """Gemini explicit context caching through google-genai."""
+
+    def __init__(self, client: Any = None):
+        """
+        Args:
+            client: google.genai Client, created from the environment on first use
+        """
+        self._client = client
+
+    def _get_client(self) -> Any:
+        if self._client is None:
+            # Imported here: only needed once a cache is actually created
+            from google import genai
+            self._client = genai.Client()
+        return self._client
+
+    async def create(self, model: str, system_instruction: str, ttl_seconds: float, display_name: str) -> str:
+        cached_content = await self._get_client().aio.caches.create(
+            model=model,
+            config=types.CreateCachedContentConfig(
+                system_instruction=system_instruction,
+                ttl=f"{int(ttl_seconds)}s",
+                display_name=display_name,
+            ),
+        )
+        return cached_content.name
+
+    async def delete(self, name: str) -> None:
+        await self._get_client().aio.caches.delete(name=name)
+
+
+class CachedContextHandle:
+    """A cached prefix at the provider and the requests currently using it."""
+
+    def __init__(self, key: str, name: str, model: str, token_count: int, expires_at: float):
+        self.key = key
+        self.name = name
+        self.model = model
+        self.token_count = token_count
+        self.created_at = time.time()
+        self.expires_at = expires_at
+        self.refcount = 0
+        self.hits = 0
+
+    def usable(self, now: float) -> bool:
+        return now < self.expires_at - _EXPIRY_MARGIN_SECONDS
+
+
+class ContextCache:
+    """
+    Content-addressed handles for cached prompt prefixes, shared by all sessions
+    in the process.
+    """
+
+    def __init__(
+        self,
+        backend: Any = None,
+        enabled: bool = False,
+        ttl_seconds: float = 3600,
+        min_tokens: int = 4096,
+        agents: Tuple[str, ...] = DEFAULT_CACHED_AGENTS,
+    ):
+        """
+        Args:
+            backend: Provider backend with async `create` and `delete`
+                (defaults to GeminiContextCacheBackend)
+            enabled: Whether requests are rewritten to use cached contexts
+            ttl_seconds: Lifetime of a cached context at the provider
+            min_tokens: Smallest prefix worth caching (providers have a minimum)
+            agents: Agents whose instruction is cached
+        """
+        self.backend = backend or GeminiContextCacheBackend()
+        self.enabled = enabled
+        self.ttl_seconds = ttl_seconds
+        self.min_tokens = min_tokens
+        self.agents = tuple(agents)
+
+        self._handles: Dict[str, CachedContextHandle] = {}
+        self._retired: List[CachedContextHandle] = []
+        self._creating: Dict[str, "asyncio.Future[CachedContextHandle]"] = {}
+        self._in_use: Dict[Tuple[str, str], CachedContextHandle] = {}
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "creates": 0, "deletes": 0, "errors": 0, "tokens_reused": 0}
+
+    @classmethod
+    def from_env(cls) -> "ContextCache":
+        """
+        Build a context cache from `CONTEXT_CACHE_*` environment variables.
+
+        Returns:
+            ContextCache: Cache backed by Gemini, disabled unless CONTEXT_CACHE_ENABLED is set
+        """
+        agents = os.environ.get("CONTEXT_CACHE_AGENTS", ",".join(DEFAULT_CACHED_AGENTS))
+        return cls(
+            enabled=os.environ.get("CONTEXT_CACHE_ENABLED", "false").lower() in ("1", "true", "yes"),
+            ttl_seconds=float(os.environ.get("CONTEXT_CACHE_TTL_SECONDS", "3600")),
+            min_tokens=int(os.environ.get("CONTEXT_CACHE_MIN_TOKENS", "4096")),
+            agents=tuple(agent.strip() for agent in agents.split(",") if agent.strip()),
+        )
+
+    async def acquire(self, model: str, system_instruction: str) -> Optional[CachedContextHandle]:
+        """
+        Get a handle on the cached context of a prefix, creating it on a miss.
+        Concurrent misses for the same prefix share one creation.
+
+        Args:
+            model: Model the context is cached for
+            system_instruction: Prefix to cache
+
+        Returns:
+            Optional[CachedContextHandle]: Handle with its reference taken, or
+            None when the prefix is too small to cache
+        """
+        token_count = estimate_tokens(system_instruction)
+        if token_count < self.min_tokens:
+            return None
+        key = context_cache_key(model, system_instruction)
+
+        with self._lock:
+            handle = self._handles.get(key)
+            if handle is not None and handle.usable(time.time()):
+                handle.refcount += 1
+                handle.hits += 1
+                self.stats["hits"] += 1
+                self.stats["tokens_reused"] += handle.token_count
+                return handle
+            if handle is not None:
+                # Expired: retire it, it is deleted once no request holds it
+                del self._handles[key]
+                self._retired.append(handle)
+            creating = self._creating.get(key)
+            if creating is None:
+                creating = self._creating[key] = asyncio.get_running_loop().create_future()
+                owner = True
+                self.stats["misses"] += 1
+            else:
+                owner = False
+
+        if not owner:
+            handle = await asyncio.shield(creating)
+            with self._lock:
+                handle.refcount += 1
+                handle.hits += 1
+                self.stats["hits"] += 1
+                self.stats["tokens_reused"] += handle.token_count
+            return handle
+
+        try:
+            name = await self.backend.create(model, system_instruction, self.ttl_seconds, f"no-match-{key[:16]}")
+        except BaseException as e:
+            with self._lock:
+                self._creating.pop(key, None)
+            creating.set_exception(e)
+            # Waiters see the error; nobody may be waiting
+            creating.exception()
+            raise
+        handle = CachedContextHandle(key, name, model, token_count, time.time() + self.ttl_seconds)
+        handle.refcount = 1
+        with self._lock:
+            self._handles[key] = handle
+            self._creating.pop(key, None)
+            self.stats["creates"] += 1
+        creating.set_result(handle)
+        await self._delete_retired()
+        return handle
+
+    async def release(self, handle: CachedContextHandle) -> None:
+        """Drop a request's reference; expired contexts without references are deleted."""
+        with self._lock:
+            handle.refcount = max(0, handle.refcount - 1)
+        await self._delete_retired()
+
+    async def _delete_retired(self) -> None:
+        with self._lock:
+            idle = [handle for handle in self._retired if handle.refcount == 0]
+            self._retired = [handle for handle in self._retired if handle.refcount > 0]
+        for handle in idle:
+            try:
+                await self.backend.delete(handle.name)
+                self.stats["deletes"] += 1
+            except Exception as e:
+                # The provider expires it on its own
+                logger.warning(f"Could not delete cached context {handle.name}: {e}")
+
+    async def close(self) -> None:
+        """Delete every cached context that no request holds, e.g. at shutdown."""
+        with self._lock:
+            self._retired.extend(self._handles.values())
+            self._handles.clear()
+        await self._delete_retired()
+
+    def handles(self) -> List[Dict[str, Any]]:
+        """Live handles, for metrics and tests."""
+        with self._lock:
+            return [
+                {"key": handle.key, "name": handle.name, "model": handle.model, "token_count": handle.token_count,
+                 "refcount": handle.refcount, "hits": handle.hits, "expires_at": handle.expires_at}
+                for handle in self._handles.values()
+            ]
+
+    async def before_model_callback(
+        self, callback_context: CallbackContext, llm_request: LlmRequest
+    ) -> Optional[LlmResponse]:
+        """
+        ADK `before_model_callback` that moves a cacheable instruction into a
+        cached context and makes the request reference it.
+
+        Cached contexts cannot be combined with a request-level instruction or
+        tools, so requests with tools are left unchanged.
+
+        Args:
+            callback_context: Callback context of the calling sub-agent
+            llm_request: Rendered model request
+
+        Returns:
+            None: The request is modified in place
+        """
+        if not self.enabled or callback_context.agent_name not in self.agents or not llm_request.config:
+            return None
+        config = llm_request.config
+        if config.tools or config.cached_content or not config.system_instruction:
+            return None
+
+        try:
+            handle = await self.acquire(llm_request.model or "", str(config.system_instruction))
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.warning(f"[{callback_context.agent_name}] - Context cache unavailable, sending the full prompt: {e}")
+            return None
+        if handle is None:
+            return None
+
+        self._in_use[(callback_context.invocation_id, callback_context.agent_name)] = handle
+        config.cached_content = handle.name
+        config.system_instruction = None
+        return None
+
+    async def after_model_callback(
+        self, callback_context: CallbackContext, llm_response: LlmResponse
+    ) -> Optional[LlmResponse]:
+        """
+        ADK `after_model_callback` that releases the request's handle.
+
+        Returns:
+            None: The response is never modified
+        """
+        if llm_response.partial:
+            return None
+        handle = self._in_use.pop((callback_context.invocation_id, callback_context.agent_name), None)
+        if handle is not None:
+            await self.release(handle)
+        return None
+
+    async def on_model_error_callback(
+        self, callback_context: CallbackContext, llm_request: LlmRequest, error: Exception
+    ) -> Optional[LlmResponse]:
+        """ADK `on_model_error_callback` that releases the failed request's handle."""
+        handle = self._in_use.pop((callback_context.invocation_id, callback_context.agent_name), None)
+        if handle is not None:
+            await self.release(handle)
+        return None
+
+
+# Shared by the sub-agents with large, stable instructions
+context_cache = ContextCache.from_env()
@@ -0,0 +1,117 @@
+"""
+CPU Tasks for No-Match Analysis Agent
+CPU-bound task functions run in the process pool (see tools/process_pool.py).
+Each takes a column of str / bytes items as its first argument; like the pool,
+this module only imports the standard library. Stage modules (clustering, bot
+export parsing, ...) are imported inside their task functions, so a worker
+only loads the stages it actually runs.
+"""
+
+import hashlib
+import json
+import zlib
+from typing import Any, Dict, Optional, Tuple
+
+from tools.process_pool import buffer_of
+
+
+def compress_state_payload(column) -> Tuple[str, bytes]:
+    """
+    Hash and compress a serialized state value for offloading.
+
+    Args:
+        column: Single item holding the serialized value
+
+    Returns:
+        Tuple[str, bytes]: SHA-256 hex digest and zlib-compressed payload
+    """
+    payload = buffer_of(column, 0)
+    return hashlib.sha256(payload).hexdigest(), zlib.compress(payload)
+
+
+def inflate_state_payload(column, value_format: str) -> Any:
+    """
+    Decompress and deserialize an offloaded state value.
+
+    Args:
+        column: Single item holding the compressed payload
+        value_format: "text" or "json"
+
+    Returns:
+        Any: The original state value
+    """
+    payload = zlib.decompress(buffer_of(column, 0))
+    text = payload.decode("utf-8")
+    if value_format == "json":
+        return json.loads(text)
+    return text
+
+
+def compare_utterance_clusters(column, top: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Cluster the utterances of two windows and test each cluster's rate change.
+
+    Args:
+        column: JSON rows of the current utterances, current days, baseline
+            utterances and baseline days, in that order
+        top: Utterance rows each window was limited to, None if complete
+
+    Returns:
+        Dict[str, Any]: Output of `period_comparison.compare_clusters`
+    """
+    from tools.period_comparison import compare_clusters
+
+    return compare_clusters(*(json.loads(bytes(buffer_of(column, index))) for index in range(4)), top=top)
+
+
+def build_intent_bundle(column, path: str) -> Dict[str, Any]:
+    """
+    Parse a bot export and write an intent import bundle for a CSV to a file.
+
+    Args:
+        column: CSV content and bot export JSON (may be empty)
+        path: File the zip is written to
+
+    Returns:
+        Dict[str, Any]: Counts returned by `artifact_utils.write_intent_bundle`
+    """
+    from artifact_utils import write_intent_bundle
+
+    with open(path, "wb") as fileobj:
+        return write_intent_bundle(fileobj, column[0], column[1])
+
+
+def validate_phrase_csv(column, drop_collisions: bool) -> Tuple[str, Dict[str, Any]]:
+    """
+    Index a bot export's training phrases and validate a training-phrase CSV against it.
+
+    Args:
+        column: CSV content and bot export JSON (may be empty)
+        drop_collisions: Also drop rows flagged as cross-intent collisions
+
+    Returns:
+        Tuple[str, Dict[str, Any]]: Output of `phrase_validation.validate_training_phrases`
+    """
+    from tools.phrase_validation import BotPhraseIndex, validate_training_phrases
+
+    bot_json = column[1]
+    bot_index = BotPhraseIndex.from_bot_json(bot_json) if bot_json else None
+    return validate_training_phrases(column[0], bot_index, drop_collisions)
+
+
+def fit_instruction(column, keys, budget: int) -> Tuple[str, Dict[str, Any]]:
+    """
+    Render an instruction template within a token budget.
+
+    Args:
+        column: Template, focus text and the placeholder values in the order of `keys`
+        keys: Placeholder names of the values
+        budget: Token budget of the rendered instruction
+
+    Returns:
+        Tuple[str, Dict[str, Any]]: Output of `context_budget.ContextBudget.fit`
+    """
+    from tools.context_budget import ContextBudget
+
+    values = {key: column[index + 2] for index, key in enumerate(keys)}
+    return ContextBudget().fit(column[0], values, budget, column[1])
@@ -0,0 +1,234 @@
+"""
+Event Stream for No-Match Analysis Agent
+Relay between a sub-agent's events and the runner that coalesces streamed
+text chunks and bounds how many of them wait for a slow consumer.
+
+With streaming enabled, a sub-agent yields a partial event per model chunk.
+The relay runs the sub-agent in its own task and buffers its events:
+
+- consecutive partial text chunks of one author are merged into one event
+  until the merged text reaches `coalesce_chars` or the first chunk is
+  `coalesce_seconds` old
+- when more than `max_buffered_events` partial events wait for the consumer,
+  the oldest are dropped; the final event carries the full text anyway
+- partial events still buffered when their author's final event arrives are
+  dropped as superseded
+
+Final events (complete responses, tool calls and state deltas) are never
+merged or dropped. The sub-agent waits after each one until the consumer has
+processed it, as the orchestrator reads state the runner applies from them.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Any, AsyncGenerator, Deque, Dict, List, Optional
+
+from google.adk.events import Event
+from google.genai import types
+
+logger = logging.getLogger(__name__)
+
+
+class _BufferedEvent:
+    """An event waiting for the consumer; partial text chunks may still be merged into it."""
+
+    def __init__(self, event: Event, processed: Optional["asyncio.Future[None]"] = None):
+        self.event = event
+        self.processed = processed
+        self.texts: List[str] = [part.text for part in event.content.parts] if _is_text_chunk(event) else []
+        self.chars = sum(len(text) for text in self.texts)
+        self.chunks = 1
+        self.started = time.monotonic()
+
+    @property
+    def mergeable(self) -> bool:
+        return bool(self.texts)
+
+    def merge(self, event: Event) -> None:
+        for part in event.content.parts:
+            self.texts.append(part.text)
+            self.chars += len(part.text)
+        self.chunks += 1
+
+    def build(self) -> Event:
+        if self.chunks == 1:
+            return self.event
+        first_part = self.event.content.parts[0]
+        return self.event.model_copy(update={
+            "content": types.Content(
+                role=self.event.content.role,
+                parts=[types.Part(text="".join(self.texts), thought=first_part.thought)],
+            )
+        })
+
+
+def _is_text_chunk(event: Event) -> bool:
+    """Whether an event is a partial chunk with only text parts and no actions."""
+    if not event.partial or not event.content or not event.content.parts:
+        return False
+    if event.actions and (event.actions.state_delta or event.actions.artifact_delta):
+        return False
+    return all(part.text is not None and not part.function_call for part in event.content.parts)
+
+
+class EventStream:
+    """
+    Coalescing, bounded relay of sub-agent events (see module docstring).
+    """
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        coalesce_seconds: float = 0.1,
+        coalesce_chars: int = 2048,
+        max_buffered_events: int = 32,
+    ):
+        """
+        Args:
+            enabled: Whether events are relayed through the buffer; when off
+                they are passed through unchanged
+            coalesce_seconds: Longest a text chunk waits for more chunks to merge with
+            coalesce_chars: Merged text size at which a partial event is sent
+            max_buffered_events: Partial events kept per session while the
+                consumer is behind
+        """
+        self.enabled = enabled
+        self.coalesce_seconds = coalesce_seconds
+        self.coalesce_chars = coalesce_chars
+        self.max_buffered_events = max_buffered_events
+        self.stats = {"events_in": 0, "events_out": 0, "coalesced": 0, "dropped": 0, "superseded": 0, "max_buffered": 0}
+
+    @classmethod
+    def from_env(cls) -> "EventStream":
+        """
+        Build the relay from `EVENT_STREAM_*` environment variables.
+
+        Returns:
+            EventStream: Relay configured from the environment
+        """
+        return cls(
+            enabled=os.environ.get("EVENT_STREAM_ENABLED", "true").lower() in ("1", "true", "yes"),
+            coalesce_seconds=float(os.environ.get("EVENT_STREAM_COALESCE_MS", "100")) / 1000,
+            coalesce_chars=int(os.environ.get("EVENT_STREAM_COALESCE_CHARS", "2048")),
+            max_buffered_events=int(os.environ.get("EVENT_STREAM_MAX_BUFFERED_EVENTS", "32")),
+        )
+
+    async def relay(self, events: AsyncGenerator[Event, None], label: str = "") -> AsyncGenerator[Event, None]:
+        """
+        Relay the events of a sub-agent run.
+
+        Args:
+            events: Event stream of the sub-agent run
+            label: Name used in logs, e.g. the step
+
+        Yields:
+            Event: Final events unchanged and in order, with partial text
+            chunks merged and, when the consumer falls behind, thinned out
+        """
+        if not self.enabled:
+            async for event in events:
+                yield event
+            return
+
+        loop = asyncio.get_running_loop()
+        buffer: Deque[_BufferedEvent] = deque()
+        changed = asyncio.Event()
+        finished: Dict[str, Any] = {}
+        counts = {"events_in": 0, "events_out": 0, "coalesced": 0, "dropped": 0, "superseded": 0, "max_buffered": 0}
+
+        def drop_partials(author: Optional[str] = None) -> int:
+            """Drop buffered partial events (of one author), returning how many."""
+            kept = [item for item in buffer if item.processed or (author is not None and item.event.author != author)]
+            dropped = len(buffer) - len(kept)
+            buffer.clear()
+            buffer.extend(kept)
+            return dropped
+
+        async def produce() -> None:
+            try:
+                async for event in events:
+                    counts["events_in"] += 1
+                    if event.partial:
+                        last = buffer[-1] if buffer else None
+                        if (
+                            last is not None and last.mergeable and _is_text_chunk(event)
+                            and last.event.author == event.author
+                            and last.event.content.parts[0].thought == event.content.parts[0].thought
+                            and last.chars < self.coalesce_chars
+                        ):
+                            last.merge(event)
+                            counts["coalesced"] += 1
+                        else:
+                            buffer.append(_BufferedEvent(event))
+                            partials = sum(1 for item in buffer if item.processed is None)
+                            if partials > self.max_buffered_events:
+                                # The consumer is behind: drop the oldest partial event
+                                oldest = next(item for item in buffer if item.processed is None)
+                                buffer.remove(oldest)
+                                counts["dropped"] += oldest.chunks
+                        counts["max_buffered"] = max(counts["max_buffered"], len(buffer))
+                        changed.set()
+                        continue
+
+                    # The final event repeats the full text of its author's chunks
+                    counts["superseded"] += drop_partials(event.author)
+                    processed = loop.create_future()
+                    buffer.append(_BufferedEvent(event, processed))
+                    counts["max_buffered"] = max(counts["max_buffered"], len(buffer))
+                    changed.set()
+                    await processed
+            except Exception as e:
+                finished["error"] = e
+            finally:
+                finished["done"] = True
+                changed.set()
+                await events.aclose()
+
+        producer = asyncio.ensure_future(produce())
+        try:
+            while True:
+                changed.clear()
+                if not buffer:
+                    if finished.get("done"):
+                        if "error" in finished:
+                            raise finished["error"]
+                        return
+                    await changed.wait()
+                    continue
+
+                head = buffer[0]
+                if head.mergeable and len(buffer) == 1 and not finished.get("done") and head.chars < self.coalesce_chars:
+                    # Give the chunk a moment to collect more text
+                    remaining = head.started + self.coalesce_seconds - time.monotonic()
+                    if remaining > 0:
+                        try:
+                            await asyncio.wait_for(changed.wait(), remaining)
+                        except asyncio.TimeoutError:
+                            pass
+                        else:
+                            continue
+
+                buffer.popleft()
+                counts["events_out"] += 1
+                yield head.build()
+                if head.processed is not None and not head.processed.done():
+                    head.processed.set_result(None)
+        finally:
+            if not producer.done():
+                producer.cancel()
+            await asyncio.gather(producer, return_exceptions=True)
+            for name, value in counts.items():
+                self.stats[name] = max(self.stats[name], value) if name == "max_buffered" else self.stats[name] + value
+            if counts["coalesced"] or counts["dropped"] or counts["superseded"]:
+                logger.info(
+                    f"Event stream{f' ({label})' if label else ''}: {counts['events_in']} events in, "
+                    f"{counts['events_out']} out, {counts['coalesced']} coalesced, {counts['dropped']} dropped, "
+                    f"{counts['superseded']} superseded"
+                )
+
+
+# Shared by all sessions; the buffer itself is per relay, i.e. per session step
+event_stream = EventStream.from_env()
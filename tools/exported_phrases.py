@@ -0,0 +1,349 @@
+"""
+Exported Phrases for No-Match Analysis Agent
+Persistent record of the training phrases already exported per bot and intent,
+so delta CSV exports (see artifact_utils.save_delta_csv_artifact) only contain
+phrases that were never exported before.
+
+Phrases are stored as 16-byte digests of the normalized (intent, phrase) pair
+in a local SQLite file. Rows without an intent or a phrase are never exported. An in-memory Bloom filter per bot sits in front of it:
+a phrase the filter has never seen is new without a database lookup, and only
+the filter's "maybe" answers are confirmed in SQLite.
+"""
+
+import hashlib
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+DEFAULT_EXPORTED_PHRASES_DB_PATH = "exported_phrases.db"
+
+INTENT_COLUMN = "Intent Name"
+PHRASE_COLUMN = "Training Phrase"
+LANGUAGE_COLUMN = "Language Code"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS exported_phrases (
+    bot_id TEXT NOT NULL,
+    digest BLOB NOT NULL,
+    intent TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    version INTEGER,
+    exported_at REAL NOT NULL,
+    PRIMARY KEY (bot_id, digest)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS phrase_exports (
+    bot_id TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    version INTEGER,
+    user_id TEXT,
+    session_id TEXT,
+    base_filename TEXT,
+    base_version INTEGER,
+    new_rows INTEGER NOT NULL,
+    skipped_rows INTEGER NOT NULL,
+    exported_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS phrase_exports_bot ON phrase_exports (bot_id, exported_at);
+"""
+
+
+def phrase_digest(intent: str, phrase: str) -> bytes:
+    """
+    Digest of a training phrase of an intent, ignoring case and spacing.
+
+    Returns:
+        bytes: 16-byte BLAKE2b digest
+    """
+    normalized = "\x1f".join(re.sub(r"\s+", " ", value or "").strip().casefold() for value in (intent, phrase))
+    return hashlib.blake2b(normalized.encode("utf-8"), digest_size=16).digest()
+
+
+class BloomFilter:
+    """
+    Fixed-size Bloom filter over byte-string keys.
+
+    Bit positions come from double hashing the key's BLAKE2b digest, so keys
+    that are already digests cost one hash per lookup.
+    """
+
+    def __init__(self, capacity: int, false_positive_rate: float = 0.01):
+        """
+        Args:
+            capacity: Keys the filter is sized for
+            false_positive_rate: False positive rate at `capacity` keys
+        """
+        capacity = max(1, capacity)
+        self.capacity = capacity
+        self.num_bits = max(8, int(-capacity * math.log(false_positive_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.num_bits + 7) // 8)
+
+    def _positions(self, key: bytes) -> Iterable[int]:
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return ((first + i * second) % self.num_bits for i in range(self.num_hashes))
+
+    def add(self, key: bytes) -> None:
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: bytes) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class ExportedPhraseRegistry:
+    """
+    Training phrases already exported per bot, plus the lineage of each export.
+
+    The SQLite file can be shared by every worker process on the host; each
+    process keeps its own Bloom filters, which only ever miss phrases that
+    another process exported since the filter was built, and those are caught
+    by the database lookup on the next "maybe" or by the primary key on insert.
+    """
+
+    def __init__(self, db_path: str, false_positive_rate: float = 0.01):
+        """
+        Args:
+            db_path: Path to the SQLite database file
+            false_positive_rate: Target false positive rate of the Bloom filters
+        """
+        self.db_path = db_path
+        self.false_positive_rate = false_positive_rate
+        self._lock = threading.Lock()
+        self._filters: Dict[str, BloomFilter] = {}
+        self._conn = sqlite3.connect(db_path, timeout=5.0, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+        self.metrics = {"checked": 0, "filter_negatives": 0, "database_lookups": 0, "false_positives": 0}
+
+    @classmethod
+    def from_env(cls) -> "ExportedPhraseRegistry":
+        """
+        Build a registry at `EXPORTED_PHRASES_DB_PATH`.
+
+        Returns:
+            ExportedPhraseRegistry: Registry backed by the local SQLite file
+        """
+        return cls(os.environ.get("EXPORTED_PHRASES_DB_PATH", DEFAULT_EXPORTED_PHRASES_DB_PATH))
+
+    def _filter(self, bot_id: str) -> BloomFilter:
+        """Bloom filter of a bot, built from the database on first use."""
+        bloom = self._filters.get(bot_id)
+        if bloom is None:
+            digests = [row[0] for row in self._conn.execute(
+                "SELECT digest FROM exported_phrases WHERE bot_id = ?", (bot_id,)
+            )]
+            # Room to grow before the false positive rate degrades
+            bloom = BloomFilter(max(10000, 2 * len(digests)), self.false_positive_rate)
+            for digest in digests:
+                bloom.add(digest)
+            self._filters[bot_id] = bloom
+        elif bloom.count >= bloom.capacity:
+            del self._filters[bot_id]
+            return self._filter(bot_id)
+        return bloom
+
+    @staticmethod
+    def _digest_rows(
+        rows: List[Dict[str, Any]], intent_column: str, phrase_column: str
+    ) -> List[Tuple[bytes, str, Dict[str, Any]]]:
+        """(digest, intent, row) of the rows with an intent and a phrase, first occurrence of each phrase only."""
+        digested = []
+        seen = set()
+        for row in rows:
+            intent = (row.get(intent_column) or "").strip()
+            phrase = (row.get(phrase_column) or "").strip()
+            if not intent or not phrase:
+                continue
+            digest = phrase_digest(intent, phrase)
+            if digest in seen:
+                continue
+            seen.add(digest)
+            digested.append((digest, intent, row))
+        return digested
+
+    def _exported(self, bot_id: str, digests: List[bytes]) -> set:
+        """The digests already in the database; call with the lock held."""
+        bloom = self._filter(bot_id)
+        maybe = [digest for digest in digests if digest in bloom]
+        self.metrics["checked"] += len(digests)
+        self.metrics["filter_negatives"] += len(digests) - len(maybe)
+        self.metrics["database_lookups"] += len(maybe)
+
+        exported = set()
+        for start in range(0, len(maybe), 500):
+            chunk = maybe[start:start + 500]
+            exported.update(row[0] for row in self._conn.execute(
+                f"SELECT digest FROM exported_phrases WHERE bot_id = ? AND digest IN ({','.join('?' * len(chunk))})",
+                (bot_id, *chunk),
+            ))
+        self.metrics["false_positives"] += len(maybe) - len(exported)
+        return exported
+
+    def split_new(
+        self, bot_id: str, rows: List[Dict[str, Any]], intent_column: str = INTENT_COLUMN, phrase_column: str = PHRASE_COLUMN
+    ) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        Keep the rows whose phrase was never exported for the bot, without
+        reserving them (see `reserve_new`).
+
+        Args:
+            bot_id: Bot the phrases belong to
+            rows: CSV rows
+            intent_column: Column holding the intent name
+            phrase_column: Column holding the training phrase
+
+        Returns:
+            Tuple[List[Dict[str, Any]], int]: New rows (first occurrence only)
+            and the number of rows skipped, including rows without an intent
+            or a phrase
+        """
+        candidates = self._digest_rows(rows, intent_column, phrase_column)
+        with self._lock:
+            exported = self._exported(bot_id, [digest for digest, _, _ in candidates])
+        new_rows = [row for digest, _, row in candidates if digest not in exported]
+        return new_rows, len(rows) - len(new_rows)
+
+    def reserve_new(
+        self,
+        bot_id: str,
+        rows: List[Dict[str, Any]],
+        filename: str,
+        intent_column: str = INTENT_COLUMN,
+        phrase_column: str = PHRASE_COLUMN,
+    ) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        Like `split_new`, but also records the new phrases for `filename` in
+        the same transaction, so concurrent exports of the bot (in this or
+        another process) never both get a phrase. Finish the export with
+        `record_export`, or undo it with `release`.
+
+        Returns:
+            Tuple[List[Dict[str, Any]], int]: Reserved rows and the number of rows skipped
+        """
+        candidates = self._digest_rows(rows, intent_column, phrase_column)
+        now = time.time()
+        with self._lock:
+            # The write lock is taken before the lookup, so no other process can reserve in between
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                exported = self._exported(bot_id, [digest for digest, _, _ in candidates])
+                reserved = []
+                for digest, intent, row in candidates:
+                    if digest in exported:
+                        continue
+                    # The filter may not know phrases another process reserved; the primary key does
+                    inserted = self._conn.execute(
+                        "INSERT OR IGNORE INTO exported_phrases VALUES (?, ?, ?, ?, NULL, ?)",
+                        (bot_id, digest, intent, filename, now),
+                    ).rowcount
+                    if inserted:
+                        reserved.append((digest, intent, row))
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                raise
+            bloom = self._filter(bot_id)
+            for digest, _, _ in reserved:
+                bloom.add(digest)
+        new_rows = [row for _, _, row in reserved]
+        return new_rows, len(rows) - len(new_rows)
+
+    def release(self, bot_id: str, filename: str) -> None:
+        """Drop the phrases reserved for an export that was not saved."""
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    "DELETE FROM exported_phrases WHERE bot_id = ? AND filename = ? AND version IS NULL",
+                    (bot_id, filename),
+                )
+
+    def last_export(self, bot_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Get the most recent export of a bot.
+
+        Returns:
+            Optional[Dict[str, Any]]: filename, version, user_id, session_id and
+            exported_at of the last export, None if the bot was never exported
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT filename, version, user_id, session_id, exported_at FROM phrase_exports "
+                "WHERE bot_id = ? ORDER BY exported_at DESC, rowid DESC LIMIT 1",
+                (bot_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("filename", "version", "user_id", "session_id", "exported_at"), row))
+
+    def record_export(
+        self,
+        bot_id: str,
+        rows: List[Dict[str, Any]],
+        filename: str,
+        version: Optional[int],
+        user_id: Optional[str] = None,
+        session_id: Optional[str] = None,
+        base: Optional[Dict[str, Any]] = None,
+        skipped_rows: int = 0,
+        intent_column: str = INTENT_COLUMN,
+        phrase_column: str = PHRASE_COLUMN,
+    ) -> None:
+        """
+        Record exported rows and the export's lineage.
+
+        Args:
+            bot_id: Bot the phrases belong to
+            rows: Rows written to the artifact
+            filename: Artifact filename
+            version: Artifact version
+            user_id: User the artifact was saved for
+            session_id: Session the artifact was saved in
+            base: Previous export of the bot (from `last_export`), if any
+            skipped_rows: Rows left out because they were exported before
+        """
+        now = time.time()
+        digests = [(digest, intent) for digest, intent, _ in self._digest_rows(rows, intent_column, phrase_column)]
+        with self._lock:
+            with self._conn:
+                # Phrases reserved for this export (see `reserve_new`) get its version
+                self._conn.executemany(
+                    "INSERT INTO exported_phrases VALUES (?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (bot_id, digest) DO UPDATE SET version = excluded.version, exported_at = excluded.exported_at "
+                    "WHERE exported_phrases.filename = excluded.filename AND exported_phrases.version IS NULL",
+                    [(bot_id, digest, intent, filename, version, now) for digest, intent in digests],
+                )
+                self._conn.execute(
+                    "INSERT INTO phrase_exports VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (bot_id, filename, version, user_id, session_id,
+                     (base or {}).get("filename"), (base or {}).get("version"), len(rows), skipped_rows, now),
+                )
+            bloom = self._filter(bot_id)
+            for digest, _ in digests:
+                bloom.add(digest)
+
+
+_registry: Optional[ExportedPhraseRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_exported_phrase_registry() -> ExportedPhraseRegistry:
+    """
+    Get the process-wide registry, opening its database on first use.
+
+    Returns:
+        ExportedPhraseRegistry: Registry configured from the environment
+    """
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ExportedPhraseRegistry.from_env()
+        return _registry
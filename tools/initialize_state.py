@@ -1,19 +1,22 @@
 from google.adk.agents.callback_context import CallbackContext
 from google.adk.sessions.state import State
 from google.adk.tools import ToolContext
+import asyncio
 import os
 from tools.bigquery_tools import bigquery_metdata_extraction_tool
 
-def initialize_state_var(callback_context: CallbackContext):
+async def initialize_state_var(callback_context: CallbackContext):
     """
     Initialize state variables for the no-match analysis agent.
     Sets up BigQuery configuration and initializes all workflow state variables.
+    Configuration already present in session state (e.g. set per job by the
+    batch runner) takes precedence over the environment.
     """
     # Initialize BigQuery configuration
-    PROJECT = os.environ.get("PROJECT")
-    BQ_LOCATION = os.environ.get("BQ_LOCATION")
-    DATASET = os.environ.get("DATASET")
-    GCS_BUCKET_NAME = os.environ.get("GCS_BUCKET_NAME")
+    PROJECT = callback_context.state.get("PROJECT") or os.environ.get("PROJECT")
+    BQ_LOCATION = callback_context.state.get("BQ_LOCATION") or os.environ.get("BQ_LOCATION")
+    DATASET = callback_context.state.get("DATASET") or os.environ.get("DATASET")
+    GCS_BUCKET_NAME = callback_context.state.get("GCS_BUCKET_NAME") or os.environ.get("GCS_BUCKET_NAME")
 
     callback_context.state["PROJECT"] = PROJECT
     callback_context.state["BQ_LOCATION"] = BQ_LOCATION
@@ -22,7 +25,9 @@ def initialize_state_var(callback_context: CallbackContext):
 
     # Initialize BigQuery metadata for conversation data retrieval
     try:
-        bigquery_metadata = bigquery_metdata_extraction_tool(
+        # Off the event loop, so concurrent sessions are not blocked by the lookup
+        bigquery_metadata = await asyncio.to_thread(
+            bigquery_metdata_extraction_tool,
             PROJECT=PROJECT,
             BQ_LOCATION=BQ_LOCATION,
             DATASET=DATASET
@@ -35,9 +40,13 @@ def initialize_state_var(callback_context: CallbackContext):
     # Initialize no-match analysis flow state variables
     callback_context.state["conversation_data_output"] = ""
     callback_context.state["no_match_analysis_output"] = ""
-    callback_context.state["dialogflow_bot_json"] = ""
+    callback_context.state["dialogflow_bot_json"] = callback_context.state.get("dialogflow_bot_json") or ""
     callback_context.state["dialogflow_analysis_output"] = ""
     callback_context.state["csv_generation_output"] = ""
+
+    # Reset the degraded marker of a previous run (see tools/step_deadlines.py)
+    callback_context.state["run_degraded"] = False
+    callback_context.state["degraded_steps"] = []
     
     # Initialize user query for context
     callback_context.state["user_query"] = "" 
\ No newline at end of file
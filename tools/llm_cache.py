@@ -0,0 +1,244 @@
+"""
+LLM Response Cache for No-Match Analysis Agent
+Opt-in memoization of sub-agent model calls, keyed by a hash of the model name,
+rendered instruction and request contents. Cached responses are returned from
+`before_model_callback`, so ADK emits them as normal events.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.models.llm_request import LlmRequest
+from google.adk.models.llm_response import LlmResponse
+
+logger = logging.getLogger(__name__)
+
+# Session state flag that skips cache lookups for one session (responses are still stored)
+LLM_CACHE_BYPASS_STATE_KEY = "llm_cache_bypass"
+
+
+def _strip_call_ids(value: Any) -> Any:
+    """Drop client-generated function call ids, which differ on every run."""
+    if isinstance(value, dict):
+        return {k: _strip_call_ids(v) for k, v in value.items() if k != "id" or not _is_call_payload(value)}
+    if isinstance(value, list):
+        return [_strip_call_ids(v) for v in value]
+    return value
+
+
+def _is_call_payload(value: Dict[str, Any]) -> bool:
+    return "name" in value and ("args" in value or "response" in value)
+
+
+def compute_request_key(llm_request: LlmRequest) -> str:
+    """
+    Compute the cache key for a model request.
+
+    Args:
+        llm_request: Fully rendered request about to be sent to the model
+
+    Returns:
+        str: SHA-256 hex digest of model, instruction, config and contents
+    """
+    key_material = {
+        "model": llm_request.model,
+        "config": llm_request.config.model_dump(mode="json", exclude_none=True) if llm_request.config else {},
+        "contents": [content.model_dump(mode="json", exclude_none=True) for content in llm_request.contents],
+    }
+    serialized = json.dumps(_strip_call_ids(key_material), sort_keys=True, default=str)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+class LlmResponseCache:
+    """
+    Two-tier response cache: an in-process LRU in front of a directory of
+    JSON files that can be shared between processes and runs.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = False,
+        cache_dir: Optional[str] = None,
+        max_memory_entries: int = 256,
+        ttl_seconds: float = 86400,
+        bypass: bool = False,
+    ):
+        """
+        Args:
+            enabled: Whether lookups and stores happen at all
+            cache_dir: Directory for the disk tier, or None for memory only
+            max_memory_entries: Size of the in-process LRU tier
+            ttl_seconds: Entries older than this are treated as misses
+            bypass: Skip lookups globally while still refreshing stored entries
+        """
+        self.enabled = enabled
+        self.cache_dir = cache_dir
+        self.max_memory_entries = max_memory_entries
+        self.ttl_seconds = ttl_seconds
+        self.bypass = bypass
+
+        self._memory: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._pending_keys: Dict[Tuple[str, str], str] = {}
+        self.stats = {"hits": 0, "misses": 0, "stores": 0}
+
+        if self.enabled and self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    @classmethod
+    def from_env(cls) -> "LlmResponseCache":
+        """
+        Build a cache from `LLM_CACHE_*` environment variables.
+
+        Returns:
+            LlmResponseCache: Cache instance, disabled unless LLM_CACHE_ENABLED is set
+        """
+        return cls(
+            enabled=os.environ.get("LLM_CACHE_ENABLED", "false").lower() in ("1", "true", "yes"),
+            cache_dir=os.environ.get("LLM_CACHE_DIR", ".llm_cache") or None,
+            max_memory_entries=int(os.environ.get("LLM_CACHE_MAX_ENTRIES", "256")),
+            ttl_seconds=float(os.environ.get("LLM_CACHE_TTL_SECONDS", "86400")),
+            bypass=os.environ.get("LLM_CACHE_BYPASS", "false").lower() in ("1", "true", "yes"),
+        )
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key: str) -> Optional[LlmResponse]:
+        """
+        Look up a cached response.
+
+        Args:
+            key: Request key from `compute_request_key`
+
+        Returns:
+            Optional[LlmResponse]: Cached response, or None on a miss or expiry
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+
+        if entry is None and self.cache_dir:
+            try:
+                with open(self._disk_path(key), "r", encoding="utf-8") as f:
+                    record = json.load(f)
+                entry = (record["created_at"], record["response"])
+                self._remember(key, entry)
+            except FileNotFoundError:
+                entry = None
+            except Exception as e:
+                logger.warning(f"Ignoring unreadable LLM cache entry {key}: {e}")
+                entry = None
+
+        if entry is None or now - entry[0] > self.ttl_seconds:
+            return None
+        return LlmResponse.model_validate_json(entry[1])
+
+    def put(self, key: str, llm_response: LlmResponse) -> None:
+        """
+        Store a response in both tiers.
+
+        Args:
+            key: Request key from `compute_request_key`
+            llm_response: Final, non-partial model response
+        """
+        entry = (time.time(), llm_response.model_dump_json(exclude_none=True))
+        self._remember(key, entry)
+
+        if self.cache_dir:
+            try:
+                # Write-then-rename so concurrent readers never see a partial file
+                fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump({"created_at": entry[0], "response": entry[1]}, f)
+                os.replace(tmp_path, self._disk_path(key))
+            except Exception as e:
+                logger.warning(f"Could not write LLM cache entry {key}: {e}")
+        self.stats["stores"] += 1
+
+    def _remember(self, key: str, entry: Tuple[float, str]) -> None:
+        with self._lock:
+            self._memory[key] = entry
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_memory_entries:
+                self._memory.popitem(last=False)
+
+    def clear(self) -> None:
+        """Drop the in-process tier (the disk tier is left untouched)."""
+        with self._lock:
+            self._memory.clear()
+
+    def before_model_callback(
+        self, callback_context: CallbackContext, llm_request: LlmRequest
+    ) -> Optional[LlmResponse]:
+        """
+        ADK `before_model_callback` that replays a cached response on a hit.
+
+        Args:
+            callback_context: Callback context of the calling sub-agent
+            llm_request: Rendered model request
+
+        Returns:
+            Optional[LlmResponse]: Cached response to use instead of calling the model
+        """
+        if not self.enabled:
+            return None
+
+        key = compute_request_key(llm_request)
+        self._pending_keys[(callback_context.invocation_id, callback_context.agent_name)] = key
+
+        if self.bypass or callback_context.state.get(LLM_CACHE_BYPASS_STATE_KEY):
+            return None
+
+        cached = self.get(key)
+        if cached is None:
+            self.stats["misses"] += 1
+            return None
+
+        self.stats["hits"] += 1
+        logger.info(f"LLM cache hit for {callback_context.agent_name} ({key[:12]})")
+        cached.custom_metadata = {**(cached.custom_metadata or {}), "llm_cache": "hit"}
+        return cached
+
+    def after_model_callback(
+        self, callback_context: CallbackContext, llm_response: LlmResponse
+    ) -> Optional[LlmResponse]:
+        """
+        ADK `after_model_callback` that stores final model responses.
+
+        Args:
+            callback_context: Callback context of the calling sub-agent
+            llm_response: Response returned by the model
+
+        Returns:
+            None: The response is never modified
+        """
+        if not self.enabled or llm_response.partial:
+            return None
+        key = self._pending_keys.pop((callback_context.invocation_id, callback_context.agent_name), None)
+        if llm_response.error_code or (llm_response.custom_metadata or {}).get("llm_cache") == "hit":
+            return None
+        if key and llm_response.content:
+            self.put(key, llm_response)
+        return None
+
+    def on_model_error_callback(
+        self, callback_context: CallbackContext, llm_request: LlmRequest, error: Exception
+    ) -> Optional[LlmResponse]:
+        """ADK `on_model_error_callback` that forgets the failed request's key."""
+        self._pending_keys.pop((callback_context.invocation_id, callback_context.agent_name), None)
+        return None
+
+
+# Shared cache used by all sub-agents
+llm_response_cache = LlmResponseCache.from_env()
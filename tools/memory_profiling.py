@@ -0,0 +1,345 @@
+"""
+Memory Profiling for No-Match Analysis Agent
+Opt-in tracemalloc profiling around each orchestrator step and each tool call.
+Every profile records the peak and net traced memory, the top allocation sites
+and the retained size of each state key. At the end of a run the profiles are
+saved as a JSON artifact (and optionally to a local directory) so regressions
+can be compared between runs.
+
+tracemalloc counts the whole process: with several sessions running at once a
+profile also includes their allocations, so profile one run at a time.
+"""
+
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.tools import BaseTool, ToolContext
+from google.genai import types
+
+from tools.state_offload import is_offloaded_reference
+
+logger = logging.getLogger(__name__)
+
+MEMORY_PROFILE_MIME_TYPE = "application/json"
+
+# Allocations made by the profiler itself are not attributed to the workload
+_IGNORED_TRACE_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, __file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+]
+
+
+def retained_size(value: Any, _seen: Optional[set] = None) -> int:
+    """
+    Estimate the memory retained by a value and everything it references.
+
+    Args:
+        value: State value (str, bytes, containers, pydantic models, ...)
+
+    Returns:
+        int: Bytes, counting each shared object once
+    """
+    seen = _seen if _seen is not None else set()
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(retained_size(k, seen) + retained_size(v, seen) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(retained_size(item, seen) for item in value)
+    elif hasattr(value, "__dict__") and not isinstance(value, type):
+        size += retained_size(vars(value), seen)
+    return size
+
+
+def state_key_sizes(state: Dict[str, Any]) -> Dict[str, Dict[str, int]]:
+    """
+    Measure every state key, largest first.
+
+    Args:
+        state: Session state as a plain mapping
+
+    Returns:
+        Dict[str, Dict[str, int]]: Per key, the bytes retained in the session
+        and, for offloaded values, the payload size held in the artifact store
+    """
+    sizes = {}
+    for key, value in state.items():
+        entry = {"retained_bytes": retained_size(value)}
+        if is_offloaded_reference(value):
+            entry["offloaded_bytes"] = value.get("size", 0)
+        sizes[key] = entry
+    return dict(sorted(sizes.items(), key=lambda item: item[1]["retained_bytes"], reverse=True))
+
+
+class _OpenProfile:
+    """A step or tool call being profiled."""
+
+    def __init__(self, kind: str, name: str, snapshot: tracemalloc.Snapshot, traced_bytes: int):
+        self.kind = kind
+        self.name = name
+        self.snapshot = snapshot
+        self.traced_bytes = traced_bytes
+        self.peak_bytes = traced_bytes
+        self.started_at = datetime.now().isoformat()
+        self.started = time.perf_counter()
+
+
+class MemoryProfiler:
+    """
+    Collects tracemalloc profiles per orchestrator step and tool call.
+
+    Steps are profiled by the orchestrator with `start_step` / `finish_step`,
+    tool calls by the `before_tool_callback` / `after_tool_callback` pair. Peaks
+    are tracked per profile, so a tool call nested in a step does not hide the
+    step's own peak.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = False,
+        top_n: int = 10,
+        traceback_frames: int = 1,
+        output_dir: Optional[str] = None,
+    ):
+        """
+        Args:
+            enabled: Profile steps and tool calls
+            top_n: Allocation sites reported per profile
+            traceback_frames: Frames stored per allocation (1 = file:line only)
+            output_dir: Also write each run's report to this local directory
+        """
+        self.enabled = enabled
+        self.top_n = top_n
+        self.traceback_frames = traceback_frames
+        self.output_dir = output_dir
+        self._lock = threading.Lock()
+        self._open: Dict[Tuple[str, str], _OpenProfile] = {}
+        self._profiles: Dict[str, List[Dict[str, Any]]] = {}
+        self._started_tracing = False
+
+    @classmethod
+    def from_env(cls) -> "MemoryProfiler":
+        """
+        Build a profiler from `MEMORY_PROFILING_ENABLED`, `MEMORY_PROFILING_TOP_N`,
+        `MEMORY_PROFILING_FRAMES` and `MEMORY_PROFILING_DIR`.
+
+        Returns:
+            MemoryProfiler: Profiler, disabled unless MEMORY_PROFILING_ENABLED is set
+        """
+        return cls(
+            enabled=os.environ.get("MEMORY_PROFILING_ENABLED", "false").lower() in ("1", "true", "yes"),
+            top_n=int(os.environ.get("MEMORY_PROFILING_TOP_N", "10")),
+            traceback_frames=int(os.environ.get("MEMORY_PROFILING_FRAMES", "1")),
+            output_dir=os.environ.get("MEMORY_PROFILING_DIR") or None,
+        )
+
+    def _fold_peak(self) -> None:
+        """Credit the peak since the last reset to every open profile."""
+        peak = tracemalloc.get_traced_memory()[1]
+        for profile in self._open.values():
+            profile.peak_bytes = max(profile.peak_bytes, peak)
+        tracemalloc.reset_peak()
+
+    def _start(self, invocation_id: str, kind: str, name: str) -> None:
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(self.traceback_frames)
+                self._started_tracing = True
+            self._fold_peak()
+            traced_bytes = tracemalloc.get_traced_memory()[0]
+            snapshot = tracemalloc.take_snapshot()
+            self._open[(invocation_id, f"{kind}:{name}")] = _OpenProfile(kind, name, snapshot, traced_bytes)
+            tracemalloc.reset_peak()
+
+    def _finish(self, invocation_id: str, kind: str, name: str, state: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                return None
+            self._fold_peak()
+            profile = self._open.pop((invocation_id, f"{kind}:{name}"), None)
+            if profile is None:
+                return None
+            traced_bytes = tracemalloc.get_traced_memory()[0]
+            snapshot = tracemalloc.take_snapshot()
+
+            # Filtering and comparing allocate too; the peak is reset afterwards
+            # so this work is not credited to the profiles still open
+            key_type = "traceback" if self.traceback_frames > 1 else "lineno"
+            stats = snapshot.filter_traces(_IGNORED_TRACE_FILTERS).compare_to(
+                profile.snapshot.filter_traces(_IGNORED_TRACE_FILTERS), key_type
+            )
+            top_allocations = [
+                {
+                    "site": [f"{frame.filename}:{frame.lineno}" for frame in stat.traceback],
+                    "size_bytes": stat.size,
+                    "size_diff_bytes": stat.size_diff,
+                    "count_diff": stat.count_diff,
+                }
+                for stat in stats[:self.top_n]
+            ]
+            key_sizes = state_key_sizes(state)
+            del snapshot, stats, profile.snapshot
+            tracemalloc.reset_peak()
+
+        result = {
+            "kind": kind,
+            "name": name,
+            "started_at": profile.started_at,
+            "duration_seconds": round(time.perf_counter() - profile.started, 6),
+            "traced_before_bytes": profile.traced_bytes,
+            "traced_after_bytes": traced_bytes,
+            "net_bytes": traced_bytes - profile.traced_bytes,
+            "peak_bytes": profile.peak_bytes,
+            "peak_over_start_bytes": profile.peak_bytes - profile.traced_bytes,
+            "top_allocations": top_allocations,
+            "state_keys": key_sizes,
+        }
+        with self._lock:
+            self._profiles.setdefault(invocation_id, []).append(result)
+        logger.info(
+            f"Memory profile {kind} {name}: peak +{result['peak_over_start_bytes'] / 1e6:.1f} MB, "
+            f"net {result['net_bytes'] / 1e6:+.1f} MB"
+        )
+        return result
+
+    def start_step(self, ctx: InvocationContext, step_name: str) -> None:
+        """
+        Start profiling an orchestrator step.
+
+        Args:
+            ctx: Invocation context of the orchestrator run
+            step_name: Workflow step name
+        """
+        if self.enabled:
+            self._start(ctx.invocation_id, "step", step_name)
+
+    def finish_step(self, ctx: InvocationContext, step_name: str) -> Optional[Dict[str, Any]]:
+        """
+        Finish profiling an orchestrator step.
+
+        Args:
+            ctx: Invocation context of the orchestrator run
+            step_name: Workflow step name
+
+        Returns:
+            Optional[Dict[str, Any]]: The step's profile, or None when disabled
+        """
+        if not self.enabled:
+            return None
+        return self._finish(ctx.invocation_id, "step", step_name, dict(ctx.session.state))
+
+    def before_tool_callback(self, tool: BaseTool, args: Dict[str, Any], tool_context: ToolContext) -> Optional[Dict]:
+        """
+        ADK `before_tool_callback` that starts profiling a tool call.
+
+        Returns:
+            None: The tool call always proceeds
+        """
+        if self.enabled:
+            self._start(tool_context.invocation_id, "tool", f"{tool.name}:{tool_context.function_call_id}")
+        return None
+
+    def after_tool_callback(
+        self, tool: BaseTool, args: Dict[str, Any], tool_context: ToolContext, tool_response: Any
+    ) -> Optional[Dict]:
+        """
+        ADK `after_tool_callback` that finishes profiling a tool call.
+
+        Returns:
+            None: The tool response is never modified
+        """
+        if self.enabled:
+            self._finish(
+                tool_context.invocation_id, "tool", f"{tool.name}:{tool_context.function_call_id}",
+                tool_context.state.to_dict(),
+            )
+        return None
+
+    def _release(self, invocation_id: str) -> List[Dict[str, Any]]:
+        """Take a run's profiles, drop its open ones and stop tracing once nothing is profiled."""
+        with self._lock:
+            profiles = self._profiles.pop(invocation_id, [])
+            # Tool calls that raised never reach after_tool_callback
+            for key in [key for key in self._open if key[0] == invocation_id]:
+                del self._open[key]
+            if self._started_tracing and not self._open and not self._profiles:
+                tracemalloc.stop()
+                self._started_tracing = False
+        return profiles
+
+    def discard(self, ctx: InvocationContext) -> None:
+        """
+        Drop what was profiled for a run without saving it, e.g. when the run
+        failed or was cancelled, and stop tracing once nothing is profiled.
+        Does nothing for a run whose report was saved.
+
+        Args:
+            ctx: Invocation context of the orchestrator run
+        """
+        profiles = self._release(ctx.invocation_id)
+        if profiles:
+            logger.info(f"Discarded {len(profiles)} memory profile(s) of unfinished run {ctx.invocation_id}")
+
+    async def save_report(self, ctx: InvocationContext) -> Optional[str]:
+        """
+        Save the profiles of a run and stop tracing once nothing is profiled.
+
+        The report is saved as the session artifact
+        `memory_profile_<invocation_id>.json` and, if configured, written to
+        the local output directory.
+
+        Args:
+            ctx: Invocation context of the orchestrator run
+
+        Returns:
+            Optional[str]: Artifact filename, or None if there was nothing to save
+        """
+        profiles = self._release(ctx.invocation_id)
+        if not profiles:
+            return None
+
+        report = {
+            "app_name": ctx.app_name,
+            "session_id": ctx.session.id,
+            "invocation_id": ctx.invocation_id,
+            "timestamp": datetime.now().isoformat(),
+            "profiles": profiles,
+        }
+        payload = json.dumps(report, indent=2, default=str).encode("utf-8")
+        filename = f"memory_profile_{ctx.invocation_id}.json"
+
+        if self.output_dir:
+            os.makedirs(self.output_dir, exist_ok=True)
+            with open(os.path.join(self.output_dir, filename), "wb") as f:
+                f.write(payload)
+
+        if ctx.artifact_service is not None:
+            try:
+                await ctx.artifact_service.save_artifact(
+                    app_name=ctx.app_name,
+                    user_id=ctx.user_id,
+                    session_id=ctx.session.id,
+                    filename=filename,
+                    artifact=types.Part.from_bytes(data=payload, mime_type=MEMORY_PROFILE_MIME_TYPE),
+                )
+            except Exception as e:
+                logger.warning(f"Could not save memory profile artifact {filename}: {e}")
+        return filename
+
+
+# Shared by the orchestrator and the tool-calling sub-agents
+memory_profiler = MemoryProfiler.from_env()
@@ -0,0 +1,424 @@
+"""
+Model Tiering for No-Match Analysis Agent
+Per-call model routing across cost/capability tiers (by default
+gemini-2.5-flash-lite, gemini-2.5-flash and gemini-2.5-pro).
+
+Each sub-agent starts at its step's tier. A request whose estimated input is
+larger than a tier's `max_input_tokens` moves up to a tier that fits it, and
+with a latency target (SLO) set, a tier whose observed p90 latency for the step
+misses the target gives way to the most capable cheaper tier that meets it.
+A response that fails validation (empty, cut off, or a CSV without its header
+row) is retried once on each higher tier until one passes.
+
+Routing happens inside the model (`TieredLlm`), after the sub-agent's callbacks,
+by setting the request's model name, so the LLM cache, rate limiter and retry
+policy apply unchanged. Requests referencing a cached context stay on the model
+the context was created for.
+
+Per-tier calls, validation failures, latency and list-price cost are kept by
+`ModelRouter.report()` so the thresholds can be tuned from real runs.
+"""
+
+import csv
+import io
+import logging
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Any, AsyncGenerator, Callable, Deque, Dict, List, Optional, Tuple
+
+from google.adk.models.base_llm import BaseLlm
+from google.adk.models.llm_request import LlmRequest
+from google.adk.models.llm_response import LlmResponse
+
+from tools.phrase_validation import extract_csv_content, find_phrase_columns
+from tools.rate_limiter import estimate_request_tokens
+from tools.resilience import resilient_model
+
+logger = logging.getLogger(__name__)
+
+# Cheapest first; "name=model" pairs
+DEFAULT_MODEL_TIERS = "lite=gemini-2.5-flash-lite,flash=gemini-2.5-flash,pro=gemini-2.5-pro"
+# Largest estimated input each tier is trusted with (0 = no limit)
+DEFAULT_MAX_INPUT_TOKENS = {"lite": 8000, "flash": 200000, "pro": 0}
+# List price in USD per million input and output tokens
+DEFAULT_TIER_COSTS = {"lite": (0.10, 0.40), "flash": (0.30, 2.50), "pro": (1.25, 10.00)}
+# Starting tier per step: filling the SQL template is trivial, the rest needs flash
+DEFAULT_STEP_TIERS = {
+    "conversation_data_retrieval_agent": "lite",
+    "dialogflow_cx_parser_agent": "flash",
+    "no_match_analysis_agent": "flash",
+    "csv_generation_agent": "flash",
+}
+
+_LATENCY_WINDOW = 200
+# Observed latencies needed before a tier's p90 is trusted for the SLO
+_MIN_SLO_SAMPLES = 5
+_SLO_PERCENTILE = 0.9
+
+
+class ModelTier:
+    """One model of the tier ladder."""
+
+    def __init__(self, name: str, model: str, max_input_tokens: int = 0,
+                 input_cost_per_million: float = 0.0, output_cost_per_million: float = 0.0):
+        """
+        Args:
+            name: Tier name, e.g. "lite"
+            model: Model name sent to Gemini
+            max_input_tokens: Largest estimated input routed to this tier, 0 for no limit
+            input_cost_per_million: USD per million input tokens
+            output_cost_per_million: USD per million output (and thinking) tokens
+        """
+        self.name = name
+        self.model = model
+        self.max_input_tokens = max_input_tokens
+        self.input_cost_per_million = input_cost_per_million
+        self.output_cost_per_million = output_cost_per_million
+
+    def fits(self, input_tokens: int) -> bool:
+        return not self.max_input_tokens or input_tokens <= self.max_input_tokens
+
+    def cost(self, input_tokens: int, output_tokens: int) -> float:
+        return (input_tokens * self.input_cost_per_million + output_tokens * self.output_cost_per_million) / 1_000_000
+
+
+def _response_text(responses: List[LlmResponse]) -> Tuple[str, bool]:
+    """Concatenated text of responses and whether any part is a function call."""
+    text, function_call = [], False
+    for response in responses:
+        for part in (response.content.parts if response.content else None) or []:
+            if part.function_call:
+                function_call = True
+            elif part.text and not part.thought:
+                text.append(part.text)
+    return "".join(text), function_call
+
+
+def _validate_csv(text: str) -> Optional[str]:
+    header = next(csv.reader(io.StringIO(extract_csv_content(text))), [])
+    intent_column, phrase_column = find_phrase_columns(header)
+    return None if intent_column and phrase_column else "csv_header_missing"
+
+
+# Step-specific checks on the text of a final response
+STEP_VALIDATORS: Dict[str, Callable[[str], Optional[str]]] = {
+    "csv_generation_agent": _validate_csv,
+}
+
+
+def validate_response(step: str, responses: List[LlmResponse]) -> Optional[str]:
+    """
+    Check a model response before it is accepted.
+
+    Args:
+        step: Sub-agent that made the call
+        responses: Responses of one non-streaming call
+
+    Returns:
+        Optional[str]: Failure reason, or None if the response is usable
+    """
+    if not responses:
+        return "empty_response"
+    if responses[-1].error_code:
+        return f"finish_reason:{responses[-1].error_code}"
+    text, function_call = _response_text(responses)
+    if function_call:
+        # Tool calls are checked by the tool itself
+        return None
+    if not text.strip():
+        return "empty_response"
+    validator = STEP_VALIDATORS.get(step)
+    return validator(text) if validator else None
+
+
+class ModelRouter:
+    """
+    Picks the tier of each model call and keeps per-tier latency and cost.
+    """
+
+    def __init__(
+        self,
+        tiers: List[ModelTier],
+        enabled: bool = False,
+        step_tiers: Optional[Dict[str, str]] = None,
+        latency_slo_seconds: float = 0.0,
+        step_latency_slos: Optional[Dict[str, float]] = None,
+    ):
+        """
+        Args:
+            tiers: Tier ladder, cheapest first
+            enabled: Whether calls are routed; when off every call uses the
+                sub-agent's own model, and is still measured
+            step_tiers: Starting tier name per sub-agent
+            latency_slo_seconds: Latency target of every step, 0 for none
+            step_latency_slos: Latency target per sub-agent, overriding the default
+        """
+        self.tiers = tiers
+        self.enabled = enabled
+        self.step_tiers = dict(DEFAULT_STEP_TIERS if step_tiers is None else step_tiers)
+        self.latency_slo_seconds = latency_slo_seconds
+        self.step_latency_slos = dict(step_latency_slos or {})
+
+        self._latencies: Dict[Tuple[str, str], Deque[float]] = defaultdict(lambda: deque(maxlen=_LATENCY_WINDOW))
+        self._stats: Dict[str, Dict[str, Any]] = {}
+        self._routes: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "ModelRouter":
+        """
+        Build a router from `MODEL_TIERING_ENABLED`, `MODEL_TIERS`,
+        `MODEL_TIER_MAX_INPUT_TOKENS_<TIER>`, `MODEL_TIER_COST_<TIER>` ("input,output"
+        USD per million tokens), `MODEL_TIER_<AGENT NAME>` (starting tier, e.g.
+        MODEL_TIER_NO_MATCH_ANALYSIS_AGENT=pro), `MODEL_TIER_LATENCY_SLO_SECONDS`
+        and `MODEL_TIER_LATENCY_SLO_SECONDS_<AGENT NAME>`.
+
+        Returns:
+            ModelRouter: Router configured from the environment, disabled by default
+        """
+        tiers = []
+        for entry in os.environ.get("MODEL_TIERS", DEFAULT_MODEL_TIERS).split(","):
+            name, _, model = entry.strip().partition("=")
+            if not model:
+                continue
+            key = name.upper()
+            input_cost, output_cost = DEFAULT_TIER_COSTS.get(name, (0.0, 0.0))
+            cost = os.environ.get(f"MODEL_TIER_COST_{key}")
+            if cost:
+                input_cost, output_cost = (float(value) for value in cost.split(","))
+            tiers.append(ModelTier(
+                name, model.strip(),
+                max_input_tokens=int(os.environ.get(f"MODEL_TIER_MAX_INPUT_TOKENS_{key}", DEFAULT_MAX_INPUT_TOKENS.get(name, 0))),
+                input_cost_per_million=input_cost,
+                output_cost_per_million=output_cost,
+            ))
+
+        step_tiers = dict(DEFAULT_STEP_TIERS)
+        for step in list(step_tiers):
+            step_tiers[step] = os.environ.get(f"MODEL_TIER_{step.upper()}", step_tiers[step])
+        slo_prefix = "MODEL_TIER_LATENCY_SLO_SECONDS_"
+        return cls(
+            tiers,
+            enabled=os.environ.get("MODEL_TIERING_ENABLED", "false").lower() in ("1", "true", "yes"),
+            step_tiers=step_tiers,
+            latency_slo_seconds=float(os.environ.get("MODEL_TIER_LATENCY_SLO_SECONDS", "0")),
+            step_latency_slos={
+                name[len(slo_prefix):].lower(): float(value)
+                for name, value in os.environ.items() if name.startswith(slo_prefix)
+            },
+        )
+
+    def tier_index(self, name_or_model: str) -> Optional[int]:
+        """Position of a tier in the ladder, by tier name or model name."""
+        for index, tier in enumerate(self.tiers):
+            if name_or_model in (tier.name, tier.model):
+                return index
+        return None
+
+    def latency_percentile(self, step: str, tier: ModelTier, percentile: float = _SLO_PERCENTILE) -> Optional[float]:
+        """Observed latency percentile of a tier for a step, or None with too few samples."""
+        with self._lock:
+            samples = sorted(self._latencies[(step, tier.name)])
+        if len(samples) < _MIN_SLO_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * percentile))]
+
+    def route(self, step: str, input_tokens: int, default_model: str) -> Tuple[Optional[int], str]:
+        """
+        Pick the tier of a call.
+
+        Args:
+            step: Sub-agent making the call
+            input_tokens: Estimated input tokens of the request
+            default_model: The sub-agent's own model
+
+        Returns:
+            Tuple[Optional[int], str]: Tier index (None for a model outside the
+            ladder) and the reason for the choice
+        """
+        if not self.enabled or not self.tiers:
+            return self.tier_index(default_model), "disabled"
+
+        index = self.tier_index(self.step_tiers.get(step, default_model))
+        if index is None:
+            index = self.tier_index(default_model)
+        if index is None:
+            return None, "unknown_model"
+        reason = "step"
+        while not self.tiers[index].fits(input_tokens) and index < len(self.tiers) - 1:
+            index += 1
+            reason = "input_tokens"
+
+        slo = self.step_latency_slos.get(step, self.latency_slo_seconds)
+        observed = self.latency_percentile(step, self.tiers[index]) if slo else None
+        if observed is not None and observed > slo:
+            # Most capable cheaper tier that still fits the input and meets the target
+            for lower in range(index - 1, -1, -1):
+                lower_observed = self.latency_percentile(step, self.tiers[lower])
+                if self.tiers[lower].fits(input_tokens) and (lower_observed is None or lower_observed <= slo):
+                    return lower, "latency_slo"
+        return index, reason
+
+    def _tier_stats(self, name: str) -> Dict[str, Any]:
+        return self._stats.setdefault(name, {
+            "calls": 0, "errors": 0, "validation_failures": 0, "fallbacks": 0,
+            "input_tokens": 0, "output_tokens": 0, "cost_usd": 0.0, "seconds": 0.0,
+        })
+
+    def record(self, step: str, tier: Optional[ModelTier], model: str, reason: str, seconds: float,
+               responses: List[LlmResponse], estimated_input_tokens: int,
+               failure: Optional[str] = None, error: bool = False) -> None:
+        """
+        Record one call on a tier.
+
+        Args:
+            step: Sub-agent that made the call
+            tier: Tier used, None for a model outside the ladder
+            model: Model name used
+            reason: Why the tier was picked
+            seconds: Wall time of the call, including retries
+            responses: Responses received
+            estimated_input_tokens: Used when the response has no usage metadata
+            failure: Validation failure reason, if the response was rejected
+            error: Whether the call raised
+        """
+        usage = next((response.usage_metadata for response in reversed(responses) if response.usage_metadata), None)
+        input_tokens = (usage.prompt_token_count if usage else None) or estimated_input_tokens
+        output_tokens = ((usage.candidates_token_count or 0) + (usage.thoughts_token_count or 0)) if usage else 0
+        name = tier.name if tier else model
+        with self._lock:
+            stats = self._tier_stats(name)
+            stats["calls"] += 1
+            stats["errors"] += int(error)
+            stats["validation_failures"] += int(failure is not None)
+            stats["input_tokens"] += input_tokens
+            stats["output_tokens"] += output_tokens
+            stats["cost_usd"] += tier.cost(input_tokens, output_tokens) if tier else 0.0
+            stats["seconds"] += seconds
+            if not error:
+                self._latencies[(step, name)].append(seconds)
+            self._routes[step][f"{name}:{reason}"] += 1
+        logger.info(f"[{step}] - Model tier {name} ({model}, {reason}): {seconds:.2f}s, "
+                    f"{input_tokens} in / {output_tokens} out tokens" + (f", rejected: {failure}" if failure else ""))
+
+    def record_fallback(self, step: str, tier: ModelTier, failure: str) -> None:
+        with self._lock:
+            self._tier_stats(tier.name)["fallbacks"] += 1
+        logger.warning(f"[{step}] - Response from tier {tier.name} failed validation ({failure}); trying a higher tier")
+
+    def report(self) -> Dict[str, Any]:
+        """
+        Per-tier calls, failures, tokens, cost and latency, and the routing
+        decisions per step.
+
+        Returns:
+            Dict[str, Any]: {"tiers": {tier: {...}}, "routes": {step: {"tier:reason": count}}}
+        """
+        with self._lock:
+            stats = {name: dict(values) for name, values in self._stats.items()}
+            latencies: Dict[str, List[float]] = defaultdict(list)
+            for (_, name), samples in self._latencies.items():
+                latencies[name].extend(samples)
+            routes = {step: dict(counts) for step, counts in self._routes.items()}
+        for name, values in stats.items():
+            samples = sorted(latencies.get(name, []))
+            values["cost_usd"] = round(values["cost_usd"], 6)
+            values["seconds"] = round(values["seconds"], 3)
+            values["p50_seconds"] = round(samples[len(samples) // 2], 3) if samples else None
+            values["p95_seconds"] = round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3) if samples else None
+        return {"tiers": stats, "routes": routes}
+
+    def reset(self) -> None:
+        """Forget all measurements (tests and benchmarks)."""
+        with self._lock:
+            self._latencies.clear()
+            self._stats.clear()
+            self._routes.clear()
+
+
+# Shared by all sub-agents
+model_router = ModelRouter.from_env()
+
+
+class TieredLlm(BaseLlm):
+    """
+    Model wrapper that routes every call of a sub-agent to a tier of
+    `ModelRouter` and falls back to higher tiers when a response fails
+    validation.
+
+    Streaming calls are routed and measured but not validated, since chunks
+    already sent to the caller cannot be taken back.
+    """
+
+    step: str
+    inner: BaseLlm
+    router: Optional[ModelRouter] = None
+
+    def _router(self) -> ModelRouter:
+        return self.router or model_router
+
+    @property
+    def capabilities(self):
+        return self.inner.capabilities
+
+    async def generate_content_async(
+        self, llm_request: LlmRequest, stream: bool = False
+    ) -> AsyncGenerator[LlmResponse, None]:
+        router = self._router()
+        estimated_tokens = estimate_request_tokens(llm_request)
+        default_model = llm_request.model or self.model
+        if llm_request.config and llm_request.config.cached_content:
+            # A cached context only exists for the model it was created for
+            index, reason = router.tier_index(default_model), "cached_context"
+            last = index
+        else:
+            index, reason = router.route(self.step, estimated_tokens, default_model)
+            last = len(router.tiers) - 1 if router.enabled else index
+
+        while True:
+            tier = router.tiers[index] if index is not None else None
+            llm_request.model = tier.model if tier else default_model
+            started = time.monotonic()
+            responses: List[LlmResponse] = []
+            try:
+                async for response in self.inner.generate_content_async(llm_request, stream=stream):
+                    if stream:
+                        yield response
+                    responses.append(response)
+            except Exception:
+                router.record(self.step, tier, llm_request.model, reason, time.monotonic() - started,
+                              responses, estimated_tokens, error=True)
+                raise
+            seconds = time.monotonic() - started
+            if stream:
+                router.record(self.step, tier, llm_request.model, reason, seconds, responses, estimated_tokens)
+                return
+
+            failure = validate_response(self.step, responses)
+            router.record(self.step, tier, llm_request.model, reason, seconds, responses, estimated_tokens, failure)
+            if failure is None or index is None or index >= last:
+                for response in responses:
+                    yield response
+                return
+            router.record_fallback(self.step, tier, failure)
+            index, reason = index + 1, "fallback"
+
+    def connect(self, llm_request: LlmRequest):
+        return self.inner.connect(llm_request)
+
+
+def tiered_model(step: str, model_name: str) -> TieredLlm:
+    """
+    Build the routed, retrying model of a sub-agent.
+
+    Args:
+        step: Sub-agent name, selects the starting tier and validators
+        model_name: Model used when tiering is disabled or the request is
+            pinned to it, e.g. "gemini-2.5-flash"
+
+    Returns:
+        TieredLlm: Model to pass to `LlmAgent(model=...)`
+    """
+    return TieredLlm(model=model_name, step=step, inner=resilient_model(model_name))
@@ -0,0 +1,395 @@
+"""
+No-Match Rollup for No-Match Analysis Agent
+Keeps a compact daily rollup of no-match counts next to the Dialogflow CX
+export table, so aggregate questions ("top no-match utterances last month",
+"trend by week", "which pages miss most") read kilobytes of rollup rows
+instead of re-aggregating the raw export.
+
+The rollup table holds two grains per day:
+- `day`: totals for the day (turns, no-match turns, conversations)
+- `utterance`: no-match turns and conversations per normalized utterance,
+  page and flow
+
+The rollup is opt-in (NO_MATCH_ROLLUP_ENABLED): it creates two tables in the
+export's dataset, writes to them with MERGE and copies normalized utterance
+text, which may contain personal data, out of the export. When it is disabled
+every question is aggregated from the export table.
+
+Only complete days (up to yesterday) within the backfill window are rolled
+up, and only days not rolled up yet, so a refresh costs one scan of the new
+days. Rolled-up days are recorded one row per day in a coverage table after
+their rollup rows are written; rows are written with MERGE, so concurrent or
+retried refreshes never double count. Days a question needs that are not in
+the coverage table (today, days before the backfill window, days missed while
+the rollup was behind) are aggregated from the export table in the same query.
+"""
+
+import asyncio
+import logging
+import os
+import weakref
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from tools.bigquery_tools import run_bigquery_query
+
+logger = logging.getLogger(__name__)
+
+NO_MATCH_ROLLUP_ENABLED = os.environ.get("NO_MATCH_ROLLUP_ENABLED", "false").lower() in ("1", "true", "yes")
+NO_MATCH_ROLLUP_TABLE = os.environ.get("NO_MATCH_ROLLUP_TABLE", "no_match_daily_rollup")
+# Days rolled up, one row per day
+NO_MATCH_ROLLUP_COVERAGE_TABLE = f"{NO_MATCH_ROLLUP_TABLE}_coverage"
+# Complete days kept rolled up, counting back from yesterday
+NO_MATCH_ROLLUP_BACKFILL_DAYS = int(os.environ.get("NO_MATCH_ROLLUP_BACKFILL_DAYS", "90"))
+
+EXPORT_TABLE = "dialogflow_bigquery_export_data"
+
+# group_by -> key expression over the rollup columns, and the grain it reads
+GROUP_BY_KEYS: Dict[str, Tuple[str, str]] = {
+    "utterance": ("utterance", "utterance"),
+    "page": ("page", "utterance"),
+    "flow": ("flow", "utterance"),
+    "day": ("CAST(day AS STRING)", "day"),
+    "week": ("CAST(DATE_TRUNC(day, WEEK(MONDAY)) AS STRING)", "day"),
+}
+
+DateRange = Tuple[date, date]
+
+# (PROJECT, DATASET) -> last day known to be rolled up in this process
+_refreshed_through: Dict[Tuple[str, str], date] = {}
+# asyncio locks belong to one event loop (e.g. the web server's or a batch run's)
+_refresh_locks: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Tuple[str, str], asyncio.Lock]]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def _table(PROJECT: str, DATASET: str, table: str) -> str:
+    return f"`{PROJECT}.{DATASET}.{table}`"
+
+
+def build_daily_aggregate_query(PROJECT: str, DATASET: str, ranges: List[DateRange]) -> str:
+    """
+    Build the query that aggregates export rows into rollup rows.
+
+    Args:
+        PROJECT: GCP project of the export table
+        DATASET: Dataset of the export table
+        ranges: Inclusive date ranges to aggregate
+
+    Returns:
+        str: SQL returning rows with the rollup table's columns
+    """
+    days = _days_condition("DATE(request_time)", ranges)
+    return f"""
+        WITH turns AS (
+          SELECT
+            DATE(request_time) AS day,
+            conversation_name,
+            LOWER(TRIM(JSON_VALUE(request, '$.queryInput.text.text'))) AS utterance,
+            IFNULL(JSON_VALUE(response, '$.queryResult.currentPage.displayName'), '') AS page,
+            IFNULL(JSON_VALUE(response, '$.queryResult.currentFlow.displayName'), '') AS flow,
+            (JSON_VALUE(request, '$.intentDetectionConfidence') = '0.0'
+             OR JSON_VALUE(request, '$.intentDetectionConfidence') IS NULL) AS is_no_match
+          FROM {_table(PROJECT, DATASET, EXPORT_TABLE)}
+          WHERE ({days})
+            AND JSON_VALUE(request, '$.queryInput.text.text') IS NOT NULL
+        )
+        SELECT
+          day, 'day' AS grain, '' AS utterance, '' AS page, '' AS flow,
+          COUNTIF(is_no_match) AS no_match_turns,
+          COUNT(*) AS turns,
+          COUNT(DISTINCT IF(is_no_match, conversation_name, NULL)) AS no_match_conversations,
+          COUNT(DISTINCT conversation_name) AS conversations
+        FROM turns
+        GROUP BY day
+        UNION ALL
+        SELECT
+          day, 'utterance' AS grain, utterance, page, flow,
+          COUNT(*) AS no_match_turns,
+          COUNT(*) AS turns,
+          COUNT(DISTINCT conversation_name) AS no_match_conversations,
+          COUNT(DISTINCT conversation_name) AS conversations
+        FROM turns
+        WHERE is_no_match
+        GROUP BY day, utterance, page, flow
+    """
+
+
+def _days_condition(column: str, ranges: List[DateRange]) -> str:
+    return " OR ".join(f"{column} BETWEEN '{start}' AND '{end}'" for start, end in ranges)
+
+
+def build_create_table_query(PROJECT: str, DATASET: str) -> str:
+    """DDL for the rollup table, partitioned by day, and its coverage table."""
+    return f"""
+        CREATE TABLE IF NOT EXISTS {_table(PROJECT, DATASET, NO_MATCH_ROLLUP_TABLE)} (
+          day DATE,
+          grain STRING,
+          utterance STRING,
+          page STRING,
+          flow STRING,
+          no_match_turns INT64,
+          turns INT64,
+          no_match_conversations INT64,
+          conversations INT64
+        )
+        PARTITION BY day
+        CLUSTER BY grain, utterance;
+        CREATE TABLE IF NOT EXISTS {_table(PROJECT, DATASET, NO_MATCH_ROLLUP_COVERAGE_TABLE)} (
+          day DATE,
+          rolled_up_at TIMESTAMP
+        )
+    """
+
+
+def build_coverage_query(PROJECT: str, DATASET: str) -> str:
+    """Query for the rolled-up days."""
+    return f"""
+        SELECT day AS covered_day
+        FROM {_table(PROJECT, DATASET, NO_MATCH_ROLLUP_COVERAGE_TABLE)}
+        ORDER BY day
+    """
+
+
+def build_merge_query(PROJECT: str, DATASET: str, ranges: List[DateRange]) -> str:
+    """
+    Script that adds the rollup rows of the days in `ranges` that are not
+    there yet, then records the days as covered. A day is only marked once
+    its rows are written; a failed script is safe to run again.
+    """
+    days = " UNION ALL ".join(
+        f"SELECT day FROM UNNEST(GENERATE_DATE_ARRAY('{start}', '{end}')) AS day" for start, end in ranges
+    )
+    return f"""
+        MERGE {_table(PROJECT, DATASET, NO_MATCH_ROLLUP_TABLE)} AS rollup
+        USING ({build_daily_aggregate_query(PROJECT, DATASET, ranges)}) AS fresh
+        ON rollup.day = fresh.day AND rollup.grain = fresh.grain AND rollup.utterance = fresh.utterance
+          AND rollup.page = fresh.page AND rollup.flow = fresh.flow
+        WHEN NOT MATCHED THEN INSERT ROW;
+        MERGE {_table(PROJECT, DATASET, NO_MATCH_ROLLUP_COVERAGE_TABLE)} AS coverage
+        USING ({days}) AS fresh
+        ON coverage.day = fresh.day
+        WHEN NOT MATCHED THEN INSERT (day, rolled_up_at) VALUES (fresh.day, CURRENT_TIMESTAMP())
+    """
+
+
+def build_rollup_read_query(
+    PROJECT: str,
+    DATASET: str,
+    rollup_ranges: List[DateRange],
+    raw_ranges: List[DateRange],
+    group_by: str,
+    top: int,
+) -> str:
+    """
+    Build the query answering a question from the rollup, topped up from the
+    export table for days the rollup does not cover.
+
+    Args:
+        PROJECT: GCP project
+        DATASET: Dataset of the export and rollup tables
+        rollup_ranges: Days read from the rollup
+        raw_ranges: Days aggregated from the export table
+        group_by: One of GROUP_BY_KEYS
+        top: Rows returned (for utterance, page and flow)
+
+    Returns:
+        str: SQL returning one row per group key
+    """
+    key, grain = GROUP_BY_KEYS[group_by]
+    sources = []
+    if rollup_ranges:
+        sources.append(
+            f"SELECT * FROM {_table(PROJECT, DATASET, NO_MATCH_ROLLUP_TABLE)}"
+            f" WHERE {_days_condition('day', rollup_ranges)}"
+        )
+    if raw_ranges:
+        sources.append(f"SELECT * FROM ({build_daily_aggregate_query(PROJECT, DATASET, raw_ranges)})")
+    union = "\n          UNION ALL\n          ".join(sources)
+
+    if grain == "day":
+        return f"""
+        SELECT
+          {key} AS group_key,
+          SUM(no_match_turns) AS no_match_turns,
+          SUM(turns) AS turns,
+          SUM(no_match_conversations) AS no_match_conversations,
+          SUM(conversations) AS conversations,
+          SAFE_DIVIDE(SUM(no_match_turns), SUM(turns)) AS no_match_rate
+        FROM (
+          {union}
+        )
+        WHERE grain = 'day'
+        GROUP BY group_key
+        ORDER BY group_key
+    """
+    return f"""
+        SELECT
+          {key} AS group_key,
+          SUM(no_match_turns) AS no_match_turns,
+          SUM(no_match_conversations) AS no_match_conversations
+        FROM (
+          {union}
+        )
+        WHERE grain = 'utterance'
+        GROUP BY group_key
+        ORDER BY no_match_turns DESC, group_key
+        LIMIT {top}
+    """
+
+
+def _as_date(value: Any) -> Optional[date]:
+    if value is None or isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+def _day_ranges(days: List[date]) -> List[DateRange]:
+    """Runs of consecutive days, from sorted days."""
+    ranges: List[DateRange] = []
+    for day in days:
+        if ranges and day <= ranges[-1][1] + timedelta(days=1):
+            ranges[-1] = (ranges[-1][0], max(day, ranges[-1][1]))
+        else:
+            ranges.append((day, day))
+    return ranges
+
+
+def _uncovered_ranges(start: date, end: date, coverage: List[DateRange]) -> List[DateRange]:
+    """Runs of days in `start`..`end` outside the covered ranges."""
+    uncovered = []
+    for covered_start, covered_end in coverage:
+        if covered_end < start or covered_start > end:
+            continue
+        if covered_start > start:
+            uncovered.append((start, covered_start - timedelta(days=1)))
+        start = max(start, covered_end + timedelta(days=1))
+    if start <= end:
+        uncovered.append((start, end))
+    return uncovered
+
+
+async def rollup_coverage(PROJECT: str, DATASET: str) -> List[DateRange]:
+    """
+    Get the days covered by the rollup.
+
+    Returns:
+        List[DateRange]: Runs of consecutive rolled-up days, empty if the rollup is empty
+    """
+    rows = await run_bigquery_query(PROJECT, build_coverage_query(PROJECT, DATASET))
+    return _day_ranges(sorted(_as_date(row["covered_day"]) for row in rows if row.get("covered_day") is not None))
+
+
+async def refresh_rollup(PROJECT: str, DATASET: str, through: Optional[date] = None) -> Dict[str, Any]:
+    """
+    Roll up the complete days that are not in the rollup yet.
+
+    Args:
+        PROJECT: GCP project
+        DATASET: Dataset of the export table; the rollup is created next to it
+        through: Last day to roll up, defaults to yesterday
+
+    Returns:
+        Dict[str, Any]: Days added (`added_from` / `added_through`, None when
+        already up to date, and the `added_ranges` in between) and the last
+        rolled-up day
+    """
+    through = through or date.today() - timedelta(days=1)
+    cache_key = (PROJECT, DATASET)
+    locks = _refresh_locks.setdefault(asyncio.get_running_loop(), {})
+    lock = locks.setdefault(cache_key, asyncio.Lock())
+
+    async with lock:
+        if _refreshed_through.get(cache_key, date.min) >= through:
+            return {"added_from": None, "added_through": None, "added_ranges": [],
+                    "covered_through": _refreshed_through[cache_key]}
+
+        await run_bigquery_query(PROJECT, build_create_table_query(PROJECT, DATASET))
+        coverage = await rollup_coverage(PROJECT, DATASET)
+        window_start = through - timedelta(days=NO_MATCH_ROLLUP_BACKFILL_DAYS - 1)
+        # Days of the window not rolled up yet, including gaps left while the rollup was behind
+        missing = _uncovered_ranges(window_start, through, coverage)
+
+        if missing:
+            logger.info(f"Rolling up no-match counts for {PROJECT}.{DATASET}: {missing[0][0]} to {missing[-1][1]} "
+                        f"({len(missing)} range(s))")
+            await run_bigquery_query(PROJECT, build_merge_query(PROJECT, DATASET, missing))
+        _refreshed_through[cache_key] = max(through, coverage[-1][1]) if coverage else through
+
+    return {
+        "added_from": missing[0][0] if missing else None,
+        "added_through": missing[-1][1] if missing else None,
+        "added_ranges": missing,
+        "covered_through": _refreshed_through[cache_key],
+    }
+
+
+def _split_range(start: date, end: date, coverage: List[DateRange]) -> Tuple[List[DateRange], List[DateRange]]:
+    """Split a date range into the days read from the rollup and the days read raw."""
+    rollup_ranges = [
+        (max(start, covered_start), min(end, covered_end))
+        for covered_start, covered_end in coverage
+        if covered_end >= start and covered_start <= end
+    ]
+    return rollup_ranges, _uncovered_ranges(start, end, coverage)
+
+
+async def no_match_rollup_tool(
+    PROJECT: str,
+    DATASET: str,
+    start_date: str,
+    end_date: str,
+    group_by: str = "utterance",
+    top: int = 20,
+) -> Dict[str, Any]:
+    """
+    Answer aggregate no-match questions from the daily no-match rollup.
+
+    Use this for top no-match utterances, no-match counts by page or flow, and
+    no-match trends by day or week. When the rollup is enabled it reads a
+    small precomputed table instead of the raw export; otherwise it aggregates
+    the export. Use `bigquery_execution_tool` when conversation scripts are needed.
+
+    Args:
+    `PROJECT` - GCP Project of the export table
+    `DATASET` - Dataset of the export table
+    `start_date` - First day, YYYY-MM-DD
+    `end_date` - Last day, YYYY-MM-DD
+    `group_by` - One of "utterance", "page", "flow", "day", "week"
+    `top` - Rows to return for utterance, page and flow (most no-match turns first)
+
+    Returns:
+    Dictionary with `rows` (group_key, no_match_turns, no_match_conversations,
+    plus turns, conversations and no_match_rate for day and week) and `source`
+    ("rollup", "rollup+raw" or "raw"). Conversation counts are summed over days
+    (and, for page and flow, over utterances), so they are upper bounds.
+    """
+    if group_by not in GROUP_BY_KEYS:
+        return {"error": f"group_by must be one of {sorted(GROUP_BY_KEYS)}", "rows": []}
+    try:
+        start, end = sorted((date.fromisoformat(start_date), date.fromisoformat(end_date)))
+    except (TypeError, ValueError):
+        return {"error": f"start_date and end_date must be YYYY-MM-DD, got {start_date!r} and {end_date!r}", "rows": []}
+
+    coverage: List[DateRange] = []
+    if NO_MATCH_ROLLUP_ENABLED:
+        try:
+            await refresh_rollup(PROJECT, DATASET)
+            coverage = await rollup_coverage(PROJECT, DATASET)
+        except Exception as e:
+            # No write access or no rollup: aggregate the export table directly
+            logger.warning(f"No-match rollup unavailable for {PROJECT}.{DATASET}, reading raw export: {e}")
+
+    rollup_ranges, raw_ranges = _split_range(start, end, coverage)
+    rows = await run_bigquery_query(
+        PROJECT, build_rollup_read_query(PROJECT, DATASET, rollup_ranges, raw_ranges, group_by, top)
+    )
+    source = "rollup+raw" if rollup_ranges and raw_ranges else "rollup" if rollup_ranges else "raw"
+    return {
+        "group_by": group_by,
+        "start_date": start.isoformat(),
+        "end_date": end.isoformat(),
+        "source": source,
+        "raw_days": [[range_start.isoformat(), range_end.isoformat()] for range_start, range_end in raw_ranges],
+        "rows": rows,
+    }
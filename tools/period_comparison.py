@@ -0,0 +1,297 @@
+"""
+Period Comparison for No-Match Analysis Agent
+Period-over-period no-match regression check ("this week vs last week"). Both
+windows are aggregated concurrently from the daily no-match rollup, utterances
+are aligned into clusters across the windows, and each cluster's no-match
+rate change is tested for significance. Only the deltas are passed on to the
+analysis step, so a comparison costs about as much as a single run.
+"""
+
+import asyncio
+import json
+import math
+import os
+import re
+import unicodedata
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from tools.cpu_tasks import compare_utterance_clusters
+from tools.no_match_rollup import no_match_rollup_tool
+from tools.process_pool import cpu_task_pool
+from tools.records import UtteranceCluster, UtteranceCount, records_from_rows
+from tools.top_k import TopK
+
+COMPARISON_MODE_STATE_KEY = "comparison_mode"
+COMPARISON_WINDOWS_STATE_KEY = "comparison_windows"
+COMPARISON_OUTPUT_STATE_KEY = "comparison_output"
+
+COMPARISON_WINDOW_DAYS = int(os.environ.get("COMPARISON_WINDOW_DAYS", "7"))
+# Utterances read per window; a cluster only in one window's top is "unknown" unless the
+# other window's read was complete (fewer rows than this)
+COMPARISON_TOP_UTTERANCES = int(os.environ.get("COMPARISON_TOP_UTTERANCES", "500"))
+# Cluster deltas passed on to the analysis step
+COMPARISON_MAX_DELTAS = int(os.environ.get("COMPARISON_MAX_DELTAS", "30"))
+# Cluster deltas kept in the comparison output, largest |z| first
+COMPARISON_MAX_CLUSTERS = int(os.environ.get("COMPARISON_MAX_CLUSTERS", "200"))
+
+# Two-sided 5% significance
+SIGNIFICANCE_Z = 1.959964
+
+# Words that do not change what a user asked for
+_FILLER_WORDS = {"a", "an", "the", "i", "my", "me", "please", "can", "could", "you", "to", "is", "hi", "hello", "hey"}
+
+Window = Tuple[str, str]
+
+
+def comparison_enabled(state: Dict[str, Any]) -> bool:
+    """Whether a run is a period-over-period comparison."""
+    return bool(state.get(COMPARISON_MODE_STATE_KEY))
+
+
+def comparison_windows(state: Dict[str, Any], today: Optional[date] = None) -> Tuple[Window, Window]:
+    """
+    Pick the current and baseline windows.
+
+    Args:
+        state: Session state, may hold `comparison_windows` as
+            {"current": [start, end], "baseline": [start, end]}
+        today: Current date (for tests)
+
+    Returns:
+        Tuple[Window, Window]: Current and baseline (start, end) ISO dates.
+        By default the last COMPARISON_WINDOW_DAYS complete days and the same
+        number of days before them.
+    """
+    windows = state.get(COMPARISON_WINDOWS_STATE_KEY) or {}
+    if windows.get("current") and windows.get("baseline"):
+        return tuple(windows["current"]), tuple(windows["baseline"])
+    current_end = (today or date.today()) - timedelta(days=1)
+    current_start = current_end - timedelta(days=COMPARISON_WINDOW_DAYS - 1)
+    baseline_end = current_start - timedelta(days=1)
+    baseline_start = baseline_end - timedelta(days=COMPARISON_WINDOW_DAYS - 1)
+    return (
+        (current_start.isoformat(), current_end.isoformat()),
+        (baseline_start.isoformat(), baseline_end.isoformat()),
+    )
+
+
+def utterance_cluster_key(utterance: str) -> str:
+    """
+    Cluster key of an utterance: casefolded words without punctuation or filler
+    words, in sorted order, so "Cancel my order!" and "please cancel order"
+    fall in the same cluster. Words are Unicode (NFKC) letters and digits, so
+    accented and non-Latin utterances keep their words; "" when there are none.
+    """
+    words = re.findall(r"[\w']+", unicodedata.normalize("NFKC", utterance or "").casefold())
+    content = sorted(set(words) - _FILLER_WORDS)
+    return " ".join(content) or " ".join(words)
+
+
+def two_proportion_z(successes_a: int, trials_a: int, successes_b: int, trials_b: int) -> Optional[float]:
+    """
+    z statistic of the difference between two proportions (pooled variance).
+
+    Returns:
+        Optional[float]: Positive when the first proportion is higher, None
+        when either side has no trials or the pooled proportion is 0 or 1
+    """
+    if trials_a <= 0 or trials_b <= 0:
+        return None
+    pooled = (successes_a + successes_b) / (trials_a + trials_b)
+    variance = pooled * (1 - pooled) * (1 / trials_a + 1 / trials_b)
+    if variance <= 0:
+        return None
+    return (successes_a / trials_a - successes_b / trials_b) / math.sqrt(variance)
+
+
+def _window_totals(day_rows: List[Dict[str, Any]]) -> Dict[str, int]:
+    return {
+        "turns": sum(int(row.get("turns") or 0) for row in day_rows),
+        "no_match_turns": sum(int(row.get("no_match_turns") or 0) for row in day_rows),
+    }
+
+
+def _clusters(utterance_rows: List[Dict[str, Any]]) -> Dict[str, UtteranceCluster]:
+    clusters: Dict[str, UtteranceCluster] = {}
+    for row in records_from_rows(UtteranceCount, utterance_rows):
+        key = utterance_cluster_key(row.utterance)
+        cluster = clusters.get(key)
+        if cluster is None:
+            cluster = clusters[key] = UtteranceCluster(key)
+        cluster.add(row.utterance, row.no_match_turns)
+    return clusters
+
+
+def _rate_change(current: int, current_turns: int, baseline: int, baseline_turns: int) -> Dict[str, Any]:
+    current_rate = current / current_turns if current_turns else 0.0
+    baseline_rate = baseline / baseline_turns if baseline_turns else 0.0
+    z = two_proportion_z(current, current_turns, baseline, baseline_turns)
+    return {
+        "current_rate": current_rate,
+        "baseline_rate": baseline_rate,
+        "rate_change": current_rate - baseline_rate,
+        "relative_change": (current_rate - baseline_rate) / baseline_rate if baseline_rate else None,
+        "z": z,
+        "significant": z is not None and abs(z) >= SIGNIFICANCE_Z,
+    }
+
+
+def compare_clusters(
+    current_utterances: List[Dict[str, Any]],
+    current_days: List[Dict[str, Any]],
+    baseline_utterances: List[Dict[str, Any]],
+    baseline_days: List[Dict[str, Any]],
+    top: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Align utterance clusters across two windows and test each rate change.
+
+    Rates are no-match turns of a cluster per turn in the window, so windows
+    with different traffic are comparable. A window read with `top` rows may
+    have left a cluster out; a cluster found in only one window is then
+    "unknown", with no count, rate change or test for the other window,
+    instead of being tested against 0.
+
+    Args:
+        current_utterances, baseline_utterances: Rollup rows grouped by utterance
+        current_days, baseline_days: Rollup rows grouped by day
+        top: Utterance rows each window was limited to, None if complete
+
+    Returns:
+        Dict[str, Any]: Window totals, the overall rate change and the
+        COMPARISON_MAX_CLUSTERS per-cluster changes with the largest |z|
+        (ties by cluster key), largest first
+    """
+    current_totals, baseline_totals = _window_totals(current_days), _window_totals(baseline_days)
+    current_clusters, baseline_clusters = _clusters(current_utterances), _clusters(baseline_utterances)
+    # A window with fewer rows than the limit was read whole: a missing cluster had no no-match turns
+    current_complete = top is None or len(current_utterances) < top
+    baseline_complete = top is None or len(baseline_utterances) < top
+
+    deltas = TopK(COMPARISON_MAX_CLUSTERS, key=lambda delta: abs(delta["z"] or 0.0), tie_key=lambda delta: delta["cluster"])
+    unknown = 0
+    for key in set(current_clusters) | set(baseline_clusters):
+        current = current_clusters.get(key) or UtteranceCluster(key)
+        baseline = baseline_clusters.get(key) or UtteranceCluster(key)
+        # Both windows' utterances, baseline first
+        merged = UtteranceCluster(key)
+        merged.merge(baseline)
+        merged.merge(current)
+        if (key not in current_clusters and not current_complete) or (key not in baseline_clusters and not baseline_complete):
+            unknown += 1
+            deltas.push({
+                "cluster": key,
+                "label": merged.label(),
+                "utterances": merged.top_utterances(5),
+                "current_no_match_turns": current.no_match_turns if key in current_clusters else None,
+                "baseline_no_match_turns": baseline.no_match_turns if key in baseline_clusters else None,
+                "status": "unknown",
+                "current_rate": None,
+                "baseline_rate": None,
+                "rate_change": None,
+                "relative_change": None,
+                "z": None,
+                "significant": False,
+            })
+            continue
+        change = _rate_change(
+            current.no_match_turns, current_totals["turns"], baseline.no_match_turns, baseline_totals["turns"]
+        )
+        deltas.push({
+            "cluster": key,
+            "label": merged.label(),
+            "utterances": merged.top_utterances(5),
+            "current_no_match_turns": current.no_match_turns,
+            "baseline_no_match_turns": baseline.no_match_turns,
+            "status": "new" if not baseline.no_match_turns else "resolved" if not current.no_match_turns else "changed",
+            **change,
+        })
+
+    return {
+        "current_totals": current_totals,
+        "baseline_totals": baseline_totals,
+        "overall": _rate_change(
+            current_totals["no_match_turns"], current_totals["turns"],
+            baseline_totals["no_match_turns"], baseline_totals["turns"],
+        ),
+        "clusters": deltas.items(),
+        "clusters_compared": deltas.seen,
+        "clusters_unknown": unknown,
+    }
+
+
+async def compare_periods(PROJECT: str, DATASET: str, current: Window, baseline: Window) -> Dict[str, Any]:
+    """
+    Compare no-match rates of two windows, reading both concurrently.
+
+    Args:
+        PROJECT: GCP project of the export table
+        DATASET: Dataset of the export table
+        current: (start, end) of the window under test
+        baseline: (start, end) of the window to compare against
+
+    Returns:
+        Dict[str, Any]: Output of `compare_clusters` plus the windows and the
+        rollup source of each read
+    """
+    reads = await asyncio.gather(
+        no_match_rollup_tool(PROJECT, DATASET, current[0], current[1], "utterance", COMPARISON_TOP_UTTERANCES),
+        no_match_rollup_tool(PROJECT, DATASET, current[0], current[1], "day"),
+        no_match_rollup_tool(PROJECT, DATASET, baseline[0], baseline[1], "utterance", COMPARISON_TOP_UTTERANCES),
+        no_match_rollup_tool(PROJECT, DATASET, baseline[0], baseline[1], "day"),
+    )
+    # Clustering and scoring run in the CPU task pool, off the event loop
+    comparison = await cpu_task_pool.run(
+        compare_utterance_clusters, [json.dumps(read["rows"], default=str) for read in reads], COMPARISON_TOP_UTTERANCES
+    )
+    comparison.update({
+        "current_window": list(current),
+        "baseline_window": list(baseline),
+        "sources": sorted({read["source"] for read in reads}),
+    })
+    return comparison
+
+
+def format_comparison_report(comparison: Dict[str, Any], max_deltas: int = COMPARISON_MAX_DELTAS) -> str:
+    """
+    Render the cluster deltas as markdown, for the user and the analysis step.
+
+    Args:
+        comparison: Output of `compare_periods`
+        max_deltas: Clusters listed, significant changes first
+
+    Returns:
+        str: Report with the overall change and the largest cluster changes
+    """
+    overall = comparison["overall"]
+    current, baseline = comparison["current_window"], comparison["baseline_window"]
+
+    def flag(delta: Dict[str, Any]) -> str:
+        if delta.get("status") == "unknown":
+            return f"outside the other window's top {COMPARISON_TOP_UTTERANCES}, not tested"
+        if not delta["significant"]:
+            return "not significant"
+        return "⬆️ significant increase" if delta["rate_change"] > 0 else "⬇️ significant decrease"
+
+    lines = [
+        f"## 📊 No-Match Comparison: {current[0]} to {current[1]} vs {baseline[0]} to {baseline[1]}",
+        "",
+        f"- Turns: {comparison['current_totals']['turns']} vs {comparison['baseline_totals']['turns']}",
+        f"- No-match rate: {overall['current_rate']:.2%} vs {overall['baseline_rate']:.2%} "
+        f"({overall['rate_change'] * 100:+.2f} pp, {flag(overall)})",
+        "",
+        "### Utterance clusters with the largest changes",
+        "",
+        "| Cluster | Example utterances | No-match turns (current / baseline) | Rate change | Status |",
+        "|---|---|---|---|---|",
+    ]
+    for delta in comparison["clusters"][:max_deltas]:
+        counts = [count if count is not None else "?" for count in (delta["current_no_match_turns"], delta["baseline_no_match_turns"])]
+        rate_change = f"{delta['rate_change'] * 100:+.2f} pp" if delta["rate_change"] is not None else "n/a"
+        lines.append(
+            f"| {delta['label']} | {'; '.join(delta['utterances'][:3])} | "
+            f"{counts[0]} / {counts[1]} | {rate_change} | {delta['status']}, {flag(delta)} |"
+        )
+    lines += ["", "Rates are no-match turns per turn in the window; significance is a two-proportion z-test at 5%."]
+    return "\n".join(lines)
@@ -0,0 +1,318 @@
+"""
+Phrase Validation for No-Match Analysis Agent
+Bulk validation of the training-phrase CSV produced by Step 4, before it
+reaches a Dialogflow CX import. Every row is reduced to two keys once:
+
+- exact key: the phrase casefolded with whitespace collapsed
+- near key: the phrase's content words without punctuation, in sorted order
+  (see `utterance_cluster_key`), or the exact key if it has no words
+
+and all checks are set and dictionary lookups on those keys against the CSV
+itself and the parsed bot's phrase index, so tens of thousands of rows
+validate in milliseconds.
+
+Rows that cannot or should not be imported are dropped: empty rows, phrases
+over the CX length limit, exact and near duplicates within an intent, phrases
+the intent already has in the bot, and rows past the per-intent phrase limit.
+Phrases that also belong to another intent (cross-intent collisions) make
+intent matching ambiguous; they are flagged, and dropped too if configured.
+"""
+
+import csv
+import io
+import json
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from tools.exported_phrases import INTENT_COLUMN, LANGUAGE_COLUMN, PHRASE_COLUMN
+from tools.period_comparison import utterance_cluster_key
+from tools.records import IntentPhrase
+from tools.state_offload import state_value_digest
+
+PHRASE_VALIDATION_ENABLED = os.environ.get("PHRASE_VALIDATION_ENABLED", "true").lower() in ("1", "true", "yes")
+PHRASE_VALIDATION_DROP_COLLISIONS = os.environ.get("PHRASE_VALIDATION_DROP_COLLISIONS", "false").lower() in ("1", "true", "yes")
+
+# Dialogflow CX limits
+CX_MAX_PHRASE_CHARS = int(os.environ.get("CX_MAX_PHRASE_CHARS", "768"))
+CX_MAX_PHRASES_PER_INTENT = int(os.environ.get("CX_MAX_PHRASES_PER_INTENT", "2000"))
+CX_MAX_INTENT_NAME_CHARS = int(os.environ.get("CX_MAX_INTENT_NAME_CHARS", "64"))
+
+VALIDATION_REPORT_STATE_KEY = "csv_validation_report"
+# Dropped and flagged rows listed in the report; every row is counted
+VALIDATION_REPORT_MAX_ROWS = 200
+
+_FLAG_REASONS = ("cross_intent_collision", "intent_name_too_long")
+
+_CSV_BLOCK_PATTERN = re.compile(r"```(?:csv)?[ \t]*\n(.*?)```", re.DOTALL)
+
+# Phrase indexes of recently validated bot exports, by digest of the export
+_BOT_INDEX_CACHE_SIZE = 8
+_bot_index_cache: "OrderedDict[str, BotPhraseIndex]" = OrderedDict()
+
+
+def extract_csv_content(csv_generation_output: str) -> str:
+    """
+    Get the CSV text from the CSV generation step's output.
+
+    Args:
+        csv_generation_output: Model output, possibly with the CSV in a fenced block
+
+    Returns:
+        str: CSV content
+    """
+    match = _CSV_BLOCK_PATTERN.search(csv_generation_output)
+    return (match.group(1) if match else csv_generation_output).strip() + "\n"
+
+
+def replace_csv_content(csv_generation_output: str, csv_content: str) -> str:
+    """Put validated CSV content back where `extract_csv_content` found it."""
+    match = _CSV_BLOCK_PATTERN.search(csv_generation_output)
+    if not match:
+        return csv_content
+    return csv_generation_output[:match.start(1)] + csv_content + csv_generation_output[match.end(1):]
+
+
+def _find_column(fieldnames: List[str], preferred: str, aliases: Tuple[str, ...]) -> Optional[str]:
+    """Find a column by name, ignoring case, spaces and underscores."""
+    def simplify(name: str) -> str:
+        return re.sub(r"[\s_]+", "", (name or "").lower())
+    wanted = {simplify(preferred), *aliases}
+    return next((name for name in fieldnames if simplify(name) in wanted), None)
+
+
+def find_phrase_columns(fieldnames: List[str]) -> Tuple[Optional[str], Optional[str]]:
+    """Find the intent and training-phrase columns of a CSV header, or None for each one missing."""
+    return (
+        _find_column(fieldnames, INTENT_COLUMN, ("intent", "intentdisplayname")),
+        _find_column(fieldnames, PHRASE_COLUMN, ("phrase", "trainingphrasetext")),
+    )
+
+
+def read_intent_phrases(csv_content: str) -> List[IntentPhrase]:
+    """
+    Read the non-empty training phrases of a CSV.
+
+    Args:
+        csv_content: CSV with intent and training-phrase columns (see
+            `find_phrase_columns`) and an optional language code column
+
+    Returns:
+        List[IntentPhrase]: Phrases in CSV order, empty if a column is missing
+    """
+    reader = csv.reader(io.StringIO(csv_content))
+    fieldnames = next(reader, [])
+    intent_column, phrase_column = find_phrase_columns(fieldnames)
+    if not intent_column or not phrase_column:
+        return []
+    language_column = _find_column(fieldnames, LANGUAGE_COLUMN, ("language",))
+    intent_index, phrase_index = fieldnames.index(intent_column), fieldnames.index(phrase_column)
+    language_index = fieldnames.index(language_column) if language_column else None
+    phrases = []
+    for row in reader:
+        intent = row[intent_index].strip() if intent_index < len(row) else ""
+        phrase = row[phrase_index].strip() if phrase_index < len(row) else ""
+        if intent and phrase:
+            language = row[language_index].strip() if language_index is not None and language_index < len(row) else ""
+            phrases.append(IntentPhrase(intent, phrase, language))
+    return phrases
+
+
+def bot_intent_phrases(bot: Any) -> List[IntentPhrase]:
+    """
+    Get the training phrases of a parsed Dialogflow CX bot export.
+
+    Args:
+        bot: Export with `intents[].displayName` and
+            `intents[].trainingPhrases[].parts[].text`; anything but an
+            object has no phrases
+
+    Returns:
+        List[IntentPhrase]: One record per training phrase
+    """
+    intents = (bot.get("intents") or []) if isinstance(bot, dict) else []
+    return [
+        IntentPhrase(
+            intent.get("displayName", ""),
+            "".join(part.get("text", "") for part in phrase.get("parts", [])),
+            phrase.get("languageCode", ""),
+        )
+        for intent in intents
+        for phrase in intent.get("trainingPhrases", [])
+    ]
+
+
+def exact_key(phrase: str) -> str:
+    return " ".join((phrase or "").casefold().split())
+
+
+def near_key(phrase: str) -> str:
+    """Content words of a phrase in sorted order; phrases without words fall back to their exact key."""
+    return utterance_cluster_key(phrase) or exact_key(phrase)
+
+
+class BotPhraseIndex:
+    """Training phrases of a parsed bot, indexed by exact and near key."""
+
+    def __init__(self, phrases: List[IntentPhrase]):
+        """
+        Args:
+            phrases: Training phrases of the bot
+        """
+        self.exact: Dict[str, Set[str]] = {}
+        self.near: Dict[str, Set[str]] = {}
+        self.phrase_counts: Dict[str, int] = {}
+        for phrase in phrases:
+            self.phrase_counts[phrase.intent] = self.phrase_counts.get(phrase.intent, 0) + 1
+            self.exact.setdefault(exact_key(phrase.phrase), set()).add(phrase.intent)
+            self.near.setdefault(near_key(phrase.phrase), set()).add(phrase.intent)
+
+    @classmethod
+    def from_bot_json(cls, bot_json: str) -> "BotPhraseIndex":
+        """
+        Index a Dialogflow CX bot export (cached per export).
+
+        Args:
+            bot_json: Export with `intents[].displayName` and
+                `intents[].trainingPhrases[].parts[].text`
+
+        Returns:
+            BotPhraseIndex: Index, empty if the export has no intents
+        """
+        digest = state_value_digest(bot_json)
+        index = _bot_index_cache.get(digest)
+        if index is not None:
+            _bot_index_cache.move_to_end(digest)
+            return index
+
+        try:
+            bot = json.loads(bot_json) if bot_json else {}
+        except json.JSONDecodeError:
+            bot = {}
+        index = cls(bot_intent_phrases(bot))
+        _bot_index_cache[digest] = index
+        while len(_bot_index_cache) > _BOT_INDEX_CACHE_SIZE:
+            _bot_index_cache.popitem(last=False)
+        return index
+
+
+def validate_training_phrases(
+    csv_content: str,
+    bot_index: Optional[BotPhraseIndex] = None,
+    drop_collisions: bool = PHRASE_VALIDATION_DROP_COLLISIONS,
+) -> Tuple[str, Dict[str, Any]]:
+    """
+    Validate and deduplicate a training-phrase CSV.
+
+    Args:
+        csv_content: CSV with "Intent Name" and "Training Phrase" columns
+            (case, spaces and underscores in the header are ignored)
+        bot_index: Phrases of the parsed bot, if a bot export was provided
+        drop_collisions: Also drop rows flagged as cross-intent collisions
+
+    Returns:
+        Tuple[str, Dict[str, Any]]: Validated CSV and a report with the
+        counts per reason and the first dropped and flagged rows
+    """
+    started = time.perf_counter()
+    reader = csv.reader(io.StringIO(csv_content))
+    fieldnames = next(reader, [])
+    intent_column, phrase_column = find_phrase_columns(fieldnames)
+    if not intent_column or not phrase_column:
+        return csv_content, {"status": "skipped", "reason": f"CSV needs '{INTENT_COLUMN}' and '{PHRASE_COLUMN}' columns"}
+    intent_index, phrase_index = fieldnames.index(intent_column), fieldnames.index(phrase_column)
+    rows = [row for row in reader if row]
+    bot_index = bot_index or BotPhraseIndex([])
+
+    # Keys are computed once per distinct phrase; generated CSVs repeat a lot
+    keys: Dict[str, Tuple[str, str]] = {}
+    keyed = []
+    # Near key -> intents proposing it in this CSV, to find collisions between new rows
+    csv_near_intents: Dict[str, Set[str]] = {}
+    for row in rows:
+        intent = row[intent_index].strip() if intent_index < len(row) else ""
+        phrase = row[phrase_index].strip() if phrase_index < len(row) else ""
+        phrase_keys = keys.get(phrase)
+        if phrase_keys is None:
+            phrase_keys = keys[phrase] = (exact_key(phrase), near_key(phrase))
+        keyed.append((row, intent, phrase, *phrase_keys))
+        if intent and phrase:
+            csv_near_intents.setdefault(phrase_keys[1], set()).add(intent)
+
+    kept: List[List[str]] = []
+    dropped: List[Dict[str, Any]] = []
+    flagged: List[Dict[str, Any]] = []
+    counts: Dict[str, int] = {}
+    seen_exact: Set[Tuple[str, str]] = set()
+    seen_near: Set[Tuple[str, str]] = set()
+    intent_counts: Dict[str, int] = dict(bot_index.phrase_counts)
+    bot_exact, bot_near = bot_index.exact, bot_index.near
+    no_intents: Set[str] = set()
+
+    def report(entries: List[Dict[str, Any]], line: int, intent: str, phrase: str, reason: str, **extra) -> None:
+        counts[reason] = counts.get(reason, 0) + 1
+        if len(entries) < VALIDATION_REPORT_MAX_ROWS:
+            entries.append({"line": line, "intent": intent, "phrase": phrase, "reason": reason, **extra})
+
+    for line, (row, intent, phrase, exact, near) in enumerate(keyed, start=2):
+        reason = None
+        exact_owners = bot_exact.get(exact, no_intents)
+        near_owners = bot_near.get(near, no_intents)
+        if not intent or not phrase:
+            reason = "empty"
+        elif len(phrase) > CX_MAX_PHRASE_CHARS:
+            reason = "too_long"
+        elif (intent, exact) in seen_exact:
+            reason = "duplicate"
+        elif (intent, near) in seen_near:
+            reason = "near_duplicate"
+        elif intent in exact_owners or intent in near_owners:
+            reason = "exists_in_bot"
+        elif intent_counts.get(intent, 0) >= CX_MAX_PHRASES_PER_INTENT:
+            reason = "intent_phrase_limit"
+        if reason:
+            report(dropped, line, intent, phrase, reason)
+            continue
+
+        seen_exact.add((intent, exact))
+        seen_near.add((intent, near))
+        # Other intents that have the phrase in the bot or propose it in this CSV
+        if exact_owners or near_owners or len(csv_near_intents[near]) > 1:
+            other_intents = (exact_owners | near_owners | csv_near_intents[near]) - {intent}
+            report(flagged, line, intent, phrase, "cross_intent_collision", other_intents=sorted(other_intents))
+            if drop_collisions:
+                report(dropped, line, intent, phrase, "cross_intent_collision")
+                continue
+        if len(intent) > CX_MAX_INTENT_NAME_CHARS:
+            report(flagged, line, intent, phrase, "intent_name_too_long")
+        intent_counts[intent] = intent_counts.get(intent, 0) + 1
+        kept.append(row)
+
+    output = io.StringIO()
+    writer = csv.writer(output, lineterminator="\n")
+    writer.writerow(fieldnames)
+    writer.writerows(kept)
+
+    flagged_count = sum(count for reason, count in counts.items() if reason in _FLAG_REASONS)
+    return output.getvalue(), {
+        "status": "validated",
+        "rows": len(rows),
+        "kept": len(kept),
+        "dropped": len(rows) - len(kept),
+        "flagged": flagged_count,
+        "counts": counts,
+        "dropped_rows": dropped,
+        "flagged_rows": flagged,
+        "seconds": round(time.perf_counter() - started, 6),
+    }
+
+
+def format_validation_summary(report: Dict[str, Any]) -> str:
+    """One-line summary of a validation report for logs and the final response."""
+    if report.get("status") != "validated":
+        return f"CSV validation skipped: {report.get('reason', 'no CSV')}"
+    reasons = ", ".join(f"{reason}: {count}" for reason, count in sorted(report["counts"].items())) or "no issues"
+    return (f"CSV validation kept {report['kept']} of {report['rows']} rows, dropped {report['dropped']}, "
+            f"flagged {report['flagged']} ({reasons})")
@@ -0,0 +1,276 @@
+"""
+CPU Task Pool for No-Match Analysis Agent
+Managed process pool for CPU-bound local work (compression, parsing, scoring)
+so it does not stall the asyncio loop that serves every concurrent session.
+Large text or byte columns are handed to workers through one shared memory
+block instead of being pickled, workers are recycled after a fixed number of
+tasks and the CPU time of every task is recorded.
+
+This module only imports the standard library, so spawned workers start fast.
+"""
+
+import asyncio
+import atexit
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+ColumnItem = Union[str, bytes]
+
+
+class SharedColumn:
+    """
+    Read-only view of a list of strings or byte strings packed into one
+    shared memory block. Only the block name and item offsets are pickled.
+    """
+
+    def __init__(self, name: str, offsets: List[Tuple[int, int, bool]]):
+        """
+        Args:
+            name: Shared memory block name
+            offsets: (start, end, is_text) per item
+        """
+        self.name = name
+        self.offsets = offsets
+        self._block: Optional[shared_memory.SharedMemory] = None
+
+    def __getstate__(self):
+        return {"name": self.name, "offsets": self.offsets}
+
+    def __setstate__(self, state):
+        self.name = state["name"]
+        self.offsets = state["offsets"]
+        self._block = None
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def buffer(self, index: int) -> memoryview:
+        """
+        Get the raw bytes of an item without copying them.
+
+        Args:
+            index: Item index
+
+        Returns:
+            memoryview: View into the shared block (valid until `close`)
+        """
+        if self._block is None:
+            self._block = shared_memory.SharedMemory(name=self.name)
+        start, end, _ = self.offsets[index]
+        return self._block.buf[start:end]
+
+    def __getitem__(self, index: int) -> ColumnItem:
+        data = bytes(self.buffer(index))
+        return data.decode("utf-8") if self.offsets[index][2] else data
+
+    def __iter__(self):
+        return (self[index] for index in range(len(self)))
+
+    def close(self) -> None:
+        """Detach from the shared block (the owner unlinks it)."""
+        if self._block is not None:
+            self._block.close()
+            self._block = None
+
+
+def buffer_of(column: Union[SharedColumn, Sequence[ColumnItem]], index: int) -> Union[memoryview, bytes]:
+    """
+    Get an item's bytes from a shared or plain column.
+
+    Args:
+        column: Column passed to a task function
+        index: Item index
+
+    Returns:
+        Union[memoryview, bytes]: Item bytes (zero-copy for shared columns)
+    """
+    if isinstance(column, SharedColumn):
+        return column.buffer(index)
+    item = column[index]
+    return item.encode("utf-8") if isinstance(item, str) else item
+
+
+def _pack_column(items: Sequence[ColumnItem]) -> Tuple[shared_memory.SharedMemory, SharedColumn]:
+    """Copy items into a new shared memory block."""
+    encoded = [(item.encode("utf-8"), True) if isinstance(item, str) else (item, False) for item in items]
+    block = shared_memory.SharedMemory(create=True, size=max(1, sum(len(data) for data, _ in encoded)))
+    offsets: List[Tuple[int, int, bool]] = []
+    position = 0
+    for data, is_text in encoded:
+        block.buf[position:position + len(data)] = data
+        offsets.append((position, position + len(data), is_text))
+        position += len(data)
+    return block, SharedColumn(block.name, offsets)
+
+
+def _run_task(func: Callable, column: Any, args: tuple) -> Tuple[Any, float, int]:
+    """Worker entry point: run a task and measure its CPU time."""
+    started = time.process_time()
+    try:
+        result = func(column, *args)
+    finally:
+        if isinstance(column, SharedColumn):
+            column.close()
+    return result, time.process_time() - started, os.getpid()
+
+
+class CpuTaskPool:
+    """
+    Process pool for CPU-bound task functions.
+
+    A task function takes a column (a `SharedColumn` or a plain list of str /
+    bytes items) followed by any small picklable arguments, and must be a
+    module-level function importable by the workers. With `max_workers=0`
+    tasks run in a thread instead (for environments without subprocesses).
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 2,
+        max_tasks_per_child: Optional[int] = 100,
+        shared_memory_threshold_bytes: int = 64 * 1024,
+    ):
+        """
+        Args:
+            max_workers: Worker processes, 0 to run tasks in a thread
+            max_tasks_per_child: Tasks per worker (on average) after which the
+                workers are replaced, or None to keep them
+            shared_memory_threshold_bytes: Columns at least this large go
+                through shared memory instead of pickling
+        """
+        self.max_workers = max_workers
+        self.max_tasks_per_child = max_tasks_per_child
+        self.shared_memory_threshold_bytes = shared_memory_threshold_bytes
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._executor_tasks = 0
+        self._generations = 0
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, Dict[str, float]] = defaultdict(
+            lambda: {"tasks": 0, "failures": 0, "cpu_seconds": 0.0, "wall_seconds": 0.0, "shared_bytes": 0}
+        )
+        self._worker_pids: set = set()
+
+    @classmethod
+    def from_env(cls) -> "CpuTaskPool":
+        """
+        Build a pool from `CPU_POOL_WORKERS`, `CPU_POOL_MAX_TASKS_PER_CHILD`
+        and `CPU_POOL_SHARED_MEMORY_THRESHOLD_BYTES`.
+
+        Returns:
+            CpuTaskPool: Pool whose workers start on first use
+        """
+        max_tasks_per_child = int(os.environ.get("CPU_POOL_MAX_TASKS_PER_CHILD", "100"))
+        return cls(
+            max_workers=int(os.environ.get("CPU_POOL_WORKERS", str(min(4, os.cpu_count() or 1)))),
+            max_tasks_per_child=max_tasks_per_child if max_tasks_per_child > 0 else None,
+            shared_memory_threshold_bytes=int(os.environ.get("CPU_POOL_SHARED_MEMORY_THRESHOLD_BYTES", str(64 * 1024))),
+        )
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            # Workers are recycled a generation at a time: the executor's own
+            # max_tasks_per_child can hang on Python 3.11 once workers restart
+            if (self._executor is not None and self.max_tasks_per_child
+                    and self._executor_tasks >= self.max_tasks_per_child * self.max_workers):
+                # Tasks already submitted still finish, then the old workers exit
+                self._executor.shutdown(wait=False)
+                self._executor = None
+                self._generations += 1
+            if self._executor is None:
+                # spawn, not fork: forking a process with live gRPC/HTTP client threads is unsafe
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn")
+                )
+                self._executor_tasks = 0
+            self._executor_tasks += 1
+            return self._executor
+
+    async def run(self, func: Callable, column: Sequence[ColumnItem], *args: Any) -> Any:
+        """
+        Run a task function in the pool.
+
+        Args:
+            func: Module-level task function `func(column, *args)`
+            column: str / bytes items, shared with the worker without pickling
+                when large enough
+            *args: Extra picklable arguments
+
+        Returns:
+            Any: The task function's result
+        """
+        task_name = func.__name__
+        started = time.monotonic()
+        size = sum(len(item) for item in column)
+        block: Optional[shared_memory.SharedMemory] = None
+        task_column: Any = list(column)
+
+        try:
+            if self.max_workers <= 0:
+                result, cpu_seconds, pid = await asyncio.to_thread(_run_task, func, task_column, args)
+            else:
+                if size >= self.shared_memory_threshold_bytes:
+                    block, task_column = _pack_column(column)
+                    self._metrics[task_name]["shared_bytes"] += size
+                loop = asyncio.get_running_loop()
+                try:
+                    result, cpu_seconds, pid = await loop.run_in_executor(
+                        self._get_executor(), _run_task, func, task_column, args
+                    )
+                except BrokenProcessPool:
+                    # A worker died (e.g. OOM); start a fresh pool for later tasks
+                    with self._lock:
+                        self._executor = None
+                    raise
+        except Exception:
+            self._metrics[task_name]["failures"] += 1
+            raise
+        finally:
+            if block is not None:
+                block.close()
+                block.unlink()
+
+        metrics = self._metrics[task_name]
+        metrics["tasks"] += 1
+        metrics["cpu_seconds"] += cpu_seconds
+        metrics["wall_seconds"] += time.monotonic() - started
+        self._worker_pids.add(pid)
+        logger.debug(f"CPU task {task_name} ({size} bytes) used {cpu_seconds:.3f}s CPU in worker {pid}")
+        return result
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """
+        Get per-task-function counters.
+
+        Returns:
+            Dict[str, Any]: Tasks, failures, total CPU and wall seconds and bytes
+            passed through shared memory per task function, plus the number of
+            distinct worker processes used and worker generations recycled so far
+        """
+        return {
+            "workers": self.max_workers,
+            "worker_processes_used": len(self._worker_pids),
+            "recycled_generations": self._generations,
+            "tasks": {name: dict(counters) for name, counters in self._metrics.items()},
+        }
+
+    def shutdown(self) -> None:
+        """Stop the worker processes."""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True, cancel_futures=True)
+                self._executor = None
+
+
+# Shared by every session in this process
+cpu_task_pool = CpuTaskPool.from_env()
+atexit.register(cpu_task_pool.shutdown)
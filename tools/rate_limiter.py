@@ -0,0 +1,401 @@
+"""
+Gemini Rate Limiter for No-Match Analysis Agent
+Process-wide (optionally cross-process) token-bucket limiter on requests and
+tokens per minute, shared by all sub-agents. Waiting calls are served by
+priority class first, then fairly across sessions within a class.
+
+The sub-agents' `before_model_callback` tags each model call with its session
+and priority; the model wrapper (`resilience.ResilientLlm`) then waits for
+budget before every attempt, so retries, hedged duplicates and tier fallbacks
+are limited like first attempts.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict, deque
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.models.llm_request import LlmRequest
+from google.adk.models.llm_response import LlmResponse
+
+logger = logging.getLogger(__name__)
+
+# Session state key selecting the priority class of a session's model calls
+REQUEST_PRIORITY_STATE_KEY = "request_priority"
+
+# Lower rank is served first
+PRIORITY_CLASSES: Dict[str, int] = {
+    "interactive": 0,
+    "batch": 1,
+}
+DEFAULT_PRIORITY = "interactive"
+
+_LATENCY_WINDOW = 1000
+
+# (priority, session id, agent name) of the model call in progress, set by `before_model_callback`
+_request_scope: ContextVar[Tuple[str, str, str]] = ContextVar("gemini_request_scope", default=(DEFAULT_PRIORITY, "", ""))
+
+
+def estimate_request_tokens(llm_request: LlmRequest) -> int:
+    """
+    Roughly estimate the input tokens of a model request (about 4 characters per token).
+
+    Args:
+        llm_request: Model request
+
+    Returns:
+        int: Estimated token count, at least 1
+    """
+    characters = 0
+    if llm_request.config and llm_request.config.system_instruction:
+        characters += len(str(llm_request.config.system_instruction))
+    for content in llm_request.contents:
+        for part in content.parts or []:
+            if part.text:
+                characters += len(part.text)
+            elif part.function_call or part.function_response:
+                characters += len(part.model_dump_json(exclude_none=True))
+    return max(1, characters // 4)
+
+
+class RateBudget:
+    """
+    In-process pair of token buckets: one for requests, one for LLM tokens.
+    A limit of 0 disables that bucket.
+    """
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float):
+        self.limits = (requests_per_minute, tokens_per_minute)
+        self._levels = [requests_per_minute, tokens_per_minute]
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._updated_at
+        self._updated_at = now
+        for i, limit in enumerate(self.limits):
+            if limit:
+                self._levels[i] = min(limit, self._levels[i] + elapsed * limit / 60.0)
+
+    def reserve(self, requests: float, tokens: float) -> float:
+        """
+        Consume from both buckets if possible.
+
+        Args:
+            requests: Requests to consume
+            tokens: Tokens to consume (capped at the bucket size)
+
+        Returns:
+            float: 0 if consumed, otherwise seconds to wait before retrying
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            return self._reserve_levels(self._levels, requests, tokens)
+
+    def _reserve_levels(self, levels: List[float], requests: float, tokens: float) -> float:
+        wait = 0.0
+        amounts = (requests, tokens)
+        for i, limit in enumerate(self.limits):
+            if not limit:
+                continue
+            amount = min(amounts[i], limit)
+            if levels[i] < amount:
+                wait = max(wait, (amount - levels[i]) * 60.0 / limit)
+        if wait:
+            return wait
+        for i, limit in enumerate(self.limits):
+            if limit:
+                levels[i] -= min(amounts[i], limit)
+        return 0.0
+
+    def adjust_tokens(self, delta: float) -> None:
+        """
+        Correct the token bucket once the actual usage is known.
+
+        Args:
+            delta: Actual minus estimated tokens (may be negative)
+        """
+        if not self.limits[1]:
+            return
+        with self._lock:
+            self._levels[1] = min(self.limits[1], self._levels[1] - delta)
+
+
+class SqliteRateBudget(RateBudget):
+    """
+    Rate budget whose bucket levels live in a SQLite file, so every worker
+    process on the host draws from the same quota.
+    """
+
+    def __init__(self, db_path: str, requests_per_minute: float, tokens_per_minute: float, name: str = "gemini"):
+        super().__init__(requests_per_minute, tokens_per_minute)
+        self.name = name
+        self._conn = sqlite3.connect(db_path, timeout=5.0, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS rate_budget ("
+            "name TEXT PRIMARY KEY, requests REAL NOT NULL, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "INSERT OR IGNORE INTO rate_budget VALUES (?, ?, ?, ?)",
+            (name, requests_per_minute, tokens_per_minute, time.time()),
+        )
+
+    def _transact(self, operation) -> Any:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                requests, tokens, updated_at = self._conn.execute(
+                    "SELECT requests, tokens, updated_at FROM rate_budget WHERE name = ?", (self.name,)
+                ).fetchone()
+                now = time.time()
+                elapsed = max(0.0, now - updated_at)
+                levels = [requests, tokens]
+                for i, limit in enumerate(self.limits):
+                    if limit:
+                        levels[i] = min(limit, levels[i] + elapsed * limit / 60.0)
+                result = operation(levels)
+                self._conn.execute(
+                    "UPDATE rate_budget SET requests = ?, tokens = ?, updated_at = ? WHERE name = ?",
+                    (levels[0], levels[1], now, self.name),
+                )
+                self._conn.execute("COMMIT")
+                return result
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def reserve(self, requests: float, tokens: float) -> float:
+        return self._transact(lambda levels: self._reserve_levels(levels, requests, tokens))
+
+    def adjust_tokens(self, delta: float) -> None:
+        if not self.limits[1]:
+            return
+
+        def apply(levels):
+            levels[1] = min(self.limits[1], levels[1] - delta)
+
+        self._transact(apply)
+
+
+class GeminiRateLimiter:
+    """
+    Priority queue in front of a `RateBudget`.
+
+    Waiters are ordered by priority class, then by a per-session virtual
+    finish time (weighted fair queuing on estimated tokens), so one large
+    batch session cannot starve other sessions in its class.
+    """
+
+    def __init__(self, budget: Optional[RateBudget] = None):
+        """
+        Args:
+            budget: Rate budget to draw from, or None for no limiting (metrics only)
+        """
+        self.budget = budget
+        self._queue: List[Tuple[int, float, int, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+        self._virtual_time: Dict[int, float] = defaultdict(float)
+        self._session_finish: Dict[Tuple[int, str], float] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._pending: Dict[Tuple[str, str], int] = {}
+        self._waits: Dict[str, Deque[float]] = defaultdict(lambda: deque(maxlen=_LATENCY_WINDOW))
+        self._granted: Dict[str, int] = defaultdict(int)
+
+    @classmethod
+    def from_env(cls) -> "GeminiRateLimiter":
+        """
+        Build a limiter from `GEMINI_RATE_LIMIT_*` environment variables.
+
+        Returns:
+            GeminiRateLimiter: Limiter, unlimited unless RPM or TPM is set
+        """
+        rpm = float(os.environ.get("GEMINI_RATE_LIMIT_RPM", "0"))
+        tpm = float(os.environ.get("GEMINI_RATE_LIMIT_TPM", "0"))
+        if not rpm and not tpm:
+            return cls()
+        db_path = os.environ.get("GEMINI_RATE_LIMIT_DB")
+        if db_path:
+            return cls(SqliteRateBudget(db_path, rpm, tpm))
+        return cls(RateBudget(rpm, tpm))
+
+    def _ensure_dispatcher(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._wakeup = asyncio.Event()
+            self._queue = []
+            self._dispatcher = None
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = loop.create_task(self._dispatch())
+
+    async def _dispatch(self) -> None:
+        """Grant queued requests in order as the budget allows."""
+        while self._queue:
+            entry = self._queue[0]
+            rank, finish_tag, _, tokens, future = entry
+            if future.done():
+                heapq.heappop(self._queue)
+                continue
+            # In a thread: a shared (SQLite) budget may wait on other processes' locks
+            wait = await asyncio.to_thread(self.budget.reserve, 1, tokens) if self.budget else 0.0
+            if wait == 0:
+                # Other requests may have been queued meanwhile; grant the one reserved for
+                if self._queue and self._queue[0] is entry:
+                    heapq.heappop(self._queue)
+                elif entry in self._queue:
+                    self._queue.remove(entry)
+                    heapq.heapify(self._queue)
+                self._virtual_time[rank] = max(self._virtual_time[rank], finish_tag - tokens)
+                if not future.done():
+                    future.set_result(None)
+                continue
+            # Sleep until the budget refills, or until a higher-priority request arrives
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+
+    async def acquire(self, tokens: int, priority: str = DEFAULT_PRIORITY, session_id: str = "") -> float:
+        """
+        Wait for budget for one model request.
+
+        Args:
+            tokens: Estimated tokens of the request
+            priority: Priority class name from PRIORITY_CLASSES
+            session_id: Session used for fair queuing within the class
+
+        Returns:
+            float: Seconds spent queued
+        """
+        rank = PRIORITY_CLASSES.get(priority, PRIORITY_CLASSES[DEFAULT_PRIORITY])
+        started = time.monotonic()
+
+        if self.budget is not None:
+            if len(self._session_finish) > 10000:
+                # Sessions whose finish tag is behind the virtual clock no longer affect ordering
+                self._session_finish = {
+                    key: finish for key, finish in self._session_finish.items()
+                    if finish > self._virtual_time[key[0]]
+                }
+            start_tag = max(self._virtual_time[rank], self._session_finish.get((rank, session_id), 0.0))
+            finish_tag = start_tag + tokens
+            self._session_finish[(rank, session_id)] = finish_tag
+
+            self._ensure_dispatcher()
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._queue, (rank, finish_tag, next(self._sequence), tokens, future))
+            self._wakeup.set()
+            await future
+
+        waited = time.monotonic() - started
+        self._waits[priority].append(waited)
+        self._granted[priority] += 1
+        return waited
+
+    async def acquire_for_request(self, llm_request: LlmRequest) -> float:
+        """
+        Wait for budget for one attempt of a model request, in the priority
+        class and session the sub-agent's `before_model_callback` tagged it with.
+
+        Args:
+            llm_request: Model request about to be sent
+
+        Returns:
+            float: Seconds spent queued
+        """
+        priority, session_id, agent_name = _request_scope.get()
+        waited = await self.acquire(estimate_request_tokens(llm_request), priority=priority, session_id=session_id)
+        if waited > 1.0:
+            logger.info(f"Rate limiter held {agent_name or 'model call'} for {waited:.1f}s ({priority})")
+        return waited
+
+    def get_metrics(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Get per-queue latency metrics.
+
+        Returns:
+            Dict[str, Dict[str, Any]]: For each priority class, the number of
+            granted requests, current queue depth and p50/p95/max wait seconds
+        """
+        depth: Dict[int, int] = defaultdict(int)
+        for rank, _, _, _, future in self._queue:
+            if not future.done():
+                depth[rank] += 1
+
+        metrics = {}
+        for priority, rank in PRIORITY_CLASSES.items():
+            waits = sorted(self._waits.get(priority, ()))
+            metrics[priority] = {
+                "granted": self._granted.get(priority, 0),
+                "queued": depth.get(rank, 0),
+                "p50_wait_seconds": waits[len(waits) // 2] if waits else 0.0,
+                "p95_wait_seconds": waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else 0.0,
+                "max_wait_seconds": waits[-1] if waits else 0.0,
+            }
+        return metrics
+
+    async def before_model_callback(
+        self, callback_context: CallbackContext, llm_request: LlmRequest
+    ) -> Optional[LlmResponse]:
+        """
+        ADK `before_model_callback` that tags the model call with its session's
+        priority. Budget is acquired by the model wrapper, once per attempt
+        (see `acquire_for_request`).
+
+        Args:
+            callback_context: Callback context of the calling sub-agent
+            llm_request: Rendered model request
+
+        Returns:
+            None: The model call always proceeds
+        """
+        priority = callback_context.state.get(REQUEST_PRIORITY_STATE_KEY) or DEFAULT_PRIORITY
+        session_id = callback_context._invocation_context.session.id
+        _request_scope.set((priority, session_id, callback_context.agent_name))
+        self._pending[(callback_context.invocation_id, callback_context.agent_name)] = estimate_request_tokens(llm_request)
+        return None
+
+    async def after_model_callback(
+        self, callback_context: CallbackContext, llm_response: LlmResponse
+    ) -> Optional[LlmResponse]:
+        """
+        ADK `after_model_callback` that reconciles estimated and actual token usage.
+
+        Args:
+            callback_context: Callback context of the calling sub-agent
+            llm_response: Response returned by the model
+
+        Returns:
+            None: The response is never modified
+        """
+        if llm_response.partial:
+            # Usage is only final on the last, non-partial response of a stream
+            return None
+        estimate = self._pending.pop((callback_context.invocation_id, callback_context.agent_name), None)
+        usage = llm_response.usage_metadata
+        if self.budget and estimate is not None and usage and usage.total_token_count:
+            await asyncio.to_thread(self.budget.adjust_tokens, usage.total_token_count - estimate)
+        return None
+
+    def on_model_error_callback(
+        self, callback_context: CallbackContext, llm_request: LlmRequest, error: Exception
+    ) -> Optional[LlmResponse]:
+        """ADK `on_model_error_callback` that forgets the failed request's estimate."""
+        self._pending.pop((callback_context.invocation_id, callback_context.agent_name), None)
+        return None
+
+
+# Shared limiter used by all sub-agents
+gemini_rate_limiter = GeminiRateLimiter.from_env()
@@ -0,0 +1,139 @@
+"""
+Compact Records for No-Match Analysis Agent
+Slotted record types for the data the local stages pass around.
+
+- UtteranceCount: no-match turns and conversations of one utterance
+- UtteranceCluster: utterances sharing a cluster key, with their turns
+- IntentPhrase: a training phrase of an intent
+
+Records have no per-instance `__dict__`, so a row costs a fraction of the
+equivalent dict. They pickle as plain tuples, e.g. as results of worker
+processes. Like the process pool, this module only imports the standard library.
+"""
+
+from typing import Any, Dict, Iterable, List, Mapping, Tuple, Type
+
+from tools.top_k import top_k
+
+# Field kinds: "s" string, "i" integer, "f" float, "ls" list of strings, "li" list of integers
+_DEFAULTS = {"s": "", "i": 0, "f": 0.0, "ls": (), "li": ()}
+
+
+class Record:
+    """
+    Base of the slotted record types. Subclasses declare `FIELDS` as
+    (name, kind) pairs and `__slots__` with the same names; `ROW_ALIASES` maps
+    source column names (e.g. of a BigQuery row) to field names.
+    """
+
+    __slots__ = ()
+    FIELDS: Tuple[Tuple[str, str], ...] = ()
+    ROW_ALIASES: Dict[str, str] = {}
+
+    def __init__(self, *values: Any, **named: Any):
+        if len(values) > len(self.FIELDS):
+            raise TypeError(f"{type(self).__name__} takes at most {len(self.FIELDS)} values")
+        for index, (name, kind) in enumerate(self.FIELDS):
+            if index < len(values):
+                value = values[index]
+            else:
+                value = named.pop(name, _DEFAULTS[kind])
+            setattr(self, name, list(value) if kind in ("ls", "li") else value)
+        if named:
+            raise TypeError(f"{type(self).__name__} has no field(s) {sorted(named)}")
+
+    @classmethod
+    def from_row(cls, row: Mapping[str, Any]) -> "Record":
+        """
+        Build a record from a dict-like row, coercing numeric fields.
+
+        Args:
+            row: Row keyed by field names or `ROW_ALIASES`
+
+        Returns:
+            Record: Record with missing fields defaulted
+        """
+        values = {}
+        for column, value in row.items():
+            name = cls.ROW_ALIASES.get(column, column)
+            if name in cls.__slots__:
+                values[name] = value
+        for name, kind in cls.FIELDS:
+            if kind == "i":
+                values[name] = int(values.get(name) or 0)
+            elif kind == "f":
+                values[name] = float(values.get(name) or 0.0)
+            elif kind == "s":
+                values[name] = "" if values.get(name) is None else str(values[name])
+        return cls(**values)
+
+    def to_row(self) -> Dict[str, Any]:
+        """Plain dict of the fields, e.g. for JSON or a tool result."""
+        return {name: getattr(self, name) for name, _ in self.FIELDS}
+
+    def astuple(self) -> tuple:
+        return tuple(getattr(self, name) for name, _ in self.FIELDS)
+
+    def __eq__(self, other: Any) -> bool:
+        return type(other) is type(self) and other.astuple() == self.astuple()
+
+    def __repr__(self) -> str:
+        values = ", ".join(f"{name}={getattr(self, name)!r}" for name, _ in self.FIELDS)
+        return f"{type(self).__name__}({values})"
+
+    def __reduce__(self):
+        # Slotted classes pickle through this, e.g. results of worker processes
+        return type(self), self.astuple()
+
+
+class UtteranceCount(Record):
+    """No-match turns and conversations of one utterance (rollup or sampled preview row)."""
+
+    __slots__ = ("utterance", "no_match_turns", "no_match_conversations")
+    FIELDS = (("utterance", "s"), ("no_match_turns", "i"), ("no_match_conversations", "i"))
+    ROW_ALIASES = {"group_key": "utterance", "conversations": "no_match_conversations"}
+
+
+class UtteranceCluster(Record):
+    """Utterances that share a cluster key (see `utterance_cluster_key`), with their no-match turns."""
+
+    __slots__ = ("key", "no_match_turns", "utterances", "utterance_turns")
+    FIELDS = (("key", "s"), ("no_match_turns", "i"), ("utterances", "ls"), ("utterance_turns", "li"))
+
+    def add(self, utterance: str, turns: int) -> None:
+        """Count no-match turns of a member utterance."""
+        self.no_match_turns += turns
+        try:
+            self.utterance_turns[self.utterances.index(utterance)] += turns
+        except ValueError:
+            self.utterances.append(utterance)
+            self.utterance_turns.append(turns)
+
+    def merge(self, other: "UtteranceCluster") -> None:
+        for utterance, turns in zip(other.utterances, other.utterance_turns):
+            self.add(utterance, turns)
+
+    def top_utterances(self, limit: int) -> List[str]:
+        """Member utterances, most no-match turns first."""
+        order = top_k(range(len(self.utterances)), limit, key=lambda index: self.utterance_turns[index])
+        return [self.utterances[index] for index in order]
+
+    def label(self) -> str:
+        """Member utterance with the most turns; ties go to the greatest string."""
+        return max(zip(self.utterance_turns, self.utterances))[1] if self.utterances else self.key
+
+
+class IntentPhrase(Record):
+    """A training phrase of an intent, with its optional language code."""
+
+    __slots__ = ("intent", "phrase", "language_code")
+    FIELDS = (("intent", "s"), ("phrase", "s"), ("language_code", "s"))
+    ROW_ALIASES = {"Intent Name": "intent", "Training Phrase": "phrase", "Language Code": "language_code"}
+
+
+def records_from_rows(record_type: Type[Record], rows: Iterable[Mapping[str, Any]]) -> List[Record]:
+    return [record_type.from_row(row) for row in rows]
+
+
+def records_to_rows(records: Iterable[Record]) -> List[Dict[str, Any]]:
+    return [record.to_row() for record in records]
@@ -0,0 +1,356 @@
+"""
+Resilience Utilities for No-Match Analysis Agent
+Per-call deadlines, exponential backoff with full jitter for retryable errors
+and optional hedged duplicate requests for BigQuery and Gemini calls.
+"""
+
+import asyncio
+import logging
+import os
+import random
+import time
+from collections import defaultdict, deque
+from typing import Any, AsyncGenerator, Awaitable, Callable, Deque, Dict, List, Optional
+
+from google.adk.models.base_llm import BaseLlm
+from google.adk.models.llm_request import LlmRequest
+from google.adk.models.llm_response import LlmResponse
+
+from tools.rate_limiter import GeminiRateLimiter, gemini_rate_limiter
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+_LATENCY_WINDOW = 200
+_MIN_HEDGE_SAMPLES = 20
+
+_latencies: Dict[str, Deque[float]] = defaultdict(lambda: deque(maxlen=_LATENCY_WINDOW))
+_stats: Dict[str, Dict[str, int]] = defaultdict(lambda: {"calls": 0, "retries": 0, "hedges": 0, "hedge_wins": 0, "failures": 0})
+
+
+def is_retryable_error(error: BaseException) -> bool:
+    """
+    Decide whether an error is transient and worth retrying.
+
+    Args:
+        error: Exception raised by a BigQuery or Gemini call
+
+    Returns:
+        bool: True for timeouts, connection errors and retryable HTTP status codes
+    """
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return True
+    code = getattr(error, "code", None)
+    if isinstance(code, int) and code in RETRYABLE_STATUS_CODES:
+        return True
+    # google.api_core exceptions expose the HTTP status as `code` (checked above);
+    # fall back to their class names to avoid importing api_core here
+    return type(error).__name__ in {
+        "TooManyRequests", "ServiceUnavailable", "InternalServerError",
+        "BadGateway", "GatewayTimeout", "DeadlineExceeded",
+    }
+
+
+class RetryPolicy:
+    """
+    Retry, deadline and hedging settings for one kind of call.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = 4,
+        attempt_timeout_seconds: Optional[float] = None,
+        total_timeout_seconds: Optional[float] = None,
+        initial_backoff_seconds: float = 0.5,
+        max_backoff_seconds: float = 30.0,
+        hedging_enabled: bool = False,
+        hedge_percentile: float = 0.95,
+        min_hedge_delay_seconds: float = 1.0,
+    ):
+        """
+        Args:
+            max_attempts: Attempts including the first one
+            attempt_timeout_seconds: Deadline for a single attempt, or None
+            total_timeout_seconds: Deadline across all attempts and backoff, or None
+            initial_backoff_seconds: Backoff cap for the first retry
+            max_backoff_seconds: Upper bound on any single backoff
+            hedging_enabled: Send a duplicate request when an attempt runs past
+                the latency percentile of recent calls
+            hedge_percentile: Latency percentile that triggers a hedge
+            min_hedge_delay_seconds: Never hedge earlier than this
+        """
+        self.max_attempts = max_attempts
+        self.attempt_timeout_seconds = attempt_timeout_seconds
+        self.total_timeout_seconds = total_timeout_seconds
+        self.initial_backoff_seconds = initial_backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.hedging_enabled = hedging_enabled
+        self.hedge_percentile = hedge_percentile
+        self.min_hedge_delay_seconds = min_hedge_delay_seconds
+
+    @classmethod
+    def from_env(cls, prefix: str, **defaults) -> "RetryPolicy":
+        """
+        Build a policy from `<PREFIX>_*` environment variables.
+
+        Args:
+            prefix: Variable prefix, e.g. "BIGQUERY" or "LLM"
+            **defaults: Default values for the constructor arguments
+
+        Returns:
+            RetryPolicy: Policy with environment overrides applied
+        """
+        def env_float(name: str, default: Optional[float]) -> Optional[float]:
+            value = os.environ.get(f"{prefix}_{name}")
+            if value is None:
+                return default
+            return float(value) if float(value) > 0 else None
+
+        policy = cls(**defaults)
+        policy.max_attempts = int(os.environ.get(f"{prefix}_MAX_ATTEMPTS", policy.max_attempts))
+        policy.attempt_timeout_seconds = env_float("ATTEMPT_TIMEOUT_SECONDS", policy.attempt_timeout_seconds)
+        policy.total_timeout_seconds = env_float("TOTAL_TIMEOUT_SECONDS", policy.total_timeout_seconds)
+        hedging = os.environ.get(f"{prefix}_HEDGING_ENABLED")
+        if hedging is not None:
+            policy.hedging_enabled = hedging.lower() in ("1", "true", "yes")
+        return policy
+
+    def backoff_delay(self, retry_number: int) -> float:
+        """
+        Full-jitter exponential backoff.
+
+        Args:
+            retry_number: 0 for the first retry
+
+        Returns:
+            float: Seconds to sleep before the retry
+        """
+        cap = min(self.max_backoff_seconds, self.initial_backoff_seconds * (2 ** retry_number))
+        return random.uniform(0, cap)
+
+    def hedge_delay(self, operation: str) -> Optional[float]:
+        """
+        Get how long to wait before sending a hedged duplicate.
+
+        Args:
+            operation: Operation name used to track latencies
+
+        Returns:
+            Optional[float]: Seconds, or None if hedging is off or there are
+            too few samples to estimate the percentile
+        """
+        if not self.hedging_enabled:
+            return None
+        samples = sorted(_latencies[operation])
+        if len(samples) < _MIN_HEDGE_SAMPLES:
+            return None
+        index = min(len(samples) - 1, int(len(samples) * self.hedge_percentile))
+        return max(self.min_hedge_delay_seconds, samples[index])
+
+
+def get_resilience_stats() -> Dict[str, Dict[str, int]]:
+    """
+    Get call, retry and hedge counters per operation.
+
+    Returns:
+        Dict[str, Dict[str, int]]: Counters keyed by operation name
+    """
+    return {operation: dict(counters) for operation, counters in _stats.items()}
+
+
+async def _admitted(
+    attempt_factory: Callable[[], Awaitable[Any]], admit: Optional[Callable[[], Awaitable[Any]]], timeout: Optional[float]
+) -> Any:
+    """Wait for admission (e.g. rate budget), then run one attempt within its timeout."""
+    if admit is not None:
+        await admit()
+    return await asyncio.wait_for(attempt_factory(), timeout)
+
+
+async def _run_hedged(
+    attempt_factory: Callable[[], Awaitable[Any]], policy: RetryPolicy, operation: str, timeout: Optional[float],
+    admit: Optional[Callable[[], Awaitable[Any]]] = None,
+) -> Any:
+    """Run one attempt, adding a hedged duplicate if it is slow. The loser is cancelled."""
+    started = time.monotonic()
+    tasks: List[asyncio.Task] = [asyncio.ensure_future(_admitted(attempt_factory, admit, timeout))]
+    try:
+        hedge_delay = policy.hedge_delay(operation)
+        if hedge_delay is not None and (timeout is None or hedge_delay < timeout):
+            done, _ = await asyncio.wait(tasks, timeout=hedge_delay)
+            if not done:
+                _stats[operation]["hedges"] += 1
+                logger.info(f"Hedging {operation} after {hedge_delay:.2f}s")
+                hedge_timeout = None if timeout is None else timeout - hedge_delay
+                tasks.append(asyncio.ensure_future(_admitted(attempt_factory, admit, hedge_timeout)))
+
+        first_error: Optional[BaseException] = None
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if len(tasks) > 1 and task is tasks[1]:
+                        _stats[operation]["hedge_wins"] += 1
+                    _latencies[operation].append(time.monotonic() - started)
+                    return task.result()
+                first_error = first_error or task.exception()
+        raise first_error
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+async def run_with_resilience(
+    attempt_factory: Callable[[], Awaitable[Any]], policy: RetryPolicy, operation: str,
+    admit: Optional[Callable[[], Awaitable[Any]]] = None,
+) -> Any:
+    """
+    Run an async call with deadlines, jittered retries and optional hedging.
+
+    Args:
+        attempt_factory: Creates a fresh awaitable for each attempt
+        policy: Retry policy to apply
+        operation: Operation name for latency tracking, stats and logs
+        admit: Awaited before every attempt and hedged duplicate, outside the
+            attempt timeout (e.g. waiting for rate budget)
+
+    Returns:
+        Any: Result of the first successful attempt
+
+    Raises:
+        Exception: The last error once attempts or the total deadline run out,
+        or immediately for non-retryable errors
+    """
+    _stats[operation]["calls"] += 1
+    deadline = time.monotonic() + policy.total_timeout_seconds if policy.total_timeout_seconds else None
+
+    for attempt in range(policy.max_attempts):
+        timeout = policy.attempt_timeout_seconds
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            timeout = remaining if timeout is None else min(timeout, remaining)
+        try:
+            return await _run_hedged(attempt_factory, policy, operation, timeout, admit)
+        except Exception as e:
+            if not is_retryable_error(e) or attempt == policy.max_attempts - 1:
+                _stats[operation]["failures"] += 1
+                raise
+            delay = policy.backoff_delay(attempt)
+            if deadline is not None and time.monotonic() + delay >= deadline:
+                _stats[operation]["failures"] += 1
+                raise
+            _stats[operation]["retries"] += 1
+            logger.warning(f"{operation} attempt {attempt + 1} failed ({type(e).__name__}: {e}); retrying in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+
+def run_sync_with_retries(call: Callable[[], Any], policy: RetryPolicy, operation: str) -> Any:
+    """
+    Blocking counterpart of `run_with_resilience` (retries and backoff only).
+
+    Args:
+        call: Function performing one attempt; it should honour
+            `policy.attempt_timeout_seconds` itself
+        policy: Retry policy to apply
+        operation: Operation name for stats and logs
+
+    Returns:
+        Any: Result of the first successful attempt
+    """
+    _stats[operation]["calls"] += 1
+    for attempt in range(policy.max_attempts):
+        try:
+            return call()
+        except Exception as e:
+            if not is_retryable_error(e) or attempt == policy.max_attempts - 1:
+                _stats[operation]["failures"] += 1
+                raise
+            delay = policy.backoff_delay(attempt)
+            _stats[operation]["retries"] += 1
+            logger.warning(f"{operation} attempt {attempt + 1} failed ({type(e).__name__}: {e}); retrying in {delay:.2f}s")
+            time.sleep(delay)
+
+
+class ResilientLlm(BaseLlm):
+    """
+    Model wrapper that applies a `RetryPolicy` to every call of an inner model.
+
+    Non-streaming calls are retried and may be hedged. Streaming calls are
+    retried only until the first chunk is yielded, since chunks already sent
+    to the caller cannot be taken back. Every attempt, hedge included, first
+    waits for rate budget (see tools/rate_limiter.py).
+    """
+
+    inner: Optional[BaseLlm] = None
+    policy: RetryPolicy
+    limiter: Optional[GeminiRateLimiter] = None
+
+    def _limiter(self) -> GeminiRateLimiter:
+        return self.limiter or gemini_rate_limiter
+
+    def _inner_model(self) -> BaseLlm:
+        """Get the inner model, creating a Gemini model on first use."""
+        if self.inner is None:
+            # Deferred so importing the agents does not load the Gemini client stack
+            from google.adk.models.google_llm import Gemini
+
+            self.inner = Gemini(model=self.model)
+        return self.inner
+
+    @property
+    def capabilities(self):
+        return self._inner_model().capabilities
+
+    async def generate_content_async(
+        self, llm_request: LlmRequest, stream: bool = False
+    ) -> AsyncGenerator[LlmResponse, None]:
+        inner = self._inner_model()
+        limiter = self._limiter()
+        # Per requested model, so routed tiers keep separate latency histories
+        operation = f"llm:{llm_request.model or inner.model}"
+
+        if stream:
+            for attempt in range(self.policy.max_attempts):
+                yielded = False
+                await limiter.acquire_for_request(llm_request)
+                try:
+                    async for response in inner.generate_content_async(llm_request, stream=True):
+                        yielded = True
+                        yield response
+                    return
+                except Exception as e:
+                    if yielded or not is_retryable_error(e) or attempt == self.policy.max_attempts - 1:
+                        raise
+                    await asyncio.sleep(self.policy.backoff_delay(attempt))
+
+        async def attempt() -> List[LlmResponse]:
+            return [response async for response in inner.generate_content_async(llm_request, stream=False)]
+
+        async def admit() -> None:
+            await limiter.acquire_for_request(llm_request)
+
+        for response in await run_with_resilience(attempt, self.policy, operation, admit):
+            yield response
+
+    def connect(self, llm_request: LlmRequest):
+        return self._inner_model().connect(llm_request)
+
+
+def resilient_model(model_name: str) -> ResilientLlm:
+    """
+    Build a Gemini model wrapped with the `LLM_*` retry policy.
+
+    Args:
+        model_name: Gemini model name, e.g. "gemini-2.5-flash"
+
+    Returns:
+        ResilientLlm: Model to pass to `LlmAgent(model=...)`; the Gemini client
+        itself is created on the first call
+    """
+    return ResilientLlm(
+        model=model_name,
+        policy=RetryPolicy.from_env("LLM", attempt_timeout_seconds=180.0, total_timeout_seconds=600.0),
+    )
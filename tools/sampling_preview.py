@@ -0,0 +1,357 @@
+"""
+Sampling Preview for No-Match Analysis Agent
+Fast preview of a date range from a sample of conversations: estimated
+no-match rates and the most frequent no-match utterances, each with a
+confidence interval. The orchestrator shows the preview before (optionally)
+refining it with the full workflow.
+
+Conversations are sampled by hashing `conversation_name`, so every turn of a
+sampled conversation is included and the same conversations are sampled on
+every run. TABLESAMPLE scans fewer bytes but samples storage blocks, which
+splits conversations; it is available for turn-level estimates only.
+"""
+
+import asyncio
+import math
+import os
+import re
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from tools.bigquery_tools import run_bigquery_query
+from tools.records import UtteranceCount, records_from_rows
+
+PREVIEW_MODE_STATE_KEY = "preview_mode"
+PREVIEW_REFINE_STATE_KEY = "preview_refine"
+PREVIEW_SAMPLE_PERCENT_STATE_KEY = "preview_sample_percent"
+PREVIEW_ESTIMATES_STATE_KEY = "preview_estimates"
+
+DEFAULT_SAMPLE_PERCENT = float(os.environ.get("PREVIEW_SAMPLE_PERCENT", "1.0"))
+PREVIEW_SAMPLING_METHOD = os.environ.get("PREVIEW_SAMPLING_METHOD", "hash").lower()
+PREVIEW_TOP_PATTERNS = int(os.environ.get("PREVIEW_TOP_PATTERNS", "10"))
+PREVIEW_DEFAULT_DAYS = 7
+
+# Two-sided 95% confidence
+Z_95 = 1.959964
+
+# Hash buckets for conversation sampling: percentages down to 0.01% are exact
+_HASH_BUCKETS = 10000
+
+
+def preview_enabled(state: Dict[str, Any]) -> bool:
+    """Whether a run should start with a sampling preview (state key, else `PREVIEW_MODE_ENABLED`)."""
+    value = state.get(PREVIEW_MODE_STATE_KEY)
+    if value is None:
+        return os.environ.get("PREVIEW_MODE_ENABLED", "false").lower() in ("1", "true", "yes")
+    return bool(value)
+
+
+# Relative ranges the preview resolves itself; other date wording leaves the range unresolved
+_TRAILING_RANGE_PATTERN = re.compile(r"\b(?:last|past|previous)\s+(\d+)\s+(day|week)s?\b")
+_CALENDAR_RANGE_PATTERN = re.compile(r"\b(last|previous|this)\s+(week|month|quarter|year)\b")
+_DATE_WORDS_PATTERN = re.compile(
+    r"\b(?:today|yesterday|days?|weeks?|weekend|months?|quarters?|years?|ago|since|until|q[1-4]|"
+    r"jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|june?|july?|aug(?:ust)?|sep(?:t(?:ember)?)?|"
+    r"oct(?:ober)?|nov(?:ember)?|dec(?:ember)?|\d{4}|\d{1,2}/\d{1,2}(?:/\d{2,4})?)\b"
+)
+
+
+def _period_start(day: date, unit: str) -> date:
+    """First day of the calendar week (Monday), month, quarter or year containing a day."""
+    if unit == "week":
+        return day - timedelta(days=day.weekday())
+    if unit == "month":
+        return day.replace(day=1)
+    if unit == "quarter":
+        return day.replace(month=(day.month - 1) // 3 * 3 + 1, day=1)
+    return day.replace(month=1, day=1)
+
+
+def preview_date_range(
+    state: Dict[str, Any], user_query: str = "", today: Optional[date] = None
+) -> Optional[Tuple[str, str]]:
+    """
+    Pick the date range to preview.
+
+    Args:
+        state: Session state, may hold `start_date` and `end_date`
+        user_query: Text of the user query, searched for two YYYY-MM-DD dates
+            or a relative range ("last 30 days", "last quarter", "yesterday", ...)
+        today: Current date (for tests)
+
+    Returns:
+        Optional[Tuple[str, str]]: Inclusive start and end date, ISO
+        formatted; the last 7 days when the query names no range, like the
+        retrieval step's default; None when the query names a range the
+        preview cannot resolve, so it does not estimate a different window
+        than the full run
+    """
+    if state.get("start_date") and state.get("end_date"):
+        return str(state["start_date"]), str(state["end_date"])
+    query = (user_query or "").lower()
+    dates = re.findall(r"\b\d{4}-\d{2}-\d{2}\b", query)
+    if len(dates) >= 2:
+        return tuple(sorted(dates[:2]))
+
+    end = today or date.today()
+    trailing = _TRAILING_RANGE_PATTERN.search(query)
+    if trailing:
+        days = int(trailing.group(1)) * (7 if trailing.group(2) == "week" else 1)
+        return (end - timedelta(days=max(1, days) - 1)).isoformat(), end.isoformat()
+    calendar = _CALENDAR_RANGE_PATTERN.search(query)
+    if calendar:
+        which, unit = calendar.groups()
+        start = _period_start(end, unit)
+        if which != "this":
+            # The period before the current one ends the day before it starts
+            end = start - timedelta(days=1)
+            start = _period_start(end, unit)
+        return start.isoformat(), end.isoformat()
+    if re.search(r"\byesterday\b", query):
+        yesterday = end - timedelta(days=1)
+        return yesterday.isoformat(), yesterday.isoformat()
+    if re.search(r"\btoday\b", query):
+        return end.isoformat(), end.isoformat()
+    if dates or _DATE_WORDS_PATTERN.search(query):
+        return None
+    return (end - timedelta(days=PREVIEW_DEFAULT_DAYS - 1)).isoformat(), end.isoformat()
+
+
+def _sampled_turns_sql(PROJECT: str, DATASET: str, start_date: str, end_date: str, sample_percent: float, method: str) -> str:
+    """Common table expression selecting the sampled turns of the date range."""
+    table = f"`{PROJECT}.{DATASET}.dialogflow_bigquery_export_data`"
+    if method == "tablesample":
+        source, sample_filter = f"{table} TABLESAMPLE SYSTEM ({sample_percent} PERCENT)", ""
+    else:
+        buckets = max(1, round(sample_percent / 100 * _HASH_BUCKETS))
+        source = table
+        sample_filter = f"\n            AND MOD(ABS(FARM_FINGERPRINT(conversation_name)), {_HASH_BUCKETS}) < {buckets}"
+    return f"""
+        WITH sampled AS (
+          SELECT
+            conversation_name,
+            LOWER(TRIM(JSON_VALUE(request, '$.queryInput.text.text'))) AS utterance,
+            (JSON_VALUE(request, '$.intentDetectionConfidence') = '0.0'
+             OR JSON_VALUE(request, '$.intentDetectionConfidence') IS NULL) AS is_no_match
+          FROM {source}
+          WHERE DATE(request_time) BETWEEN '{start_date}' AND '{end_date}'
+            AND JSON_VALUE(request, '$.queryInput.text.text') IS NOT NULL{sample_filter}
+        )"""
+
+
+def build_summary_query(PROJECT: str, DATASET: str, start_date: str, end_date: str,
+                        sample_percent: float, method: str = "hash") -> str:
+    """
+    Build the query for the sample's per-conversation totals.
+
+    Returns:
+        str: SQL returning one row with the sample size and the sums needed
+        for ratio estimates and their variance
+    """
+    return _sampled_turns_sql(PROJECT, DATASET, start_date, end_date, sample_percent, method) + """,
+        per_conversation AS (
+          SELECT conversation_name, COUNT(*) AS turns, COUNTIF(is_no_match) AS no_match_turns
+          FROM sampled
+          GROUP BY conversation_name
+        )
+        SELECT
+          COUNT(*) AS conversations,
+          COUNTIF(no_match_turns > 0) AS conversations_with_no_match,
+          SUM(turns) AS turns,
+          SUM(no_match_turns) AS no_match_turns,
+          SUM(turns * turns) AS sum_turns_squared,
+          SUM(no_match_turns * no_match_turns) AS sum_no_match_turns_squared,
+          SUM(turns * no_match_turns) AS sum_turns_by_no_match_turns
+        FROM per_conversation
+    """
+
+
+def build_pattern_query(PROJECT: str, DATASET: str, start_date: str, end_date: str,
+                        sample_percent: float, method: str = "hash", top: int = PREVIEW_TOP_PATTERNS) -> str:
+    """
+    Build the query for the most frequent no-match utterances in the sample.
+
+    Returns:
+        str: SQL returning utterance, no_match_turns and conversations per utterance
+    """
+    return _sampled_turns_sql(PROJECT, DATASET, start_date, end_date, sample_percent, method) + f"""
+        SELECT utterance, COUNT(*) AS no_match_turns, COUNT(DISTINCT conversation_name) AS conversations
+        FROM sampled
+        WHERE is_no_match
+        GROUP BY utterance
+        ORDER BY no_match_turns DESC
+        LIMIT {top}
+    """
+
+
+def wilson_interval(successes: int, trials: int, z: float = Z_95) -> Tuple[float, float]:
+    """
+    Wilson score interval for a proportion (well-behaved for small counts).
+
+    Returns:
+        Tuple[float, float]: Lower and upper bound, (0, 0) without trials
+    """
+    if trials <= 0:
+        return 0.0, 0.0
+    p = successes / trials
+    denominator = 1 + z * z / trials
+    center = (p + z * z / (2 * trials)) / denominator
+    margin = z * math.sqrt(p * (1 - p) / trials + z * z / (4 * trials * trials)) / denominator
+    return max(0.0, center - margin), min(1.0, center + margin)
+
+
+def ratio_estimate(
+    n: int, sum_x: float, sum_y: float, sum_xx: float, sum_yy: float, sum_xy: float,
+    sampling_fraction: float = 0.0, z: float = Z_95,
+) -> Dict[str, float]:
+    """
+    Estimate sum(y) / sum(x) from a sample of clusters (conversations).
+
+    Turns of one conversation are correlated, so the variance is computed
+    from per-conversation residuals (linearization), not from turn counts.
+
+    Args:
+        n: Sampled conversations
+        sum_x, sum_y: Sums of the denominator and numerator per conversation
+        sum_xx, sum_yy, sum_xy: Sums of squares and cross products
+        sampling_fraction: Share of the population sampled (finite population correction)
+
+    Returns:
+        Dict[str, float]: estimate, standard_error, ci_low and ci_high
+    """
+    if n <= 0 or sum_x <= 0:
+        return {"estimate": 0.0, "standard_error": 0.0, "ci_low": 0.0, "ci_high": 0.0}
+    ratio = sum_y / sum_x
+    if n < 2:
+        return {"estimate": ratio, "standard_error": float("nan"), "ci_low": 0.0, "ci_high": 1.0}
+    residual_ss = max(0.0, sum_yy - 2 * ratio * sum_xy + ratio * ratio * sum_xx)
+    mean_x = sum_x / n
+    variance = (1 - min(sampling_fraction, 1.0)) * residual_ss / (n * (n - 1) * mean_x * mean_x)
+    standard_error = math.sqrt(variance)
+    return {
+        "estimate": ratio,
+        "standard_error": standard_error,
+        "ci_low": max(0.0, ratio - z * standard_error),
+        "ci_high": min(1.0, ratio + z * standard_error),
+    }
+
+
+def build_estimates(summary: Dict[str, Any], patterns: List[Dict[str, Any]], sample_percent: float) -> Dict[str, Any]:
+    """
+    Turn the sample totals into population estimates with 95% intervals.
+
+    Args:
+        summary: Row of the summary query
+        patterns: Rows of the pattern query
+        sample_percent: Percentage of conversations sampled
+
+    Returns:
+        Dict[str, Any]: Sample size, estimated conversations, conversation-level
+        and turn-level no-match rates, and per-utterance frequencies
+    """
+    fraction = sample_percent / 100
+    n = int(summary.get("conversations") or 0)
+    with_no_match = int(summary.get("conversations_with_no_match") or 0)
+    no_match_turns = int(summary.get("no_match_turns") or 0)
+    low, high = wilson_interval(with_no_match, n)
+
+    pattern_estimates = []
+    for row in records_from_rows(UtteranceCount, patterns):
+        conversations = row.no_match_conversations
+        share_low, share_high = wilson_interval(conversations, n)
+        pattern_estimates.append({
+            "utterance": row.utterance,
+            "sample_no_match_turns": row.no_match_turns,
+            "share_of_no_match_turns": (row.no_match_turns / no_match_turns) if no_match_turns else 0.0,
+            "conversation_rate": {"estimate": conversations / n if n else 0.0, "ci_low": share_low, "ci_high": share_high},
+            "estimated_conversations": {
+                "estimate": round(conversations / fraction) if fraction else None,
+                "ci_low": round(share_low * n / fraction) if fraction else None,
+                "ci_high": round(share_high * n / fraction) if fraction else None,
+            },
+        })
+
+    return {
+        "sample_percent": sample_percent,
+        "confidence_level": 0.95,
+        "sampled_conversations": n,
+        "sampled_turns": int(summary.get("turns") or 0),
+        "estimated_total_conversations": round(n / fraction) if fraction else None,
+        "conversation_no_match_rate": {"estimate": with_no_match / n if n else 0.0, "ci_low": low, "ci_high": high},
+        "turn_no_match_rate": ratio_estimate(
+            n,
+            float(summary.get("turns") or 0),
+            float(no_match_turns),
+            float(summary.get("sum_turns_squared") or 0),
+            float(summary.get("sum_no_match_turns_squared") or 0),
+            float(summary.get("sum_turns_by_no_match_turns") or 0),
+            sampling_fraction=fraction,
+        ),
+        "patterns": pattern_estimates,
+    }
+
+
+async def run_sampled_preview(
+    PROJECT: str,
+    DATASET: str,
+    start_date: str,
+    end_date: str,
+    sample_percent: float = DEFAULT_SAMPLE_PERCENT,
+    method: str = PREVIEW_SAMPLING_METHOD,
+) -> Dict[str, Any]:
+    """
+    Run the preview queries and estimate no-match rates for the date range.
+
+    Args:
+        PROJECT: GCP project of the export table
+        DATASET: Dataset of the export table
+        start_date: First day, YYYY-MM-DD
+        end_date: Last day, YYYY-MM-DD
+        sample_percent: Percentage of conversations to sample
+        method: "hash" (whole conversations) or "tablesample" (storage blocks)
+
+    Returns:
+        Dict[str, Any]: Output of `build_estimates` plus the date range and method
+    """
+    summary_rows, pattern_rows = await asyncio.gather(
+        run_bigquery_query(PROJECT, build_summary_query(PROJECT, DATASET, start_date, end_date, sample_percent, method)),
+        run_bigquery_query(PROJECT, build_pattern_query(PROJECT, DATASET, start_date, end_date, sample_percent, method)),
+    )
+    estimates = build_estimates(summary_rows[0] if summary_rows else {}, pattern_rows, sample_percent)
+    estimates.update({"start_date": start_date, "end_date": end_date, "sampling_method": method})
+    return estimates
+
+
+def format_preview_report(estimates: Dict[str, Any]) -> str:
+    """
+    Render preview estimates as a markdown report.
+
+    Args:
+        estimates: Output of `run_sampled_preview`
+
+    Returns:
+        str: Report for the user
+    """
+    def percent(interval: Dict[str, Any]) -> str:
+        return f"{interval['estimate']:.1%} (95% CI {interval['ci_low']:.1%}–{interval['ci_high']:.1%})"
+
+    lines = [
+        f"## 🔎 No-Match Preview ({estimates['start_date']} to {estimates['end_date']})",
+        "",
+        f"Estimated from a {estimates['sample_percent']:g}% sample of conversations "
+        f"({estimates['sampled_conversations']} conversations, {estimates['sampled_turns']} turns, "
+        f"{estimates['sampling_method']} sampling). Figures are estimates, not exact counts.",
+        "",
+        f"- Conversations with at least one no-match: {percent(estimates['conversation_no_match_rate'])}",
+        f"- Turns that are no-matches: {percent(estimates['turn_no_match_rate'])}",
+    ]
+    if estimates["patterns"]:
+        lines += ["", "### Most frequent no-match utterances", "",
+                  "| Utterance | Share of no-match turns | Conversations affected |", "|---|---|---|"]
+        for pattern in estimates["patterns"]:
+            conversations = pattern["estimated_conversations"]
+            lines.append(
+                f"| {pattern['utterance']} | {pattern['share_of_no_match_turns']:.1%} | "
+                f"~{conversations['estimate']} ({conversations['ci_low']}–{conversations['ci_high']}) |"
+            )
+    return "\n".join(lines)
@@ -0,0 +1,378 @@
+"""
+State Offload Utilities for No-Match Analysis Agent
+Moves large session state values into the artifact service and keeps only a
+lightweight reference in state. Referenced values are rehydrated lazily when a
+prompt template needs them.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import weakref
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.agents.readonly_context import ReadonlyContext
+from google.adk.events import Event, EventActions
+from google.genai import types
+
+from tools.cpu_tasks import compress_state_payload, inflate_state_payload
+from tools.process_pool import cpu_task_pool
+
+logger = logging.getLogger(__name__)
+
+# State keys that may carry megabytes of data between workflow steps
+OFFLOADABLE_STATE_KEYS: List[str] = [
+    "bigquery_metadata",
+    "conversation_data_output",
+    "dialogflow_bot_json",
+    "no_match_analysis_output",
+    "dialogflow_analysis_output",
+]
+
+OFFLOAD_THRESHOLD_BYTES = int(os.environ.get("STATE_OFFLOAD_THRESHOLD_BYTES", "32768"))
+# Values at least this large are hashed and (de)compressed in the CPU task pool
+CPU_POOL_MIN_BYTES = int(os.environ.get("STATE_OFFLOAD_CPU_POOL_MIN_BYTES", str(1024 * 1024)))
+OFFLOAD_REFERENCE_MARKER = "__offloaded_state__"
+OFFLOAD_MIME_TYPE = "application/zlib"
+
+_STATE_PLACEHOLDER_PATTERN = re.compile(r"\{([A-Za-z_][A-Za-z0-9_]*)(\?)?\}")
+_REHYDRATION_CACHE_SIZE = 16
+_SAVED_ARTIFACTS_CACHE_SIZE = 4096
+
+# Content-addressed, so entries never go stale for a given digest
+_rehydration_cache: "OrderedDict[str, Any]" = OrderedDict()
+# Artifacts known to exist, keyed by (id of the artifact service, app, user, filename);
+# the weak reference tells a live service from a new one that reused its id
+_saved_artifacts: "OrderedDict[tuple, weakref.ref]" = OrderedDict()
+
+
+def is_offloaded_reference(value: Any) -> bool:
+    """
+    Check whether a state value is an offload reference.
+
+    Args:
+        value: State value to check
+
+    Returns:
+        bool: True if the value points at an offloaded artifact
+    """
+    return isinstance(value, dict) and value.get(OFFLOAD_REFERENCE_MARKER) is True
+
+
+def get_state_value_size(value: Any) -> int:
+    """
+    Get the logical size of a state value without rehydrating it.
+
+    Args:
+        value: State value or offload reference
+
+    Returns:
+        int: Character count for strings, original byte size for references,
+        serialized size otherwise
+    """
+    if is_offloaded_reference(value):
+        return value["size"]
+    if isinstance(value, str):
+        return len(value)
+    if not value:
+        return 0
+    return len(json.dumps(value, default=str))
+
+
+def _serialize_state_value(value: Any) -> Optional[tuple]:
+    """Serialize a state value to bytes, returning (payload, format)."""
+    if isinstance(value, str):
+        return value.encode("utf-8"), "text"
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, default=str).encode("utf-8"), "json"
+    return None
+
+
+def _deserialize_state_value(payload: bytes, value_format: str) -> Any:
+    """Inverse of `_serialize_state_value`."""
+    text = payload.decode("utf-8")
+    if value_format == "json":
+        return json.loads(text)
+    return text
+
+
+def state_value_digest(value: Any) -> str:
+    """
+    Get the SHA-256 digest of a state value's content.
+
+    Inline values and their offload references give the same digest, so a value
+    hashes the same whether or not it has been offloaded.
+
+    Args:
+        value: State value or offload reference
+
+    Returns:
+        str: SHA-256 hex digest
+    """
+    if is_offloaded_reference(value):
+        return value["sha256"]
+    serialized = _serialize_state_value(value)
+    payload = serialized[0] if serialized else json.dumps(value, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha256(payload).hexdigest()
+
+
+async def offload_state_value(ctx: InvocationContext, key: str, value: Any) -> Any:
+    """
+    Offload a single state value to the artifact service if it is large enough.
+
+    The value is zlib-compressed and stored as a user-scoped artifact named
+    after its SHA-256 digest, so identical values are stored once per user.
+
+    Args:
+        ctx: Invocation context
+        key: State key the value belongs to
+        value: State value to offload
+
+    Returns:
+        Any: An offload reference, or the original value if it was left inline
+    """
+    if ctx.artifact_service is None or is_offloaded_reference(value):
+        return value
+
+    serialized = _serialize_state_value(value)
+    if serialized is None:
+        return value
+    payload, value_format = serialized
+    if len(payload) < OFFLOAD_THRESHOLD_BYTES:
+        return value
+
+    compressed: Optional[bytes] = None
+    if len(payload) >= CPU_POOL_MIN_BYTES:
+        digest, compressed = await cpu_task_pool.run(compress_state_payload, [payload])
+    else:
+        digest = hashlib.sha256(payload).hexdigest()
+    filename = f"user:state_offload_{digest}.zlib"
+    cache_key = (id(ctx.artifact_service), ctx.app_name, ctx.user_id, filename)
+
+    try:
+        if not _is_saved_artifact(ctx.artifact_service, cache_key):
+            versions = await ctx.artifact_service.list_versions(
+                app_name=ctx.app_name,
+                user_id=ctx.user_id,
+                session_id=ctx.session.id,
+                filename=filename,
+            )
+            if not versions:
+                await ctx.artifact_service.save_artifact(
+                    app_name=ctx.app_name,
+                    user_id=ctx.user_id,
+                    session_id=ctx.session.id,
+                    filename=filename,
+                    artifact=types.Part.from_bytes(
+                        data=compressed or zlib.compress(payload), mime_type=OFFLOAD_MIME_TYPE
+                    ),
+                )
+            _remember_saved_artifact(ctx.artifact_service, cache_key)
+    except Exception as e:
+        logger.warning(f"Could not offload state key '{key}', keeping it inline: {e}")
+        return value
+
+    _remember_rehydrated_value(digest, value)
+    logger.info(f"Offloaded state key '{key}' ({len(payload)} bytes) to artifact {filename}")
+    return {
+        OFFLOAD_REFERENCE_MARKER: True,
+        "key": key,
+        "artifact": filename,
+        "sha256": digest,
+        "size": len(payload),
+        "format": value_format,
+    }
+
+
+async def offload_event_state(ctx: InvocationContext, event: Event) -> Event:
+    """
+    Replace large offloadable values in an event's state delta with references.
+
+    Args:
+        ctx: Invocation context
+        event: Event emitted by a sub-agent, modified in place
+
+    Returns:
+        Event: The same event, safe to yield to the runner
+    """
+    state_delta = event.actions.state_delta if event.actions else None
+    if not state_delta:
+        return event
+    for key in OFFLOADABLE_STATE_KEYS:
+        if key in state_delta:
+            state_delta[key] = await offload_state_value(ctx, key, state_delta[key])
+    return event
+
+
+async def offload_session_state(ctx: InvocationContext, author: str) -> Optional[Event]:
+    """
+    Offload large values already present in session state.
+
+    Covers values written outside the sub-agent event stream, such as the
+    BigQuery metadata set by `initialize_state_var` or a bot export supplied
+    when the session was created.
+
+    Args:
+        ctx: Invocation context
+        author: Name of the agent emitting the state update
+
+    Returns:
+        Optional[Event]: Event carrying the reference state delta, or None if
+        nothing was offloaded
+    """
+    state_delta: Dict[str, Any] = {}
+    for key in OFFLOADABLE_STATE_KEYS:
+        value = ctx.session.state.get(key)
+        if not value or is_offloaded_reference(value):
+            continue
+        offloaded = await offload_state_value(ctx, key, value)
+        if offloaded is not value:
+            state_delta[key] = offloaded
+
+    if not state_delta:
+        return None
+    return Event(
+        invocation_id=ctx.invocation_id,
+        author=author,
+        branch=ctx.branch,
+        actions=EventActions(state_delta=state_delta),
+    )
+
+
+def _is_saved_artifact(artifact_service: Any, cache_key: tuple) -> bool:
+    """Whether this artifact service is known to hold the artifact."""
+    service_ref = _saved_artifacts.get(cache_key)
+    if service_ref is None or service_ref() is not artifact_service:
+        return False
+    _saved_artifacts.move_to_end(cache_key)
+    return True
+
+
+def _remember_saved_artifact(artifact_service: Any, cache_key: tuple) -> None:
+    """Keep a bounded LRU of artifacts known to exist, per artifact service."""
+    _saved_artifacts[cache_key] = weakref.ref(artifact_service)
+    _saved_artifacts.move_to_end(cache_key)
+    while len(_saved_artifacts) > _SAVED_ARTIFACTS_CACHE_SIZE:
+        _saved_artifacts.popitem(last=False)
+
+
+def _remember_rehydrated_value(digest: str, value: Any) -> None:
+    """Keep a bounded LRU of recently offloaded or loaded values."""
+    _rehydration_cache[digest] = value
+    _rehydration_cache.move_to_end(digest)
+    while len(_rehydration_cache) > _REHYDRATION_CACHE_SIZE:
+        _rehydration_cache.popitem(last=False)
+
+
+async def load_state_value(ctx: InvocationContext, value: Any) -> Any:
+    """
+    Resolve a state value, loading it from the artifact service if offloaded.
+
+    Args:
+        ctx: Invocation context
+        value: State value or offload reference
+
+    Returns:
+        Any: The original value
+    """
+    if not is_offloaded_reference(value):
+        return value
+
+    digest = value["sha256"]
+    if digest in _rehydration_cache:
+        _rehydration_cache.move_to_end(digest)
+        return _rehydration_cache[digest]
+
+    if ctx.artifact_service is None:
+        raise ValueError(f"Cannot load offloaded state '{value['key']}': no artifact service configured")
+
+    artifact = await ctx.artifact_service.load_artifact(
+        app_name=ctx.app_name,
+        user_id=ctx.user_id,
+        session_id=ctx.session.id,
+        filename=value["artifact"],
+    )
+    if artifact is None or artifact.inline_data is None:
+        raise ValueError(f"Offloaded state artifact not found: {value['artifact']}")
+
+    # Compare the expected inflated size; state text compresses roughly 4x
+    if len(artifact.inline_data.data) * 4 >= CPU_POOL_MIN_BYTES:
+        resolved = await cpu_task_pool.run(inflate_state_payload, [artifact.inline_data.data], value["format"])
+    else:
+        resolved = _deserialize_state_value(zlib.decompress(artifact.inline_data.data), value["format"])
+    _remember_rehydrated_value(digest, resolved)
+    return resolved
+
+
+async def resolve_template_values(template: str, readonly_context: ReadonlyContext) -> Dict[str, str]:
+    """
+    Resolve the state values of a template's `{key}` and `{key?}` placeholders,
+    rehydrating offloaded values.
+
+    Args:
+        template: Instruction template with state placeholders
+        readonly_context: Context passed to the instruction provider
+
+    Returns:
+        Dict[str, str]: Placeholder key -> value as text ("" for missing optional keys)
+    """
+    ctx = readonly_context._invocation_context
+    state = ctx.session.state
+
+    values: Dict[str, str] = {}
+    for match in _STATE_PLACEHOLDER_PATTERN.finditer(template):
+        key, optional = match.group(1), match.group(2)
+        if key in values:
+            continue
+        if key not in state:
+            if optional:
+                values[key] = ""
+                continue
+            raise KeyError(f"Context variable not found: `{key}`.")
+        resolved = await load_state_value(ctx, state[key])
+        values[key] = "" if resolved is None else str(resolved)
+    return values
+
+
+def fill_template(template: str, values: Dict[str, str]) -> str:
+    """Substitute resolved values (see `resolve_template_values`) into a template."""
+    return _STATE_PLACEHOLDER_PATTERN.sub(lambda m: values[m.group(1)], template)
+
+
+async def render_instruction_template(template: str, readonly_context: ReadonlyContext) -> str:
+    """
+    Fill `{key}` and `{key?}` placeholders from session state.
+
+    Mirrors ADK's built-in state injection, but only rehydrates offloaded
+    values for the keys the template actually references.
+
+    Args:
+        template: Instruction template with state placeholders
+        readonly_context: Context passed to the instruction provider
+
+    Returns:
+        str: Rendered instruction
+    """
+    return fill_template(template, await resolve_template_values(template, readonly_context))
+
+
+def state_offload_instruction(template: str):
+    """
+    Build an ADK instruction provider for a template that may reference
+    offloaded state keys.
+
+    Args:
+        template: Instruction template with state placeholders
+
+    Returns:
+        Callable: Async instruction provider for `LlmAgent(instruction=...)`
+    """
+    async def instruction_provider(readonly_context: ReadonlyContext) -> str:
+        return await render_instruction_template(template, readonly_context)
+
+    return instruction_provider
@@ -0,0 +1,194 @@
+"""
+Step Deadlines for No-Match Analysis Agent
+End-to-end latency budget for a workflow run with a deadline per step. A step
+that runs past its deadline is cancelled and recorded as degraded, so the run
+can finish with whatever outputs are already in state.
+"""
+
+import asyncio
+import os
+import time
+from typing import Any, AsyncGenerator, Dict, List, Optional
+
+from google.adk.events import Event
+
+from tools.workflow_checkpoints import WORKFLOW_STEPS
+
+RUN_DEGRADED_STATE_KEY = "run_degraded"
+DEGRADED_STEPS_STATE_KEY = "degraded_steps"
+
+DEFAULT_RUN_SLO_SECONDS = 1800.0
+
+# Step number -> default deadline; each step is also bounded by the remaining run budget
+DEFAULT_STEP_TIMEOUT_SECONDS: Dict[int, float] = {
+    1: 600.0,
+    2: 600.0,
+    3: 300.0,
+    4: 300.0,
+}
+
+
+class StepDeadlineExceeded(Exception):
+    """A workflow step ran past its deadline and was cancelled."""
+
+
+def _env_seconds(name: str, default: Optional[float]) -> Optional[float]:
+    """Read a duration from the environment; 0 or less means no limit."""
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return float(value) if float(value) > 0 else None
+
+
+class RunDeadline:
+    """
+    Latency budget for one orchestrator run.
+
+    The deadline of a step is the smaller of its own timeout and the time left
+    in the run budget, so a slow early step leaves less time for later ones
+    instead of pushing the run past its SLO.
+    """
+
+    def __init__(
+        self,
+        slo_seconds: Optional[float] = DEFAULT_RUN_SLO_SECONDS,
+        step_timeouts: Optional[Dict[int, Optional[float]]] = None,
+    ):
+        """
+        Args:
+            slo_seconds: End-to-end budget for the run, or None for no limit
+            step_timeouts: Deadline per step number, None for no limit
+        """
+        self.slo_seconds = slo_seconds
+        self.step_timeouts = dict(DEFAULT_STEP_TIMEOUT_SECONDS if step_timeouts is None else step_timeouts)
+        self.started_at = time.monotonic()
+        self.degraded_steps: List[Dict[str, Any]] = []
+
+    @classmethod
+    def from_env(cls) -> "RunDeadline":
+        """
+        Build a run deadline from `RUN_SLO_SECONDS` and `STEP_<N>_TIMEOUT_SECONDS`.
+
+        Returns:
+            RunDeadline: Deadline starting now
+        """
+        step_timeouts = {
+            step: _env_seconds(f"STEP_{step}_TIMEOUT_SECONDS", default)
+            for step, default in DEFAULT_STEP_TIMEOUT_SECONDS.items()
+        }
+        return cls(_env_seconds("RUN_SLO_SECONDS", DEFAULT_RUN_SLO_SECONDS), step_timeouts)
+
+    def remaining(self) -> Optional[float]:
+        """
+        Get the time left in the run budget.
+
+        Returns:
+            Optional[float]: Seconds left (never negative), or None without a budget
+        """
+        if self.slo_seconds is None:
+            return None
+        return max(0.0, self.slo_seconds - (time.monotonic() - self.started_at))
+
+    def step_timeout(self, step: int) -> Optional[float]:
+        """
+        Get the deadline for a step starting now.
+
+        Args:
+            step: Step number (1-4)
+
+        Returns:
+            Optional[float]: Seconds the step may run, or None for no limit
+        """
+        limits = [limit for limit in (self.step_timeouts.get(step), self.remaining()) if limit is not None]
+        return min(limits) if limits else None
+
+    @property
+    def degraded(self) -> bool:
+        """Whether any step of this run missed its deadline."""
+        return bool(self.degraded_steps)
+
+    def record_timeout(self, step: int, timeout: float) -> Dict[str, Any]:
+        """
+        Record that a step missed its deadline.
+
+        Args:
+            step: Step number (1-4)
+            timeout: Deadline the step was given, in seconds
+
+        Returns:
+            Dict[str, Any]: State delta marking the run as degraded
+        """
+        self.degraded_steps.append({
+            "step": step,
+            "name": WORKFLOW_STEPS[step]["name"],
+            "reason": "timeout",
+            "timeout_seconds": round(timeout, 3),
+        })
+        return {
+            RUN_DEGRADED_STATE_KEY: True,
+            DEGRADED_STEPS_STATE_KEY: list(self.degraded_steps),
+        }
+
+
+async def run_with_deadline(
+    events: AsyncGenerator[Event, None], timeout: Optional[float]
+) -> AsyncGenerator[Event, None]:
+    """
+    Relay the events of a sub-agent run, cancelling it at the deadline.
+
+    The sub-agent runs in its own task and hands over one event at a time,
+    waiting until the caller has processed it. This keeps the sub-agent in step
+    with the runner (which appends each event to the session) while the wait
+    for the next event can be bounded.
+
+    Args:
+        events: Event stream of the sub-agent run
+        timeout: Seconds the whole run may take, or None for no limit
+
+    Yields:
+        Event: Events of the sub-agent run
+
+    Raises:
+        StepDeadlineExceeded: The deadline passed; the sub-agent has been cancelled.
+            Errors of the sub-agent itself, including its own timeouts, propagate unchanged.
+    """
+    if timeout is None:
+        async for event in events:
+            yield event
+        return
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    handoff: asyncio.Queue = asyncio.Queue(maxsize=1)
+
+    async def produce() -> None:
+        try:
+            async for event in events:
+                processed = loop.create_future()
+                await handoff.put((event, processed))
+                await processed
+        except Exception as e:
+            await handoff.put((e, None))
+        else:
+            await handoff.put((None, None))
+        finally:
+            await events.aclose()
+
+    producer = asyncio.ensure_future(produce())
+    try:
+        while True:
+            try:
+                item, processed = await asyncio.wait_for(handoff.get(), max(0.0, deadline - loop.time()))
+            except asyncio.TimeoutError:
+                raise StepDeadlineExceeded(f"Step exceeded its {timeout:.1f}s deadline") from None
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+            processed.set_result(None)
+    finally:
+        if not producer.done():
+            producer.cancel()
+        # Let the cancelled sub-agent unwind (close model streams, tool calls)
+        await asyncio.gather(producer, return_exceptions=True)
@@ -0,0 +1,249 @@
+"""
+Streaming Top-K for No-Match Analysis Agent
+Ranking of no-match conversations, utterances and clusters over streams, in
+memory proportional to k rather than to the data.
+
+- TopK: bounded min-heap of the k highest-scoring items. Ties are broken by a
+  tie key (smallest first), or by arrival order without one, so results do
+  not depend on how a stream was split. Top-k sets of shards, days or
+  incremental runs can be merged.
+- CountMinSketch: approximate frequencies of an unbounded key stream in a
+  fixed `depth` x `width` counter table; estimates never undercount and
+  overcount by at most `epsilon` x the stream total with probability `1 - delta`.
+- HeavyHitters: the k most frequent keys of a stream, tracked with a
+  count-min sketch and a bounded candidate set.
+
+Like the process pool, this module only imports the standard library.
+"""
+
+import hashlib
+import heapq
+import itertools
+import math
+import struct
+from array import array
+from typing import Any, Callable, Dict, Generic, Iterable, List, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+class _Entry:
+    """Heap entry; the heap root is the entry that ranks last."""
+
+    __slots__ = ("score", "tie", "item")
+
+    def __init__(self, score: Any, tie: Any, item: Any):
+        self.score = score
+        self.tie = tie
+        self.item = item
+
+    def __lt__(self, other: "_Entry") -> bool:
+        # Lower scores rank lower; among equal scores, greater tie keys rank lower
+        if self.score != other.score:
+            return self.score < other.score
+        return self.tie > other.tie
+
+
+class TopK(Generic[T]):
+    """
+    The k highest-scoring items of a stream.
+    """
+
+    def __init__(self, k: int, key: Callable[[T], Any], tie_key: Optional[Callable[[T], Any]] = None):
+        """
+        Args:
+            k: Items to keep
+            key: Score of an item; higher ranks first
+            tie_key: Breaks score ties, smaller first; defaults to arrival order
+        """
+        if k < 0:
+            raise ValueError("k must not be negative")
+        self.k = k
+        self.key = key
+        self.tie_key = tie_key
+        self.seen = 0
+        self._heap: List[_Entry] = []
+        self._sequence = itertools.count()
+
+    def push(self, item: T) -> bool:
+        """
+        Offer an item.
+
+        Returns:
+            bool: Whether the item is (for now) in the top k
+        """
+        self.seen += 1
+        if self.k == 0:
+            return False
+        entry = _Entry(self.key(item), self.tie_key(item) if self.tie_key else next(self._sequence), item)
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, entry)
+            return True
+        if self._heap[0] < entry:
+            heapq.heapreplace(self._heap, entry)
+            return True
+        return False
+
+    def extend(self, items: Iterable[T]) -> "TopK[T]":
+        for item in items:
+            self.push(item)
+        return self
+
+    def merge(self, other: "TopK[T]") -> "TopK[T]":
+        """
+        Add the items kept by another TopK (e.g. of another shard or day).
+        Without a tie key, the other's items rank after this one's on ties.
+
+        Returns:
+            TopK[T]: This TopK
+        """
+        seen = self.seen + other.seen
+        self.extend(other.items())
+        self.seen = seen
+        return self
+
+    def threshold(self) -> Optional[Any]:
+        """Lowest score still in the top k once it is full, else None."""
+        return self._heap[0].score if len(self._heap) == self.k and self._heap else None
+
+    def items(self) -> List[T]:
+        """Kept items, best first."""
+        return [entry.item for entry in sorted(self._heap, reverse=True)]
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+
+def top_k(items: Iterable[T], k: int, key: Callable[[T], Any], tie_key: Optional[Callable[[T], Any]] = None) -> List[T]:
+    """The k highest-scoring items of an iterable, best first (see TopK)."""
+    return TopK(k, key, tie_key).extend(items).items()
+
+
+class CountMinSketch:
+    """
+    Approximate counts of keys in a fixed table of `depth` rows of `width` counters.
+    """
+
+    def __init__(self, width: int = 2048, depth: int = 5):
+        """
+        Args:
+            width: Counters per row; overcount is at most e / width of the total
+            depth: Rows (hash functions); the bound fails with probability e^-depth
+        """
+        if width <= 0 or depth <= 0:
+            raise ValueError("width and depth must be positive")
+        self.width = width
+        self.depth = depth
+        self.total = 0
+        self._counts = array("Q", bytes(8 * width * depth))
+
+    @classmethod
+    def from_error(cls, epsilon: float = 0.001, delta: float = 0.01) -> "CountMinSketch":
+        """
+        Size a sketch for an error bound.
+
+        Args:
+            epsilon: Overcount bound as a fraction of the stream total
+            delta: Probability that a key exceeds the bound
+
+        Returns:
+            CountMinSketch: Sketch with width e/epsilon and depth ln(1/delta)
+        """
+        return cls(width=math.ceil(math.e / epsilon), depth=math.ceil(math.log(1 / delta)))
+
+    def _positions(self, key: str) -> List[int]:
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=8 * self.depth).digest()
+        return [
+            row * self.width + value % self.width
+            for row, value in enumerate(struct.unpack(f"<{self.depth}Q", digest))
+        ]
+
+    def add(self, key: str, count: int = 1) -> int:
+        """
+        Count occurrences of a key.
+
+        Returns:
+            int: The key's estimated count after the update
+        """
+        self.total += count
+        estimate = None
+        for position in self._positions(key):
+            self._counts[position] += count
+            value = self._counts[position]
+            estimate = value if estimate is None or value < estimate else estimate
+        return estimate
+
+    def estimate(self, key: str) -> int:
+        """Estimated count of a key; never lower than the true count."""
+        return min(self._counts[position] for position in self._positions(key))
+
+    def merge(self, other: "CountMinSketch") -> "CountMinSketch":
+        """Add the counts of a sketch of the same size (e.g. of another shard)."""
+        if (other.width, other.depth) != (self.width, self.depth):
+            raise ValueError("Only sketches of the same width and depth can be merged")
+        for position, value in enumerate(other._counts):
+            self._counts[position] += value
+        self.total += other.total
+        return self
+
+    def to_bytes(self) -> bytes:
+        """Serialize the sketch, e.g. to store it with incremental results."""
+        return struct.pack("<IIQ", self.width, self.depth, self.total) + self._counts.tobytes()
+
+    @classmethod
+    def from_bytes(cls, payload: bytes) -> "CountMinSketch":
+        width, depth, total = struct.unpack_from("<IIQ", payload)
+        sketch = cls(width, depth)
+        sketch.total = total
+        sketch._counts = array("Q")
+        sketch._counts.frombytes(payload[struct.calcsize("<IIQ"):])
+        return sketch
+
+
+class HeavyHitters:
+    """
+    The k most frequent keys of an unbounded stream, with approximate counts.
+    """
+
+    def __init__(self, k: int, sketch: Optional[CountMinSketch] = None):
+        """
+        Args:
+            k: Keys to track
+            sketch: Count-min sketch to count with (defaults to `CountMinSketch.from_error()`)
+        """
+        self.k = k
+        self.sketch = sketch or CountMinSketch.from_error()
+        self._candidates: Dict[str, int] = {}
+        # (estimate, key) of the candidates; entries go stale as estimates grow
+        self._heap: List[Tuple[int, str]] = []
+
+    def add(self, key: str, count: int = 1) -> None:
+        estimate = self.sketch.add(key, count)
+        if key in self._candidates or len(self._candidates) < self.k:
+            self._candidates[key] = estimate
+            heapq.heappush(self._heap, (estimate, key))
+            if len(self._heap) > 4 * max(self.k, 1):
+                self._heap = [(value, candidate) for candidate, value in self._candidates.items()]
+                heapq.heapify(self._heap)
+            return
+        while self._heap and self._candidates.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        if self._heap and estimate > self._heap[0][0]:
+            _, evicted = heapq.heapreplace(self._heap, (estimate, key))
+            del self._candidates[evicted]
+            self._candidates[key] = estimate
+
+    def merge(self, other: "HeavyHitters") -> "HeavyHitters":
+        """Combine with the heavy hitters of another shard (same sketch size)."""
+        self.sketch.merge(other.sketch)
+        keys = set(self._candidates) | set(other._candidates)
+        kept = top_k(keys, self.k, key=self.sketch.estimate, tie_key=lambda key: key)
+        self._candidates = {key: self.sketch.estimate(key) for key in kept}
+        self._heap = [(value, key) for key, value in self._candidates.items()]
+        heapq.heapify(self._heap)
+        return self
+
+    def top(self, limit: Optional[int] = None) -> List[Tuple[str, int]]:
+        """(key, estimated count) pairs, most frequent first, ties by key."""
+        ranked = sorted(self._candidates.items(), key=lambda item: (-item[1], item[0]))
+        return ranked[:limit] if limit is not None else ranked
@@ -0,0 +1,209 @@
+"""
+Workflow Checkpoints for No-Match Analysis Agent
+Records, per workflow step, the output key, a fingerprint of the step's inputs
+and its completion status, so a new run with the same inputs can skip the
+steps that already completed and resume from the first incomplete or stale one.
+"""
+
+import hashlib
+import os
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional
+
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.events import Event, EventActions
+
+from tools.state_offload import state_value_digest
+
+# User-scoped so checkpoints (and the offloaded outputs they reference) carry
+# over to new sessions of the same user
+CHECKPOINTS_STATE_KEY = "user:workflow_checkpoints"
+
+# Set to a step number (1-4) to ignore checkpoints from that step onwards
+RERUN_FROM_STEP_STATE_KEY = "rerun_from_step"
+
+STATUS_COMPLETED = "completed"
+STATUS_EMPTY = "empty"
+
+# Step number -> (step name, output key, state keys the step reads)
+WORKFLOW_STEPS: Dict[int, Dict[str, Any]] = {
+    1: {
+        "name": "conversation_data_retrieval",
+        "output_key": "conversation_data_output",
+        "input_keys": ["PROJECT", "BQ_LOCATION", "DATASET"],
+    },
+    2: {
+        "name": "no_match_analysis",
+        "output_key": "no_match_analysis_output",
+        "input_keys": ["conversation_data_output"],
+    },
+    3: {
+        "name": "dialogflow_cx_parser",
+        "output_key": "dialogflow_analysis_output",
+        "input_keys": ["dialogflow_bot_json"],
+    },
+    4: {
+        "name": "csv_generation",
+        "output_key": "csv_generation_output",
+        "input_keys": ["no_match_analysis_output", "dialogflow_analysis_output"],
+    },
+}
+
+
+def step_fingerprint(step: int, state: Dict[str, Any], user_query: str = "") -> str:
+    """
+    Fingerprint the inputs of a step.
+
+    Args:
+        step: Step number (1-4)
+        state: Session state (or any mapping with the step's input keys)
+        user_query: Text of the user query, used by step 1 only
+
+    Returns:
+        str: SHA-256 hex digest of the step's inputs
+    """
+    parts: List[str] = [WORKFLOW_STEPS[step]["name"]]
+    parts.extend(state_value_digest(state.get(key, "")) for key in WORKFLOW_STEPS[step]["input_keys"])
+    if step == 1:
+        parts.append(user_query)
+        parts.append(date.today().isoformat())
+    return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()
+
+
+def build_checkpoint(step: int, state: Dict[str, Any], user_query: str = "") -> Dict[str, Any]:
+    """
+    Build the checkpoint entry of a step from the state after it ran.
+
+    Args:
+        step: Step number (1-4)
+        state: Session state holding the step's inputs and output
+        user_query: Text of the user query, used by step 1 only
+
+    Returns:
+        Dict[str, Any]: Checkpoint entry, stored under the step name
+    """
+    output_key = WORKFLOW_STEPS[step]["output_key"]
+    output = state.get(output_key, "")
+    return {
+        "step": step,
+        "output_key": output_key,
+        "input_fingerprint": step_fingerprint(step, state, user_query),
+        "status": STATUS_COMPLETED if output else STATUS_EMPTY,
+        "output": output,
+        "completed_at": datetime.now().isoformat(),
+    }
+
+
+def _user_query_text(ctx: InvocationContext) -> str:
+    if not ctx.user_content or not ctx.user_content.parts:
+        return ""
+    return "".join(part.text or "" for part in ctx.user_content.parts)
+
+
+class WorkflowCheckpointer:
+    """
+    Tracks step checkpoints for one orchestrator run.
+
+    The fingerprint of a step covers only the state keys it reads, so a change
+    upstream makes every downstream checkpoint stale automatically. Step 1 also
+    covers the user query and the current date, since relative date ranges such
+    as "last week" resolve differently from one day to the next.
+    """
+
+    def __init__(self, ctx: InvocationContext, enabled: bool = True):
+        """
+        Args:
+            ctx: Invocation context of the orchestrator run
+            enabled: Whether completed checkpoints may be restored
+        """
+        self.ctx = ctx
+        self.enabled = enabled
+        self.checkpoints: Dict[str, Dict[str, Any]] = dict(ctx.session.state.get(CHECKPOINTS_STATE_KEY) or {})
+        self.rerun_from_step: Optional[int] = ctx.session.state.get(RERUN_FROM_STEP_STATE_KEY) or None
+
+    @classmethod
+    def from_context(cls, ctx: InvocationContext) -> "WorkflowCheckpointer":
+        """
+        Build a checkpointer, honouring the `WORKFLOW_CHECKPOINTS_ENABLED` variable.
+
+        Args:
+            ctx: Invocation context of the orchestrator run
+
+        Returns:
+            WorkflowCheckpointer: Checkpointer for this run
+        """
+        enabled = os.environ.get("WORKFLOW_CHECKPOINTS_ENABLED", "true").lower() in ("1", "true", "yes")
+        return cls(ctx, enabled=enabled)
+
+    def fingerprint(self, step: int) -> str:
+        """
+        Fingerprint the inputs of a step from the current session state.
+
+        Args:
+            step: Step number (1-4)
+
+        Returns:
+            str: SHA-256 hex digest of the step's inputs
+        """
+        return step_fingerprint(step, self.ctx.session.state, _user_query_text(self.ctx))
+
+    def restore(self, step: int) -> Optional[Dict[str, Any]]:
+        """
+        Get the state delta that restores a step's output from its checkpoint.
+
+        Args:
+            step: Step number (1-4)
+
+        Returns:
+            Optional[Dict[str, Any]]: State delta with the saved output, or None
+            if the step has to run (disabled, forced rerun, missing, incomplete
+            or stale checkpoint)
+        """
+        if not self.enabled:
+            return None
+        if self.rerun_from_step and step >= self.rerun_from_step:
+            return None
+
+        checkpoint = self.checkpoints.get(WORKFLOW_STEPS[step]["name"])
+        if not checkpoint or checkpoint.get("status") != STATUS_COMPLETED:
+            return None
+        if checkpoint.get("input_fingerprint") != self.fingerprint(step):
+            return None
+        return {checkpoint["output_key"]: checkpoint["output"]}
+
+    def complete(self, step: int) -> Dict[str, Any]:
+        """
+        Record a step's result from the current session state.
+
+        Args:
+            step: Step number (1-4)
+
+        Returns:
+            Dict[str, Any]: State delta that persists the updated checkpoints
+        """
+        self.checkpoints[WORKFLOW_STEPS[step]["name"]] = build_checkpoint(
+            step, self.ctx.session.state, _user_query_text(self.ctx)
+        )
+        state_delta: Dict[str, Any] = {CHECKPOINTS_STATE_KEY: dict(self.checkpoints)}
+        if self.rerun_from_step:
+            # A forced rerun applies to a single run only
+            state_delta[RERUN_FROM_STEP_STATE_KEY] = None
+        return state_delta
+
+    def state_event(self, author: str, state_delta: Dict[str, Any]) -> Event:
+        """
+        Wrap a state delta in an event for the orchestrator to yield.
+
+        Args:
+            author: Name of the orchestrator agent
+            state_delta: Delta from `restore` or `complete`
+
+        Returns:
+            Event: Event carrying the state delta
+        """
+        return Event(
+            invocation_id=self.ctx.invocation_id,
+            author=author,
+            branch=self.ctx.branch,
+            actions=EventActions(state_delta=state_delta),
+        )